@@ -5,37 +5,248 @@ import os
 from dotenv import load_dotenv
 
 # Importar la función de carga de modelos
-from .models import load_models 
+from .models import load_models
 
 # Cargar las variables de entorno desde el archivo .env
 # Esto debe hacerse antes de que se acceda a cualquier variable de entorno.
-load_dotenv() 
+load_dotenv()
+
+def _env_bool(name, default):
+    """Lee una variable de entorno booleana ('true', '1', 't')."""
+    return os.getenv(name, default).lower() in ('true', '1', 't')
+
+def load_config():
+    """
+    Lee la configuración desde las variables de entorno.
+    La usan tanto la aplicación Flask como el proceso servidor de modelos.
+    """
+    config = {}
+    # DEBUG: Convertir la cadena a booleano
+    config['DEBUG'] = _env_bool('DEBUG', 'False')
+    # API_PORT: Convertir a entero
+    config['API_PORT'] = int(os.getenv('API_PORT', 5000))
+    # Nombres de los modelos de Hugging Face
+    config['HF_MODEL_AUTOCOMPLETE'] = os.getenv('HF_MODEL_AUTOCOMPLETE')
+    config['HF_MODEL_TEXT2TEXT'] = os.getenv('HF_MODEL_TEXT2TEXT')
+    # Modelos adicionales que las solicitudes eligen con el campo 'model' ('nombre=tipo:modelo,...')
+    # y memoria máxima de los modelos cargados a la vez (0 = sin límite)
+    config['MODELS'] = os.getenv('MODELS', '')
+    config['MODEL_MEMORY_BUDGET_MB'] = float(os.getenv('MODEL_MEMORY_BUDGET_MB', 0))
+    # Instantáneas de los modelos (scripts/snapshot_models.py): pesos safetensors mapeados en memoria
+    config['MODEL_SNAPSHOT_DIR'] = os.getenv('MODEL_SNAPSHOT_DIR', '')
+    # Motor de ejecución de los modelos ('eager', 'compile' u 'onnx'; ver app/engines.py), motores por modelo
+    # ('nombre=motor,...'), exportaciones ONNX (scripts/export_onnx.py) y modo de torch.compile
+    config['MODEL_ENGINE'] = os.getenv('MODEL_ENGINE', 'eager').lower()
+    config['MODEL_ENGINES'] = os.getenv('MODEL_ENGINES', '')
+    config['MODEL_ONNX_DIR'] = os.getenv('MODEL_ONNX_DIR', '')
+    config['MODEL_COMPILE_MODE'] = os.getenv('MODEL_COMPILE_MODE', 'default')
+    config['MODEL_ENGINE_VERIFY'] = _env_bool('MODEL_ENGINE_VERIFY', 'True')
+    # Carga de modelos bajo demanda: precalentamiento al arrancar, descarga tras inactividad
+    # (0 = nunca) y espera antes de reintentar una carga fallida
+    config['MODEL_WARMUP'] = _env_bool('MODEL_WARMUP', 'False')
+    config['MODEL_IDLE_TTL_S'] = float(os.getenv('MODEL_IDLE_TTL_S', 0))
+    config['MODEL_LOAD_RETRY_S'] = float(os.getenv('MODEL_LOAD_RETRY_S', 30))
+    # Pipeline falso determinista (app/stub.py) en lugar de los modelos reales, para benchmarks
+    config['MODEL_STUB'] = _env_bool('MODEL_STUB', 'False')
+    config['MODEL_STUB_TOKEN_DELAY_MS'] = float(os.getenv('MODEL_STUB_TOKEN_DELAY_MS', 5))
+    # Perfil de CPU: cuantización ('none', 'int8' o 'bf16') e hilos de torch (0 = automático:
+    # núcleos / INFERENCE_WORKERS, el número de procesos que cargan modelos; gunicorn exporta WEB_CONCURRENCY)
+    config['CPU_QUANTIZE'] = os.getenv('CPU_QUANTIZE', 'none').lower()
+    config['CPU_THREADS'] = int(os.getenv('CPU_THREADS', 0))
+    config['CPU_INTEROP_THREADS'] = int(os.getenv('CPU_INTEROP_THREADS', 0))
+    config['INFERENCE_WORKERS'] = int(os.getenv('INFERENCE_WORKERS', os.getenv('WEB_CONCURRENCY', 1)))
+    # Generación asistida en /complete: modelo borrador (vacío = desactivada) y tokens que propone por paso
+    config['HF_MODEL_DRAFT'] = os.getenv('HF_MODEL_DRAFT', '')
+    config['ASSISTED_NUM_TOKENS'] = int(os.getenv('ASSISTED_NUM_TOKENS', 5))
+    # Micro-batching: ventana de espera, tamaño máximo de lote y tokens máximos por lote
+    config['BATCHING_ENABLED'] = _env_bool('BATCHING_ENABLED', 'True')
+    config['BATCH_MAX_WAIT_MS'] = float(os.getenv('BATCH_MAX_WAIT_MS', 10))
+    config['BATCH_MAX_SIZE'] = int(os.getenv('BATCH_MAX_SIZE', 8))
+    config['BATCH_MAX_TOKENS'] = int(os.getenv('BATCH_MAX_TOKENS', 4096))
+    config['BATCH_REQUEST_TIMEOUT_S'] = float(os.getenv('BATCH_REQUEST_TIMEOUT_S', 300))
+    # Endpoints por lotes (/fix/batch, ...): número máximo de elementos por solicitud
+    config['BATCH_ENDPOINT_MAX_ITEMS'] = int(os.getenv('BATCH_ENDPOINT_MAX_ITEMS', 256))
+    # Carriles de prioridad: 'interactive' (PRIORITY_INTERACTIVE_ENDPOINTS, por defecto /complete) y 'bulk' (el resto),
+    # o el que pida la cabecera X-Priority. Las pasadas de todos los modelos se turnan (PRIORITY_MAX_CONCURRENT_PASSES
+    # plazas comunes: la CPU es de todos) con prioridad para el carril interactivo,
+    # reparto justo ponderado por cliente (X-API-Key o IP) y cesión entre pasos de decodificación
+    config['PRIORITY_ENABLED'] = _env_bool('PRIORITY_ENABLED', 'True')
+    config['PRIORITY_MAX_CONCURRENT_PASSES'] = int(os.getenv('PRIORITY_MAX_CONCURRENT_PASSES', 1))
+    config['PRIORITY_INTERACTIVE_ENDPOINTS'] = os.getenv('PRIORITY_INTERACTIVE_ENDPOINTS', '/complete')
+    config['PRIORITY_HEADER'] = os.getenv('PRIORITY_HEADER', 'X-Priority')
+    config['PRIORITY_CLIENT_HEADER'] = os.getenv('PRIORITY_CLIENT_HEADER', 'X-API-Key')
+    config['PRIORITY_CLIENT_WEIGHTS'] = os.getenv('PRIORITY_CLIENT_WEIGHTS', '') # clave=peso,...
+    config['PRIORITY_PREEMPT'] = _env_bool('PRIORITY_PREEMPT', 'True')
+    config['PRIORITY_BULK_MAX_WAIT_S'] = float(os.getenv('PRIORITY_BULK_MAX_WAIT_S', 5))
+    # Caché de respuestas para /fix y /convert (deterministas): LRU en memoria y, opcionalmente, sqlite en disco
+    config['CACHE_ENABLED'] = _env_bool('CACHE_ENABLED', 'True')
+    config['CACHE_MAX_BYTES'] = int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    config['CACHE_DB_PATH'] = os.getenv('CACHE_DB_PATH', '')
+    config['CACHE_DB_MAX_ENTRIES'] = int(os.getenv('CACHE_DB_MAX_ENTRIES', 100000))
+    # Agrupación de solicitudes deterministas idénticas en curso (una sola inferencia para todas).
+    # Con COALESCE_DB_PATH (sqlite compartida), también entre workers; vacío = sólo dentro de cada proceso
+    config['COALESCE_ENABLED'] = _env_bool('COALESCE_ENABLED', 'True')
+    config['COALESCE_DB_PATH'] = os.getenv('COALESCE_DB_PATH', '')
+    config['COALESCE_WAIT_TIMEOUT_S'] = float(os.getenv('COALESCE_WAIT_TIMEOUT_S', 300))
+    config['COALESCE_POLL_MS'] = float(os.getenv('COALESCE_POLL_MS', 10))
+    # Trabajos asíncronos (POST /jobs, GET /jobs/<id>): cola sqlite compartida por los workers de la máquina,
+    # hilos por proceso que la vacían, tiempo que se guardan los resultados y espera máxima del long-poll.
+    # Sin JOBS_DB_PATH no hay cola (una ruta por defecto compartiría la cola con otros despliegues de la máquina)
+    config['JOBS_ENABLED'] = _env_bool('JOBS_ENABLED', 'True')
+    config['JOBS_DB_PATH'] = os.getenv('JOBS_DB_PATH', '')
+    config['JOBS_WORKERS'] = int(os.getenv('JOBS_WORKERS', 2))
+    config['JOBS_RESULT_TTL_S'] = float(os.getenv('JOBS_RESULT_TTL_S', 86400))
+    config['JOBS_MAX_WAIT_S'] = float(os.getenv('JOBS_MAX_WAIT_S', 30))
+    config['JOBS_MAX_ATTEMPTS'] = int(os.getenv('JOBS_MAX_ATTEMPTS', 3))
+    config['JOBS_POLL_MS'] = float(os.getenv('JOBS_POLL_MS', 200))
+    config['JOBS_CALLBACK_TIMEOUT_S'] = float(os.getenv('JOBS_CALLBACK_TIMEOUT_S', 10))
+    # Hosts a los que se admite enviar el callback_url (separados por comas); vacío = cualquier host público
+    config['JOBS_CALLBACK_ALLOWED_HOSTS'] = os.getenv('JOBS_CALLBACK_ALLOWED_HOSTS', '')
+    # Caché KV por prefijo para /complete con sesión de editor (X-Session-Id)
+    config['PREFIX_CACHE_ENABLED'] = _env_bool('PREFIX_CACHE_ENABLED', 'True')
+    config['PREFIX_CACHE_MAX_BYTES'] = int(os.getenv('PREFIX_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    config['PREFIX_CACHE_MAX_PER_SESSION'] = int(os.getenv('PREFIX_CACHE_MAX_PER_SESSION', 4))
+    config['PREFIX_CACHE_MIN_TOKENS'] = int(os.getenv('PREFIX_CACHE_MIN_TOKENS', 16))
+    # Admisión por tokens: límites de max_tokens y num_suggestions, tokens de entrada por endpoint
+    # (0 = ventana de contexto del modelo), qué hacer con las entradas largas ('reject' = 413,
+    # 'keep_head' o 'keep_tail' = truncar) y presupuesto global de tokens de prefill simultáneos (0 = sin límite)
+    config['ADMISSION_ENABLED'] = _env_bool('ADMISSION_ENABLED', 'True')
+    config['ADMISSION_MAX_NEW_TOKENS'] = int(os.getenv('ADMISSION_MAX_NEW_TOKENS', 512))
+    config['ADMISSION_MAX_SUGGESTIONS'] = int(os.getenv('ADMISSION_MAX_SUGGESTIONS', 5))
+    for operation, truncate in (('COMPLETE', 'keep_tail'), ('FIX', 'reject'), ('CONVERT', 'reject')):
+        config[f'ADMISSION_MAX_INPUT_TOKENS_{operation}'] = int(os.getenv(f'ADMISSION_MAX_INPUT_TOKENS_{operation}', 0))
+        config[f'ADMISSION_TRUNCATE_{operation}'] = os.getenv(f'ADMISSION_TRUNCATE_{operation}', truncate).lower()
+    config['ADMISSION_TOKEN_BUDGET'] = int(os.getenv('ADMISSION_TOKEN_BUDGET', 8192))
+    config['ADMISSION_QUEUE_TIMEOUT_S'] = float(os.getenv('ADMISSION_QUEUE_TIMEOUT_S', 30))
+    # Criterios de parada: fin del bloque del cursor en /complete (valor por defecto de 'stop_at_block_end';
+    # desactivado para no cambiar la salida de los clientes que no lo piden),
+    # lenguaje de /complete si la solicitud no trae 'language', reglas del lenguaje en /fix y /convert,
+    # y si /complete devuelve el prompt + la generación (valor por defecto de 'return_full_text')
+    config['STOP_AT_BLOCK_END'] = _env_bool('STOP_AT_BLOCK_END', 'False')
+    config['COMPLETE_LANGUAGE'] = os.getenv('COMPLETE_LANGUAGE', 'python').lower()
+    config['STOP_LANGUAGE_RULES'] = _env_bool('STOP_LANGUAGE_RULES', 'True')
+    config['COMPLETE_RETURN_FULL_TEXT'] = _env_bool('COMPLETE_RETURN_FULL_TEXT', 'True')
+    # Varias sugerencias en /complete: prefill compartido (el prompt se codifica una vez para todas),
+    # devolver cada sugerencia repetida una sola vez, tokens iguales a partir de los cuales dos sugerencias
+    # se dan por convergidas (0 = sin detección) y tokens decodificados por solicitud entre todas (0 = sin límite)
+    config['COMPLETE_SHARED_PREFILL'] = _env_bool('COMPLETE_SHARED_PREFILL', 'True')
+    config['COMPLETE_DEDUP_SUGGESTIONS'] = _env_bool('COMPLETE_DEDUP_SUGGESTIONS', 'True')
+    config['COMPLETE_CONVERGE_TOKENS'] = int(os.getenv('COMPLETE_CONVERGE_TOKENS', 16))
+    config['COMPLETE_MAX_DECODE_TOKENS'] = int(os.getenv('COMPLETE_MAX_DECODE_TOKENS', 1024))
+    # Vía rápida de /fix sin modelo: el código válido se devuelve tal cual y, si sólo falla la sangría,
+    # se normaliza de forma determinista. Lenguaje que se comprueba si la solicitud no trae 'language'
+    # (vacío = sólo con 'language'); los lenguajes sin comprobador pasan siempre al modelo
+    config['FIX_FAST_PATH'] = _env_bool('FIX_FAST_PATH', 'True')
+    config['FIX_REINDENT'] = _env_bool('FIX_REINDENT', 'True')
+    config['FIX_DEFAULT_LANGUAGE'] = os.getenv('FIX_DEFAULT_LANGUAGE', '').lower()
+    # Modo archivo de /fix y /convert ("mode": "file"): tokens de entrada por fragmento,
+    # número máximo de fragmentos por archivo y fragmentos en paralelo durante el streaming
+    config['FILE_CHUNK_MAX_TOKENS'] = int(os.getenv('FILE_CHUNK_MAX_TOKENS', 200))
+    config['FILE_MAX_CHUNKS'] = int(os.getenv('FILE_MAX_CHUNKS', 64))
+    config['FILE_CHUNK_PARALLELISM'] = int(os.getenv('FILE_CHUNK_PARALLELISM', 8))
+    # Servidor ASGI (app/asgi.py): solicitudes de inferencia en curso, cola de espera y espera máxima de turno
+    config['ASGI_MAX_IN_FLIGHT'] = int(os.getenv('ASGI_MAX_IN_FLIGHT', 32))
+    config['ASGI_MAX_QUEUE'] = int(os.getenv('ASGI_MAX_QUEUE', 256))
+    config['ASGI_QUEUE_TIMEOUT_S'] = float(os.getenv('ASGI_QUEUE_TIMEOUT_S', 30))
+    # Router multinodo (app/router.py, scripts/run_router.py): backends ('http://host:puerto,...'), nodos virtuales
+    # por backend en el anillo, caracteres del prompt que forman la clave de afinidad de /complete,
+    # comprobaciones de salud (GET /), solicitudes en curso a partir de las que se derrama al backend menos
+    # cargado (0 = nunca), reintentos ante errores de conexión y tiempo máximo de cada solicitud reenviada
+    config['ROUTER_BACKENDS'] = os.getenv('ROUTER_BACKENDS', '')
+    config['ROUTER_PORT'] = int(os.getenv('ROUTER_PORT', 8000))
+    config['ROUTER_VNODES'] = int(os.getenv('ROUTER_VNODES', 64))
+    config['ROUTER_PREFIX_CHARS'] = int(os.getenv('ROUTER_PREFIX_CHARS', 256))
+    config['ROUTER_HEALTH_INTERVAL_S'] = float(os.getenv('ROUTER_HEALTH_INTERVAL_S', 2))
+    config['ROUTER_HEALTH_TIMEOUT_S'] = float(os.getenv('ROUTER_HEALTH_TIMEOUT_S', 1))
+    config['ROUTER_UNHEALTHY_AFTER'] = int(os.getenv('ROUTER_UNHEALTHY_AFTER', 2))
+    config['ROUTER_SPILL_IN_FLIGHT'] = int(os.getenv('ROUTER_SPILL_IN_FLIGHT', 8))
+    config['ROUTER_RETRIES'] = int(os.getenv('ROUTER_RETRIES', 2))
+    config['ROUTER_TIMEOUT_S'] = float(os.getenv('ROUTER_TIMEOUT_S', 300))
+    config['ROUTER_MAX_CONNECTIONS'] = int(os.getenv('ROUTER_MAX_CONNECTIONS', 256))
+    # Métricas de Prometheus (/metrics). Con METRICS_DIR, los procesos vuelcan sus valores allí y se suman.
+    config['METRICS_ENABLED'] = _env_bool('METRICS_ENABLED', 'True')
+    config['METRICS_DIR'] = os.getenv('METRICS_DIR', '')
+    config['METRICS_FLUSH_S'] = float(os.getenv('METRICS_FLUSH_S', 5))
+    # Backend de inferencia: 'local' (cada proceso carga los modelos) o 'remote'
+    # (un único proceso servidor de modelos atiende a todos los workers HTTP).
+    config['INFERENCE_BACKEND'] = os.getenv('INFERENCE_BACKEND', 'local').lower()
+    config['MODEL_SERVER_ADDRESS'] = os.getenv('MODEL_SERVER_ADDRESS', '/tmp/iacodex-model-server.sock')
+    # La clave por defecto sólo se admite con el socket Unix; por TCP el servidor exige una propia y,
+    # salvo con MODEL_SERVER_ALLOW_REMOTE, escucha sólo en loopback (los mensajes se deserializan con pickle)
+    config['MODEL_SERVER_AUTHKEY'] = os.getenv('MODEL_SERVER_AUTHKEY', 'iacodex')
+    config['MODEL_SERVER_ALLOW_REMOTE'] = _env_bool('MODEL_SERVER_ALLOW_REMOTE', 'False')
+    return config
 
 def create_app():
     """
     Crea y configura la instancia de la aplicación Flask.
     """
     app = Flask(__name__)
-    
+
     # --- Configuración de la aplicación desde variables de entorno ---
-    # DEBUG: Convertir la cadena a booleano
-    app.config['DEBUG'] = os.getenv('DEBUG', 'False').lower() in ('true', '1', 't')
-    # API_PORT: Convertir a entero
-    app.config['API_PORT'] = int(os.getenv('API_PORT', 5000))
-    # Nombres de los modelos de Hugging Face
-    app.config['HF_MODEL_AUTOCOMPLETE'] = os.getenv('HF_MODEL_AUTOCOMPLETE')
-    app.config['HF_MODEL_TEXT2TEXT'] = os.getenv('HF_MODEL_TEXT2TEXT')
-    
-    # --- Carga de modelos de IA ---
-    # Es crucial cargar los modelos dentro del contexto de la aplicación para asegurar que
-    # estén disponibles para todas las solicitudes y se carguen una sola vez.
+    app.config.update(load_config())
+
+    # --- Métricas ---
+    # Antes de registrar los modelos, para medir también sus tiempos de carga.
+    from .metrics import init_metrics
+    init_metrics(app.config)
+
+    # --- Registro de modelos de IA ---
+    # Los modelos se registran aquí y se cargan una sola vez, con la primera solicitud que los necesita
+    # (o ahora mismo si MODEL_WARMUP está activado). Así `import app` y los health checks son inmediatos.
+    # Con INFERENCE_BACKEND=remote no se carga nada: las solicitudes se reenvían al servidor de modelos.
     with app.app_context():
         load_models(app.config) # Pasar la configuración para que models.py acceda a los nombres de modelos
 
+    # --- Admisión por tokens (límites por endpoint y presupuesto de prefill) ---
+    from .admission import init_admission
+    init_admission(app.config)
+
+    # --- Criterios de parada (secuencias de parada y fin de bloque) ---
+    from .stopping import init_stopping
+    init_stopping(app.config)
+
+    # --- Varias sugerencias de /complete (prefill compartido, convergencia y presupuesto) ---
+    from .suggestions import init_suggestions
+    init_suggestions(app.config)
+
+    # --- Vía rápida de /fix (código válido o con sólo errores de sangría, sin modelo) ---
+    from .fastfix import init_fastfix
+    init_fastfix(app.config)
+
+    # --- Modo archivo (fragmentos por fronteras sintácticas) ---
+    from .chunking import init_chunking
+    init_chunking(app.config)
+
+    # --- Planificador de micro-lotes ---
+    # Se sitúa entre los endpoints y los pipelines para agrupar solicitudes concurrentes.
+    from .batching import init_batching
+    init_batching(app.config)
+
+    # --- Carriles de prioridad y turnos de las pasadas del modelo ---
+    from .scheduling import init_scheduling
+    init_scheduling(app.config)
+
+    # --- Caché de respuestas ---
+    from .cache import init_cache
+    init_cache(app.config)
+
+    # --- Agrupación de solicitudes idénticas en curso ---
+    from .coalesce import init_coalesce
+    init_coalesce(app.config)
+
+    # --- Trabajos asíncronos (cola sqlite y sus hilos) ---
+    from .jobs import init_jobs
+    init_jobs(app.config)
+
+    # --- Caché KV por prefijo (autocompletado incremental) ---
+    from .kv_cache import init_prefix_cache
+    init_prefix_cache(app.config)
+
     # --- Registro de Blueprints ---
     # Un Blueprint organiza un conjunto de rutas y otras funciones relacionadas.
     # Es una buena práctica para modularizar aplicaciones Flask grandes.
     from .api import api_bp
     app.register_blueprint(api_bp)
 
-    return app
\ No newline at end of file
+    return app
@@ -0,0 +1,271 @@
+# ia-codex-api/app/admission.py
+
+"""
+Admisión de solicitudes según su longitud en tokens.
+
+- Cada entrada se tokeniza una sola vez (el resultado se reutiliza en el micro-batching).
+- Límites por endpoint: tokens de entrada (por defecto, la ventana de contexto del modelo),
+  max_tokens y num_suggestions. Los parámetros fuera de rango se rechazan con 422 y las entradas
+  demasiado largas con 413, o se truncan conservando el principio o el final según la configuración.
+- Un presupuesto global de tokens (TokenBudget) limita el trabajo de prefill simultáneo del proceso:
+  las solicitudes esperan su turno en orden de llegada, de modo que una solicitud enorme no monopoliza
+  el modelo ni se queda sin turno.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+TRUNCATION_MODES = ('reject', 'keep_head', 'keep_tail')
+
+_config = {
+    'enabled': True,
+    'max_new_tokens': 512,
+    'max_suggestions': 5,
+    'max_input_tokens': {'complete': 0, 'fix': 0, 'convert': 0},  # 0 = ventana de contexto del modelo
+    'truncate': {'complete': 'keep_tail', 'fix': 'reject', 'convert': 'reject'},
+}
+_counters = {'admitted': 0, 'truncated': 0, 'rejected_413': 0, 'rejected_422': 0}
+_counters_lock = threading.Lock()
+_prefix_tokens = {} # (id del tokenizer, prefijo) -> número de tokens del texto fijo del prompt
+
+# Presupuesto global de tokens de prefill (None = sin límite).
+token_budget = None
+
+
+class AdmissionError(Exception):
+    """Solicitud rechazada por la admisión, con el código HTTP que debe ver el cliente (413, 422 o 503)."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class Admission:
+    """Resultado de admitir una entrada: el texto (quizá truncado) y su número de tokens."""
+
+    __slots__ = ('text', 'input_tokens', 'truncated_tokens')
+
+    def __init__(self, text, input_tokens, truncated_tokens=0):
+        self.text = text
+        self.input_tokens = input_tokens
+        self.truncated_tokens = truncated_tokens
+
+
+class TokenBudget:
+    """
+    Semáforo de tokens con cola FIFO: una solicitud reserva sus tokens de prefill y espera hasta que
+    es la primera de la cola y caben en el presupuesto. Una solicitud mayor que todo el presupuesto
+    reserva el presupuesto completo (se ejecuta sola).
+    """
+
+    def __init__(self, max_tokens, timeout_s=30.0):
+        self.max_tokens = max_tokens
+        self.timeout_s = timeout_s
+        self._cond = threading.Condition()
+        self._waiters = deque()
+        self._in_use = 0
+        self._counters = {'reservations': 0, 'waited': 0, 'timeouts': 0, 'wait_seconds': 0.0}
+
+    @contextmanager
+    def reserve(self, tokens):
+        tokens = max(1, min(int(tokens), self.max_tokens))
+        ticket = object()
+        started = time.monotonic()
+        deadline = started + self.timeout_s
+
+        with self._cond:
+            self._waiters.append(ticket)
+            while self._waiters[0] is not ticket or self._in_use + tokens > self.max_tokens:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiters.remove(ticket)
+                    self._counters['timeouts'] += 1
+                    self._cond.notify_all()
+                    raise AdmissionError("El servidor está saturado: no hay presupuesto de tokens disponible.", 503)
+                self._cond.wait(remaining)
+            self._waiters.popleft()
+            self._in_use += tokens
+            waited = time.monotonic() - started
+            self._counters['reservations'] += 1
+            self._counters['waited'] += 1 if waited > 0.001 else 0
+            self._counters['wait_seconds'] += waited
+            self._cond.notify_all() # El siguiente de la cola puede caber también
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_use -= tokens
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict(self._counters, in_use=self._in_use, waiting=len(self._waiters), max_tokens=self.max_tokens)
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def _reject(message, status_code):
+    _count('rejected_413' if status_code == 413 else 'rejected_422')
+    return AdmissionError(message, status_code)
+
+
+def context_window(pipeline):
+    """Longitud máxima de entrada del modelo (tokenizer.model_max_length o la configuración del modelo)."""
+    limit = getattr(getattr(pipeline, 'tokenizer', None), 'model_max_length', None)
+    if isinstance(limit, int) and 0 < limit < 1_000_000: # Los tokenizers sin límite devuelven un valor enorme
+        return limit
+    config = getattr(getattr(pipeline, 'model', None), 'config', None)
+    for attr in ('n_positions', 'max_position_embeddings'):
+        value = getattr(config, attr, None)
+        if isinstance(value, int) and value > 0:
+            return value
+    return None
+
+
+def _tokenizer(pipeline):
+    """Tokenizer real del pipeline, o None si no tiene (pipelines remotos o falsos: se estiman ~4 caracteres por token)."""
+    tokenizer = getattr(pipeline, 'tokenizer', None)
+    return tokenizer if tokenizer is not None and hasattr(tokenizer, 'decode') else None
+
+
+def _encode(tokenizer, text):
+    return tokenizer(text, add_special_tokens=False)['input_ids']
+
+
+def count_tokens(pipeline, text):
+    """Tokens de un texto con el tokenizer del pipeline (o la estimación de ~4 caracteres por token)."""
+    tokenizer = _tokenizer(pipeline)
+    return len(_encode(tokenizer, text)) if tokenizer is not None else (len(text) + 3) // 4
+
+
+def _prefix_length(tokenizer, prefix):
+    if not prefix:
+        return 0
+    if tokenizer is None:
+        return (len(prefix) + 3) // 4
+    key = (id(tokenizer), prefix)
+    if key not in _prefix_tokens:
+        _prefix_tokens[key] = len(_encode(tokenizer, prefix))
+    return _prefix_tokens[key]
+
+
+def positive_int(data, field, default, maximum):
+    """
+    Lee un parámetro entero positivo de la solicitud y comprueba su máximo (422 si no es válido).
+    Si el cliente no lo envía, se usa el valor por defecto limitado al máximo.
+    """
+    limited = _config['enabled'] and maximum
+    if field not in data:
+        return min(default, maximum) if limited else default
+    value = data[field]
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise _reject(f"El campo '{field}' debe ser un entero positivo.", 422)
+    if limited and value > maximum:
+        raise _reject(f"El campo '{field}' ({value}) supera el máximo permitido ({maximum}).", 422)
+    return value
+
+
+def max_new_tokens(data, default=256):
+    return positive_int(data, 'max_tokens', default, _config['max_new_tokens'])
+
+
+def num_suggestions(data, default=1):
+    return positive_int(data, 'num_suggestions', default, _config['max_suggestions'])
+
+
+def admit(operation, pipeline, text, prefix='', max_new_tokens=256):
+    """
+    Tokeniza 'text' (el código o prompt del cliente; 'prefix' es el texto fijo que le antepone el prompt)
+    y aplica el límite de tokens de entrada del endpoint: devuelve un Admission con el texto,
+    truncado si la configuración lo permite, o lanza AdmissionError (413).
+    """
+    tokenizer = _tokenizer(pipeline)
+    token_ids = _encode(tokenizer, text) if tokenizer is not None else None
+    text_tokens = len(token_ids) if token_ids is not None else (len(text) + 3) // 4
+    prefix_tokens = _prefix_length(tokenizer, prefix)
+    if not _config['enabled']:
+        return Admission(text, prefix_tokens + text_tokens)
+
+    limit = _config['max_input_tokens'].get(operation) or None
+    window = context_window(pipeline)
+    if window is not None:
+        # Los modelos sólo de decodificador comparten la ventana entre el prompt y los tokens generados.
+        window_limit = window - max_new_tokens if operation == 'complete' else window
+        if window_limit <= prefix_tokens:
+            raise _reject(
+                f"El campo 'max_tokens' ({max_new_tokens}) no cabe en la ventana de contexto del modelo ({window} tokens).",
+                422
+            )
+        limit = min(limit, window_limit) if limit else window_limit
+
+    if limit is None or prefix_tokens + text_tokens <= limit:
+        _count('admitted')
+        return Admission(text, prefix_tokens + text_tokens)
+
+    mode = _config['truncate'].get(operation, 'reject')
+    if mode == 'reject':
+        raise _reject(
+            f"La entrada tiene {prefix_tokens + text_tokens} tokens y el máximo para /{operation} es {limit}.", 413
+        )
+
+    keep = max(1, limit - prefix_tokens)
+    if token_ids is not None:
+        kept_ids = token_ids[:keep] if mode == 'keep_head' else token_ids[-keep:]
+        truncated = tokenizer.decode(kept_ids)
+    else:
+        truncated = text[:keep * 4] if mode == 'keep_head' else text[-keep * 4:]
+    if mode == 'keep_tail' and '\n' in truncated:
+        # Empieza en una línea completa en lugar de a mitad de una.
+        truncated = truncated[truncated.index('\n') + 1:]
+
+    _count('truncated')
+    kept_tokens = min(keep, text_tokens)
+    return Admission(truncated, prefix_tokens + kept_tokens, text_tokens - kept_tokens)
+
+
+@contextmanager
+def prefill_budget(tokens):
+    """Reserva 'tokens' del presupuesto global de prefill mientras dura la inferencia."""
+    if token_budget is None or not tokens:
+        yield
+        return
+    with token_budget.reserve(tokens):
+        yield
+
+
+def init_admission(app_config):
+    """Configura la admisión a partir de la configuración de la aplicación."""
+    global token_budget
+    _config['enabled'] = app_config.get('ADMISSION_ENABLED', True)
+    _config['max_new_tokens'] = int(app_config.get('ADMISSION_MAX_NEW_TOKENS', 512))
+    _config['max_suggestions'] = int(app_config.get('ADMISSION_MAX_SUGGESTIONS', 5))
+    for operation in ('complete', 'fix', 'convert'):
+        suffix = operation.upper()
+        _config['max_input_tokens'][operation] = int(app_config.get(f'ADMISSION_MAX_INPUT_TOKENS_{suffix}', 0))
+        mode = app_config.get(f'ADMISSION_TRUNCATE_{suffix}', _config['truncate'][operation])
+        if mode not in TRUNCATION_MODES:
+            raise ValueError(f"ADMISSION_TRUNCATE_{suffix} debe ser uno de {', '.join(TRUNCATION_MODES)}.")
+        _config['truncate'][operation] = mode
+
+    budget = int(app_config.get('ADMISSION_TOKEN_BUDGET', 8192))
+    token_budget = (
+        TokenBudget(budget, float(app_config.get('ADMISSION_QUEUE_TIMEOUT_S', 30)))
+        if _config['enabled'] and budget > 0 else None
+    )
+
+
+def get_stats():
+    with _counters_lock:
+        counters = dict(_counters)
+    return dict(
+        counters,
+        enabled=_config['enabled'],
+        token_budget=token_budget.stats() if token_budget is not None else None,
+    )
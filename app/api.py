@@ -1,13 +1,208 @@
 # ia-codex-api/app/api.py
 
 import sys
-from flask import Blueprint, request, jsonify
-from .models import get_generator_pipeline, get_text2text_pipeline
-from .utils import get_json_data # Importa la nueva función de utilidad
+from flask import Blueprint, Response, current_app, g, request, jsonify, stream_with_context
+from . import admission
+from . import metrics
+from . import scheduling
+from . import models
+from .models import get_model_status, get_cpu_profile, stream_generation
+from . import batching
+from . import cache
+from . import coalesce
+from . import chunking
+from . import fastfix
+from . import inference
+from . import jobs
+from . import kv_cache
+from . import suggestions
+from .inference import InferenceError
+from .utils import get_json_data, wants_stream, sse_event # Importa las funciones de utilidad
 
 # Crear un Blueprint para la API. Esto permite organizar las rutas.
 api_bp = Blueprint('api', __name__)
 
+@api_bp.before_request
+def _start_metrics():
+    # Etiqueta de baja cardinalidad: la regla de la ruta, no la URL concreta.
+    g.metrics_token = metrics.start_request(request.url_rule.rule if request.url_rule else 'unmatched')
+    # Carril de prioridad (interactivo o masivo) y cliente de la solicitud (ver app/scheduling.py).
+    g.priority_token = scheduling.start_request(request.path, request.headers.get, request.remote_addr)
+
+@api_bp.after_request
+def _finish_metrics(response):
+    """Añade la cabecera Server-Timing con las etapas de la solicitud y registra su duración."""
+    server_timing = metrics.server_timing_header()
+    if server_timing:
+        response.headers['Server-Timing'] = server_timing
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        metrics.finish_request(token, response.status_code)
+    token = g.pop('priority_token', None)
+    if token is not None:
+        scheduling.finish_request(token)
+    return response
+
+def _prepare(operation, data):
+    """
+    Valida la solicitud y construye la tarea de inferencia.
+    Devuelve (tarea, None) o (None, respuesta de error).
+    """
+    try:
+        return inference.prepare(operation, data), None
+    except Exception as e:
+        payload, status_code = inference.error_payload(operation, e)
+        return None, (jsonify(payload), status_code)
+
+def _run(task):
+    """Ejecuta una tarea individual y construye la respuesta JSON (con la cabecera X-Cache si aplica)."""
+    try:
+        payload, cache_hit = inference.run(task)
+    except Exception as e:
+        payload, status_code = inference.error_payload(task.operation, e)
+        return jsonify(payload), status_code
+
+    headers = {}
+    if task.cache_key is not None:
+        headers['X-Cache'] = 'HIT' if cache_hit else 'MISS'
+    if task.truncated_tokens:
+        headers['X-Input-Truncated'] = str(task.truncated_tokens) # Tokens descartados de la entrada
+    with metrics.stage('serialize'):
+        response = jsonify(payload)
+    return response, 200, headers
+
+def _stream_response(task):
+    """
+    Devuelve una respuesta Server-Sent Events que emite cada fragmento de texto en cuanto se decodifica
+    (evento por defecto, {"token": ...}) y, al terminar, un evento 'done' con el resultado completo.
+    Los errores durante la generación se notifican con un evento 'error'.
+    """
+    if task.cache_key is not None:
+        cached = cache.get_cached(task.cache_key)
+        if cached is not None:
+            return _cached_stream_response(task.response(cached))
+
+    action = inference.ACTIONS[task.operation]
+    generate_kwargs = {
+        key: value for key, value in task.params.items()
+        if key not in ('num_return_sequences', 'return_full_text')
+    }
+
+    def build_result(text):
+        value = task.stream_result(text) # /complete: con o sin el prompt, según 'return_full_text'
+        if task.cache_key is not None:
+            cache.set_cached(task.cache_key, value)
+        return task.response(value)
+
+    # El cuerpo se genera después de after_request: la prioridad de la solicitud se guarda aquí.
+    priority = scheduling.current()
+
+    def generate():
+        parts = []
+        try:
+            with scheduling.use_priority(priority), models.model_in_use(task.kind), \
+                    admission.prefill_budget(task.prefill_tokens):
+                # La generación se detiene en cuanto la salida está completa (ver app/stopping.py).
+                for text in task.stream_chunks(stream_generation(task.pipeline, task.prompt, **generate_kwargs)):
+                    parts.append(text)
+                    yield sse_event({"token": text})
+            yield sse_event(build_result(''.join(parts)), event='done')
+        except admission.AdmissionError as e:
+            yield sse_event({"error": e.message}, event='error')
+        except Exception as e:
+            print(f"Error al {action} (streaming): {e}", file=sys.stderr)
+            yield sse_event({"error": f"Error interno del servidor al {action}: {str(e)}"}, event='error')
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'} # Evita que un proxy acumule el stream
+    if task.truncated_tokens:
+        headers['X-Input-Truncated'] = str(task.truncated_tokens)
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+def _cached_stream_response(result):
+    """
+    Respuesta Server-Sent Events para un resultado ya guardado en la caché:
+    el texto completo se envía como un único fragmento, seguido del evento 'done'.
+    """
+    text = next(iter(result.values()))
+    body = sse_event({"token": text}) + sse_event(result, event='done')
+    return Response(body, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Cache': 'HIT'})
+
+def _file_response(operation, data):
+    """
+    Modo archivo ("mode": "file") de /fix y /convert: el código se divide en fragmentos por fronteras
+    sintácticas que se ejecutan como un lote y se unen en orden (ver app/chunking.py).
+    Con streaming, cada fragmento se envía como un evento 'chunk' en cuanto termina.
+    """
+    try:
+        chunked = chunking.prepare_chunked(operation, data)
+        if wants_stream(request, data):
+            # El cuerpo se genera después de after_request: la prioridad de la solicitud se guarda aquí.
+            priority = scheduling.current()
+
+            def generate():
+                with scheduling.use_priority(priority):
+                    yield from chunking.stream_events(chunked)
+
+            return Response(
+                stream_with_context(generate()),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+        payload = chunking.run_chunked(chunked)
+    except Exception as e:
+        payload, status_code = inference.error_payload(operation, e)
+        return jsonify(payload), status_code
+
+    with metrics.stage('serialize'):
+        response = jsonify(payload)
+    return response, 200
+
+def _batch_endpoint(operation):
+    """
+    Procesa un endpoint por lotes: {"items": [...]} con un objeto por elemento.
+    Los campos del JSON fuera de 'items' sirven como valores por defecto de cada elemento.
+    Los resultados vuelven en el orden de la solicitud, con un error por elemento si alguno falla.
+    """
+    data, error_message, status_code = get_json_data(request)
+    if error_message:
+        return jsonify({"error": error_message}), status_code
+
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "El campo 'items' es requerido y debe ser una lista no vacía."}), 400
+
+    max_items = current_app.config.get('BATCH_ENDPOINT_MAX_ITEMS', 256)
+    if len(items) > max_items:
+        return jsonify({"error": f"Demasiados elementos en el lote ({len(items)}); el máximo es {max_items}."}), 413
+
+    defaults = {key: value for key, value in data.items() if key not in ('items', 'stream')}
+    tasks = []
+    for item in items:
+        if not isinstance(item, dict):
+            tasks.append(InferenceError("Cada elemento de 'items' debe ser un objeto JSON."))
+            continue
+        try:
+            tasks.append(inference.prepare(operation, dict(defaults, **item)))
+        except Exception as e:
+            tasks.append(e)
+
+    try:
+        outcomes = inference.run_many(tasks)
+    except Exception as e:
+        payload, status_code = inference.error_payload(operation, e)
+        return jsonify(payload), status_code
+
+    results = []
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            payload, status_code = inference.error_payload(operation, outcome)
+            results.append(dict(payload, status=status_code))
+        else:
+            results.append(outcome)
+    with metrics.stage('serialize'):
+        response = jsonify({"results": results})
+    return response, 200
+
 @api_bp.route('/')
 def home():
     """
@@ -16,6 +211,60 @@ def home():
     """
     return jsonify({"message": "Bienvenido a la IA Codex API. Utiliza /complete, /fix o /convert."})
 
+def collect_stats():
+    """
+    Métricas internas del servicio (estado de los modelos y perfil de CPU, admisión por tokens,
+    micro-batching por lote, carriles de prioridad, caché de respuestas, agrupación de solicitudes, caché KV por prefijo, trabajos asíncronos,
+    vía rápida de /fix, sugerencias de /complete). Con el servidor de modelos compartido, incluye también sus métricas.
+    """
+    result = {
+        "models": get_model_status(),
+        "cpu_profile": get_cpu_profile(),
+        "admission": admission.get_stats(),
+        "batching": batching.get_stats(),
+        "cache": cache.get_stats(),
+        "coalesce": coalesce.get_stats(),
+        "jobs": jobs.get_stats(),
+        "priority": scheduling.get_stats(),
+        "prefix_cache": kv_cache.get_stats(),
+        "fix_fast_path": fastfix.get_stats(),
+        "suggestions": suggestions.get_stats(),
+    }
+    generator_pipeline = models.generator_pipeline # Sin forzar la carga del modelo
+    if getattr(generator_pipeline, 'is_remote', False):
+        try:
+            result["model_server"] = generator_pipeline.client.request('stats')
+        except Exception as e:
+            result["model_server"] = {"error": str(e)}
+    return result
+
+@api_bp.route('/stats')
+def stats():
+    """
+    Endpoint con métricas internas del servicio (ver collect_stats).
+    """
+    return jsonify(collect_stats())
+
+@api_bp.route('/models')
+def list_models():
+    """
+    Modelos disponibles para el campo 'model' de las solicitudes: cuáles están cargados,
+    su memoria y cuántas solicitudes han atendido (ver models.list_models).
+    """
+    try:
+        return jsonify(models.list_models())
+    except Exception as e:
+        return jsonify({"error": f"No se pudo obtener la lista de modelos: {e}"}), 503
+
+@api_bp.route('/metrics')
+def prometheus_metrics():
+    """
+    Métricas en formato de texto de Prometheus, sumadas entre todos los procesos si METRICS_DIR está configurado.
+    """
+    if not metrics.enabled():
+        return jsonify({"error": "Las métricas están desactivadas (METRICS_ENABLED=False)."}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @api_bp.route('/complete', methods=['POST'])
 def complete_code():
     """
@@ -26,38 +275,22 @@ def complete_code():
     if error_message:
         return jsonify({"error": error_message}), status_code
 
-    prompt = data.get('prompt')
-    if not prompt:
-        return jsonify({"error": "El campo 'prompt' es requerido."}), 400 # Mensaje de error unificado
+    if request.headers.get('X-Session-Id'):
+        data.setdefault('session_id', request.headers['X-Session-Id'])
 
-    # Obtener parámetros opcionales de la solicitud, con valores por defecto.
-    max_tokens = data.get("max_tokens", 256)
-    num_suggestions = data.get("num_suggestions", 1)
+    task, error_response = _prepare('complete', data)
+    if error_response:
+        return error_response
 
-    # Obtener el pipeline del modelo de autocompletado.
-    generator_pipeline = get_generator_pipeline()
-    if generator_pipeline is None:
-        return jsonify({"error": "Modelo de autocompletado no cargado."}), 500
+    # Streaming: los tokens se envían a medida que se generan (sólo una sugerencia).
+    if wants_stream(request, data):
+        if task.params['num_return_sequences'] != 1:
+            return jsonify({"error": "El streaming sólo admite num_suggestions=1."}), 400
+        return _stream_response(task)
 
-    try:
-        # Generar sugerencias de autocompletado usando el modelo.
-        suggestions = generator_pipeline(
-            prompt,
-            max_new_tokens=max_tokens,
-            num_return_sequences=num_suggestions,
-            pad_token_id=generator_pipeline.tokenizer.eos_token_id,
-            return_full_text=True # Para text-generation, si quieres el prompt + generacion
-        )
-        
-        results = []
-        for suggestion in suggestions:
-            results.append(suggestion['generated_text'])
-        
-        return jsonify({"suggestions": results}), 200
-
-    except Exception as e:
-        print(f"Error al autocompletar código: {e}", file=sys.stderr)
-        return jsonify({"error": f"Error interno del servidor al autocompletar código: {str(e)}"}), 500
+    # Generar sugerencias de autocompletado usando el modelo.
+    # La solicitud pasa por el planificador de micro-lotes, que la agrupa con otras concurrentes.
+    return _run(task)
 
 @api_bp.route('/fix', methods=['POST'])
 def fix_code():
@@ -69,32 +302,16 @@ def fix_code():
     if error_message:
         return jsonify({"error": error_message}), status_code
 
-    code_snippet = data.get('code')
-    if not code_snippet:
-        return jsonify({"error": "El campo 'code' es requerido."}), 400 # Mensaje de error unificado
+    # Modo archivo: archivos completos que no caben en la ventana de contexto del modelo.
+    if chunking.wants_file_mode(data):
+        return _file_response('fix', data)
 
-    max_tokens = data.get("max_tokens", 256)
+    task, error_response = _prepare('fix', data)
+    if error_response:
+        return error_response
 
-    text2text_pipeline = get_text2text_pipeline()
-    if text2text_pipeline is None:
-        return jsonify({"error": "Modelo de corrección no cargado."}), 500
-
-    try:
-        # Formular el prompt para la corrección de código.
-        prompt = f"Corrige los errores de sintaxis y ajusta la sangría de este código:\n{code_snippet}"
-        
-        # Generar el código corregido.
-        corrected_code = text2text_pipeline(
-            prompt, 
-            max_new_tokens=max_tokens, # Usar max_new_tokens
-            do_sample=False # Eliminado: return_full_text=False
-        )[0]['generated_text']
-        
-        return jsonify({"fixed_code": corrected_code}), 200
-
-    except Exception as e:
-        print(f"Error al corregir código: {e}", file=sys.stderr)
-        return jsonify({"error": f"Error interno del servidor al corregir código: {str(e)}"}), 500
+    # La generación es determinista (do_sample=False): si ya se calculó, se sirve desde la caché.
+    return _run(task)
 
 @api_bp.route('/convert', methods=['POST'])
 def convert_code():
@@ -106,39 +323,71 @@ def convert_code():
     if error_message:
         return jsonify({"error": error_message}), status_code
 
-    code_snippet = data.get('code')
-    target_language = data.get('target_language') # ¡Cambiado de 'to_lang' a 'target_language'!
-    
-    if not code_snippet:
-        return jsonify({"error": "El campo 'code' es requerido."}), 400
-    if not target_language:
-        return jsonify({"error": "El campo 'target_language' es requerido."}), 400 # Mensaje de error unificado
+    if chunking.wants_file_mode(data):
+        return _file_response('convert', data)
+
+    task, error_response = _prepare('convert', data)
+    if error_response:
+        return error_response
+
+    # Streaming: el código traducido se envía a medida que se genera.
+    if wants_stream(request, data):
+        return _stream_response(task)
+
+    return _run(task)
 
-    max_tokens = data.get("max_tokens", 256)
+@api_bp.route('/complete/batch', methods=['POST'])
+def complete_code_batch():
+    """
+    Autocompleta varios prompts en una sola llamada.
+    Espera un JSON con 'items': [{"prompt": ...}, ...].
+    """
+    return _batch_endpoint('complete')
 
-    text2text_pipeline = get_text2text_pipeline()
-    if text2text_pipeline is None:
-        return jsonify({"error": "Modelo de conversión no cargado."}), 500
+@api_bp.route('/fix/batch', methods=['POST'])
+def fix_code_batch():
+    """
+    Corrige varios fragmentos de código en una sola llamada.
+    Espera un JSON con 'items': [{"code": ...}, ...].
+    """
+    return _batch_endpoint('fix')
 
-    # Lista de lenguajes soportados (puedes ampliarla)
-    # Es crucial que tu modelo T5 haya sido entrenado o pueda manejar estas traducciones.
-    supported_languages = ['python', 'javascript', 'java', 'c++', 'go', 'ruby'] 
-    if target_language.lower() not in supported_languages:
-        return jsonify({"error": f"El lenguaje objetivo '{target_language}' no es soportado."}), 400
+@api_bp.route('/convert/batch', methods=['POST'])
+def convert_code_batch():
+    """
+    Convierte varios fragmentos de código en una sola llamada.
+    Espera un JSON con 'items': [{"code": ..., "target_language": ...}, ...].
+    'target_language' puede indicarse una sola vez fuera de 'items'.
+    """
+    return _batch_endpoint('convert')
 
+@api_bp.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Encola un trabajo asíncrono y devuelve su id sin esperar a la inferencia (202).
+    Espera un JSON con 'operation' ('complete', 'fix' o 'convert'), 'input' (el cuerpo de ese endpoint)
+    y, opcionalmente, 'callback_url'. Con la cabecera Idempotency-Key, repetir la solicitud devuelve el mismo trabajo.
+    """
+    data, error_message, status_code = get_json_data(request)
+    if error_message:
+        return jsonify({"error": error_message}), status_code
     try:
-        # Formular el prompt para la traducción de código.
-        prompt = f"Traduce el siguiente fragmento de código al lenguaje {target_language}:\n{code_snippet}"
-        
-        # Generar el código traducido.
-        translated_code = text2text_pipeline(
-            prompt, 
-            max_new_tokens=max_tokens, # Usando max_new_tokens
-            do_sample=False # Eliminado: return_full_text=False
-        )[0]['generated_text']
-        
-        return jsonify({"converted_code": translated_code}), 200
+        job, created = jobs.submit(data, scheduling.current().client, request.headers.get('Idempotency-Key'))
+    except jobs.JobError as e:
+        return jsonify({"error": e.message}), e.status_code
+    job['status_url'] = f"/jobs/{job['job_id']}"
+    return jsonify(job), 202 if created else 200, {'Location': job['status_url']}
 
-    except Exception as e:
-        print(f"Error al convertir código: {e}", file=sys.stderr)
-        return jsonify({"error": f"Error interno del servidor al convertir código: {str(e)}"}), 500
\ No newline at end of file
+@api_bp.route('/jobs/<job_id>')
+def get_job(job_id):
+    """
+    Estado de un trabajo y, cuando termina, su resultado (el mismo JSON que devolvería el endpoint).
+    Con ?wait=<segundos> (hasta JOBS_MAX_WAIT_S) espera a que termine antes de responder.
+    """
+    try:
+        job = jobs.wait_for(job_id, jobs.wait_time(request.args.get('wait')))
+    except jobs.JobError as e:
+        return jsonify({"error": e.message}), e.status_code
+    if job is None:
+        return jsonify({"error": f"El trabajo '{job_id}' no existe o su resultado ya caducó."}), 404
+    return jsonify(job)
@@ -0,0 +1,489 @@
+# ia-codex-api/app/asgi.py
+
+"""
+Punto de entrada ASGI con el mismo contrato que la aplicación Flask (/, /stats, /complete, /fix, /convert).
+
+El bucle de eventos sólo atiende conexiones: la validación, la caché y la inferencia se ejecutan en un
+ThreadPoolExecutor dedicado, así que miles de conexiones en espera o en streaming apenas cuestan memoria.
+El número de solicitudes de inferencia en curso está acotado; cuando además la cola de espera está llena
+se responde 429, y si una solicitud espera turno más de ASGI_QUEUE_TIMEOUT_S se responde 503.
+
+Arranque (requiere uvicorn):
+    uvicorn --factory app.asgi:create_asgi_app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import contextvars
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import load_config
+from . import admission
+from . import batching
+from . import cache
+from . import chunking
+from . import coalesce
+from . import fastfix
+from . import inference
+from . import jobs
+from . import kv_cache
+from . import metrics
+from . import models
+from . import scheduling
+from . import stopping
+from . import suggestions
+from .models import load_models, stream_generation
+from .utils import sse_event
+
+# Operaciones que admiten streaming (Server-Sent Events), como en app/api.py.
+STREAMING_OPERATIONS = ('complete', 'convert')
+# Operaciones con modo archivo ("mode": "file", ver app/chunking.py).
+FILE_OPERATIONS = ('fix', 'convert')
+
+
+class Overloaded(Exception):
+    """El servidor no admite más solicitudes de inferencia ahora mismo (429 o 503)."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class InferenceGate:
+    """
+    Limita las solicitudes de inferencia en curso (max_in_flight) y las que esperan turno (max_queue).
+    Sólo se usa desde el hilo del bucle de eventos, así que los contadores no necesitan candados.
+    """
+
+    def __init__(self, max_in_flight=32, max_queue=256, queue_timeout_s=30.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self.in_flight = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._counters = {'admitted': 0, 'rejected_429': 0, 'rejected_503': 0}
+
+    async def acquire(self):
+        if self._slots.locked() and self.waiting >= self.max_queue:
+            self._counters['rejected_429'] += 1
+            raise Overloaded("Demasiadas solicitudes en curso. Inténtalo de nuevo en unos segundos.", 429)
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            self._counters['rejected_503'] += 1
+            raise Overloaded("El servidor está saturado: la solicitud esperó demasiado su turno.", 503)
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self._counters['admitted'] += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        return dict(
+            self._counters,
+            in_flight=self.in_flight,
+            waiting=self.waiting,
+            max_in_flight=self.max_in_flight,
+            max_queue=self.max_queue,
+        )
+
+
+def _header(scope, name):
+    """Valor de una cabecera de la solicitud ASGI (nombre en minúsculas) o ''."""
+    for key, value in scope.get('headers', []):
+        if key.decode('latin-1').lower() == name:
+            return value.decode('latin-1')
+    return ''
+
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def _wait_disconnect(receive):
+    """Espera a que el cliente cierre la conexión (se usa durante el streaming)."""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def _send_json(send, status_code, payload, headers=None):
+    with metrics.stage('serialize'):
+        body = json.dumps(payload).encode()
+    response_headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    for key, value in (headers or {}).items():
+        response_headers.append((key.lower().encode(), str(value).encode()))
+    await send({'type': 'http.response.start', 'status': status_code, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _send_error(send, operation, error):
+    payload, status_code = inference.error_payload(operation, error)
+    await _send_json(send, status_code, payload)
+
+
+def _sse_headers(extra=None):
+    headers = [
+        (b'content-type', b'text/event-stream; charset=utf-8'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'), # Evita que un proxy acumule el stream
+    ]
+    for key, value in (extra or {}).items():
+        headers.append((key.lower().encode(), value.encode()))
+    return headers
+
+
+class AsgiApp:
+    """
+    Aplicación ASGI sin dependencias externas. Comparte con la aplicación Flask la lógica de
+    app/inference.py, el micro-batching y las cachés.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        max_in_flight = int(config.get('ASGI_MAX_IN_FLIGHT', 32))
+        self.gate = InferenceGate(
+            max_in_flight=max_in_flight,
+            max_queue=int(config.get('ASGI_MAX_QUEUE', 256)),
+            queue_timeout_s=float(config.get('ASGI_QUEUE_TIMEOUT_S', 30)),
+        )
+        # Un hilo por solicitud admitida: casi todos esperan al planificador de micro-lotes, no usan CPU.
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='iacodex-inference')
+        self.routes = {
+            '/': {'GET': self.home},
+            '/stats': {'GET': self.stats},
+            '/models': {'GET': self.list_models},
+            '/metrics': {'GET': self.prometheus_metrics},
+            '/complete': {'POST': lambda *args: self.operation('complete', *args)},
+            '/fix': {'POST': lambda *args: self.operation('fix', *args)},
+            '/convert': {'POST': lambda *args: self.operation('convert', *args)},
+            '/jobs': {'POST': self.create_job},
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        label, methods = self._route(scope['path'])
+        token = metrics.start_request(label)
+        client = scope.get('client')
+        priority_token = scheduling.start_request(
+            scope['path'], lambda name: _header(scope, name.lower()), client[0] if client else None
+        )
+        status = [500]
+
+        async def send_with_metrics(message):
+            # La cabecera Server-Timing lleva las etapas medidas hasta que empieza la respuesta.
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                server_timing = metrics.server_timing_header()
+                if server_timing:
+                    message = dict(message, headers=list(message['headers']) + [(b'server-timing', server_timing.encode())])
+            await send(message)
+
+        try:
+            if methods is None:
+                await _send_json(send_with_metrics, 404, {"error": "Ruta no encontrada."})
+                return
+            handler = methods.get(scope['method'])
+            if handler is None:
+                await _send_json(send_with_metrics, 405, {"error": "Método no permitido."}, {'Allow': ', '.join(methods)})
+                return
+            await handler(scope, receive, send_with_metrics)
+        finally:
+            metrics.finish_request(token, status[0])
+            scheduling.finish_request(priority_token)
+
+    def _route(self, path):
+        """Etiqueta de la ruta (de baja cardinalidad, como la regla de Flask) y sus métodos."""
+        if path.startswith('/jobs/') and path.count('/') == 2 and len(path) > len('/jobs/'):
+            job_id = path[len('/jobs/'):]
+            return '/jobs/<job_id>', {'GET': lambda *args: self.get_job(job_id, *args)}
+        methods = self.routes.get(path)
+        return (path if methods is not None else 'unmatched'), methods
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _offload(self, func, *args):
+        """
+        Ejecuta una función bloqueante en el executor de inferencia, con el contexto de la solicitud
+        (las etapas medidas en el hilo se suman a esta solicitud).
+        """
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, context.run, func, *args)
+
+    async def _read_json(self, scope, receive):
+        """
+        Equivalente a utils.get_json_data: devuelve (datos, None) o (None, (código, JSON de error)).
+        """
+        content_type = _header(scope, 'content-type').split(';')[0].strip()
+        if content_type != 'application/json' and not content_type.endswith('+json'):
+            return None, (415, {"error": "Formato JSON inválido. Content-Type debe ser application/json."})
+        body = await _read_body(receive)
+        try:
+            with metrics.stage('parse'):
+                data = json.loads(body) if body else None
+        except ValueError:
+            return None, (400, {"error": "El cuerpo de la solicitud no es un JSON válido."})
+        if data is None:
+            return None, (400, {"error": "No se proporcionaron datos JSON o el JSON está vacío."})
+        if not isinstance(data, dict):
+            return None, (400, {"error": "El JSON de la solicitud debe ser un objeto."})
+        return data, None
+
+    async def home(self, scope, receive, send):
+        await _send_json(send, 200, {"message": "Bienvenido a la IA Codex API. Utiliza /complete, /fix o /convert."})
+
+    async def stats(self, scope, receive, send):
+        from .api import collect_stats
+        result = await self._offload(collect_stats)
+        result["asgi"] = self.gate.stats()
+        await _send_json(send, 200, result)
+
+    async def list_models(self, scope, receive, send):
+        try:
+            result = await self._offload(models.list_models)
+        except Exception as e:
+            await _send_json(send, 503, {"error": f"No se pudo obtener la lista de modelos: {e}"})
+            return
+        await _send_json(send, 200, result)
+
+    async def prometheus_metrics(self, scope, receive, send):
+        if not metrics.enabled():
+            await _send_json(send, 404, {"error": "Las métricas están desactivadas (METRICS_ENABLED=False)."})
+            return
+        body = (await self._offload(metrics.render)).encode()
+        headers = [(b'content-type', b'text/plain; version=0.0.4'), (b'content-length', str(len(body)).encode())]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def create_job(self, scope, receive, send):
+        data, error = await self._read_json(scope, receive)
+        if error:
+            await _send_json(send, *error)
+            return
+        try:
+            job, created = await self._offload(
+                jobs.submit, data, scheduling.current().client, _header(scope, 'idempotency-key') or None
+            )
+        except jobs.JobError as e:
+            await _send_json(send, e.status_code, {"error": e.message})
+            return
+        job['status_url'] = f"/jobs/{job['job_id']}"
+        await _send_json(send, 202 if created else 200, job, {'Location': job['status_url']})
+
+    async def get_job(self, job_id, scope, receive, send):
+        """Estado de un trabajo; con ?wait=<segundos>, espera sin ocupar un hilo a que termine (long-poll)."""
+        query = dict(
+            part.split('=', 1) for part in scope.get('query_string', b'').decode('latin-1').split('&') if '=' in part
+        )
+        try:
+            deadline = asyncio.get_running_loop().time() + jobs.wait_time(query.get('wait'))
+            while True:
+                job = await self._offload(jobs.get, job_id)
+                if job is None or job['status'] in ('done', 'failed') or asyncio.get_running_loop().time() >= deadline:
+                    break
+                await asyncio.sleep(min(0.1, max(0.0, deadline - asyncio.get_running_loop().time())))
+        except jobs.JobError as e:
+            await _send_json(send, e.status_code, {"error": e.message})
+            return
+        if job is None:
+            await _send_json(send, 404, {"error": f"El trabajo '{job_id}' no existe o su resultado ya caducó."})
+            return
+        await _send_json(send, 200, job)
+
+    async def operation(self, operation, scope, receive, send):
+        data, error = await self._read_json(scope, receive)
+        if error:
+            await _send_json(send, *error)
+            return
+        if operation == 'complete' and _header(scope, 'x-session-id'):
+            data.setdefault('session_id', _header(scope, 'x-session-id'))
+        stream = operation in STREAMING_OPERATIONS and (
+            data.get('stream') is True or 'text/event-stream' in _header(scope, 'accept')
+        )
+
+        try:
+            await self.gate.acquire()
+        except Overloaded as e:
+            await _send_json(send, e.status_code, {"error": e.message}, {'Retry-After': 1})
+            return
+
+        try:
+            if operation in FILE_OPERATIONS and chunking.wants_file_mode(data):
+                await self._file_mode(operation, data, scope, receive, send)
+                return
+            try:
+                task = await self._offload(inference.prepare, operation, data)
+            except Exception as e:
+                await _send_error(send, operation, e)
+                return
+
+            if stream:
+                if task.params.get('num_return_sequences', 1) != 1:
+                    await _send_json(send, 400, {"error": "El streaming sólo admite num_suggestions=1."})
+                    return
+                await self._stream(task, receive, send)
+                return
+
+            try:
+                payload, cache_hit = await self._offload(inference.run, task)
+            except Exception as e:
+                await _send_error(send, operation, e)
+                return
+            headers = {}
+            if task.cache_key is not None:
+                headers['X-Cache'] = 'HIT' if cache_hit else 'MISS'
+            if task.truncated_tokens:
+                headers['X-Input-Truncated'] = task.truncated_tokens
+            await _send_json(send, 200, payload, headers)
+        finally:
+            self.gate.release()
+
+    async def _file_mode(self, operation, data, scope, receive, send):
+        """Modo archivo de /fix y /convert (ver app/chunking.py), con o sin streaming por fragmento."""
+        try:
+            chunked = await self._offload(chunking.prepare_chunked, operation, data)
+            if data.get('stream') is True or 'text/event-stream' in _header(scope, 'accept'):
+                await self._pump(chunking.stream_events(chunked), receive, send)
+                return
+            payload = await self._offload(chunking.run_chunked, chunked)
+        except Exception as e:
+            await _send_error(send, operation, e)
+            return
+        await _send_json(send, 200, payload)
+
+    async def _stream(self, task, receive, send):
+        """
+        Streaming Server-Sent Events con el mismo formato que app/api.py. La generación corre en un hilo
+        del executor y pasa cada fragmento al bucle de eventos; si el cliente se desconecta, se detiene.
+        """
+        if task.cache_key is not None:
+            cached = await self._offload(cache.get_cached, task.cache_key)
+            if cached is not None:
+                result = task.response(cached)
+                body = sse_event({"token": next(iter(result.values()))}) + sse_event(result, event='done')
+                await send({'type': 'http.response.start', 'status': 200, 'headers': _sse_headers({'X-Cache': 'HIT'})})
+                await send({'type': 'http.response.body', 'body': body.encode()})
+                return
+
+        action = inference.ACTIONS[task.operation]
+        generate_kwargs = {
+            key: value for key, value in task.params.items()
+            if key not in ('num_return_sequences', 'return_full_text')
+        }
+
+        def events():
+            parts = []
+            # La generación se detiene en cuanto la salida está completa (ver app/stopping.py).
+            generator = task.stream_chunks(stream_generation(task.pipeline, task.prompt, **generate_kwargs))
+            try:
+                with models.model_in_use(task.kind), admission.prefill_budget(task.prefill_tokens):
+                    for text in generator:
+                        parts.append(text)
+                        yield sse_event({"token": text})
+                value = task.stream_result(''.join(parts)) # /complete: con o sin el prompt ('return_full_text')
+                if task.cache_key is not None:
+                    cache.set_cached(task.cache_key, value)
+                yield sse_event(task.response(value), event='done')
+            except admission.AdmissionError as e:
+                yield sse_event({"error": e.message}, event='error')
+            except Exception as e:
+                print(f"Error al {action} (streaming): {e}", file=sys.stderr)
+                yield sse_event({"error": f"Error interno del servidor al {action}: {str(e)}"}, event='error')
+            finally:
+                generator.close() # Detiene la generación si el cliente se fue
+
+        extra = {'X-Input-Truncated': str(task.truncated_tokens)} if task.truncated_tokens else None
+        await self._pump(events(), receive, send, extra)
+
+    async def _pump(self, events, receive, send, extra_headers=None):
+        """
+        Envía como Server-Sent Events los textos de 'events', un generador bloqueante que corre en un hilo
+        del executor y pasa cada evento al bucle de eventos. Si el cliente se desconecta, el generador se cierra.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def produce():
+            try:
+                for event in events:
+                    if cancelled.is_set():
+                        return
+                    loop.call_soon_threadsafe(queue.put_nowait, event)
+            finally:
+                events.close()
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': _sse_headers(extra_headers)})
+        producer = loop.run_in_executor(self.executor, contextvars.copy_context().run, produce)
+        disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    return
+                chunk = getter.result()
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            cancelled.set()
+            disconnected.cancel()
+            await producer # El hueco de inferencia se libera cuando el hilo termina de verdad
+
+
+def create_asgi_app(config=None):
+    """
+    Crea la aplicación ASGI. Inicializa los mismos componentes que create_app() en app/__init__.py.
+    'config' permite sobrescribir valores de la configuración leída del entorno.
+    """
+    app_config = load_config()
+    app_config.update(config or {})
+
+    metrics.init_metrics(app_config)
+    load_models(app_config)
+    admission.init_admission(app_config)
+    stopping.init_stopping(app_config)
+    suggestions.init_suggestions(app_config)
+    fastfix.init_fastfix(app_config)
+    chunking.init_chunking(app_config)
+    batching.init_batching(app_config)
+    cache.init_cache(app_config)
+    coalesce.init_coalesce(app_config)
+    jobs.init_jobs(app_config)
+    scheduling.init_scheduling(app_config)
+    kv_cache.init_prefix_cache(app_config)
+    return AsgiApp(app_config)
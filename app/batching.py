@@ -0,0 +1,434 @@
+# ia-codex-api/app/batching.py
+
+import contextlib
+import os
+import sys
+import time
+import threading
+from collections import deque
+from functools import partial
+
+from . import metrics
+from . import scheduling
+from . import stopping
+from .models import get_pipeline, inference_context, model_label
+
+# Planificadores activos, uno por modelo ('generator', 'text2text' y los adicionales de MODELS).
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+# Configuración por defecto. Se sobrescribe en init_batching() con los valores del .env.
+_config = {
+    'enabled': True,
+    'max_wait_ms': 10.0,
+    'max_batch_size': 8,
+    'max_batch_tokens': 4096,
+    'request_timeout_s': 300.0,
+}
+
+def _count_tokens(pipeline, text):
+    """
+    Cuenta los tokens de un texto con el tokenizer del pipeline.
+    Si el pipeline no tiene tokenizer, usa una estimación de ~4 caracteres por token.
+    """
+    tokenizer = getattr(pipeline, 'tokenizer', None)
+    if tokenizer is not None:
+        try:
+            return len(tokenizer(text)['input_ids'])
+        except Exception:
+            pass
+    return len(text) // 4 + 1
+
+
+def _normalize_outputs(outputs, num_prompts):
+    """
+    Normaliza la salida de un pipeline llamado con una lista de prompts.
+    Devuelve siempre una lista (una entrada por prompt) de listas de diccionarios,
+    sin importar si el pipeline devolvió un diccionario o una lista por prompt.
+    """
+    if num_prompts == 1 and outputs and isinstance(outputs[0], dict):
+        # Algunos pipelines aplanan la salida cuando sólo hay un prompt y varias secuencias.
+        return [list(outputs)]
+    return [[item] if isinstance(item, dict) else list(item) for item in outputs]
+
+
+def run_batch(pipeline, prompts, priority=None, stop_rules=None, **params):
+    """
+    Ejecuta una lista de prompts en una sola pasada del pipeline (con padding).
+    Los prompts se ordenan por longitud para reducir el padding desperdiciado
+    y los resultados se devuelven en el orden original.
+    La pasada espera su turno según 'priority' (por defecto, la de la solicitud en curso; ver app/scheduling.py)
+    y, si es del carril masivo, cede el turno entre pasos de decodificación al carril interactivo.
+    'stop_rules' (una StopRule o None por prompt, ver app/stopping.py) termina cada fila en cuanto su salida
+    está completa; la salida se devuelve sin recortar.
+    """
+    order = sorted(range(len(prompts)), key=lambda i: len(prompts[i]))
+    sorted_prompts = [prompts[i] for i in order]
+    sorted_rules = [stop_rules[i] for i in order] if stop_rules else None
+    remote = getattr(pipeline, 'is_remote', False)
+    if remote:
+        # El servidor de modelos da los turnos: la prioridad viaja con la solicitud (y las reglas de parada).
+        turn = contextlib.nullcontext(None)
+        if sorted_rules:
+            params = dict(params, stop_rules=sorted_rules)
+    else:
+        turn = scheduling.model_pass(scheduling.estimate_cost(sorted_prompts, params.get('max_new_tokens')), priority)
+    with turn as current_turn:
+        criteria = None
+        if not remote:
+            criteria = stopping.merge_criteria(
+                scheduling.stopping_criteria(current_turn, pipeline),
+                stopping.generation_criteria(pipeline, sorted_rules, params.get('num_return_sequences', 1)),
+            )
+        if criteria is not None:
+            params = dict(params, stopping_criteria=criteria)
+        started = time.perf_counter()
+        with inference_context():
+            outputs = pipeline(sorted_prompts, batch_size=len(sorted_prompts), **params)
+        duration = time.perf_counter() - started
+    outputs = _normalize_outputs(outputs, len(sorted_prompts))
+    if metrics.enabled():
+        try:
+            _record_generation(pipeline, sorted_prompts, outputs, params, duration)
+        except Exception as e:
+            # Las métricas nunca deben hacer fallar una inferencia.
+            print(f"Error al registrar las métricas del lote: {e}", file=sys.stderr)
+
+    results = [None] * len(prompts)
+    for position, index in enumerate(order):
+        results[index] = outputs[position]
+    return results
+
+
+def _record_generation(pipeline, prompts, outputs, params, duration):
+    """Métricas por modelo de una pasada: tokens de entrada y salida, tokens/s y tamaño del lote."""
+    full_text = params.get('return_full_text', False)
+    input_tokens = sum(_count_tokens(pipeline, prompt) for prompt in prompts)
+    output_tokens = sum(
+        _count_tokens(pipeline, item['generated_text'][len(prompt):] if full_text else item['generated_text'])
+        for prompt, items in zip(prompts, outputs) for item in items
+    )
+    model = model_label(pipeline)
+    metrics.inc('iacodex_model_tokens', input_tokens, model=model, direction='input')
+    metrics.inc('iacodex_model_tokens', output_tokens, model=model, direction='output')
+    metrics.inc('iacodex_model_generation_seconds', duration, model=model)
+    metrics.observe('iacodex_model_batch_size', len(prompts), model=model)
+    if duration > 0:
+        metrics.observe('iacodex_model_tokens_per_second', output_tokens / duration, model=model)
+
+
+class _PendingRequest:
+    """Solicitud en espera de ser agrupada en un lote."""
+
+    __slots__ = (
+        'prompt', 'params', 'stop_rule', 'key', 'num_tokens', 'priority', 'enqueued_at', 'event', 'result', 'error',
+        'stages'
+    )
+
+    def __init__(self, prompt, params, num_tokens, priority, stop_rule=None):
+        self.prompt = prompt
+        self.params = params
+        self.stop_rule = stop_rule # Reglas de parada de la solicitud (no impiden agruparla con otras)
+        # Sólo se agrupan solicitudes con parámetros de generación idénticos.
+        self.key = tuple(sorted(params.items()))
+        self.num_tokens = num_tokens
+        self.priority = priority # Carril y cliente de la solicitud (ver app/scheduling.py)
+        self.enqueued_at = time.monotonic()
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.stages = {} # Etapas medidas en el hilo del planificador (ver app/metrics.py)
+
+
+def _lane_rank(pending):
+    return scheduling.LANES.index(pending.priority.lane)
+
+
+class BatchScheduler:
+    """
+    Planificador de micro-lotes para un pipeline.
+    Reúne las solicitudes que llegan dentro de una ventana de tiempo, las agrupa
+    por parámetros de generación compatibles y las ejecuta en una sola pasada.
+    """
+
+    def __init__(self, name, get_pipeline, max_wait_ms=10.0, max_batch_size=8,
+                 max_batch_tokens=4096, request_timeout_s=300.0):
+        self.name = name
+        self.get_pipeline = get_pipeline
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_batch_tokens = max(1, int(max_batch_tokens))
+        self.request_timeout_s = request_timeout_s
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._worker_pid = None
+
+        # Métricas por lote
+        self._stats_lock = threading.Lock()
+        self._recent_batches = deque(maxlen=100)
+        self._totals = {
+            'batches': 0,
+            'requests': 0,
+            'tokens': 0,
+            'errors': 0,
+            'inference_seconds': 0.0,
+            'queue_wait_seconds': 0.0,
+        }
+        self._size_histogram = {}
+
+    def _ensure_worker(self):
+        """Arranca el hilo de trabajo (de forma perezosa, para sobrevivir a un fork de gunicorn)."""
+        pid = os.getpid()
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == pid:
+            return
+        with self._cond:
+            if self._worker is not None and self._worker.is_alive() and self._worker_pid == pid:
+                return
+            self._queue.clear()
+            self._worker = threading.Thread(target=self._run, name=f"batching-{self.name}", daemon=True)
+            self._worker_pid = pid
+            self._worker.start()
+
+    def submit(self, prompt, num_tokens=None, stop_rule=None, **params):
+        """
+        Encola un prompt y espera a que su lote se ejecute.
+        'num_tokens' son los tokens del prompt si ya se contaron (admisión); si no, se cuentan aquí.
+        'stop_rule' termina la generación de este prompt en cuanto su salida está completa.
+        Devuelve la lista de salidas del pipeline (diccionarios con 'generated_text') para ese prompt.
+        """
+        pipeline = self.get_pipeline()
+        if pipeline is None:
+            raise RuntimeError(f"Pipeline '{self.name}' no disponible.")
+
+        if num_tokens is None:
+            num_tokens = _count_tokens(pipeline, prompt)
+        num_tokens += int(params.get('max_new_tokens', 0) or 0)
+        pending = _PendingRequest(prompt, params, num_tokens, scheduling.current(), stop_rule)
+
+        self._ensure_worker()
+        with self._cond:
+            self._queue.append(pending)
+            self._cond.notify()
+
+        if not pending.event.wait(self.request_timeout_s):
+            raise TimeoutError(f"Tiempo de espera agotado en el planificador de lotes '{self.name}'.")
+        metrics.record_stages(pending.stages)
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _next_index(self):
+        """Posición de la siguiente solicitud: la más antigua del carril interactivo, si hay alguna."""
+        for index, pending in enumerate(self._queue):
+            if pending.priority.lane == 'interactive':
+                return index
+        return 0
+
+    def _collect(self):
+        """
+        Espera la primera solicitud y reúne las siguientes hasta llenar la ventana o los límites.
+        Las solicitudes del carril interactivo se toman antes que las del masivo.
+        """
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+
+            first = self._next_index()
+            deadline = self._queue[first].enqueued_at + self.max_wait
+            batch = [self._queue[first]]
+            del self._queue[first]
+            total_tokens = batch[0].num_tokens
+
+            while len(batch) < self.max_batch_size:
+                if not self._queue:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                    continue
+                index = self._next_index()
+                candidate = self._queue[index]
+                if total_tokens + candidate.num_tokens > self.max_batch_tokens:
+                    break
+                del self._queue[index]
+                batch.append(candidate)
+                total_tokens += candidate.num_tokens
+
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+
+            groups = {}
+            for pending in batch:
+                groups.setdefault(pending.key, []).append(pending)
+
+            # Los grupos con alguna solicitud interactiva se ejecutan primero.
+            for group in sorted(groups.values(), key=lambda group: min(_lane_rank(pending) for pending in group)):
+                self._execute(group)
+
+    def _execute(self, group):
+        """Ejecuta un grupo de solicitudes compatibles y entrega cada resultado a su solicitante."""
+        started = time.monotonic()
+        queue_wait = sum(started - pending.enqueued_at for pending in group)
+        tokens = sum(pending.num_tokens for pending in group)
+        failed = False
+        stages = {}
+
+        try:
+            pipeline = self.get_pipeline()
+            if pipeline is None:
+                raise RuntimeError(f"Pipeline '{self.name}' no disponible.")
+            # El lote pide turno con la prioridad de su solicitud más prioritaria.
+            priority = min(group, key=_lane_rank).priority
+            with metrics.collect_stages() as stages:
+                results = run_batch(
+                    pipeline, [pending.prompt for pending in group], priority=priority,
+                    stop_rules=[pending.stop_rule for pending in group], **group[0].params
+                )
+            for pending, result in zip(group, results):
+                pending.result = result
+        except Exception as e:
+            failed = True
+            print(f"Error al ejecutar el lote '{self.name}' ({len(group)} solicitudes): {e}", file=sys.stderr)
+            for pending in group:
+                pending.error = e
+        finally:
+            for pending in group:
+                # Cada solicitud del lote recibe su espera en cola y las etapas de la pasada compartida.
+                pending.stages = dict(stages, queue=started - pending.enqueued_at)
+                pending.event.set()
+
+        duration = time.monotonic() - started
+        self._record(len(group), tokens, queue_wait, duration, failed)
+
+    def _record(self, size, tokens, queue_wait, duration, failed):
+        with self._stats_lock:
+            self._totals['batches'] += 1
+            self._totals['requests'] += size
+            self._totals['tokens'] += tokens
+            self._totals['errors'] += 1 if failed else 0
+            self._totals['inference_seconds'] += duration
+            self._totals['queue_wait_seconds'] += queue_wait
+            self._size_histogram[size] = self._size_histogram.get(size, 0) + 1
+            self._recent_batches.append({
+                'size': size,
+                'tokens': tokens,
+                'avg_queue_wait_ms': round(queue_wait / size * 1000, 3),
+                'duration_ms': round(duration * 1000, 3),
+                'failed': failed,
+            })
+
+    def stats(self):
+        """Devuelve las métricas acumuladas y los últimos lotes ejecutados."""
+        with self._stats_lock:
+            totals = dict(self._totals)
+            batches = totals['batches']
+            requests = totals['requests']
+            return {
+                'config': {
+                    'max_wait_ms': self.max_wait * 1000,
+                    'max_batch_size': self.max_batch_size,
+                    'max_batch_tokens': self.max_batch_tokens,
+                },
+                'batches': batches,
+                'requests': requests,
+                'errors': totals['errors'],
+                'avg_batch_size': round(requests / batches, 3) if batches else 0.0,
+                'avg_queue_wait_ms': round(totals['queue_wait_seconds'] / requests * 1000, 3) if requests else 0.0,
+                'requests_per_inference_second': (
+                    round(requests / totals['inference_seconds'], 3) if totals['inference_seconds'] else 0.0
+                ),
+                'batch_size_histogram': {str(size): count for size, count in sorted(self._size_histogram.items())},
+                'recent_batches': list(self._recent_batches),
+            }
+
+
+def init_batching(app_config):
+    """
+    Configura los planificadores de lotes a partir de la configuración de la aplicación.
+    Los hilos de trabajo se arrancan con la primera solicitud.
+    """
+    _config['enabled'] = app_config.get('BATCHING_ENABLED', True)
+    _config['max_wait_ms'] = float(app_config.get('BATCH_MAX_WAIT_MS', 10))
+    _config['max_batch_size'] = int(app_config.get('BATCH_MAX_SIZE', 8))
+    _config['max_batch_tokens'] = int(app_config.get('BATCH_MAX_TOKENS', 4096))
+    _config['request_timeout_s'] = float(app_config.get('BATCH_REQUEST_TIMEOUT_S', 300))
+    with _schedulers_lock:
+        _schedulers.clear()
+
+
+def get_scheduler(kind):
+    """Devuelve (creándolo si hace falta) el planificador de un modelo ('generator', 'text2text' o un nombre de MODELS)."""
+    scheduler = _schedulers.get(kind)
+    if scheduler is not None:
+        return scheduler
+    with _schedulers_lock:
+        if kind not in _schedulers:
+            _schedulers[kind] = BatchScheduler(
+                kind,
+                partial(get_pipeline, kind),
+                max_wait_ms=_config['max_wait_ms'],
+                max_batch_size=_config['max_batch_size'],
+                max_batch_tokens=_config['max_batch_tokens'],
+                request_timeout_s=_config['request_timeout_s'],
+            )
+        return _schedulers[kind]
+
+
+def submit(kind, prompt, num_tokens=None, stop_rule=None, **params):
+    """
+    Envía un prompt al modelo indicado ('generator', 'text2text' o un nombre de MODELS).
+    Con el micro-batching activado pasa por el planificador; si no, llama al pipeline directamente.
+    Si el pipeline es remoto, el prompt se envía al servidor de modelos.
+    'num_tokens' (opcional) evita volver a tokenizar el prompt para formar los lotes.
+    'stop_rule' (opcional, ver app/stopping.py) termina la generación en cuanto la salida está completa.
+    Devuelve la lista de salidas del pipeline para ese prompt.
+    """
+    pipeline = get_pipeline(kind)
+    if getattr(pipeline, 'is_remote', False):
+        # Con el servidor de modelos compartido, el lote se forma allí con solicitudes de todos los workers.
+        return pipeline.submit(prompt, stop_rule=stop_rule, **params)
+    if not _config['enabled']:
+        if pipeline is None:
+            raise RuntimeError(f"Pipeline '{kind}' no disponible.")
+        return run_batch(pipeline, [prompt], stop_rules=[stop_rule], **params)[0]
+    return get_scheduler(kind).submit(prompt, num_tokens=num_tokens, stop_rule=stop_rule, **params)
+
+
+def run_many(kind, prompts, stop_rules=None, **params):
+    """
+    Ejecuta muchos prompts con los mismos parámetros como inferencia por lotes (endpoints /batch).
+    Se ordenan por longitud y se trocean en lotes de BATCH_MAX_SIZE para minimizar el padding.
+    Devuelve, en el orden de entrada, la lista de salidas de cada prompt o la excepción de su lote.
+    """
+    pipeline = get_pipeline(kind)
+    if pipeline is None:
+        raise RuntimeError(f"Pipeline '{kind}' no disponible.")
+
+    chunk_size = _config['max_batch_size']
+    order = sorted(range(len(prompts)), key=lambda i: len(prompts[i]))
+    results = [None] * len(prompts)
+
+    for start in range(0, len(order), chunk_size):
+        indices = order[start:start + chunk_size]
+        try:
+            rules = [stop_rules[i] for i in indices] if stop_rules else None
+            outputs = run_batch(pipeline, [prompts[i] for i in indices], stop_rules=rules, **params)
+        except Exception as e:
+            print(f"Error al ejecutar el lote '{kind}' ({len(indices)} elementos): {e}", file=sys.stderr)
+            outputs = [e] * len(indices)
+        for index, output in zip(indices, outputs):
+            results[index] = output
+    return results
+
+
+def get_stats():
+    """Métricas de todos los planificadores activos."""
+    return {
+        'enabled': _config['enabled'],
+        'schedulers': {kind: scheduler.stats() for kind, scheduler in list(_schedulers.items())},
+    }
@@ -0,0 +1,197 @@
+# ia-codex-api/app/cache.py
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .utils import sqlite_connection
+
+
+def make_key(*parts):
+    """
+    Calcula una clave de caché direccionada por contenido (SHA-256) a partir de las entradas
+    que determinan la salida: endpoint, revisión del modelo, prompt, parámetros...
+    """
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Caché de respuestas de dos niveles:
+    - LRU en memoria del proceso, acotada por tamaño en bytes.
+    - Opcionalmente, una base sqlite en disco compartida entre workers que sobrevive a reinicios.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, db_path=None, db_max_entries=100000):
+        self.max_bytes = max_bytes
+        self.db_path = db_path or None
+        self.db_max_entries = db_max_entries
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._local = threading.local()
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'evictions': 0,
+            'disk_errors': 0,
+        }
+
+        if self.db_path:
+            self._init_db()
+
+    # --- Nivel en disco (sqlite) ---
+
+    def _db(self):
+        return sqlite_connection(self._local, self.db_path, timeout=5)
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._db() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    def _disk_get(self, key):
+        try:
+            row = self._db().execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            self._count('disk_errors')
+            print(f"Error al leer la caché en disco: {e}", file=sys.stderr)
+            return None
+        return row[0] if row else None
+
+    def _disk_set(self, key, value):
+        try:
+            with self._db() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, value, time.time())
+                )
+                # Poda ocasional para mantener acotado el tamaño de la base.
+                if self._counters['sets'] % 1000 == 0:
+                    conn.execute(
+                        "DELETE FROM responses WHERE key IN ("
+                        " SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                        (self.db_max_entries,)
+                    )
+        except sqlite3.Error as e:
+            self._count('disk_errors')
+            print(f"Error al escribir en la caché en disco: {e}", file=sys.stderr)
+
+    # --- Nivel en memoria (LRU) ---
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    @staticmethod
+    def _size(key, value):
+        return len(key) + len(value.encode('utf-8'))
+
+    def _memory_set(self, key, value):
+        size = self._size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= self._size(key, previous)
+            self._entries[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key, old_value = self._entries.popitem(last=False)
+                self._bytes -= self._size(old_key, old_value)
+                self._counters['evictions'] += 1
+
+    def get(self, key):
+        """Devuelve la respuesta guardada para la clave, o None si no está en ningún nivel."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return value
+
+        if self.db_path:
+            value = self._disk_get(key)
+            if value is not None:
+                self._memory_set(key, value) # Promoción al nivel en memoria
+                self._count('disk_hits')
+                return value
+
+        self._count('misses')
+        return None
+
+    def set(self, key, value):
+        """Guarda una respuesta en memoria y, si está configurado, en disco."""
+        self._count('sets')
+        self._memory_set(key, value)
+        if self.db_path:
+            self._disk_set(key, value)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            entries = len(self._entries)
+            used_bytes = self._bytes
+        hits = counters['memory_hits'] + counters['disk_hits']
+        lookups = hits + counters['misses']
+        return dict(
+            counters,
+            hits=hits,
+            hit_ratio=round(hits / lookups, 4) if lookups else 0.0,
+            memory_entries=entries,
+            memory_bytes=used_bytes,
+            memory_max_bytes=self.max_bytes,
+            disk_path=self.db_path,
+        )
+
+
+# Caché global del proceso. Se configura en init_cache(); None si está desactivada.
+response_cache = None
+
+
+def init_cache(app_config):
+    """Crea la caché de respuestas a partir de la configuración de la aplicación."""
+    global response_cache
+    if not app_config.get('CACHE_ENABLED', True):
+        response_cache = None
+        return
+    response_cache = ResponseCache(
+        max_bytes=int(app_config.get('CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+        db_path=app_config.get('CACHE_DB_PATH') or None,
+        db_max_entries=int(app_config.get('CACHE_DB_MAX_ENTRIES', 100000)),
+    )
+
+
+def get_cached(key):
+    """Consulta la caché global (None si no hay caché o no hay entrada)."""
+    if response_cache is None:
+        return None
+    return response_cache.get(key)
+
+
+def set_cached(key, value):
+    """Guarda en la caché global, si está activada."""
+    if response_cache is not None:
+        response_cache.set(key, value)
+
+
+def get_stats():
+    """Contadores de aciertos/fallos de la caché global."""
+    if response_cache is None:
+        return {'enabled': False}
+    return dict(response_cache.stats(), enabled=True)
@@ -0,0 +1,288 @@
+# ia-codex-api/app/chunking.py
+
+"""
+Modo archivo de /fix y /convert ("mode": "file"): procesa archivos completos que no caben
+en la ventana de contexto del modelo text2text.
+
+1. El código se divide por fronteras sintácticas: las sentencias de primer nivel (funciones, clases, ...)
+   con el módulo ast de Python o, si no es Python o no compila, con un analizador ligero de llaves
+   y sangría. Los comentarios y decoradores se quedan con la definición que les sigue.
+2. Las unidades consecutivas se agrupan en fragmentos de hasta FILE_CHUNK_MAX_TOKENS tokens
+   (una unidad más grande se parte por líneas).
+3. Cada fragmento es una tarea de inferencia normal (admisión, caché y micro-batching incluidos):
+   se ejecutan como un lote y los resultados se unen en el orden original.
+   En streaming, cada fragmento se envía en cuanto termina, así que el archivo tarda
+   aproximadamente lo que el fragmento más lento y no la suma de todos.
+"""
+
+import ast
+import contextvars
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from . import admission
+from . import fastfix
+from . import inference
+from .utils import sse_event
+
+_config = {'max_tokens': 200, 'max_chunks': 64, 'parallelism': 8}
+
+# Líneas de primer nivel que continúan la sentencia anterior en lugar de empezar una nueva.
+_CONTINUATIONS = ('}', ')', ']', 'else', 'elif', 'except', 'finally', 'catch', 'end', 'rescue', 'ensure', 'when')
+# Líneas que se adjuntan a la definición siguiente (comentarios, decoradores, anotaciones).
+_ATTACHED = ('#', '//', '/*', '*', '@')
+# Una definición sin sangría siempre empieza una unidad, aunque el código anterior tenga
+# paréntesis o llaves sin cerrar (habitual en el código que llega a /fix).
+_DEFINITIONS = (
+    'def ', 'async def ', 'class ', 'function ', 'async function ', 'export ', 'func ', 'fn ', 'pub ',
+    'public ', 'private ', 'protected ', 'static ', 'struct ', 'interface ', 'module ', 'package ', 'import ',
+)
+
+
+class ChunkedTask:
+    """Un archivo dividido en fragmentos, cada uno con su InferenceTask."""
+
+    def __init__(self, operation, chunks, tasks):
+        self.operation = operation
+        self.chunks = chunks
+        self.tasks = tasks
+        self.result_field = tasks[0].result_field
+
+    def stitch(self, outputs):
+        """Une las salidas de los fragmentos en el orden original, conservando los saltos de línea entre ellos."""
+        parts = []
+        for index, (chunk, output) in enumerate(zip(self.chunks, outputs)):
+            trailing = chunk[len(chunk.rstrip()):]
+            if not trailing and index < len(self.chunks) - 1:
+                trailing = '\n'
+            parts.append(output.rstrip() + trailing)
+        return ''.join(parts)
+
+    def response(self, outputs):
+        payload = {self.result_field: self.stitch(outputs), "chunks": len(self.chunks)}
+        fix_path = fastfix.combine_paths(task.fix_path for task in self.tasks if task.fix_path)
+        if fix_path is not None:
+            payload["fix_path"] = fix_path # La vía más costosa entre los fragmentos
+        return payload
+
+
+def _brace_depths(lines):
+    """
+    Profundidad de llaves/paréntesis al principio de cada línea, ignorando cadenas y comentarios.
+    Reconoce comentarios '#', '//' y '/* */', y cadenas con comillas simples, dobles, invertidas y triples.
+    """
+    depths = []
+    depth = 0
+    block_comment = False
+    string = None # Delimitador de la cadena abierta que continúa en la línea siguiente
+    for line in lines:
+        depths.append(depth)
+        i = 0
+        while i < len(line):
+            if block_comment:
+                end = line.find('*/', i)
+                if end < 0:
+                    break
+                block_comment = False
+                i = end + 2
+                continue
+            if string is not None:
+                if line[i] == '\\':
+                    i += 2
+                    continue
+                if line.startswith(string, i):
+                    i += len(string)
+                    string = None
+                    continue
+                i += 1
+                continue
+            char = line[i]
+            if char == '#' or line.startswith('//', i):
+                break
+            if line.startswith('/*', i):
+                block_comment = True
+                i += 2
+            elif line.startswith('"""', i) or line.startswith("'''", i):
+                string = line[i:i + 3]
+                i += 3
+            elif char in '"\'`':
+                string = char
+                i += 1
+            else:
+                if char in '{([':
+                    depth += 1
+                elif char in '})]':
+                    depth = max(0, depth - 1)
+                i += 1
+        if string in ('"', "'"):
+            string = None # Las comillas simples no continúan en la línea siguiente
+    return depths
+
+
+def _python_boundaries(code, lines):
+    """Líneas donde empieza cada sentencia de primer nivel (incluidos sus decoradores), según ast."""
+    tree = ast.parse(code)
+    boundaries = []
+    for node in tree.body:
+        start = min([node.lineno] + [decorator.lineno for decorator in getattr(node, 'decorator_list', [])]) - 1
+        # Los comentarios justo encima pertenecen a la definición.
+        while start > 0 and lines[start - 1].lstrip().startswith('#'):
+            start -= 1
+        boundaries.append(start)
+    return boundaries
+
+
+def _generic_boundaries(lines):
+    """
+    Líneas donde empieza una sentencia de primer nivel en cualquier lenguaje: sin sangría,
+    fuera de llaves y paréntesis (o una definición), y que no continúan la anterior.
+    Los comentarios y decoradores se quedan con la sentencia que les sigue.
+    """
+    depths = _brace_depths(lines)
+    boundaries = []
+    previous_attached = False
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        candidate = not line[0].isspace() and (
+            line.startswith(_DEFINITIONS) or (depths[index] == 0 and not stripped.startswith(_CONTINUATIONS))
+        )
+        attached = stripped.startswith(_ATTACHED)
+        if candidate and not previous_attached:
+            boundaries.append(index)
+        previous_attached = candidate and attached
+    return boundaries
+
+
+def split_units(code):
+    """Divide el código en unidades de primer nivel; al unirlas se obtiene el código original."""
+    lines = code.splitlines(keepends=True)
+    try:
+        boundaries = _python_boundaries(code, lines)
+    except (SyntaxError, ValueError):
+        boundaries = _generic_boundaries(lines) # No es Python, o es Python con errores (/fix)
+    boundaries = sorted(set(boundaries) - {0})
+    units = []
+    start = 0
+    for boundary in boundaries + [len(lines)]:
+        if boundary > start:
+            units.append(''.join(lines[start:boundary]))
+            start = boundary
+    return units
+
+
+def pack_chunks(units, max_tokens, count_tokens):
+    """Agrupa unidades consecutivas en fragmentos de hasta max_tokens; una unidad mayor se parte por líneas."""
+    chunks = []
+    current, current_tokens = '', 0
+    for unit in units:
+        tokens = count_tokens(unit)
+        if tokens > max_tokens and '\n' in unit.rstrip('\n'):
+            if current:
+                chunks.append(current)
+                current, current_tokens = '', 0
+            chunks.extend(pack_chunks(unit.splitlines(keepends=True), max_tokens, count_tokens))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = '', 0
+        current += unit
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def wants_file_mode(data):
+    return data.get('mode') == 'file'
+
+
+def prepare_chunked(operation, data):
+    """
+    Divide el campo 'code' de una solicitud en modo archivo y prepara una tarea por fragmento.
+    Sin 'max_tokens', cada fragmento puede generar hasta el doble de tokens que el mayor de ellos.
+    Lanza InferenceError o AdmissionError como inference.prepare.
+    """
+    code = data.get('code')
+    if not code:
+        raise inference.InferenceError("El campo 'code' es requerido.")
+    if operation == 'fix':
+        # Un archivo ya válido (o que sólo necesita normalizar la sangría) no se divide ni carga el modelo.
+        admission.max_new_tokens(data)
+        fast_task = inference.prepare_fast_fix(data)
+        if fast_task is not None:
+            return ChunkedTask(operation, [code], [fast_task])
+    _, text2text_pipeline = inference.get_pipeline_for('text2text', data, 'corrección/conversión')
+
+    def count_tokens(text):
+        return admission.count_tokens(text2text_pipeline, text)
+
+    chunks = pack_chunks(split_units(code), _config['max_tokens'], count_tokens)
+    if len(chunks) > _config['max_chunks']:
+        raise inference.InferenceError(
+            f"El archivo tiene demasiados fragmentos ({len(chunks)}); el máximo es {_config['max_chunks']}.", 413
+        )
+    max_tokens = admission.max_new_tokens(data, default=2 * max(count_tokens(chunk) for chunk in chunks) + 16)
+    item = {key: value for key, value in data.items() if key not in ('mode', 'stream', 'code')}
+    # Los saltos de línea finales no se envían al modelo: stitch() los restaura.
+    tasks = [inference.prepare(operation, dict(item, code=chunk.rstrip(), max_tokens=max_tokens)) for chunk in chunks]
+    return ChunkedTask(operation, chunks, tasks)
+
+
+def run_chunked(chunked):
+    """Ejecuta todos los fragmentos como inferencia por lotes y devuelve la respuesta con el archivo completo."""
+    outputs = []
+    for task, outcome in zip(chunked.tasks, inference.run_many(chunked.tasks)):
+        if isinstance(outcome, Exception):
+            raise outcome
+        outputs.append(outcome[task.result_field])
+    return chunked.response(outputs)
+
+
+def iter_completed(chunked):
+    """
+    Ejecuta los fragmentos en paralelo (el planificador de micro-lotes los agrupa) y devuelve
+    (índice, salida) de cada uno en cuanto termina.
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, min(len(chunked.tasks), _config['parallelism'])))
+    # Cada fragmento se ejecuta en una copia del contexto de la solicitud (métricas por etapa).
+    futures = {
+        executor.submit(contextvars.copy_context().run, inference.run, task): index
+        for index, task in enumerate(chunked.tasks)
+    }
+    try:
+        for future in as_completed(futures):
+            index = futures[future]
+            payload, _ = future.result()
+            yield index, payload[chunked.tasks[index].result_field]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def stream_events(chunked):
+    """
+    Eventos Server-Sent Events del modo archivo: un evento 'chunk' por fragmento en cuanto termina
+    ({"index", "total" y el resultado del fragmento}) y un evento 'done' con el archivo completo.
+    """
+    action = inference.ACTIONS[chunked.operation]
+    outputs = [None] * len(chunked.tasks)
+    try:
+        for index, output in iter_completed(chunked):
+            outputs[index] = output
+            yield sse_event(
+                {"index": index, "total": len(outputs), chunked.result_field: output}, event='chunk'
+            )
+        yield sse_event(chunked.response(outputs), event='done')
+    except (inference.InferenceError, admission.AdmissionError) as e:
+        yield sse_event({"error": e.message}, event='error')
+    except Exception as e:
+        print(f"Error al {action} (modo archivo): {e}", file=sys.stderr)
+        yield sse_event({"error": f"Error interno del servidor al {action}: {str(e)}"}, event='error')
+
+
+def init_chunking(app_config):
+    """Configura el modo archivo a partir de la configuración de la aplicación."""
+    _config['max_tokens'] = max(1, int(app_config.get('FILE_CHUNK_MAX_TOKENS', 200)))
+    _config['max_chunks'] = int(app_config.get('FILE_MAX_CHUNKS', 64))
+    _config['parallelism'] = int(app_config.get('FILE_CHUNK_PARALLELISM', 8))
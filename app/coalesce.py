@@ -0,0 +1,231 @@
+# ia-codex-api/app/coalesce.py
+
+"""
+Agrupación de solicitudes idénticas en curso (single-flight).
+
+Las solicitudes deterministas (do_sample=False: /fix y /convert) con la misma clave (endpoint, revisión
+del modelo, prompt y parámetros: la clave de la caché de respuestas) que llegan mientras otra igual se
+está ejecutando no lanzan su propia inferencia: esperan a la primera y reciben su resultado.
+
+- Dentro de un proceso, los hilos que esperan se despiertan en cuanto termina la primera.
+- Con COALESCE_DB_PATH, también entre los workers de gunicorn: una base sqlite compartida registra qué
+  claves se están ejecutando (y en qué proceso) y guarda los resultados unos segundos. Los workers que
+  llegan después consultan el resultado periódicamente. Si el proceso que ejecutaba la clave muere o
+  falla, el siguiente la ejecuta él mismo.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from . import metrics
+from .utils import sqlite_connection
+
+
+class _Flight:
+    __slots__ = ('event', 'value', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Ejecuta una sola vez cada clave en curso. Devuelve (valor, origen): origen es None si la solicitud
+    ejecutó la inferencia, 'worker' si recibió el resultado de otra del mismo proceso y 'cross_worker'
+    si lo recibió de otro worker.
+    """
+
+    def __init__(self, db_path=None, wait_timeout_s=300.0, poll_interval_s=0.01, result_ttl_s=30.0):
+        self.db_path = db_path or None
+        self.wait_timeout_s = wait_timeout_s
+        self.poll_interval_s = poll_interval_s
+        self.result_ttl_s = result_ttl_s
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._local = threading.local()
+        self._counters = {'leaders': 0, 'coalesced_local': 0, 'coalesced_remote': 0, 'takeovers': 0, 'db_errors': 0}
+        if self.db_path:
+            self._init_db()
+
+    # --- Entre workers (sqlite) ---
+
+    def _db(self):
+        return sqlite_connection(self._local, self.db_path, timeout=5, isolation_level=None)
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._db()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS inflight (key TEXT PRIMARY KEY, pid INTEGER NOT NULL, started_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            pass # Existe, pero es de otro usuario
+        return True
+
+    def _claim(self, key):
+        """
+        Intenta registrar la clave como en curso en este proceso. Devuelve (True, None) si este proceso
+        la ejecuta, o (False, valor) si otro worker ya la terminó hace poco.
+        """
+        conn = self._db()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value FROM results WHERE key = ? AND created_at > ?", (key, now - self.result_ttl_s)
+        ).fetchone()
+        if row is not None:
+            return False, json.loads(row[0])
+        owner = conn.execute("SELECT pid FROM inflight WHERE key = ?", (key,)).fetchone()
+        if owner is not None and owner[0] != os.getpid() and not self._alive(owner[0]):
+            conn.execute("DELETE FROM inflight WHERE key = ? AND pid = ?", (key, owner[0]))
+            self._count('takeovers')
+        inserted = conn.execute(
+            "INSERT OR IGNORE INTO inflight (key, pid, started_at) VALUES (?, ?, ?)", (key, os.getpid(), now)
+        ).rowcount
+        return inserted == 1, None
+
+    def _wait_remote(self, key):
+        """Espera al worker que ejecuta la clave. Devuelve (True, valor) o (False, None) si hay que ejecutarla aquí."""
+        deadline = time.monotonic() + self.wait_timeout_s
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval_s)
+            claimed, value = self._claim(key)
+            if claimed:
+                return False, None # El otro worker falló o murió: ahora la ejecuta este proceso
+            if value is not None:
+                return True, value
+        return False, None
+
+    def _publish(self, key, value):
+        conn = self._db()
+        now = time.time()
+        if value is not None:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now)
+            )
+            conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.result_ttl_s,))
+        conn.execute("DELETE FROM inflight WHERE key = ? AND pid = ?", (key, os.getpid()))
+
+    def _run_remote(self, key, func):
+        """Ejecuta func() una sola vez entre todos los workers que comparten la base."""
+        if not self.db_path:
+            return func(), None
+        try:
+            claimed, value = self._claim(key)
+            if not claimed:
+                shared, value = (True, value) if value is not None else self._wait_remote(key)
+                if shared:
+                    self._count('coalesced_remote')
+                    return value, 'cross_worker'
+        except sqlite3.Error as e:
+            self._count('db_errors')
+            print(f"Error en la agrupación de solicitudes entre workers: {e}", file=sys.stderr)
+            return func(), None
+
+        value = None
+        try:
+            value = func()
+            return value, None
+        finally:
+            try:
+                self._publish(key, value) # Sin valor (error), el siguiente worker que espera la ejecuta él mismo
+            except sqlite3.Error as e:
+                self._count('db_errors')
+                print(f"Error al publicar un resultado agrupado: {e}", file=sys.stderr)
+
+    # --- Dentro del proceso ---
+
+    def run(self, key, func):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+
+        if not leader:
+            if flight.event.wait(self.wait_timeout_s) and flight.error is None:
+                self._count('coalesced_local')
+                return flight.value, 'worker'
+            return self.run(key, func) # La primera falló o tarda demasiado: se vuelve a intentar
+
+        self._count('leaders')
+        try:
+            flight.value, origin = self._run_remote(key, func)
+            return flight.value, origin
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, in_flight=len(self._flights), shared_db=bool(self.db_path))
+
+
+single_flight = None
+
+
+def run(operation, key, func):
+    """
+    Ejecuta func() (que devuelve un valor serializable en JSON) una sola vez por clave en curso.
+    Devuelve (valor, compartido). Sin agrupación (COALESCE_ENABLED=False), siempre ejecuta func().
+    """
+    if single_flight is None or key is None:
+        return func(), False
+    value, origin = single_flight.run(key, func)
+    if origin is not None:
+        metrics.inc('iacodex_coalesced_requests', endpoint=operation, scope=origin)
+    return value, origin is not None
+
+
+def record_batch_duplicates(operation, count):
+    """Cuenta los elementos de un lote que repiten la clave de otro y reutilizan su resultado."""
+    if count:
+        metrics.inc('iacodex_coalesced_requests', float(count), endpoint=operation, scope='batch')
+
+
+def init_coalesce(app_config):
+    """Configura la agrupación de solicitudes a partir de la configuración de la aplicación."""
+    global single_flight
+    if not app_config.get('COALESCE_ENABLED', True):
+        single_flight = None
+        return
+    single_flight = SingleFlight(
+        db_path=app_config.get('COALESCE_DB_PATH') or None,
+        wait_timeout_s=float(app_config.get('COALESCE_WAIT_TIMEOUT_S', 300)),
+        poll_interval_s=float(app_config.get('COALESCE_POLL_MS', 10)) / 1000,
+    )
+
+
+def get_stats():
+    if single_flight is None:
+        return {'enabled': False}
+    return dict(single_flight.stats(), enabled=True)
@@ -0,0 +1,225 @@
+# ia-codex-api/app/engines.py
+
+"""
+Motores de ejecución de los modelos locales, elegibles por modelo (no confundir con INFERENCE_BACKEND,
+que decide si los modelos viven en cada worker o en el servidor de modelos compartido).
+
+- 'eager': el pipeline de transformers con PyTorch en modo eager (por defecto).
+- 'compile': el mismo pipeline con el forward del modelo compilado con torch.compile (formas dinámicas,
+  para no recompilar con cada longitud de prompt).
+- 'onnx': ONNX Runtime (optimum) con el grafo exportado por scripts/export_onnx.py en
+  MODEL_ONNX_DIR/<nombre>/. La exportación incluye la caché KV: los modelos solo-decodificador llevan un
+  decodificador con past_key_values, y los codificador-decodificador (T5) un codificador y un
+  decodificador con caché, así que cada paso de decodificación sólo procesa el token nuevo.
+
+Si el motor pedido no está disponible (falta la librería, no hay exportación o es de otro modelo, o falla
+la carga o la generación de prueba), el modelo se carga en eager: se avisa por stderr, se cuenta en
+iacodex_engine_fallbacks y GET /stats muestra el motor usado y el motivo.
+"""
+
+import json
+import os
+import sys
+import time
+
+from . import metrics
+
+ENGINES = ('eager', 'compile', 'onnx')
+ONNX_MANIFEST = 'iacodex_onnx.json'
+COMPILE_MODES = ('default', 'reduce-overhead', 'max-autotune')
+
+_config = {
+    'default': 'eager',  # MODEL_ENGINE
+    'per_model': {},     # MODEL_ENGINES: nombre -> motor
+    'onnx_dir': '',      # MODEL_ONNX_DIR
+    'compile_mode': 'default',
+    'verify': True,      # Generación de prueba al cargar (también compila o calienta ONNX Runtime)
+}
+
+
+def parse_engines(value):
+    """
+    Lee la variable MODEL_ENGINES: entradas 'nombre=motor' separadas por comas, p. ej.
+    'generator=onnx,text2text=compile'. Devuelve {nombre: motor}.
+    """
+    engines = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, has_name, engine = item.partition('=')
+        name, engine = name.strip(), engine.strip().lower()
+        if not has_name or not name:
+            raise ValueError(f"Entrada de MODEL_ENGINES inválida: '{item}' (formato: nombre=motor).")
+        if engine not in ENGINES:
+            raise ValueError(f"Motor inválido en MODEL_ENGINES: '{engine}' (debe ser {', '.join(ENGINES)}).")
+        engines[name] = engine
+    return engines
+
+
+def init_engines(app_config):
+    """Configura los motores de los modelos a partir de la configuración de la aplicación."""
+    default = (app_config.get('MODEL_ENGINE') or 'eager').lower()
+    if default not in ENGINES:
+        raise ValueError(f"MODEL_ENGINE inválido: '{default}' (debe ser {', '.join(ENGINES)}).")
+    compile_mode = (app_config.get('MODEL_COMPILE_MODE') or 'default').lower()
+    if compile_mode not in COMPILE_MODES:
+        raise ValueError(f"MODEL_COMPILE_MODE inválido: '{compile_mode}' (debe ser {', '.join(COMPILE_MODES)}).")
+    _config['default'] = default
+    _config['per_model'] = parse_engines(app_config.get('MODEL_ENGINES'))
+    _config['onnx_dir'] = app_config.get('MODEL_ONNX_DIR') or ''
+    _config['compile_mode'] = compile_mode
+    _config['verify'] = bool(app_config.get('MODEL_ENGINE_VERIFY', True))
+
+
+def engine_for(name):
+    """Motor configurado para el modelo 'name'."""
+    return _config['per_model'].get(name, _config['default'])
+
+
+# --- ONNX Runtime ---
+
+def read_onnx_manifest(onnx_dir, name):
+    """Manifiesto de la exportación ONNX del modelo 'name', o None si no existe o no se puede leer."""
+    try:
+        with open(os.path.join(onnx_dir, name, ONNX_MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def find_onnx_export(onnx_dir, name, model_name):
+    """
+    Directorio de la exportación ONNX de 'name'. Lanza FileNotFoundError si no hay exportación
+    o es de otro modelo (el .env cambió desde que se generó).
+    """
+    if not onnx_dir:
+        raise FileNotFoundError("MODEL_ONNX_DIR no está definido")
+    manifest = read_onnx_manifest(onnx_dir, name)
+    if manifest is None:
+        raise FileNotFoundError(f"no hay exportación en {os.path.join(onnx_dir, name)} (ver scripts/export_onnx.py)")
+    if manifest.get('model') != model_name:
+        raise FileNotFoundError(f"la exportación es de '{manifest.get('model')}', no de '{model_name}'")
+    return os.path.join(onnx_dir, name)
+
+
+def _ort_model_class(kind):
+    from optimum.onnxruntime import ORTModelForCausalLM, ORTModelForSeq2SeqLM
+    return ORTModelForCausalLM if kind == 'generator' else ORTModelForSeq2SeqLM
+
+
+def _export_footprint(path):
+    """Tamaño de los grafos y pesos exportados: es la memoria que ocupan las sesiones de ONNX Runtime."""
+    return sum(
+        os.path.getsize(os.path.join(path, file_name))
+        for file_name in os.listdir(path)
+        if file_name.endswith(('.onnx', '.onnx_data', '.onnx.data'))
+    )
+
+
+def load_onnx(name, entry, device, threads=0):
+    """Carga el modelo exportado con ONNX Runtime y lo envuelve en un pipeline de transformers."""
+    path = find_onnx_export(_config['onnx_dir'], name, entry['model_name'])
+    import onnxruntime
+    from transformers import AutoTokenizer, pipeline
+
+    session_options = onnxruntime.SessionOptions()
+    session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        session_options.intra_op_num_threads = threads
+        session_options.inter_op_num_threads = 1
+    provider = 'CUDAExecutionProvider' if device == 0 else 'CPUExecutionProvider'
+    model = _ort_model_class(entry['kind']).from_pretrained(
+        path, use_cache=True, provider=provider, session_options=session_options
+    )
+    tokenizer = AutoTokenizer.from_pretrained(path)
+    pipe = pipeline(entry['task'], model=model, tokenizer=tokenizer)
+    pipe.iacodex_footprint_bytes = _export_footprint(path)
+    return pipe
+
+
+def export_onnx(model_name, kind, task, output_dir, name):
+    """
+    Exporta 'model_name' a ONNX con la caché KV en output_dir/<name>/ (grafos, pesos, tokenizer y
+    manifiesto). Devuelve el manifiesto.
+    """
+    from transformers import AutoTokenizer
+
+    path = os.path.join(output_dir, name)
+    os.makedirs(path, exist_ok=True)
+    model = _ort_model_class(kind).from_pretrained(model_name, export=True, use_cache=True)
+    model.save_pretrained(path)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(path)
+    manifest = {
+        'model': model_name,
+        'kind': kind,
+        'task': task,
+        'use_cache': True,
+        'files': sorted(file_name for file_name in os.listdir(path) if file_name.endswith('.onnx')),
+        'exported_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+    with open(os.path.join(path, ONNX_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+# --- torch.compile ---
+
+def compile_pipeline(pipe):
+    """Compila el forward del modelo del pipeline. Devuelve el forward original (para deshacerlo)."""
+    import torch
+
+    original = pipe.model.forward
+    pipe.model.forward = torch.compile(original, mode=_config['compile_mode'], dynamic=True)
+    return original
+
+
+# --- Carga con respaldo en eager ---
+
+def _verify(pipe):
+    """Generación voraz corta: detecta grafos u operaciones no soportadas antes de servir solicitudes."""
+    if _config['verify']:
+        pipe("def f():", max_new_tokens=2, do_sample=False)
+
+
+def _fallback(name, entry, engine, error):
+    print(
+        f"Motor '{engine}' no disponible para '{name}' ({entry['model_name']}): {error}; se usa eager.",
+        file=sys.stderr
+    )
+    entry['engine_error'] = str(error)
+    metrics.inc('iacodex_engine_fallbacks', model=entry['model_name'], engine=engine)
+
+
+def build_pipeline(name, entry, device, load_eager, threads=0):
+    """
+    Construye el pipeline de 'name' con su motor. load_eager() carga el pipeline de PyTorch (con el perfil
+    de CPU aplicado); también es el respaldo si el motor pedido falla. Anota el motor usado en entry['engine'].
+    """
+    engine = engine_for(name)
+    entry['engine_error'] = None
+    if engine == 'onnx':
+        try:
+            pipe = load_onnx(name, entry, device, threads)
+            _verify(pipe)
+            pipe.iacodex_engine = entry['engine'] = 'onnx'
+            entry['source'] = 'onnx'
+            return pipe
+        except Exception as e:
+            _fallback(name, entry, engine, e)
+
+    pipe = load_eager()
+    if engine == 'compile':
+        original = None
+        try:
+            original = compile_pipeline(pipe)
+            _verify(pipe)
+            pipe.iacodex_engine = entry['engine'] = 'compile'
+            return pipe
+        except Exception as e:
+            if original is not None:
+                pipe.model.forward = original
+            _fallback(name, entry, engine, e)
+    pipe.iacodex_engine = entry['engine'] = 'eager'
+    return pipe
+
@@ -0,0 +1,261 @@
+# ia-codex-api/app/fastfix.py
+
+"""
+Vía rápida de /fix sin modelo: antes de la inferencia, el código se analiza con el comprobador de su
+lenguaje (campo 'language' o FIX_DEFAULT_LANGUAGE).
+
+- 'valid': el código ya es sintácticamente correcto y se devuelve tal cual.
+- 'reindent': sólo falla la sangría y una normalización determinista la arregla (Python: tabuladores,
+  sangría inicial del fragmento copiado, sangría inesperada). Si la reparación tendría que adivinar a qué
+  bloque pertenece una línea, no se aplica. El resultado se vuelve a comprobar antes de devolverlo.
+- 'model': lo demás (o lenguajes sin comprobador) pasa al modelo text2text como siempre.
+
+Python usa ast y tokenize. Para otros lenguajes se usa tree-sitter si está instalado
+(tree_sitter_languages); register_checker() permite añadir comprobadores propios.
+"""
+
+import ast
+import io
+import sys
+import threading
+import tokenize
+
+from . import metrics
+
+PATHS = ('valid', 'reindent', 'model') # De menor a mayor coste
+
+_config = {
+    'enabled': True,           # FIX_FAST_PATH
+    'reindent': True,          # FIX_REINDENT
+    'default_language': '',  # FIX_DEFAULT_LANGUAGE (vacío = sólo con el campo 'language')
+}
+_counters = {path: 0 for path in PATHS}
+_counters_lock = threading.Lock()
+
+# lenguaje -> comprobador(código) que devuelve True (válido), False (no válido) o None (no se sabe).
+_checkers = {}
+_tree_sitter_loaded = False
+# lenguaje -> reparación determinista(código) que devuelve el código reparado o None.
+_repairs = {}
+
+
+def register_checker(language, checker, repair=None):
+    """Registra el comprobador de sintaxis (y, opcionalmente, la reparación determinista) de un lenguaje."""
+    _checkers[language] = checker
+    if repair is not None:
+        _repairs[language] = repair
+
+
+# --- Python ---
+
+def check_python(code):
+    try:
+        ast.parse(code)
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        return False
+    return True
+
+
+def _indent_width(line):
+    """
+    Anchura de la sangría de una línea (un tabulador avanza hasta el siguiente múltiplo de 8, como en el
+    intérprete), si la sangría lleva tabuladores, y la línea sin ella.
+    """
+    stripped = line.lstrip(' \t\f')
+    indent = line[:len(line) - len(stripped)].replace('\f', '')
+    return len(indent.expandtabs(8)), '\t' in indent, stripped
+
+
+def _python_lines(code):
+    """
+    Tipo de cada línea física: 'code' si empieza una sentencia, 'comment' si sólo tiene un comentario
+    o 'other' (en blanco, o continuación dentro de paréntesis, cadenas o tras '\\'); y las líneas que terminan
+    en ':' (abren un bloque). El código se tokeniza sin sangrías, así que los errores de sangría no
+    impiden el análisis. Devuelve None si el código no se puede tokenizar (cadenas o paréntesis sin cerrar).
+    """
+    lines = code.split('\n')
+    flat = '\n'.join(line.lstrip(' \t\f') for line in lines)
+    kinds = ['other'] * len(lines)
+    openers = set()
+    starting = True # El siguiente token empieza una sentencia
+    last = None     # Último token significativo de la sentencia en curso
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(flat).readline):
+            row = token.start[0] - 1
+            if token.type in (tokenize.NL, tokenize.NEWLINE, tokenize.COMMENT):
+                if token.type == tokenize.COMMENT and starting:
+                    kinds[row] = 'comment'
+                if token.type == tokenize.NEWLINE:
+                    if last is not None and last.type == tokenize.OP and last.string == ':':
+                        openers.add(last.start[0] - 1)
+                    starting, last = True, None
+                continue
+            if token.type in (tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER):
+                continue
+            if starting:
+                kinds[row] = 'code'
+                starting = False
+            last = token
+    except (tokenize.TokenError, SyntaxError):
+        return None
+    return lines, kinds, openers
+
+
+def reindent_python(code):
+    """
+    Reconstruye la sangría de las sentencias a partir de la estructura del código:
+    - La primera sentencia queda en el nivel 0 (fragmentos copiados desde dentro de una función).
+    - Tras una línea que termina en ':', más sangría abre un nivel.
+    - Más sangría sin ':' previo sigue en el mismo nivel; menos sangría tiene que coincidir con la de un
+      nivel abierto (si queda entre dos niveles, a qué bloque pertenece la línea cambia el significado).
+    Las continuaciones de línea no se tocan, los comentarios toman el nivel de su anchura y los tabuladores
+    se sustituyen por espacios.
+    Devuelve el código reparado, o None si falta la sangría de un bloque (habría que adivinar qué líneas
+    lo forman), si una línea queda entre dos niveles abiertos o si el código no se puede tokenizar.
+    """
+    analysis = _python_lines(code)
+    if analysis is None:
+        return None
+    lines, kinds, openers = analysis
+
+    unit = None
+    widths = [] # Anchura original de cada nivel abierto
+    opener = False
+    result = list(lines)
+    for row, line in enumerate(lines):
+        kind = kinds[row]
+        if kind == 'other':
+            continue
+        width, tabs, stripped = _indent_width(line)
+        if kind == 'comment':
+            level = max(0, sum(1 for w in widths if w <= width) - 1) if widths else 0
+            result[row] = ' ' * ((unit or 4) * level) + stripped
+            continue
+
+        if not widths:
+            widths = [width]
+        elif opener:
+            if width <= widths[-1]:
+                return None # Bloque sin sangría
+            if unit is None and not tabs:
+                unit = width - widths[-1] # La sangría resultante usa el paso del código (4 si usa tabuladores)
+            widths.append(width)
+        elif width < widths[-1]:
+            while len(widths) > 1 and widths[-1] > width:
+                widths.pop()
+            if width > widths[-1]:
+                return None # Entre dos niveles abiertos: no se sabe a qué bloque pertenece
+            widths[-1] = min(widths[-1], width) # Por debajo de la primera sentencia del fragmento: nivel 0
+        result[row] = ' ' * ((unit or 4) * (len(widths) - 1)) + stripped
+        opener = row in openers
+    if opener:
+        return None # El código termina en una línea que abre un bloque vacío
+    return '\n'.join(result)
+
+
+register_checker('python', check_python, reindent_python)
+
+
+# --- tree-sitter (opcional) ---
+
+# Lenguajes de la API -> nombre del analizador en tree_sitter_languages.
+TREE_SITTER_LANGUAGES = {
+    'javascript': 'javascript', 'typescript': 'typescript', 'java': 'java', 'c': 'c', 'c++': 'cpp',
+    'c#': 'c_sharp', 'go': 'go', 'rust': 'rust', 'ruby': 'ruby', 'php': 'php', 'kotlin': 'kotlin',
+}
+
+
+def _tree_sitter_checker(parser):
+    def check(code):
+        try:
+            tree = parser.parse(code.encode('utf-8'))
+        except Exception:
+            return None
+        return not tree.root_node.has_error
+    return check
+
+
+def _register_tree_sitter():
+    global _tree_sitter_loaded
+    if _tree_sitter_loaded:
+        return
+    _tree_sitter_loaded = True
+    try:
+        from tree_sitter_languages import get_parser
+    except ImportError:
+        return
+    for language, name in TREE_SITTER_LANGUAGES.items():
+        try:
+            register_checker(language, _tree_sitter_checker(get_parser(name)))
+        except Exception as e:
+            print(f"Comprobador tree-sitter no disponible para '{language}': {e}", file=sys.stderr)
+
+
+# --- Vía rápida ---
+
+def _count(path, amount=1):
+    with _counters_lock:
+        _counters[path] += amount
+    metrics.inc('iacodex_fix_requests', amount, path=path)
+
+
+def record_model(amount=1):
+    """
+    Anota entradas de /fix que han pasado por el modelo. Se llama al ejecutar la inferencia, no al
+    preparar la tarea: los aciertos de caché y las solicitudes agrupadas no usan el modelo.
+    """
+    _count('model', amount)
+
+
+def try_fix(code, language=None):
+    """
+    Intenta resolver /fix sin el modelo. 'language' es el campo de la solicitud (None = FIX_DEFAULT_LANGUAGE).
+    Devuelve (vía, código) con vía 'valid' o 'reindent', o None si hace falta el modelo (sin contarla:
+    ver record_model).
+    """
+    if not _config['enabled']:
+        return None
+    language = (language or _config['default_language']).strip().lower()
+    checker = _checkers.get(language)
+    if checker is None:
+        return None
+    if checker(code):
+        _count('valid')
+        return 'valid', code
+
+    repair = _repairs.get(language) if _config['reindent'] else None
+    fixed = repair(code) if repair is not None else None
+    if fixed is not None and fixed != code and checker(fixed):
+        _count('reindent')
+        return 'reindent', fixed
+    return None
+
+
+def combine_paths(paths):
+    """Vía de una respuesta servida por varias entradas (modo archivo): la más costosa."""
+    paths = set(paths)
+    for path in reversed(PATHS):
+        if path in paths:
+            return path
+    return None
+
+
+def init_fastfix(app_config):
+    """Configura la vía rápida de /fix a partir de la configuración de la aplicación."""
+    _config['enabled'] = bool(app_config.get('FIX_FAST_PATH', True))
+    _config['reindent'] = bool(app_config.get('FIX_REINDENT', True))
+    _config['default_language'] = (app_config.get('FIX_DEFAULT_LANGUAGE', '') or '').strip().lower()
+    if _config['enabled']:
+        _register_tree_sitter()
+
+
+def get_stats():
+    with _counters_lock:
+        counters = dict(_counters)
+    total = sum(counters.values())
+    return dict(
+        counters,
+        enabled=_config['enabled'],
+        bypass_ratio=round((counters['valid'] + counters['reindent']) / total, 4) if total else None,
+        languages=sorted(_checkers),
+    )
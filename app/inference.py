@@ -0,0 +1,461 @@
+# ia-codex-api/app/inference.py
+
+"""
+Lógica común de las operaciones de la API (autocompletar, corregir y convertir código):
+validación de la solicitud, construcción del prompt, caché de respuestas y ejecución en los pipelines.
+La usan tanto los endpoints individuales como los endpoints por lotes.
+"""
+
+import sys
+
+from . import admission
+from . import batching
+from . import cache
+from . import coalesce
+from . import fastfix
+from . import kv_cache
+from . import models
+from . import stopping
+from . import suggestions
+from .models import (
+    get_model_revision, generate_with_prefix_cache, generate_assisted, assisted_generation_enabled, generate_suggestions
+)
+
+# Lista de lenguajes soportados (puedes ampliarla)
+# Es crucial que tu modelo T5 haya sido entrenado o pueda manejar estas traducciones.
+SUPPORTED_LANGUAGES = ['python', 'javascript', 'java', 'c++', 'go', 'ruby']
+
+# Descripción de cada operación para los mensajes de error.
+ACTIONS = {
+    'complete': 'autocompletar código',
+    'fix': 'corregir código',
+    'convert': 'convertir código',
+}
+
+
+class InferenceError(Exception):
+    """Error de validación o disponibilidad con el mensaje y el código HTTP que debe ver el cliente."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class InferenceTask:
+    """
+    Solicitud ya validada y lista para ejecutarse en un pipeline.
+    """
+
+    def __init__(self, operation, kind, pipeline, prompt, params, result_field, cache_key=None, session_id=None,
+                 input_tokens=None, truncated_tokens=0, stop_rule=None, return_full_text=True, result=None,
+                 fix_path=None):
+        self.operation = operation
+        self.kind = kind # Modelo que la atiende: 'generator', 'text2text' o un nombre de MODELS
+        self.pipeline = pipeline
+        self.prompt = prompt
+        self.params = params
+        self.result_field = result_field
+        self.cache_key = cache_key
+        self.session_id = session_id
+        self.input_tokens = input_tokens # Tokens del prompt, contados una vez en la admisión
+        self.truncated_tokens = truncated_tokens
+        self.stop_rule = stop_rule # Dónde termina la salida útil (ver app/stopping.py)
+        self.return_full_text = return_full_text # /complete: prompt + generación o sólo la generación
+        self.result = result # Resultado ya resuelto sin el modelo (vía rápida de /fix, ver app/fastfix.py)
+        self.fix_path = fix_path # /fix: 'valid', 'reindent' o 'model'
+
+    @property
+    def prefill_tokens(self):
+        """
+        Tokens que el modelo procesa en el prefill: el prompt se repite por cada secuencia devuelta,
+        salvo con el prefill compartido de las sugerencias (ver app/suggestions.py).
+        """
+        if _uses_shared_prefill(self):
+            return self.input_tokens or 0
+        return (self.input_tokens or 0) * self.params.get('num_return_sequences', 1)
+
+    def _finish(self, text, truncate=True):
+        """Recorta el texto generado en su punto de parada y añade el prompt si se pidió (/complete)."""
+        if truncate and self.stop_rule is not None:
+            text = self.stop_rule.truncate(text, self.operation)
+        if self.operation == 'complete' and self.return_full_text:
+            return self.prompt + text
+        return text
+
+    def format_result(self, outputs):
+        """Convierte la salida del pipeline en el valor que devuelve la API."""
+        if self.operation == 'complete':
+            # Los pipelines de /complete devuelven el prompt + la generación (return_full_text=True).
+            values = [self._finish(output['generated_text'][len(self.prompt):]) for output in outputs]
+            if self.params.get('num_return_sequences', 1) > 1:
+                return suggestions.distinct(values) # Cada sugerencia repetida se devuelve una sola vez
+            return values
+        return self._finish(outputs[0]['generated_text'])
+
+    def stream_chunks(self, chunks):
+        """Fragmentos de una generación en streaming, cortados donde termina la salida útil."""
+        return stopping.filter_stream(chunks, self.stop_rule, self.operation)
+
+    def stream_result(self, text):
+        """Valor final de una generación en streaming (texto ya filtrado por stream_chunks)."""
+        value = self._finish(text, truncate=False)
+        return [value] if self.operation == 'complete' else value
+
+    def response(self, value):
+        if self.fix_path is not None:
+            return {self.result_field: value, "fix_path": self.fix_path}
+        return {self.result_field: value}
+
+
+def resolve_model_for(kind, data):
+    """
+    Modelo que atiende la solicitud (campo opcional 'model'; por defecto, el modelo de su tipo), sin cargarlo.
+    Lanza InferenceError si no existe.
+    """
+    try:
+        return models.resolve_model(kind, data.get('model'))
+    except ValueError as e:
+        raise InferenceError(str(e))
+
+
+def get_pipeline_for(kind, data, label):
+    """
+    Modelo que atiende la solicitud y su pipeline (ver resolve_model_for).
+    Devuelve (nombre, pipeline) o lanza InferenceError.
+    """
+    name = resolve_model_for(kind, data)
+    pipeline = models.get_pipeline(name)
+    if pipeline is None:
+        raise InferenceError(f"Modelo de {label} no cargado.", 500)
+    return name, pipeline
+
+
+def prepare_complete(data):
+    prompt = data.get('prompt')
+    if not prompt:
+        raise InferenceError("El campo 'prompt' es requerido.") # Mensaje de error unificado
+
+    # Obtener parámetros opcionales de la solicitud, con valores por defecto (422 si superan los límites).
+    max_tokens = admission.max_new_tokens(data)
+    num_suggestions = admission.num_suggestions(data)
+
+    # Obtener el pipeline del modelo de autocompletado.
+    model_name, generator_pipeline = get_pipeline_for('generator', data, 'autocompletado')
+
+    # Con una entrada demasiado larga, 413 o se conserva el final del prompt (lo más cercano al cursor).
+    admitted = admission.admit('complete', generator_pipeline, prompt, max_new_tokens=max_tokens)
+    prompt = admitted.text
+
+    # Reglas de parada ('stop', 'language', 'stop_at_block_end') y forma de la respuesta ('return_full_text').
+    try:
+        stop_rule, return_full_text = stopping.completion_options(data, prompt)
+    except ValueError as e:
+        raise InferenceError(str(e))
+
+    params = dict(
+        max_new_tokens=max_tokens,
+        num_return_sequences=num_suggestions,
+        # pad_token_id se fija en models.py al cargar el modelo (ver _prepare_tokenizer_for_batching)
+        return_full_text=True # El prompt se quita o se conserva en format_result (campo 'return_full_text')
+    )
+    # Sesión del editor (campo 'session_id' o cabecera X-Session-Id): activa la reutilización de la caché KV.
+    session_id = data.get('session_id')
+    return InferenceTask(
+        'complete', model_name, generator_pipeline, prompt, params, 'suggestions', session_id=session_id,
+        input_tokens=admitted.input_tokens, truncated_tokens=admitted.truncated_tokens,
+        stop_rule=stop_rule, return_full_text=return_full_text
+    )
+
+
+def prepare_fix(data):
+    code_snippet = data.get('code')
+    if not code_snippet:
+        raise InferenceError("El campo 'code' es requerido.") # Mensaje de error unificado
+
+    max_tokens = admission.max_new_tokens(data)
+
+    try:
+        stop_rule = stopping.output_rule(data) # 'stop' y reglas del lenguaje del campo opcional 'language'
+    except ValueError as e:
+        raise InferenceError(str(e))
+
+    # Código ya válido o que sólo necesita normalizar la sangría: se resuelve sin cargar ni usar el modelo.
+    fast_task = prepare_fast_fix(data)
+    if fast_task is not None:
+        return fast_task
+
+    model_name, text2text_pipeline = get_pipeline_for('text2text', data, 'corrección')
+
+    # Formular el prompt para la corrección de código.
+    instruction = "Corrige los errores de sintaxis y ajusta la sangría de este código:\n"
+    admitted = admission.admit('fix', text2text_pipeline, code_snippet, instruction, max_tokens)
+    prompt = f"{instruction}{admitted.text}"
+
+    # La generación es determinista (do_sample=False): la respuesta se puede guardar en la caché.
+    # Las reglas de parada cambian la salida, así que forman parte de la clave.
+    cache_key = cache.make_key(
+        'fix', get_model_revision(text2text_pipeline), prompt, max_tokens, *_rule_key(stop_rule)
+    )
+    params = dict(max_new_tokens=max_tokens, do_sample=False)
+    return InferenceTask(
+        'fix', model_name, text2text_pipeline, prompt, params, 'fixed_code', cache_key,
+        input_tokens=admitted.input_tokens, truncated_tokens=admitted.truncated_tokens, stop_rule=stop_rule,
+        fix_path='model'
+    )
+
+
+def prepare_fast_fix(data):
+    """
+    Vía rápida de /fix (ver app/fastfix.py): devuelve una InferenceTask ya resuelta si el código es válido
+    o se arregla normalizando la sangría, o None si hace falta el modelo.
+    """
+    model_name = resolve_model_for('text2text', data)
+    language = data.get('language')
+    if language is not None and not isinstance(language, str):
+        raise InferenceError("El campo 'language' debe ser una cadena.")
+    fast = fastfix.try_fix(data['code'], language)
+    if fast is None:
+        return None
+    fix_path, fixed_code = fast
+    return InferenceTask('fix', model_name, None, data['code'], {}, 'fixed_code', result=fixed_code, fix_path=fix_path)
+
+
+def prepare_convert(data):
+    code_snippet = data.get('code')
+    target_language = data.get('target_language') # ¡Cambiado de 'to_lang' a 'target_language'!
+
+    if not code_snippet:
+        raise InferenceError("El campo 'code' es requerido.")
+    if not target_language:
+        raise InferenceError("El campo 'target_language' es requerido.") # Mensaje de error unificado
+
+    max_tokens = admission.max_new_tokens(data)
+
+    model_name, text2text_pipeline = get_pipeline_for('text2text', data, 'conversión')
+
+    if target_language.lower() not in SUPPORTED_LANGUAGES:
+        raise InferenceError(f"El lenguaje objetivo '{target_language}' no es soportado.")
+    try:
+        stop_rule = stopping.output_rule(data, target_language) # Reglas del lenguaje de destino
+    except ValueError as e:
+        raise InferenceError(str(e))
+
+    # Formular el prompt para la traducción de código.
+    instruction = f"Traduce el siguiente fragmento de código al lenguaje {target_language}:\n"
+    admitted = admission.admit('convert', text2text_pipeline, code_snippet, instruction, max_tokens)
+    prompt = f"{instruction}{admitted.text}"
+
+    cache_key = cache.make_key(
+        'convert', get_model_revision(text2text_pipeline), prompt, target_language, max_tokens, *_rule_key(stop_rule)
+    )
+    params = dict(max_new_tokens=max_tokens, do_sample=False)
+    return InferenceTask(
+        'convert', model_name, text2text_pipeline, prompt, params, 'converted_code', cache_key,
+        input_tokens=admitted.input_tokens, truncated_tokens=admitted.truncated_tokens, stop_rule=stop_rule
+    )
+
+
+def _rule_key(stop_rule):
+    """Parte de la clave de caché que corresponde a las reglas de parada (vacía si no hay)."""
+    return (stop_rule.signature(),) if stop_rule is not None else ()
+
+
+_PREPARERS = {
+    'complete': prepare_complete,
+    'fix': prepare_fix,
+    'convert': prepare_convert,
+}
+
+
+def prepare(operation, data):
+    """
+    Valida el JSON de una solicitud y construye su InferenceTask.
+    Lanza InferenceError con el mensaje y el código HTTP adecuados si la solicitud no es válida.
+    """
+    return _PREPARERS[operation](data)
+
+
+def _uses_shared_prefill(task):
+    """
+    Las completaciones con varias sugerencias codifican el prompt una sola vez y reparten su caché KV
+    entre las sugerencias (ver app/suggestions.py), en lugar de repetir el prompt en el micro-batching.
+    """
+    return task.operation == 'complete' and suggestions.uses_shared_prefill(task.params.get('num_return_sequences', 1))
+
+
+def _uses_prefix_cache(task):
+    """
+    Las completaciones de una sesión de editor con una sola sugerencia reutilizan la caché KV por prefijo
+    (cada pulsación sólo codifica los tokens nuevos). El resto pasa por el micro-batching.
+    La caché KV es del modelo de autocompletado por defecto (sus entradas no indican el modelo).
+    """
+    return (
+        task.operation == 'complete'
+        and task.kind == 'generator'
+        and task.session_id is not None
+        and task.params.get('num_return_sequences') == 1
+        and kv_cache.prefix_store is not None
+    )
+
+
+def _uses_assisted_generation(task):
+    """
+    Las completaciones de una sola sugerencia usan la generación asistida si hay un modelo borrador
+    (HF_MODEL_DRAFT), que acompaña al modelo de autocompletado por defecto.
+    Las de una sesión de editor siguen prefiriendo la caché KV por prefijo.
+    """
+    return (
+        task.operation == 'complete'
+        and task.kind == 'generator'
+        and task.params.get('num_return_sequences') == 1
+        and assisted_generation_enabled()
+    )
+
+
+def _coalesce_key(task):
+    """
+    Clave para agrupar solicitudes idénticas en curso: sólo las deterministas (do_sample=False),
+    que son las que tienen clave de caché. Incluye el nombre del modelo registrado.
+    """
+    if task.cache_key is None or task.params.get('do_sample') is not False:
+        return None
+    return f"{task.kind}:{task.cache_key}"
+
+
+def _record_model_path(tasks):
+    """Cuenta en la vía 'model' de /fix las tareas que van a ejecutar el modelo (ver fastfix.record_model)."""
+    count = sum(1 for task in tasks if task.fix_path == 'model')
+    if count:
+        fastfix.record_model(count)
+
+
+def _execute(task):
+    """Ejecuta la inferencia de una tarea y devuelve su resultado ya formateado."""
+    _record_model_path([task])
+    with models.model_in_use(task.kind), admission.prefill_budget(task.prefill_tokens):
+        if _uses_shared_prefill(task):
+            outputs = generate_suggestions(
+                task.pipeline, task.prompt, task.params['num_return_sequences'],
+                max_new_tokens=task.params['max_new_tokens'], stop_rule=task.stop_rule
+            )
+        elif _uses_prefix_cache(task):
+            outputs = generate_with_prefix_cache(
+                task.pipeline, task.prompt, max_new_tokens=task.params['max_new_tokens'], session_id=task.session_id,
+                stop_rule=task.stop_rule
+            )
+        elif _uses_assisted_generation(task):
+            outputs = generate_assisted(
+                task.pipeline, task.prompt, max_new_tokens=task.params['max_new_tokens'], stop_rule=task.stop_rule
+            )
+        else:
+            outputs = batching.submit(
+                task.kind, task.prompt, num_tokens=task.input_tokens, stop_rule=task.stop_rule, **task.params
+            )
+    return task.format_result(outputs)
+
+
+def run(task):
+    """
+    Ejecuta una tarea individual a través del planificador de micro-lotes,
+    dentro del presupuesto global de tokens de prefill.
+    Las solicitudes deterministas idénticas que llegan mientras otra está en curso esperan su resultado
+    en lugar de repetir la inferencia (ver coalesce.py).
+    Devuelve (respuesta, acierto_de_cache).
+    """
+    if task.result is not None:
+        return task.response(task.result), False
+    if task.cache_key is not None:
+        value = cache.get_cached(task.cache_key)
+        if value is not None:
+            return task.response(value), True
+
+    value, shared = coalesce.run(task.operation, _coalesce_key(task), lambda: _execute(task))
+    if task.cache_key is not None and not shared:
+        cache.set_cached(task.cache_key, value) # La guarda sólo la solicitud que ejecutó la inferencia
+    return task.response(value), False
+
+
+def run_many(tasks):
+    """
+    Ejecuta varias tareas como inferencia por lotes real.
+    Las tareas con los mismos parámetros se agrupan y se ejecutan ordenadas por longitud.
+    Devuelve, en el orden de entrada, la respuesta de cada tarea o la excepción que la hizo fallar.
+    Los elementos de 'tasks' que ya son excepciones (p. ej. errores de validación) se devuelven tal cual.
+    """
+    results = [None] * len(tasks)
+    groups = {}
+    duplicates = {} # Índice de la primera tarea con la misma clave -> índices de las repetidas
+    first_by_key = {}
+    shared = [] # Completaciones con varias sugerencias: cada una con su prefill compartido
+
+    for index, task in enumerate(tasks):
+        if isinstance(task, Exception):
+            results[index] = task
+            continue
+        if task.result is not None:
+            results[index] = task.response(task.result)
+            continue
+        if task.cache_key is not None:
+            value = cache.get_cached(task.cache_key)
+            if value is not None:
+                results[index] = task.response(value)
+                continue
+        if _uses_shared_prefill(task):
+            shared.append(index)
+            continue
+        key = _coalesce_key(task)
+        if key is not None and key in first_by_key:
+            duplicates.setdefault(first_by_key[key], []).append(index)
+            continue
+        if key is not None:
+            first_by_key[key] = index
+        group_key = (task.kind, tuple(sorted(task.params.items())))
+        groups.setdefault(group_key, []).append(index)
+
+    for (kind, _), indices in groups.items():
+        params = tasks[indices[0]].params
+        _record_model_path([tasks[index] for index in indices])
+        try:
+            with models.model_in_use(kind, hits=len(indices)), \
+                    admission.prefill_budget(sum(tasks[index].prefill_tokens for index in indices)):
+                outputs = batching.run_many(
+                    kind, [tasks[index].prompt for index in indices],
+                    stop_rules=[tasks[index].stop_rule for index in indices], **params
+                )
+        except admission.AdmissionError as e:
+            outputs = [e] * len(indices)
+        for index, output in zip(indices, outputs):
+            task = tasks[index]
+            if isinstance(output, Exception):
+                results[index] = output
+                continue
+            value = task.format_result(output)
+            if task.cache_key is not None:
+                cache.set_cached(task.cache_key, value)
+            results[index] = task.response(value)
+
+    for index in shared:
+        try:
+            results[index] = tasks[index].response(_execute(tasks[index]))
+        except Exception as e:
+            results[index] = e
+
+    # Los elementos repetidos del lote reutilizan el resultado de su primera aparición.
+    for first, indices in duplicates.items():
+        for index in indices:
+            output = results[first]
+            results[index] = output if isinstance(output, Exception) else tasks[index].response(output[tasks[first].result_field])
+        coalesce.record_batch_duplicates(tasks[first].operation, len(indices))
+
+    return results
+
+
+def error_payload(operation, error):
+    """
+    Convierte una excepción en (JSON de error, código HTTP) con el mismo formato que los endpoints.
+    """
+    if isinstance(error, (InferenceError, admission.AdmissionError)):
+        return {"error": error.message}, error.status_code
+    print(f"Error al {ACTIONS[operation]}: {error}", file=sys.stderr)
+    return {"error": f"Error interno del servidor al {ACTIONS[operation]}: {str(error)}"}, 500
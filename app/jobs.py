@@ -0,0 +1,534 @@
+# ia-codex-api/app/jobs.py
+
+"""
+Trabajos asíncronos (POST /jobs, GET /jobs/<id>) para conversiones y correcciones largas.
+
+Un trabajo lleva la misma entrada que /complete, /fix o /convert (incluido el modo archivo). Se guarda en
+una cola sqlite local (JOBS_DB_PATH), compartida por todos los workers de la máquina, y la respuesta HTTP
+vuelve en seguida con su id. Cada proceso tiene JOBS_WORKERS hilos que toman los trabajos pendientes y los
+ejecutan con los mismos pipelines que los endpoints, en el carril de prioridad masivo
+(ver app/scheduling.py). El resultado se guarda JOBS_RESULT_TTL_S segundos:
+- El cliente lo consulta con GET /jobs/<id> cuando quiera. Si se reconecta, no se repite nada.
+- ?wait=<segundos> espera (long-poll) a que termine.
+- Con 'callback_url', se le envía el resultado por POST al terminar. Para que la URL de un cliente no
+  sirva para llegar a la propia máquina o a la red interna (SSRF), sólo se admiten hosts con direcciones
+  públicas, o los de JOBS_CALLBACK_ALLOWED_HOSTS si se define. El envío se conecta a la dirección que se
+  comprobó (un DNS que cambia entre la comprobación y la conexión no lleva a otra) y no sigue redirecciones.
+
+La cabecera Idempotency-Key hace que reenviar la misma solicitud devuelva el trabajo ya creado.
+Si un worker muere con un trabajo a medias, otro lo vuelve a encolar (hasta JOBS_MAX_ATTEMPTS intentos).
+Sin JOBS_DB_PATH no hay cola y /jobs responde 503.
+"""
+
+import http.client
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import ssl
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+from . import metrics
+from . import scheduling
+from .utils import sqlite_connection
+
+OPERATIONS = ('complete', 'fix', 'convert')
+STATUSES = ('queued', 'running', 'done', 'failed')
+CALLBACK_ATTEMPTS = 3
+
+_config = {
+    'enabled': True,
+    'db_path': '',
+    'workers': 2,
+    'result_ttl_s': 86400.0,
+    'max_wait_s': 30.0,
+    'max_attempts': 3,
+    'poll_interval_s': 0.2,
+    'callback_timeout_s': 10.0,
+    'callback_allowed_hosts': set(), # JOBS_CALLBACK_ALLOWED_HOSTS (vacío = cualquier host público)
+}
+
+store = None
+
+_workers = []
+_workers_pid = None
+_workers_lock = threading.Lock()
+_wakeup = threading.Event()
+_generation = 0 # Cambia con cada init_jobs(): los hilos de una configuración anterior terminan
+_counters = {'submitted': 0, 'deduplicated': 0, 'completed': 0, 'failed': 0, 'requeued': 0, 'callbacks_failed': 0}
+_counters_lock = threading.Lock()
+
+
+class JobError(Exception):
+    """Solicitud de trabajo no válida (código HTTP en status_code)."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def _count(name, value=1):
+    with _counters_lock:
+        _counters[name] += value
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass # Existe, pero es de otro usuario
+    return True
+
+
+class JobStore:
+    """Cola persistente de trabajos en sqlite, compartida entre los workers de la máquina."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._init_db()
+
+    def _db(self):
+        return sqlite_connection(self._local, self.db_path, timeout=10, row_factory=sqlite3.Row, isolation_level=None)
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._db()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, operation TEXT NOT NULL, input TEXT NOT NULL, status TEXT NOT NULL,"
+            " client TEXT, idempotency_key TEXT UNIQUE, callback_url TEXT, callback_status TEXT,"
+            " result TEXT, status_code INTEGER, attempts INTEGER NOT NULL DEFAULT 0, worker_pid INTEGER,"
+            " created_at REAL NOT NULL, started_at REAL, finished_at REAL, expires_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def insert(self, operation, data, client, idempotency_key=None, callback_url=None):
+        """
+        Crea un trabajo en cola. Devuelve (id, creado): con una Idempotency-Key repetida, el id existente
+        (si su resultado ya caducó, la clave queda libre y se crea un trabajo nuevo).
+        """
+        job_id = uuid.uuid4().hex
+        conn = self._db()
+        if idempotency_key is not None:
+            # Un trabajo caducado que prune() aún no ha borrado no debe retener la clave: get() ya no lo ve.
+            conn.execute(
+                "DELETE FROM jobs WHERE idempotency_key = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                (idempotency_key, time.time())
+            )
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO jobs (id, operation, input, status, client, idempotency_key, callback_url,"
+            " created_at) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, operation, json.dumps(data, ensure_ascii=False), client, idempotency_key, callback_url,
+             time.time())
+        )
+        if cursor.rowcount == 1:
+            return job_id, True
+        row = conn.execute("SELECT id FROM jobs WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+        return row['id'], False
+
+    def get(self, job_id):
+        row = self._db().execute(
+            "SELECT * FROM jobs WHERE id = ? AND (expires_at IS NULL OR expires_at > ?)", (job_id, time.time())
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def claim(self):
+        """Toma el trabajo en cola más antiguo para este proceso. Devuelve la fila o None."""
+        conn = self._db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job = dict(row, status='running', worker_pid=os.getpid(), started_at=time.time(), attempts=row['attempts'] + 1)
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker_pid = ?, started_at = ?, attempts = ? WHERE id = ?",
+                (job['worker_pid'], job['started_at'], job['attempts'], job['id'])
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job
+
+    def finish(self, job_id, payload, status_code, ttl_s):
+        now = time.time()
+        self._db().execute(
+            "UPDATE jobs SET status = ?, result = ?, status_code = ?, finished_at = ?, expires_at = ?"
+            " WHERE id = ?",
+            ('done' if status_code == 200 else 'failed', json.dumps(payload, ensure_ascii=False), status_code,
+             now, now + ttl_s, job_id)
+        )
+
+    def set_callback_status(self, job_id, status):
+        self._db().execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (status, job_id))
+
+    def recover(self, max_attempts, ttl_s):
+        """
+        Vuelve a encolar los trabajos que estaban en marcha en un proceso que ya no existe
+        (o los da por fallidos si ya agotaron sus intentos). Devuelve cuántos se encolaron de nuevo.
+        """
+        conn = self._db()
+        rows = conn.execute("SELECT id, worker_pid, attempts FROM jobs WHERE status = 'running'").fetchall()
+        requeued = 0
+        now = time.time()
+        for row in rows:
+            if row['worker_pid'] is None or _process_alive(row['worker_pid']):
+                continue
+            if row['attempts'] < max_attempts:
+                requeued += conn.execute(
+                    "UPDATE jobs SET status = 'queued', worker_pid = NULL WHERE id = ? AND status = 'running'",
+                    (row['id'],)
+                ).rowcount
+            else:
+                error = {"error": "El trabajo se interrumpió varias veces (el proceso que lo ejecutaba terminó)."}
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', result = ?, status_code = 500, finished_at = ?,"
+                    " expires_at = ? WHERE id = ? AND status = 'running'",
+                    (json.dumps(error, ensure_ascii=False), now, now + ttl_s, row['id'])
+                )
+        return requeued
+
+    def prune(self):
+        """Borra los trabajos terminados cuyo resultado ya caducó."""
+        return self._db().execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)).rowcount
+
+    def counts(self):
+        rows = self._db().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update({row['status']: row['n'] for row in rows})
+        return counts
+
+
+def describe(row):
+    """Representación JSON de un trabajo (la de GET /jobs/<id> y la que se envía al callback)."""
+    job = {
+        'job_id': row['id'],
+        'operation': row['operation'],
+        'status': row['status'],
+        'created_at': row['created_at'],
+        'started_at': row['started_at'],
+        'finished_at': row['finished_at'],
+        'attempts': row['attempts'],
+    }
+    if row['status'] in ('done', 'failed'):
+        payload = json.loads(row['result'])
+        job['status_code'] = row['status_code']
+        job['result' if row['status'] == 'done' else 'error'] = payload if row['status'] == 'done' else payload.get('error')
+        job['expires_at'] = row['expires_at']
+    if row['callback_url']:
+        job['callback_status'] = row['callback_status']
+    return job
+
+
+def execute(operation, data):
+    """
+    Ejecuta la entrada de un trabajo igual que el endpoint correspondiente (con modo archivo para /fix y
+    /convert). Devuelve (respuesta JSON, código HTTP).
+    """
+    from . import chunking
+    from . import inference
+
+    data = {key: value for key, value in data.items() if key != 'stream'}
+    try:
+        if operation in ('fix', 'convert') and chunking.wants_file_mode(data):
+            return chunking.run_chunked(chunking.prepare_chunked(operation, data)), 200
+        payload, _ = inference.run(inference.prepare(operation, data))
+        return payload, 200
+    except Exception as e:
+        return inference.error_payload(operation, e)
+
+
+def check_callback_url(url):
+    """
+    Comprueba que el callback_url sea una URL http(s) a un host admitido: uno de JOBS_CALLBACK_ALLOWED_HOSTS
+    si se define y, si no, uno cuyas direcciones sean todas públicas (ni loopback, ni red privada, ni
+    link-local como la de metadatos de la nube). Lanza JobError si no se admite.
+    Devuelve las direcciones comprobadas, a las que debe conectarse el envío, o None para los hosts de
+    JOBS_CALLBACK_ALLOWED_HOSTS (de confianza, se conecta por nombre).
+    """
+    if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        raise JobError("El campo 'callback_url' debe ser una URL http(s).")
+    try:
+        parts = urllib.parse.urlsplit(url)
+        host, port = (parts.hostname or '').lower(), parts.port
+    except ValueError:
+        raise JobError("El campo 'callback_url' debe ser una URL http(s).")
+    if not host:
+        raise JobError("El campo 'callback_url' debe ser una URL http(s).")
+    if _config['callback_allowed_hosts']:
+        if host not in _config['callback_allowed_hosts']:
+            raise JobError(f"El host '{host}' del callback_url no está en JOBS_CALLBACK_ALLOWED_HOSTS.")
+        return None
+    try:
+        addresses = list(dict.fromkeys(info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)))
+    except (socket.gaierror, UnicodeError) as e:
+        raise JobError(f"No se puede resolver el host '{host}' del callback_url: {e}")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if not ip.is_global or ip.is_multicast:
+            raise JobError(f"El callback_url no puede apuntar a una dirección interna ({ip}).")
+    return addresses
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    """Conexión HTTP a una dirección ya comprobada ('address'), con el host de la URL en la cabecera Host."""
+
+    def __init__(self, host, port, address=None, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address or self.host, self.port), self.timeout)
+
+
+class _PinnedHTTPSConnection(http.client.HTTPSConnection):
+    """Como _PinnedHTTPConnection, con TLS: el certificado y el SNI son los del host de la URL."""
+
+    def __init__(self, host, port, address=None, **kwargs):
+        self.ssl_context = ssl.create_default_context()
+        super().__init__(host, port, context=self.ssl_context, **kwargs)
+        self.address = address
+
+    def connect(self):
+        sock = socket.create_connection((self.address or self.host, self.port), self.timeout)
+        self.sock = self.ssl_context.wrap_socket(sock, server_hostname=self.host)
+
+
+def _post_callback(url, data, addresses):
+    """
+    Envía 'data' por POST al callback_url conectándose a la primera de las direcciones comprobadas (o por
+    nombre si es None). No sigue redirecciones: una respuesta que no es 2xx es un error.
+    """
+    parts = urllib.parse.urlsplit(url)
+    connection_class = _PinnedHTTPSConnection if parts.scheme == 'https' else _PinnedHTTPConnection
+    conn = connection_class(
+        parts.hostname, parts.port, address=addresses[0] if addresses else None, timeout=_config['callback_timeout_s']
+    )
+    path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+    try:
+        conn.request('POST', path, body=data, headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+    finally:
+        conn.close()
+    if not 200 <= response.status < 300:
+        raise OSError(f"El callback_url respondió HTTP {response.status}.")
+
+
+def _send_callback(job_id, url, body):
+    """Envía el resultado al callback_url (CALLBACK_ATTEMPTS intentos con espera creciente) y anota si llegó."""
+    data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    for attempt in range(CALLBACK_ATTEMPTS):
+        try:
+            # El DNS puede haber cambiado desde que se encoló el trabajo: se comprueba de nuevo y el envío
+            # va a las mismas direcciones comprobadas, sin volver a resolver el host.
+            _post_callback(url, data, check_callback_url(url))
+            store.set_callback_status(job_id, 'delivered')
+            return
+        except JobError as e:
+            print(f"Callback del trabajo {job_id} descartado: {e}", file=sys.stderr)
+            break
+        except Exception as e:
+            print(f"Error al enviar el callback del trabajo {job_id} (intento {attempt + 1}): {e}", file=sys.stderr)
+            if attempt + 1 < CALLBACK_ATTEMPTS:
+                time.sleep(2 ** attempt)
+    _count('callbacks_failed')
+    try:
+        store.set_callback_status(job_id, 'failed')
+    except sqlite3.Error:
+        pass
+
+
+def run_job(row):
+    """Ejecuta un trabajo ya tomado de la cola y guarda su resultado."""
+    metrics.observe('iacodex_job_queue_seconds', max(0.0, row['started_at'] - row['created_at']), operation=row['operation'])
+    # Los trabajos van siempre por el carril masivo, repartidos entre clientes como las solicitudes síncronas.
+    with scheduling.use_priority(scheduling.Priority('bulk', row['client'] or 'jobs')):
+        payload, status_code = execute(row['operation'], json.loads(row['input']))
+    store.finish(row['id'], payload, status_code, _config['result_ttl_s'])
+    outcome = 'done' if status_code == 200 else 'failed'
+    _count('completed' if outcome == 'done' else 'failed')
+    metrics.inc('iacodex_jobs', operation=row['operation'], outcome=outcome)
+    if row['callback_url']:
+        finished = store.get(row['id'])
+        if finished is not None:
+            threading.Thread(
+                target=_send_callback, args=(row['id'], row['callback_url'], describe(finished)), daemon=True
+            ).start()
+
+
+def _maintenance():
+    """Recupera los trabajos de procesos muertos y borra los caducados."""
+    try:
+        requeued = store.recover(_config['max_attempts'], _config['result_ttl_s'])
+        if requeued:
+            _count('requeued', requeued)
+            _wakeup.set()
+        store.prune()
+    except sqlite3.Error as e:
+        print(f"Error en el mantenimiento de la cola de trabajos: {e}", file=sys.stderr)
+
+
+def _worker_loop(generation):
+    last_maintenance = 0.0
+    while generation == _generation:
+        if time.monotonic() - last_maintenance > 10:
+            last_maintenance = time.monotonic()
+            _maintenance()
+        try:
+            row = store.claim()
+        except sqlite3.Error as e:
+            print(f"Error al tomar un trabajo de la cola: {e}", file=sys.stderr)
+            row = None
+        if row is None:
+            _wakeup.wait(_config['poll_interval_s'])
+            _wakeup.clear()
+            continue
+        try:
+            run_job(row)
+        except Exception as e:
+            # Un error guardando el resultado deja el trabajo 'running': lo recupera el mantenimiento.
+            print(f"Error al ejecutar el trabajo {row['id']}: {e}", file=sys.stderr)
+
+
+def _ensure_workers():
+    """Arranca los hilos de la cola (de forma perezosa, para sobrevivir a un fork de gunicorn)."""
+    global _workers, _workers_pid
+    pid = os.getpid()
+    if _workers_pid == pid and all(worker.is_alive() for worker in _workers):
+        return
+    with _workers_lock:
+        if _workers_pid == pid and all(worker.is_alive() for worker in _workers):
+            return
+        _workers = [
+            threading.Thread(target=_worker_loop, args=(_generation,), name=f"jobs-{index}", daemon=True)
+            for index in range(max(1, _config['workers']))
+        ]
+        _workers_pid = pid
+        for worker in _workers:
+            worker.start()
+
+
+def _require_store():
+    if store is None:
+        raise JobError("Los trabajos asíncronos están desactivados (JOBS_ENABLED=False o sin JOBS_DB_PATH).", 503)
+
+
+def submit(body, client=None, idempotency_key=None):
+    """
+    Encola un trabajo a partir del cuerpo de POST /jobs ({"operation", "input", "callback_url"?}).
+    Devuelve (trabajo, creado). Lanza JobError si la solicitud no es válida.
+    """
+    _require_store()
+    if not isinstance(body, dict):
+        raise JobError("El JSON de la solicitud debe ser un objeto.")
+    operation = body.get('operation')
+    if operation not in OPERATIONS:
+        raise JobError(f"El campo 'operation' debe ser uno de: {', '.join(OPERATIONS)}.")
+    data = body.get('input')
+    if not isinstance(data, dict):
+        raise JobError("El campo 'input' debe ser un objeto JSON con la solicitud del endpoint.")
+    callback_url = body.get('callback_url')
+    if callback_url is not None:
+        check_callback_url(callback_url)
+
+    if idempotency_key:
+        idempotency_key = f"{client}:{idempotency_key}" # Las claves de un cliente no chocan con las de otro
+    job_id, created = store.insert(operation, data, client, idempotency_key, callback_url)
+    _count('submitted' if created else 'deduplicated')
+    if created:
+        metrics.inc('iacodex_jobs', operation=operation, outcome='submitted')
+    _ensure_workers()
+    _wakeup.set()
+    return describe(store.get(job_id)), created
+
+
+def get(job_id):
+    """Estado (y resultado, si ya terminó) de un trabajo, o None si no existe o ya caducó."""
+    _require_store()
+    _ensure_workers()
+    row = store.get(job_id)
+    return describe(row) if row is not None else None
+
+
+def wait_time(value):
+    """Segundos de long-poll pedidos en ?wait=, acotados a JOBS_MAX_WAIT_S."""
+    try:
+        return min(max(float(value or 0), 0.0), _config['max_wait_s'])
+    except ValueError:
+        raise JobError("El parámetro 'wait' debe ser un número de segundos.")
+
+
+def wait_for(job_id, timeout_s):
+    """Espera hasta 'timeout_s' segundos a que el trabajo termine. Devuelve su estado, o None si no existe."""
+    deadline = time.monotonic() + timeout_s
+    while True:
+        job = get(job_id)
+        if job is None or job['status'] in ('done', 'failed') or time.monotonic() >= deadline:
+            return job
+        time.sleep(min(0.1, max(0.0, deadline - time.monotonic())))
+
+
+def init_jobs(app_config):
+    """
+    Configura la cola de trabajos a partir de la configuración de la aplicación.
+    Los hilos arrancan con la primera solicitud a /jobs, o ahora mismo si quedaron trabajos pendientes.
+    """
+    global store, _generation, _workers, _workers_pid
+    _config['enabled'] = app_config.get('JOBS_ENABLED', True)
+    _config['db_path'] = app_config.get('JOBS_DB_PATH', '')
+    _config['workers'] = int(app_config.get('JOBS_WORKERS', 2))
+    _config['result_ttl_s'] = float(app_config.get('JOBS_RESULT_TTL_S', 86400))
+    _config['max_wait_s'] = float(app_config.get('JOBS_MAX_WAIT_S', 30))
+    _config['max_attempts'] = int(app_config.get('JOBS_MAX_ATTEMPTS', 3))
+    _config['poll_interval_s'] = float(app_config.get('JOBS_POLL_MS', 200)) / 1000
+    _config['callback_timeout_s'] = float(app_config.get('JOBS_CALLBACK_TIMEOUT_S', 10))
+    _config['callback_allowed_hosts'] = {
+        host.strip().lower() for host in str(app_config.get('JOBS_CALLBACK_ALLOWED_HOSTS', '')).split(',') if host.strip()
+    }
+
+    _generation += 1
+    _wakeup.set() # Despierta a los hilos anteriores para que terminen
+    with _workers_lock:
+        _workers, _workers_pid = [], None
+
+    store = None
+    if not _config['enabled'] or not _config['db_path']:
+        return
+    existed = os.path.exists(_config['db_path'])
+    try:
+        store = JobStore(_config['db_path'])
+        pending = existed and (store.counts()['queued'] or store.counts()['running'])
+    except sqlite3.Error as e:
+        print(f"Error al abrir la cola de trabajos {_config['db_path']}: {e}", file=sys.stderr)
+        store = None
+        return
+    if pending:
+        _ensure_workers()
+
+
+def get_stats():
+    if store is None:
+        return {'enabled': False}
+    with _counters_lock:
+        counters = dict(_counters)
+    try:
+        counters['jobs'] = store.counts()
+    except sqlite3.Error as e:
+        counters['jobs'] = {'error': str(e)}
+    return dict(counters, enabled=True, workers=sum(1 for worker in _workers if worker.is_alive()))
@@ -0,0 +1,238 @@
+# ia-codex-api/app/kv_cache.py
+
+"""
+Almacén de past-key-values (caché KV) por prefijo de tokens para el modelo de autocompletado.
+
+Los editores llaman a /complete con el prompt anterior más unos pocos caracteres. Si se guarda la
+caché KV del prompt anterior, el nuevo sólo necesita codificar el sufijo añadido.
+"""
+
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def _hash_tokens(token_ids):
+    return hashlib.blake2b(repr(tuple(token_ids)).encode(), digest_size=16).hexdigest()
+
+
+def _common_prefix_length(a, b):
+    length = min(len(a), len(b))
+    for i in range(length):
+        if a[i] != b[i]:
+            return i
+    return length
+
+
+def kv_nbytes(past_key_values):
+    """Memoria ocupada por una caché KV (DynamicCache o tupla de tuplas de tensores)."""
+    if hasattr(past_key_values, 'layers'):
+        # transformers recientes: una capa por objeto con .keys y .values
+        tensors = [t for layer in past_key_values.layers for t in (layer.keys, layer.values)]
+    elif hasattr(past_key_values, 'key_cache'):
+        tensors = list(past_key_values.key_cache) + list(past_key_values.value_cache)
+    else:
+        tensors = [t for layer in past_key_values for t in layer]
+    return sum(t.numel() * t.element_size() for t in tensors if t is not None)
+
+
+def kv_crop(past_key_values, length):
+    """
+    Devuelve una copia de la caché KV recortada a los primeros 'length' tokens.
+    La copia es necesaria porque generate() amplía la caché en el sitio.
+    """
+    if hasattr(past_key_values, 'crop'):
+        cropped = copy.deepcopy(past_key_values)
+        cropped.crop(length)
+        return cropped
+    return tuple(
+        tuple(tensor[:, :, :length, :].clone() for tensor in layer)
+        for layer in past_key_values
+    )
+
+
+def kv_expand(past_key_values, repeats):
+    """
+    Replica cada fila de la caché KV 'repeats' veces (la caché de un prompt pasa a servir a varias
+    secuencias que lo continúan).
+    """
+    if hasattr(past_key_values, 'batch_repeat_interleave'):
+        past_key_values.batch_repeat_interleave(repeats)
+        return past_key_values
+    return tuple(
+        tuple(tensor.repeat_interleave(repeats, dim=0) for tensor in layer)
+        for layer in past_key_values
+    )
+
+
+def kv_select(past_key_values, indices):
+    """Conserva sólo las filas 'indices' (tensor de índices) de la caché KV."""
+    if hasattr(past_key_values, 'batch_select_indices'):
+        past_key_values.batch_select_indices(indices)
+        return past_key_values
+    return tuple(
+        tuple(tensor.index_select(0, indices) for tensor in layer)
+        for layer in past_key_values
+    )
+
+
+class _Entry:
+    __slots__ = ('key', 'token_ids', 'past_key_values', 'nbytes', 'session_id', 'hits', 'created_at')
+
+    def __init__(self, key, token_ids, past_key_values, nbytes, session_id):
+        self.key = key
+        self.token_ids = token_ids
+        self.past_key_values = past_key_values
+        self.nbytes = nbytes
+        self.session_id = session_id
+        self.hits = 0
+        self.created_at = time.time()
+
+
+class PrefixKVStore:
+    """
+    Almacén acotado de cachés KV indexado por el hash del prefijo de tokens.
+    - Expulsión LRU cuando se supera el presupuesto de memoria.
+    - Afinidad por sesión: primero se buscan las entradas de la misma sesión, que admiten reutilización
+      parcial (prefijo común más largo), y cada sesión guarda como mucho max_entries_per_session entradas.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_entries_per_session=4, min_tokens=16):
+        self.max_bytes = max_bytes
+        self.max_entries_per_session = max_entries_per_session
+        self.min_tokens = min_tokens
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # hash del prefijo -> _Entry, en orden LRU
+        self._lengths = {}              # longitud de prefijo -> número de entradas con esa longitud
+        self._sessions = {}             # session_id -> [hash, ...] (de la más antigua a la más reciente)
+        self._bytes = 0
+        self._counters = {'lookups': 0, 'hits': 0, 'reused_tokens': 0, 'prompt_tokens': 0, 'evictions': 0}
+
+    def lookup(self, token_ids, session_id=None):
+        """
+        Busca la caché KV del prefijo más largo de token_ids.
+        Devuelve (copia de la caché recortada, longitud reutilizada) o (None, 0).
+        Siempre deja al menos un token sin cubrir para que el modelo tenga algo que procesar.
+        """
+        token_ids = list(token_ids)
+        limit = len(token_ids) - 1
+        best_entry, best_length = None, 0
+
+        with self._lock:
+            self._counters['lookups'] += 1
+            self._counters['prompt_tokens'] += len(token_ids)
+
+            # 1) Afinidad de sesión: prefijo común más largo con las entradas recientes de la sesión.
+            for key in reversed(self._sessions.get(session_id, [])) if session_id else []:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                length = min(_common_prefix_length(entry.token_ids, token_ids), limit)
+                if length > best_length:
+                    best_entry, best_length = entry, length
+
+            # 2) Búsqueda global por hash de prefijo exacto, de la longitud mayor a la menor.
+            for length in sorted(self._lengths, reverse=True):
+                if length <= best_length or length > len(token_ids):
+                    continue
+                entry = self._entries.get(_hash_tokens(token_ids[:length]))
+                if entry is not None and entry.token_ids == token_ids[:length]:
+                    best_entry, best_length = entry, min(length, limit)
+                    break
+
+            if best_entry is None or best_length < self.min_tokens:
+                return None, 0
+
+            self._entries.move_to_end(best_entry.key)
+            best_entry.hits += 1
+            self._counters['hits'] += 1
+            self._counters['reused_tokens'] += best_length
+            past_key_values = best_entry.past_key_values
+
+        return kv_crop(past_key_values, best_length), best_length
+
+    def store(self, token_ids, past_key_values, session_id=None):
+        """Guarda la caché KV de un prompt (ya recortada a la longitud del prompt)."""
+        token_ids = list(token_ids)
+        if len(token_ids) < self.min_tokens:
+            return
+        nbytes = kv_nbytes(past_key_values)
+        if nbytes > self.max_bytes:
+            return
+        key = _hash_tokens(token_ids)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(key, token_ids, past_key_values, nbytes, session_id)
+            self._lengths[len(token_ids)] = self._lengths.get(len(token_ids), 0) + 1
+            self._bytes += nbytes
+
+            if session_id:
+                keys = self._sessions.setdefault(session_id, [])
+                keys.append(key)
+                while len(keys) > self.max_entries_per_session:
+                    self._remove(keys[0])
+                    self._counters['evictions'] += 1
+
+            while self._bytes > self.max_bytes and self._entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self._counters['evictions'] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.nbytes
+        length = len(entry.token_ids)
+        self._lengths[length] -= 1
+        if not self._lengths[length]:
+            del self._lengths[length]
+        if entry.session_id:
+            keys = self._sessions.get(entry.session_id, [])
+            if key in keys:
+                keys.remove(key)
+            if not keys:
+                self._sessions.pop(entry.session_id, None)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            return dict(
+                counters,
+                hit_ratio=round(counters['hits'] / counters['lookups'], 4) if counters['lookups'] else 0.0,
+                reused_token_ratio=(
+                    round(counters['reused_tokens'] / counters['prompt_tokens'], 4) if counters['prompt_tokens'] else 0.0
+                ),
+                entries=len(self._entries),
+                sessions=len(self._sessions),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+            )
+
+
+# Almacén global del proceso que tiene los modelos. None si está desactivado.
+prefix_store = None
+
+
+def init_prefix_cache(app_config):
+    """Crea el almacén de cachés KV a partir de la configuración de la aplicación."""
+    global prefix_store
+    if not app_config.get('PREFIX_CACHE_ENABLED', True):
+        prefix_store = None
+        return
+    prefix_store = PrefixKVStore(
+        max_bytes=int(app_config.get('PREFIX_CACHE_MAX_BYTES', 256 * 1024 * 1024)),
+        max_entries_per_session=int(app_config.get('PREFIX_CACHE_MAX_PER_SESSION', 4)),
+        min_tokens=int(app_config.get('PREFIX_CACHE_MIN_TOKENS', 16)),
+    )
+
+
+def get_stats():
+    if prefix_store is None:
+        return {'enabled': False}
+    return dict(prefix_store.stats(), enabled=True)
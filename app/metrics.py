@@ -0,0 +1,383 @@
+# ia-codex-api/app/metrics.py
+
+"""
+Métricas en formato de texto de Prometheus (GET /metrics) y tiempos por etapa de cada solicitud.
+
+- Sólo contadores e histogramas: se pueden sumar entre procesos. Con METRICS_DIR, cada proceso
+  (workers de gunicorn, servidor de modelos) vuelca sus valores a METRICS_DIR/metrics-<pid>.json cada
+  METRICS_FLUSH_S segundos, y /metrics suma los archivos de todos.
+- Las etapas (parse, queue, tokenize, prefill, decode, detokenize, serialize) se acumulan en el contexto
+  de la solicitud en curso (contextvars) y se devuelven también en la cabecera Server-Timing.
+  Las etapas medidas en el hilo del planificador de lotes se recogen con collect_stages() y se
+  añaden a cada solicitud del lote con record_stages().
+
+Cada observación es una actualización de un diccionario bajo un candado: se puede dejar activado en producción.
+"""
+
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_LOAD_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+_RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+_RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+_PER_FORWARD_BUCKETS = (1, 1.5, 2, 2.5, 3, 4, 5, 6, 8)
+
+# nombre -> (tipo, ayuda, buckets)
+METRICS = {
+    'iacodex_requests': ('counter', "Solicitudes HTTP atendidas por endpoint y código de estado.", None),
+    'iacodex_request_duration_seconds': ('histogram', "Duración total de las solicitudes HTTP.", _TIME_BUCKETS),
+    'iacodex_stage_duration_seconds': (
+        'histogram',
+        "Duración de cada etapa de una solicitud (parse, queue, tokenize, prefill, decode, detokenize, serialize).",
+        _TIME_BUCKETS,
+    ),
+    'iacodex_model_tokens': ('counter', "Tokens de entrada y de salida procesados por cada modelo.", None),
+    'iacodex_model_generation_seconds': (
+        'counter', "Tiempo de generación acumulado por modelo (tokens/s = tokens de salida / este valor).", None
+    ),
+    'iacodex_model_tokens_per_second': ('histogram', "Tokens de salida por segundo de cada pasada del modelo.", _RATE_BUCKETS),
+    'iacodex_model_batch_size': ('histogram', "Prompts por pasada del modelo.", _SIZE_BUCKETS),
+    'iacodex_model_load_duration_seconds': ('histogram', "Tiempo de carga de cada modelo.", _LOAD_BUCKETS),
+    'iacodex_model_load_failures': ('counter', "Cargas de modelo fallidas.", None),
+    'iacodex_engine_fallbacks': (
+        'counter', "Modelos cargados en eager porque su motor (compile u onnx) no estaba disponible.", None
+    ),
+    'iacodex_model_unloads': (
+        'counter', "Modelos descargados por inactividad o por el presupuesto de memoria (MODEL_MEMORY_BUDGET_MB).", None
+    ),
+    'iacodex_priority_queue_depth': (
+        'histogram', "Pasadas del modelo en espera en cada carril de prioridad al llegar una nueva.", _SIZE_BUCKETS
+    ),
+    'iacodex_priority_wait_seconds': (
+        'histogram', "Espera de cada pasada del modelo hasta obtener turno, por carril de prioridad.", _TIME_BUCKETS
+    ),
+    'iacodex_priority_preemptions': (
+        'counter', "Generaciones masivas que cedieron el turno al carril interactivo entre pasos de decodificación.", None
+    ),
+    'iacodex_jobs': ('counter', "Trabajos asíncronos encolados y terminados (correctos o fallidos).", None),
+    'iacodex_job_queue_seconds': ('histogram', "Espera de cada trabajo asíncrono en la cola.", _TIME_BUCKETS),
+    'iacodex_early_stops': (
+        'counter', "Generaciones recortadas porque la salida útil ya estaba completa (secuencia de parada o fin de bloque).",
+        None
+    ),
+    'iacodex_suggestions': (
+        'counter',
+        "Sugerencias de /complete por resultado: devueltas, convergidas con otra, repetidas o cortadas por el presupuesto.",
+        None
+    ),
+    'iacodex_suggestion_decode_tokens': (
+        'counter', "Tokens decodificados en las completaciones con varias sugerencias y prefill compartido.", None
+    ),
+    'iacodex_fix_requests': (
+        'counter', "Entradas de /fix por vía: sin modelo ('valid', 'reindent') o con el modelo ('model').", None
+    ),
+    'iacodex_router_requests': (
+        'counter', "Solicitudes reenviadas por el router a cada backend, por motivo (ring, spill, retry, jobs).", None
+    ),
+    'iacodex_router_node_events': (
+        'counter', "Cambios de los backends del router (join, drain, down, up).", None
+    ),
+    'iacodex_coalesced_requests': (
+        'counter', "Solicitudes deterministas que reutilizaron la inferencia de otra idéntica en curso.", None
+    ),
+    'iacodex_assisted_draft_tokens': (
+        'counter', "Tokens propuestos por el modelo borrador y aceptados por el principal (generación asistida).", None
+    ),
+    'iacodex_assisted_acceptance_ratio': (
+        'histogram', "Fracción de tokens del borrador aceptados en cada generación asistida.", _RATIO_BUCKETS
+    ),
+    'iacodex_assisted_tokens_per_forward': (
+        'histogram', "Tokens generados por cada pasada del modelo principal en la generación asistida.", _PER_FORWARD_BUCKETS
+    ),
+}
+
+_config = {'enabled': True, 'dir': '', 'flush_s': 5.0}
+
+_lock = threading.Lock()
+_counters = {}    # (nombre, etiquetas) -> valor
+_histograms = {}  # (nombre, etiquetas) -> [conteos por bucket (+Inf al final), suma, total]
+_state_pid = os.getpid()
+_flusher_pid = None
+
+# Solicitud en curso (por hilo en Flask, por tarea en ASGI) y colector de etapas del hilo de lotes.
+_current_request = contextvars.ContextVar('iacodex_request_timer', default=None)
+_local = threading.local()
+
+
+class _RequestTimer:
+    __slots__ = ('endpoint', 'started', 'stages')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _check_pid():
+    """Tras un fork, el hijo empieza desde cero para no contar dos veces los valores del padre."""
+    global _state_pid
+    pid = os.getpid()
+    if pid != _state_pid:
+        _counters.clear()
+        _histograms.clear()
+        _state_pid = pid
+
+
+def inc(name, value=1.0, **labels):
+    if not _config['enabled']:
+        return
+    key = (name, _labels_key(labels))
+    with _lock:
+        _check_pid()
+        _counters[key] = _counters.get(key, 0.0) + value
+    _ensure_flusher()
+
+
+def observe(name, value, **labels):
+    if not _config['enabled']:
+        return
+    buckets = METRICS[name][2]
+    key = (name, _labels_key(labels))
+    with _lock:
+        _check_pid()
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+    _ensure_flusher()
+
+
+# --- Etapas por solicitud ---
+
+def start_request(endpoint):
+    """Empieza a medir una solicitud. Devuelve el token para finish_request()."""
+    return _current_request.set(_RequestTimer(endpoint))
+
+
+def finish_request(token, status_code):
+    """Registra la duración total y el estado de la solicitud en curso y deja de medirla."""
+    timer = _current_request.get()
+    _current_request.reset(token)
+    if timer is None:
+        return
+    inc('iacodex_requests', endpoint=timer.endpoint, status=status_code)
+    observe('iacodex_request_duration_seconds', time.perf_counter() - timer.started, endpoint=timer.endpoint)
+
+
+def record_stages(stages):
+    """Añade a la solicitud en curso etapas medidas en otro hilo (p. ej. el del planificador de lotes)."""
+    timer = _current_request.get()
+    endpoint = timer.endpoint if timer is not None else 'none'
+    for name, seconds in stages.items():
+        if timer is not None:
+            timer.stages[name] = timer.stages.get(name, 0.0) + seconds
+        observe('iacodex_stage_duration_seconds', seconds, endpoint=endpoint, stage=name)
+
+
+def add_stage(name, seconds):
+    """Suma la duración de una etapa al colector del hilo (si hay uno activo) o a la solicitud en curso."""
+    collector = getattr(_local, 'collector', None)
+    if collector is not None:
+        collector[name] = collector.get(name, 0.0) + seconds
+    else:
+        record_stages({name: seconds})
+
+
+@contextmanager
+def stage(name):
+    """Mide un bloque como una etapa: with metrics.stage('serialize'): ..."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - started)
+
+
+@contextmanager
+def collect_stages():
+    """Recoge en un diccionario las etapas medidas en este hilo (una pasada por lotes del pipeline)."""
+    previous = getattr(_local, 'collector', None)
+    _local.collector = {}
+    try:
+        yield _local.collector
+    finally:
+        _local.collector = previous
+
+
+@contextmanager
+def generation_stages():
+    """
+    Mide una llamada a generate(): 'prefill' hasta que termina el primer forward del modelo
+    (el primer token) y 'decode' el resto. El primer forward lo señala mark_forward().
+    """
+    _local.first_forward_at = None
+    _local.generating = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _local.generating = False
+        ended = time.perf_counter()
+        first = _local.first_forward_at or ended
+        add_stage('prefill', first - started)
+        add_stage('decode', ended - first)
+
+
+def mark_forward():
+    """Lo llama el forward instrumentado del modelo en cada paso de generación."""
+    if getattr(_local, 'generating', False) and _local.first_forward_at is None:
+        _local.first_forward_at = time.perf_counter()
+
+
+def server_timing_header():
+    """Cabecera Server-Timing con las etapas de la solicitud en curso (milisegundos)."""
+    timer = _current_request.get()
+    if timer is None or not timer.stages:
+        return ''
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timer.stages.items())
+
+
+# --- Volcado y agregación entre procesos ---
+
+def _snapshot():
+    with _lock:
+        _check_pid()
+        return {
+            'counters': [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            'histograms': [
+                [name, list(labels), list(entry[0]), entry[1], entry[2]] for (name, labels), entry in _histograms.items()
+            ],
+        }
+
+
+def flush():
+    """Escribe los valores de este proceso en METRICS_DIR (de forma atómica)."""
+    if not _config['dir']:
+        return
+    path = os.path.join(_config['dir'], f"metrics-{os.getpid()}.json")
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(_snapshot(), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"No se pudieron volcar las métricas en {path}: {e}", file=sys.stderr)
+
+
+def _ensure_flusher():
+    global _flusher_pid
+    if not _config['dir'] or _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+
+    def _loop():
+        while True:
+            time.sleep(_config['flush_s'])
+            flush()
+
+    threading.Thread(target=_loop, name='metrics-flush', daemon=True).start()
+
+
+def _merge(snapshots):
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot.get('counters', []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0.0) + value
+        for name, labels, counts, total, count in snapshot.get('histograms', []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            entry = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+            entry[2] += count
+    return counters, histograms
+
+
+def _collect_snapshots():
+    if not _config['dir']:
+        return [_snapshot()]
+    flush()
+    snapshots = []
+    for filename in os.listdir(_config['dir']):
+        if not (filename.startswith('metrics-') and filename.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(_config['dir'], filename)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue # Archivo a medio escribir o de un proceso que ya no existe
+    return snapshots
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def render():
+    """Texto de /metrics en el formato de exposición de Prometheus (0.0.4)."""
+    counters, histograms = _merge(_collect_snapshots())
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = counters if kind == 'counter' else histograms
+        keys = sorted(key for key in series if key[0] == name)
+        if not keys:
+            continue
+        exposed = f"{name}_total" if kind == 'counter' else name
+        lines.append(f"# HELP {exposed} {help_text}")
+        lines.append(f"# TYPE {exposed} {kind}")
+        for key in keys:
+            labels = key[1]
+            if kind == 'counter':
+                lines.append(f"{exposed}{_format_labels(labels)} {_format_value(series[key])}")
+                continue
+            counts, total, count = series[key]
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += bucket_count
+                le = bound if bound == '+Inf' else _format_value(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app_config):
+    """Configura las métricas a partir de la configuración de la aplicación."""
+    _config['enabled'] = app_config.get('METRICS_ENABLED', True)
+    _config['dir'] = app_config.get('METRICS_DIR', '') or ''
+    _config['flush_s'] = float(app_config.get('METRICS_FLUSH_S', 5))
+    if _config['dir']:
+        os.makedirs(_config['dir'], exist_ok=True)
+
+
+def enabled():
+    return _config['enabled']
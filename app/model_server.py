@@ -0,0 +1,342 @@
+# ia-codex-api/app/model_server.py
+
+"""
+Servidor de modelos compartido.
+
+Un único proceso carga los pipelines y atiende a todos los workers HTTP (gunicorn/Flask)
+a través de un socket Unix local (o TCP en localhost). Así la memoria no crece al añadir
+workers y éstos arrancan sin importar torch ni transformers.
+
+multiprocessing.connection deserializa (pickle) cada mensaje, así que quien se conecte con la clave puede
+ejecutar código en este proceso. Por TCP se exige una clave propia (no la de por defecto) y, salvo con
+MODEL_SERVER_ALLOW_REMOTE=True, una dirección de loopback.
+
+Uso:
+    python -m app.model_server
+"""
+
+import ipaddress
+import os
+import socket
+import sys
+import threading
+from multiprocessing.connection import Listener, Client
+
+from . import scheduling
+
+DEFAULT_AUTHKEY = 'iacodex' # Sólo vale para el socket Unix, que ya está protegido por sus permisos (0600)
+
+
+def parse_address(address):
+    """
+    Convierte MODEL_SERVER_ADDRESS en una dirección para multiprocessing.connection.
+    'host:puerto' se interpreta como TCP; cualquier otro valor, como la ruta de un socket Unix.
+    """
+    if ':' in address and not address.startswith('/'):
+        host, port = address.rsplit(':', 1)
+        return (host or '127.0.0.1', int(port)), 'AF_INET'
+    return address, 'AF_UNIX'
+
+
+def _is_loopback(host):
+    """Indica si todas las direcciones de 'host' son de loopback."""
+    try:
+        infos = socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        return False
+    return all(ipaddress.ip_address(info[4][0].split('%')[0]).is_loopback for info in infos)
+
+
+def check_listen_address(address, family, authkey, allow_remote=False):
+    """
+    Comprueba que el servidor pueda escuchar en 'address' sin exponer la deserialización de los mensajes:
+    por TCP hace falta una clave distinta de la de por defecto y, salvo con allow_remote, una dirección
+    de loopback. Lanza ValueError con el motivo si no.
+    """
+    if not authkey:
+        raise ValueError("MODEL_SERVER_AUTHKEY está vacía.")
+    if family != 'AF_INET':
+        return
+    if authkey == DEFAULT_AUTHKEY:
+        raise ValueError("Por TCP, MODEL_SERVER_AUTHKEY debe ser una clave propia, no la de por defecto.")
+    if not allow_remote and not _is_loopback(address[0]):
+        raise ValueError(
+            f"El servidor de modelos sólo escucha por TCP en loopback ({address[0]} no lo es); "
+            "usa MODEL_SERVER_ALLOW_REMOTE=True para permitirlo."
+        )
+
+
+class RemoteError(RuntimeError):
+    """Error producido en el servidor de modelos durante una inferencia."""
+
+
+class ModelServerClient:
+    """
+    Cliente del servidor de modelos.
+    Mantiene una conexión por hilo para que las solicitudes concurrentes no se mezclen.
+    """
+
+    def __init__(self, address, authkey):
+        self.address, self.family = parse_address(address)
+        self.authkey = authkey.encode() if isinstance(authkey, str) else authkey
+        self._local = threading.local()
+
+    @property
+    def address_label(self):
+        if self.family == 'AF_INET':
+            return f"{self.address[0]}:{self.address[1]}"
+        return self.address
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = Client(self.address, family=self.family, authkey=self.authkey)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def request(self, op, *args):
+        """
+        Envía una operación al servidor y devuelve su resultado.
+        Si la conexión se había cerrado (p. ej. el servidor se reinició), se reintenta una vez.
+        """
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send((op, args))
+                status, payload = conn.recv()
+                break
+            except (EOFError, OSError) as e:
+                self._drop_connection()
+                if attempt == 1:
+                    raise ConnectionError(f"No se pudo contactar con el servidor de modelos en {self.address_label}: {e}")
+        if status == 'error':
+            raise RemoteError(payload)
+        return payload
+
+    def request_stream(self, op, *args):
+        """
+        Envía una operación de streaming y devuelve sus fragmentos a medida que llegan.
+        Si el consumidor abandona el stream, la conexión se cierra para que el servidor deje de generar.
+        """
+        conn = self._connection()
+        finished = False
+        try:
+            conn.send((op, args))
+            while True:
+                status, payload = conn.recv()
+                if status == 'chunk':
+                    yield payload
+                elif status == 'error':
+                    finished = True
+                    raise RemoteError(payload)
+                else:
+                    finished = True
+                    return
+        except (EOFError, OSError) as e:
+            raise ConnectionError(f"Conexión perdida con el servidor de modelos en {self.address_label}: {e}")
+        finally:
+            if not finished:
+                self._drop_connection()
+
+
+class RemotePipeline:
+    """
+    Proxy de un pipeline que vive en el servidor de modelos.
+    Se usa igual que un pipeline de transformers: pipeline(prompts, **params).
+    """
+
+    is_remote = True
+    tokenizer = None
+
+    def __init__(self, kind, client):
+        self.kind = kind
+        self.client = client
+
+    def __call__(self, inputs, **params):
+        return self.client.request('call', self.kind, inputs, params, tuple(scheduling.current()))
+
+    @property
+    def model_revision(self):
+        """Revisión del modelo cargado en el servidor (se consulta una sola vez)."""
+        if getattr(self, '_model_revision', None) is None:
+            self._model_revision = self.client.request('revision', self.kind)
+        return self._model_revision
+
+    def submit(self, prompt, **params):
+        """Envía un único prompt al planificador de micro-lotes del servidor (agrupa entre workers)."""
+        return self.client.request('submit', self.kind, prompt, params, tuple(scheduling.current()))
+
+    def prefix_generate(self, prompt, **params):
+        """Autocompleta reutilizando la caché KV por prefijo que mantiene el servidor."""
+        return self.client.request('prefix_generate', self.kind, prompt, params, tuple(scheduling.current()))
+
+    def assisted_generate(self, prompt, **params):
+        """Autocompleta con la generación asistida (modelo borrador) del servidor."""
+        return self.client.request('assisted_generate', self.kind, prompt, params, tuple(scheduling.current()))
+
+    def suggestions_generate(self, prompt, num_suggestions, **params):
+        """Autocompleta con varias sugerencias y el prefill compartido en el servidor."""
+        params = dict(params, num_suggestions=num_suggestions)
+        return self.client.request('suggestions_generate', self.kind, prompt, params, tuple(scheduling.current()))
+
+    def stream(self, prompt, **params):
+        """Genera en el servidor devolviendo los fragmentos de texto a medida que se decodifican."""
+        return self.client.request_stream('stream', self.kind, prompt, params, tuple(scheduling.current()))
+
+
+def _pipeline(name):
+    from .models import get_pipeline
+
+    pipeline = get_pipeline(name)
+    if pipeline is None:
+        raise RuntimeError(f"Pipeline '{name}' no disponible en el servidor de modelos.")
+    return pipeline
+
+
+def _handle_request(op, args):
+    from . import batching
+    from . import models
+
+    if op == 'ping':
+        return {kind: models.get_pipeline(kind) is not None for kind in ('generator', 'text2text')}
+    if op == 'revision':
+        (kind,) = args
+        return models.get_model_revision(models.get_pipeline(kind))
+    if op == 'models':
+        return models.list_models()
+    if op == 'stats':
+        from . import kv_cache
+        from . import suggestions
+        return {
+            'batching': batching.get_stats(),
+            'prefix_cache': kv_cache.get_stats(),
+            'models': models.get_model_status(),
+            'cpu_profile': models.get_cpu_profile(),
+            'priority': scheduling.get_stats(),
+            'suggestions': suggestions.get_stats(),
+        }
+
+    # El resto de operaciones usan un modelo: no se descarga mientras atiende la solicitud del worker.
+    # Llevan la prioridad (carril y cliente) de la solicitud original del worker.
+    kind, prompt, params, priority = args
+    with models.model_in_use(kind, hits=len(prompt) if isinstance(prompt, list) else 1), \
+            scheduling.use_priority(priority):
+        if op == 'submit':
+            return batching.submit(kind, prompt, **params)
+        if op == 'prefix_generate':
+            return models.generate_with_prefix_cache(_pipeline(kind), prompt, **params)
+        if op == 'assisted_generate':
+            return models.generate_assisted(_pipeline(kind), prompt, **params)
+        if op == 'suggestions_generate':
+            return models.generate_suggestions(_pipeline(kind), prompt, **params)
+        if op == 'call':
+            return batching.run_batch(_pipeline(kind), prompt, **params)
+    raise ValueError(f"Operación desconocida: {op}")
+
+
+def _handle_stream(conn, args):
+    """Envía los fragmentos de una generación en streaming, seguidos de un mensaje final."""
+    from .models import model_in_use, stream_generation
+
+    kind, prompt, params, priority = args
+    with model_in_use(kind), scheduling.use_priority(priority):
+        chunks = stream_generation(_pipeline(kind), prompt, **params)
+        try:
+            for text in chunks:
+                conn.send(('chunk', text))
+        finally:
+            chunks.close() # Si el worker se desconectó, detiene la generación
+    conn.send(('ok', None))
+
+
+def _serve_connection(conn):
+    """Atiende las solicitudes de un worker hasta que cierra la conexión."""
+    try:
+        while True:
+            try:
+                op, args = conn.recv()
+            except EOFError:
+                break
+            try:
+                if op == 'stream':
+                    _handle_stream(conn, args)
+                else:
+                    conn.send(('ok', _handle_request(op, args)))
+            except (EOFError, OSError):
+                break # El worker cerró la conexión
+            except Exception as e:
+                print(f"Error en el servidor de modelos ({op}): {e}", file=sys.stderr)
+                conn.send(('error', str(e)))
+    finally:
+        conn.close()
+
+
+def serve(app_config):
+    """
+    Carga los modelos una sola vez y atiende conexiones de los workers indefinidamente.
+    """
+    from .models import load_models
+    from .batching import init_batching
+    from .kv_cache import init_prefix_cache
+    from .metrics import init_metrics
+    from .scheduling import init_scheduling
+    from .suggestions import init_suggestions
+
+    config = dict(app_config)
+    address, family = parse_address(config['MODEL_SERVER_ADDRESS'])
+    authkey = config['MODEL_SERVER_AUTHKEY']
+    try:
+        check_listen_address(address, family, authkey, config.get('MODEL_SERVER_ALLOW_REMOTE', False))
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    config['INFERENCE_BACKEND'] = 'local' # Este proceso es el que tiene los modelos
+    config['INFERENCE_WORKERS'] = 1 # ... y el único que hace inferencia: puede usar todos los núcleos
+    init_metrics(config) # Con METRICS_DIR, sus métricas se suman a las de los workers en /metrics
+    load_models(config)
+    init_batching(config)
+    init_scheduling(config) # Los turnos de las pasadas se dan aquí, con las solicitudes de todos los workers
+    init_prefix_cache(config)
+    init_suggestions(config) # Convergencia y presupuesto de las sugerencias, que se generan aquí
+
+    if family == 'AF_UNIX' and os.path.exists(address):
+        os.unlink(address) # Socket huérfano de una ejecución anterior
+
+    listener = Listener(address, family=family, authkey=authkey.encode())
+    if family == 'AF_UNIX':
+        os.chmod(address, 0o600)
+    print(f"Servidor de modelos escuchando en {config['MODEL_SERVER_ADDRESS']}")
+
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # Autenticación fallida o conexión abortada: se ignora y se sigue aceptando.
+                print(f"Conexión rechazada en el servidor de modelos: {e}", file=sys.stderr)
+                continue
+            threading.Thread(target=_serve_connection, args=(conn,), daemon=True).start()
+    except KeyboardInterrupt:
+        print("\nServidor de modelos detenido por el usuario.")
+    finally:
+        listener.close()
+
+
+def main():
+    from . import load_config
+    serve(load_config())
+
+
+if __name__ == "__main__":
+    main()
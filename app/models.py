@@ -2,65 +2,735 @@
 
 import sys
 import os
-from transformers import pipeline
-import torch
+import time
+import threading
+from contextlib import contextmanager
 
-# Variables globales para almacenar los pipelines
+from . import engines
+from . import metrics
+from . import scheduling
+from . import stopping
+
+# Nota: 'transformers' y 'torch' se importan sólo al cargar un modelo, de modo que `import app`,
+# los health checks y los workers HTTP en modo INFERENCE_BACKEND=remote arrancan sin estas librerías.
+
+# Variables globales para almacenar los pipelines (None mientras no estén cargados)
 generator_pipeline = None
 text2text_pipeline = None
-device = -1 # Valor por defecto, se actualiza en load_models
+device = -1 # Valor por defecto, se actualiza al cargar un modelo
+
+# Especificación de cada pipeline: tarea de transformers, variable de configuración con el nombre
+# del modelo, modelo por defecto, descripción y lado del padding para el micro-batching.
+_MODEL_SPECS = {
+    'generator': ('text-generation', 'HF_MODEL_AUTOCOMPLETE', 'distilgpt2', 'autocompletado', 'left'),
+    'text2text': ('text2text-generation', 'HF_MODEL_TEXT2TEXT', 't5-small', 'corrección/conversión', None),
+}
+_PIPELINE_GLOBALS = {'generator': 'generator_pipeline', 'text2text': 'text2text_pipeline'}
+
+# Registro de modelos con carga bajo demanda: estado de cada pipeline registrado en load_models(), por nombre.
+# Los modelos por defecto se llaman como su tipo ('generator' y 'text2text'); los adicionales (MODELS)
+# tienen su propio nombre y las solicitudes los eligen con el campo 'model'.
+_registry = {}
+_registry_config = {
+    'idle_ttl_s': 0.0, 'retry_s': 30.0, 'stub': False, 'stub_token_delay_s': 0.005, 'memory_budget_bytes': 0,
+    'snapshot_dir': '',
+}
+_model_kinds = {}       # nombre -> tipo de cada modelo configurado (también en los workers sin registro)
+_extra_pipelines = {}   # nombre -> pipeline (o proxy remoto) de los modelos adicionales
+_remote_client = None   # Cliente del servidor de modelos con INFERENCE_BACKEND=remote
+_residency_lock = threading.Lock() # Protege las referencias, los aciertos y las decisiones de expulsión
+_UNLOAD_REASONS = {'idle': 'por inactividad', 'memory': 'por el presupuesto de memoria', 'manual': 'a petición'}
+
+# Perfil de rendimiento en CPU (ver _apply_cpu_profile). 'threads' se fija una vez por proceso.
+_cpu_profile = {
+    'quantize': 'none',      # 'none', 'int8' (cuantización dinámica de capas lineales) o 'bf16'
+    'threads': 0,            # hilos intra-op (0 = núcleos / procesos de inferencia)
+    'interop_threads': 0,    # hilos inter-op (0 = 1)
+    'inference_workers': 1,  # procesos que hacen inferencia en la máquina (p. ej. workers de gunicorn)
+    'applied_threads': None,
+}
+# Generación asistida (decodificación especulativa) para /complete: un modelo borrador pequeño
+# propone 'num_tokens' tokens y el modelo principal los verifica en una sola pasada.
+_assisted_config = {'draft_model': '', 'num_tokens': 5}
+_assisted_stats = {'generations': 0, 'proposed': 0, 'accepted': 0, 'new_tokens': 0, 'main_forwards': 0}
+_assisted_lock = threading.Lock()
+_forward_counts = threading.local() # Pasadas del modelo principal y del borrador en la generación en curso
+_reaper = None
+_reaper_pid = None
+
+def _prepare_tokenizer_for_batching(pipe, padding_side=None):
+    """
+    Ajusta el tokenizer para poder ejecutar varios prompts en una sola pasada con padding.
+    Los modelos solo-decodificador (GPT-2) no tienen token de padding y necesitan padding a la izquierda.
+    """
+    tokenizer = pipe.tokenizer
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+        pipe.model.config.pad_token_id = tokenizer.eos_token_id
+        if getattr(pipe.model, 'generation_config', None) is not None:
+            pipe.model.generation_config.pad_token_id = tokenizer.eos_token_id
+    if padding_side is not None:
+        tokenizer.padding_side = padding_side
 
 def load_models(app_config):
     """
-    Carga los pipelines de modelos de Hugging Face.
+    Registra los pipelines de modelos de Hugging Face.
     Esta función es llamada una vez al inicio de la aplicación Flask.
+    Los modelos se cargan con la primera solicitud que los necesita, salvo que MODEL_WARMUP
+    esté activado, en cuyo caso se cargan aquí mismo (fase de precalentamiento explícita).
     """
-    global generator_pipeline, text2text_pipeline, device
+    global generator_pipeline, text2text_pipeline, _remote_client
+
+    extra_models = parse_model_specs(app_config.get('MODELS'))
+    _model_kinds.clear()
+    _model_kinds.update({kind: kind for kind in _MODEL_SPECS})
+    _model_kinds.update({name: kind for name, (kind, _) in extra_models.items()})
+    _extra_pipelines.clear()
+    _remote_client = None
+
+    _assisted_config['draft_model'] = app_config.get('HF_MODEL_DRAFT') or ''
+    _assisted_config['num_tokens'] = int(app_config.get('ASSISTED_NUM_TOKENS', 5))
 
-    device = 0 if torch.cuda.is_available() else -1
-    print(f"Device set to use {'cuda' if device == 0 else 'cpu'}")
+    if app_config.get('INFERENCE_BACKEND', 'local') == 'remote':
+        # Los modelos viven en el proceso servidor de modelos (app/model_server.py);
+        # aquí sólo se crean proxies que reenvían las llamadas por el socket local.
+        from .model_server import ModelServerClient, RemotePipeline
+        client = ModelServerClient(
+            app_config.get('MODEL_SERVER_ADDRESS', '/tmp/iacodex-model-server.sock'),
+            app_config.get('MODEL_SERVER_AUTHKEY', 'iacodex'),
+        )
+        generator_pipeline = RemotePipeline('generator', client)
+        text2text_pipeline = RemotePipeline('text2text', client)
+        _remote_client = client # Proxies de los modelos adicionales, creados con su primera solicitud
+        print(f"Usando el servidor de modelos en {client.address_label}.")
+        return
 
-    # Carga de modelos preentrenados (se descargan si no existen localmente)
     # Los nombres de los modelos se obtienen de la configuración de la aplicación (que viene del .env).
+    _registry.clear()
+    generator_pipeline = None
+    text2text_pipeline = None
+    for kind, (_, config_key, default_model, _, _) in _MODEL_SPECS.items():
+        _registry[kind] = _new_entry(kind, app_config.get(config_key) or default_model)
+    for name, (kind, model_name) in extra_models.items():
+        _registry[name] = _new_entry(kind, model_name)
+    _cpu_profile['quantize'] = (app_config.get('CPU_QUANTIZE') or 'none').lower()
+    _cpu_profile['threads'] = int(app_config.get('CPU_THREADS', 0) or 0)
+    _cpu_profile['interop_threads'] = int(app_config.get('CPU_INTEROP_THREADS', 0) or 0)
+    _cpu_profile['inference_workers'] = max(1, int(app_config.get('INFERENCE_WORKERS', 1) or 1))
+    _registry_config['idle_ttl_s'] = float(app_config.get('MODEL_IDLE_TTL_S', 0) or 0)
+    _registry_config['retry_s'] = float(app_config.get('MODEL_LOAD_RETRY_S', 30))
+    _registry_config['stub'] = bool(app_config.get('MODEL_STUB', False))
+    _registry_config['stub_token_delay_s'] = float(app_config.get('MODEL_STUB_TOKEN_DELAY_MS', 5)) / 1000
+    _registry_config['snapshot_dir'] = app_config.get('MODEL_SNAPSHOT_DIR') or ''
+    engines.init_engines(app_config)
+    _registry_config['memory_budget_bytes'] = int(float(app_config.get('MODEL_MEMORY_BUDGET_MB', 0) or 0) * 1024 * 1024)
+
+    if app_config.get('MODEL_WARMUP', False):
+        warmup()
+    else:
+        names = ', '.join(entry['model_name'] for entry in _registry.values())
+        print(f"Modelos registrados para carga bajo demanda: {names}")
+
+def parse_model_specs(value):
+    """
+    Lee la variable MODELS: entradas 'nombre=tipo:modelo' separadas por comas, p. ej.
+    'rapido=generator:distilgpt2,grande=text2text:t5-base'. Devuelve {nombre: (tipo, modelo)}.
+    """
+    specs = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, has_name, rest = item.partition('=')
+        kind, has_kind, model_name = rest.partition(':')
+        name, kind, model_name = name.strip(), kind.strip(), model_name.strip()
+        if not has_name or not has_kind or not name or not model_name:
+            raise ValueError(f"Entrada de MODELS inválida: '{item}' (formato: nombre=tipo:modelo).")
+        if kind not in _MODEL_SPECS:
+            raise ValueError(f"Tipo de modelo inválido en MODELS: '{kind}' (debe ser {' o '.join(_MODEL_SPECS)}).")
+        if name in _MODEL_SPECS:
+            raise ValueError(f"El nombre '{name}' está reservado para el modelo por defecto de ese tipo.")
+        specs[name] = (kind, model_name)
+    return specs
 
-    # Modelo para autocompletado de código
-    autocomplete_model_name = app_config.get('HF_MODEL_AUTOCOMPLETE', 'distilgpt2')
-    print(f"Cargando modelo de autocompletado: {autocomplete_model_name}...")
+def _new_entry(kind, model_name):
+    task, _, _, label, padding_side = _MODEL_SPECS[kind]
+    return {
+        'kind': kind,
+        'task': task,
+        'model_name': model_name,
+        'label': label,
+        'padding_side': padding_side,
+        'lock': threading.Lock(),
+        'last_used': None,
+        'load_seconds': None,
+        'loads': 0,
+        'unloads': 0,
+        'error': None,
+        'failed_at': None,
+        'footprint_bytes': None, # Memoria de los pesos medida en la última carga
+        'refs': 0,               # Solicitudes en curso que usan el modelo (no se puede descargar)
+        'hits': 0,               # Solicitudes atendidas
+        'source': None,          # 'hub', 'snapshot:<variante>' (MODEL_SNAPSHOT_DIR) u 'onnx' (MODEL_ONNX_DIR)
+        'engine': None,          # Motor usado en la última carga: 'eager', 'compile' u 'onnx'
+        'engine_error': None,    # Por qué no se pudo usar el motor configurado
+    }
+
+def _load_pipeline(kind):
+    """
+    Carga un pipeline de Hugging Face (se descarga si no existe localmente).
+    Con MODEL_STUB=True carga en su lugar el pipeline falso de app/stub.py (benchmarks sin modelos).
+    Devuelve el pipeline o None si la carga falla.
+    """
+    global device
+    entry = _registry[kind]
+    if _registry_config['stub']:
+        from .stub import StubPipeline
+        entry['loads'] += 1
+        print(f"Modelo falso (MODEL_STUB) para {entry['label']}: {entry['model_name']}")
+        return StubPipeline(entry['task'], entry['model_name'], token_delay_s=_registry_config['stub_token_delay_s'])
+    print(f"Cargando modelo de {entry['label']}: {entry['model_name']}...")
+    started = time.monotonic()
     try:
-        generator_pipeline = pipeline(
-            "text-generation",
-            model=autocomplete_model_name,
-            device=device,
-            torch_dtype=torch.float16 if device == 0 else None # Usar float16 en GPU para menor consumo de memoria
-        )
-        print(f"Modelo '{autocomplete_model_name}' cargado para autocompletado.")
+        from transformers import pipeline
+        import torch
+
+        device = 0 if torch.cuda.is_available() else -1
+        print(f"Device set to use {'cuda' if device == 0 else 'cpu'}")
+
+        def load_eager():
+            pipe = _load_snapshot(kind, entry, device)
+            if pipe is None:
+                pipe = pipeline(
+                    entry['task'],
+                    model=entry['model_name'],
+                    device=device,
+                    torch_dtype=torch.float16 if device == 0 else None # Usar float16 en GPU para menor consumo de memoria
+                )
+                entry['source'] = 'hub'
+            _prepare_tokenizer_for_batching(pipe, padding_side=entry['padding_side'])
+            if device == -1:
+                _apply_cpu_profile(pipe, entry)
+            return pipe
+
+        # Motor del modelo (eager, torch.compile u ONNX Runtime; ver app/engines.py), con respaldo en eager.
+        pipe = engines.build_pipeline(kind, entry, device, load_eager, threads=_intra_op_threads() if device == -1 else 0)
+        if pipe.iacodex_engine == 'onnx':
+            _prepare_tokenizer_for_batching(pipe, padding_side=entry['padding_side'])
+            pipe.iacodex_variant = entry['variant'] = 'onnx'
+        _instrument_pipeline(pipe)
+        if kind == 'generator' and _assisted_config['draft_model']:
+            if pipe.iacodex_engine == 'onnx':
+                entry['draft_error'] = "la generación asistida no está disponible con el motor onnx"
+                print(f"Generación asistida desactivada: {entry['draft_error']}.", file=sys.stderr)
+            else:
+                _attach_draft_model(pipe, entry)
     except Exception as e:
-        print(f"Error al cargar el modelo de autocompletado {autocomplete_model_name}: {e}", file=sys.stderr)
-        generator_pipeline = None # Asegurarse de que el pipeline sea None si falla la carga
+        print(f"Error al cargar el modelo de {entry['label']} {entry['model_name']}: {e}", file=sys.stderr)
+        entry['error'] = str(e)
+        entry['failed_at'] = time.monotonic()
+        metrics.inc('iacodex_model_load_failures', model=entry['model_name'])
+        return None
+
+    entry['load_seconds'] = time.monotonic() - started
+    metrics.observe('iacodex_model_load_duration_seconds', entry['load_seconds'], model=entry['model_name'])
+    entry['loads'] += 1
+    entry['error'] = None
+    entry['failed_at'] = None
+    print(f"Modelo '{entry['model_name']}' cargado para {entry['label']} en {entry['load_seconds']:.1f}s.")
+    return pipe
+
+def _load_snapshot(name, entry, device):
+    """
+    Carga el modelo desde su instantánea en MODEL_SNAPSHOT_DIR (ver app/snapshots.py), con la variante
+    bf16 si el perfil de CPU la usa. Devuelve None si no hay instantánea o falla (se carga del hub).
+    """
+    from . import snapshots
 
-    # Modelo para corrección y conversión de código (text-to-text)
-    text2text_model_name = app_config.get('HF_MODEL_TEXT2TEXT', 't5-small')
-    print(f"Cargando modelo de texto a texto: {text2text_model_name}...")
+    bf16 = device == -1 and _cpu_profile['quantize'] == 'bf16' and _cpu_supports_bf16()
+    snapshot = snapshots.find_snapshot(
+        _registry_config['snapshot_dir'], name, entry['model_name'], 'bf16' if bf16 else 'fp32'
+    )
+    if snapshot is None:
+        return None
     try:
-        text2text_pipeline = pipeline(
-            "text2text-generation",
-            model=text2text_model_name,
-            device=device,
-            torch_dtype=torch.float16 if device == 0 else None
-        )
-        print(f"Modelo '{text2text_model_name}' cargado para corrección/conversión.")
+        pipe = snapshots.load_pipeline(snapshot, entry['task'], device)
+    except Exception as e:
+        print(f"No se pudo cargar la instantánea de '{name}' ({snapshot[0]}): {e}; se carga del hub.", file=sys.stderr)
+        return None
+    entry['source'] = f"snapshot:{snapshot[2]}"
+    return pipe
+
+def _configure_cpu_threads(torch):
+    """
+    Fija los hilos intra-op e inter-op de torch una sola vez por proceso. Con varios procesos de
+    inferencia por máquina (workers de gunicorn), cada uno usa núcleos / procesos para no sobresuscribir la CPU.
+    """
+    if _cpu_profile['applied_threads'] is not None:
+        return
+    threads = _intra_op_threads()
+    interop_threads = _cpu_profile['interop_threads'] or 1
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        # Sólo se puede fijar antes de que torch haya lanzado trabajo en paralelo.
+        interop_threads = torch.get_num_interop_threads()
+    _cpu_profile['applied_threads'] = (threads, interop_threads)
+
+def _intra_op_threads():
+    """Hilos intra-op por proceso: CPU_THREADS, o núcleos / procesos de inferencia."""
+    return _cpu_profile['threads'] or max(1, (os.cpu_count() or 1) // _cpu_profile['inference_workers'])
+
+def _cpu_supports_bf16():
+    """Detecta instrucciones bf16 nativas (AVX512-BF16 o AMX) leyendo /proc/cpuinfo."""
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+def _conv1d_to_linear(model):
+    """
+    Sustituye las capas Conv1D de los modelos tipo GPT-2 por nn.Linear equivalentes
+    (misma operación, pesos traspuestos) para que la cuantización dinámica también las cubra.
+    """
+    import torch
+    from transformers.pytorch_utils import Conv1D
+
+    replaced = 0
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = torch.nn.Linear(in_features, out_features)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(parent, name, linear)
+                replaced += 1
+    return replaced
+
+def _apply_cpu_profile(pipe, entry):
+    """
+    Aplica el perfil de CPU al pipeline recién cargado: hilos, y opcionalmente cuantización dinámica
+    int8 de las capas lineales o pesos en bf16 si la CPU lo soporta. Imprime un informe con lo activado.
+    """
+    import torch
+
+    _configure_cpu_threads(torch)
+    quantize = _cpu_profile['quantize']
+    variant = 'fp32'
+
+    if quantize == 'int8':
+        converted = _conv1d_to_linear(pipe.model)
+        pipe.model = torch.ao.quantization.quantize_dynamic(pipe.model, {torch.nn.Linear}, dtype=torch.qint8)
+        variant = 'int8-dynamic'
+        detail = f"int8 dinámico en capas lineales ({converted} Conv1D convertidas)"
+    elif quantize == 'bf16':
+        if _cpu_supports_bf16():
+            pipe.model = pipe.model.to(dtype=torch.bfloat16)
+            variant = 'bf16'
+            detail = "pesos en bf16"
+        else:
+            detail = "bf16 solicitado pero la CPU no lo soporta de forma nativa; se mantiene fp32"
+    else:
+        detail = "sin cuantización (fp32)"
+
+    pipe.model.eval()
+    pipe.iacodex_variant = variant # Forma parte de la revisión del modelo (claves de caché)
+    entry['variant'] = variant
+    threads, interop_threads = _cpu_profile['applied_threads']
+    print(
+        f"Perfil CPU para '{entry['model_name']}': {detail}; hilos intra-op={threads}, "
+        f"inter-op={interop_threads}; torch.inference_mode activado."
+    )
+
+def _timed(func, stage_name):
+    def wrapper(*args, **kwargs):
+        with metrics.stage(stage_name):
+            return func(*args, **kwargs)
+    return wrapper
+
+def _instrument_pipeline(pipe):
+    """
+    Mide las etapas de cada llamada al pipeline (ver app/metrics.py): preprocess = 'tokenize',
+    _forward = generate() dividido en 'prefill' y 'decode', postprocess = 'detokenize'.
+    El forward del modelo marca el final del primer paso de generación.
+    """
+    forward = pipe._forward
+    model_forward = pipe.model.forward
+
+    def timed_forward(*args, **kwargs):
+        with metrics.generation_stages():
+            return forward(*args, **kwargs)
+
+    def marked_model_forward(*args, **kwargs):
+        output = model_forward(*args, **kwargs)
+        metrics.mark_forward()
+        _count_forward('main')
+        return output
+
+    pipe.preprocess = _timed(pipe.preprocess, 'tokenize')
+    pipe.postprocess = _timed(pipe.postprocess, 'detokenize')
+    pipe._forward = timed_forward
+    pipe.model.forward = marked_model_forward
+
+def _count_forward(role):
+    """Cuenta una pasada del modelo principal o del borrador si hay una generación asistida en curso."""
+    counts = getattr(_forward_counts, 'counts', None)
+    if counts is not None:
+        counts[role] += 1
+
+def _attach_draft_model(pipe, entry):
+    """
+    Carga el modelo borrador de la generación asistida (HF_MODEL_DRAFT) junto al modelo de autocompletado,
+    con el mismo dispositivo y la misma variante de CPU. Debe compartir el tokenizer del modelo principal;
+    si no, o si la carga falla, la generación asistida queda desactivada y /complete sigue como siempre.
+    """
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    name = _assisted_config['draft_model']
+    try:
+        draft_tokenizer = AutoTokenizer.from_pretrained(name)
+        if draft_tokenizer.get_vocab() != pipe.tokenizer.get_vocab():
+            raise ValueError("su tokenizer no coincide con el del modelo principal")
+        draft = AutoModelForCausalLM.from_pretrained(name).to(pipe.model.device)
+        variant = entry.get('variant')
+        if variant == 'int8-dynamic':
+            _conv1d_to_linear(draft)
+            draft = torch.ao.quantization.quantize_dynamic(draft, {torch.nn.Linear}, dtype=torch.qint8)
+        elif variant == 'bf16':
+            draft = draft.to(dtype=torch.bfloat16)
+        draft.eval()
+        draft.generation_config.pad_token_id = pipe.model.generation_config.pad_token_id
+        draft.generation_config.num_assistant_tokens = _assisted_config['num_tokens']
     except Exception as e:
-        print(f"Error al cargar el modelo de texto a texto {text2text_model_name}: {e}", file=sys.stderr)
-        text2text_pipeline = None # Asegurarse de que el pipeline sea None si falla la carga
+        print(f"Generación asistida desactivada: no se pudo cargar el modelo borrador {name}: {e}", file=sys.stderr)
+        entry['draft_error'] = str(e)
+        return
+
+    draft_forward = draft.forward
 
+    def counted_forward(*args, **kwargs):
+        output = draft_forward(*args, **kwargs)
+        _count_forward('draft')
+        return output
+
+    draft.forward = counted_forward
+    pipe.iacodex_draft = draft
+    entry['draft_error'] = None
+    print(f"Generación asistida activada: borrador '{name}', {_assisted_config['num_tokens']} tokens por paso.")
+
+def model_label(pipe):
+    """Nombre del modelo de un pipeline para las etiquetas de las métricas."""
+    if not getattr(pipe, 'is_remote', False) and getattr(pipe, 'model', None) is None:
+        return type(pipe).__name__
+    return (get_model_revision(pipe) or 'none').split('@')[0]
+
+def inference_context():
+    """
+    Contexto para ejecutar inferencia: torch.inference_mode() (más barato que no_grad) si torch está
+    cargado en este proceso; si no (p. ej. pipelines remotos), un contexto vacío.
+    """
+    torch = sys.modules.get('torch')
+    if torch is None:
+        import contextlib
+        return contextlib.nullcontext()
+    return torch.inference_mode()
+
+def get_cpu_profile():
+    """Opciones del perfil de CPU activas en este proceso."""
+    applied = _cpu_profile['applied_threads']
+    return {
+        'quantize': _cpu_profile['quantize'],
+        'bf16_supported': _cpu_supports_bf16(),
+        'intra_op_threads': applied[0] if applied else None,
+        'inter_op_threads': applied[1] if applied else None,
+        'inference_workers': _cpu_profile['inference_workers'],
+    }
+
+def _loaded(name):
+    """Pipeline cargado del modelo 'name', o None."""
+    global_name = _PIPELINE_GLOBALS.get(name)
+    return globals()[global_name] if global_name else _extra_pipelines.get(name)
+
+def _set_loaded(name, pipe):
+    global_name = _PIPELINE_GLOBALS.get(name)
+    if global_name:
+        globals()[global_name] = pipe
+    elif pipe is None:
+        _extra_pipelines.pop(name, None)
+    else:
+        _extra_pipelines[name] = pipe
+
+def _tensor_bytes(value):
+    if hasattr(value, 'element_size') and hasattr(value, 'numel'):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(item) for item in value)
+    return 0
+
+def _pipeline_footprint(pipe):
+    """
+    Memoria aproximada de un pipeline: los tensores del state_dict de su modelo (y del borrador de la
+    generación asistida). Incluye los pesos empaquetados de las capas cuantizadas.
+    """
+    footprint = getattr(pipe, 'iacodex_footprint_bytes', None)
+    if footprint is not None:
+        return footprint
+    total = 0
+    for model in (getattr(pipe, 'model', None), getattr(pipe, 'iacodex_draft', None)):
+        state_dict = getattr(model, 'state_dict', None)
+        if callable(state_dict):
+            total += sum(_tensor_bytes(value) for value in state_dict().values())
+    return total
+
+def get_pipeline(name):
+    """
+    Devuelve el pipeline del modelo 'name' (un tipo para los modelos por defecto o un nombre de MODELS),
+    cargándolo si es la primera vez que se usa. Las solicitudes concurrentes que llegan durante la carga
+    esperan a esa única carga. Tras un fallo de carga no se reintenta hasta pasados MODEL_LOAD_RETRY_S segundos.
+    Con MODEL_MEMORY_BUDGET_MB, cargar un modelo descarga antes los menos usados recientemente.
+    """
+    pipe = _loaded(name)
+    entry = _registry.get(name)
+    if entry is None:
+        # Sin registro (p. ej. proxies del servidor de modelos): los modelos adicionales se crean al usarlos.
+        if pipe is None and _remote_client is not None and name in _model_kinds:
+            from .model_server import RemotePipeline
+            pipe = _extra_pipelines.setdefault(name, RemotePipeline(name, _remote_client))
+        return pipe
+
+    loaded_now = False
+    if pipe is None:
+        _enforce_budget(entry['footprint_bytes'] or 0, keep=name) # Hace sitio si ya se conoce su tamaño
+        with entry['lock']:
+            pipe = _loaded(name)
+            if pipe is None:
+                if entry['failed_at'] is not None and time.monotonic() - entry['failed_at'] < _registry_config['retry_s']:
+                    return None
+                pipe = _load_pipeline(name)
+                if pipe is None:
+                    return None
+                entry['footprint_bytes'] = _pipeline_footprint(pipe)
+                _set_loaded(name, pipe)
+                loaded_now = True
+                _ensure_reaper()
+
+    entry['last_used'] = time.monotonic()
+    if loaded_now:
+        _enforce_budget(keep=name)
+    return pipe
 
 def get_generator_pipeline():
-    """Devuelve el pipeline del modelo de generación/autocompletado."""
-    return generator_pipeline
+    """Devuelve el pipeline del modelo de generación/autocompletado (lo carga si hace falta)."""
+    return get_pipeline('generator')
 
 def get_text2text_pipeline():
-    """Devuelve el pipeline del modelo de texto a texto/corrección/conversión."""
-    return text2text_pipeline
+    """Devuelve el pipeline del modelo de texto a texto/corrección/conversión (lo carga si hace falta)."""
+    return get_pipeline('text2text')
+
+def resolve_model(kind, name=None):
+    """
+    Nombre del modelo que atiende una solicitud de tipo 'kind': el que pide el cliente (campo 'model')
+    o, si no pide ninguno, el modelo por defecto de ese tipo. Lanza ValueError si no existe o es de otro tipo.
+    """
+    if name is None:
+        return kind
+    if not isinstance(name, str) or _model_kinds.get(name, name if name in _MODEL_SPECS else None) != kind:
+        available = ', '.join(sorted(model for model, model_kind in _model_kinds.items() if model_kind == kind))
+        raise ValueError(f"Modelo desconocido: '{name}'. Disponibles: {available or kind}.")
+    return name
+
+@contextmanager
+def model_in_use(name, hits=1):
+    """
+    Marca un modelo como en uso mientras dura una inferencia: no se descarga (ni por el presupuesto de memoria
+    ni por inactividad) hasta que termina la última solicitud que lo usa. 'hits' son las solicitudes atendidas.
+    """
+    entry = _registry.get(name)
+    if entry is None:
+        yield
+        return
+    with _residency_lock:
+        entry['refs'] += 1
+        entry['hits'] += hits
+    try:
+        yield
+    finally:
+        with _residency_lock:
+            entry['refs'] -= 1
+
+def warmup(kinds=None):
+    """Carga ahora los modelos indicados (por defecto, todos los registrados)."""
+    for kind in kinds or list(_registry):
+        get_pipeline(kind)
+
+def unload_model(name, reason='idle'):
+    """
+    Descarga un modelo para liberar memoria; se volverá a cargar con la siguiente solicitud.
+    Un modelo en uso no se descarga.
+    """
+    entry = _registry.get(name)
+    if entry is None:
+        return False
+    with entry['lock']:
+        with _residency_lock:
+            if _loaded(name) is None or entry['refs'] > 0:
+                return False
+            _set_loaded(name, None)
+            entry['unloads'] += 1
+
+    import gc
+    gc.collect()
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    metrics.inc('iacodex_model_unloads', model=entry['model_name'], reason=reason)
+    print(f"Modelo '{entry['model_name']}' descargado {_UNLOAD_REASONS.get(reason, reason)}.")
+    return True
+
+def _enforce_budget(incoming_bytes=0, keep=None):
+    """
+    Descarga los modelos residentes menos usados recientemente (LRU) que no estén en uso hasta que,
+    junto con los 'incoming_bytes' del modelo que se va a cargar, quepan en MODEL_MEMORY_BUDGET_MB.
+    """
+    budget = _registry_config['memory_budget_bytes']
+    if budget <= 0:
+        return
+    with _residency_lock:
+        resident = {name: entry for name, entry in _registry.items() if _loaded(name) is not None}
+        total = incoming_bytes + sum(entry['footprint_bytes'] or 0 for entry in resident.values())
+        candidates = sorted(
+            (name for name, entry in resident.items() if name != keep and entry['refs'] == 0),
+            key=lambda name: resident[name]['last_used'] or 0
+        )
+    for name in candidates:
+        if total <= budget:
+            return
+        if unload_model(name, reason='memory'):
+            total -= resident[name]['footprint_bytes'] or 0
+    if total > budget:
+        print(
+            f"Aviso: los modelos residentes ({total / 2**20:.0f} MB) superan MODEL_MEMORY_BUDGET_MB "
+            f"({budget / 2**20:.0f} MB) porque los demás están en uso.",
+            file=sys.stderr
+        )
+
+def _ensure_reaper():
+    """Arranca (una vez por proceso) el hilo que descarga los modelos inactivos más de MODEL_IDLE_TTL_S."""
+    global _reaper, _reaper_pid
+    ttl = _registry_config['idle_ttl_s']
+    if ttl <= 0 or (_reaper is not None and _reaper.is_alive() and _reaper_pid == os.getpid()):
+        return
+
+    def _reap():
+        while True:
+            time.sleep(max(1.0, min(ttl / 2, 30.0)))
+            now = time.monotonic()
+            for name, entry in list(_registry.items()):
+                last_used = entry['last_used']
+                if _loaded(name) is not None and last_used is not None and now - last_used > ttl:
+                    unload_model(name)
+
+    _reaper = threading.Thread(target=_reap, name="model-idle-reaper", daemon=True)
+    _reaper_pid = os.getpid()
+    _reaper.start()
+
+def get_model_status():
+    """Estado de cada modelo registrado: cargado o no, tiempo de carga, inactividad y último error."""
+    now = time.monotonic()
+    status = {}
+    for name, entry in _registry.items():
+        status[name] = {
+            'model': entry['model_name'],
+            'kind': entry['kind'],
+            'loaded': _loaded(name) is not None,
+            'load_seconds': round(entry['load_seconds'], 3) if entry['load_seconds'] is not None else None,
+            'idle_seconds': round(now - entry['last_used'], 1) if entry['last_used'] is not None else None,
+            'loads': entry['loads'],
+            'unloads': entry['unloads'],
+            'variant': entry.get('variant'),
+            'source': entry['source'],
+            'engine': entry['engine'] or engines.engine_for(name),
+            'engine_error': entry['engine_error'],
+            'footprint_mb': _megabytes(entry['footprint_bytes']),
+            'hits': entry['hits'],
+            'in_use': entry['refs'],
+            'error': entry['error'],
+        }
+    if 'generator' in status and _assisted_config['draft_model']:
+        status['generator']['assisted'] = get_assisted_stats()
+    return status
+
+def _megabytes(num_bytes):
+    return round(num_bytes / 2**20, 1) if num_bytes is not None else None
+
+def list_models():
+    """
+    Modelos registrados (GET /models): tipo, si es el modelo por defecto de su tipo, si está cargado,
+    su memoria, solicitudes atendidas y en curso, y el presupuesto de memoria de los modelos residentes.
+    Con el servidor de modelos compartido, la lista viene del servidor.
+    """
+    if not _registry and _remote_client is not None:
+        return _remote_client.request('models')
+    now = time.monotonic()
+    with _residency_lock:
+        entries = [
+            {
+                'name': name,
+                'kind': entry['kind'],
+                'model': entry['model_name'],
+                'default': name == entry['kind'],
+                'resident': _loaded(name) is not None,
+                'footprint_mb': _megabytes(entry['footprint_bytes']),
+                'hits': entry['hits'],
+                'in_use': entry['refs'],
+                'loads': entry['loads'],
+                'unloads': entry['unloads'],
+                'idle_seconds': round(now - entry['last_used'], 1) if entry['last_used'] is not None else None,
+            }
+            for name, entry in _registry.items()
+        ]
+    budget = _registry_config['memory_budget_bytes']
+    return {
+        'models': entries,
+        'memory': {
+            'budget_mb': _megabytes(budget) if budget > 0 else None,
+            'resident_mb': round(sum(entry['footprint_mb'] or 0 for entry in entries if entry['resident']), 1),
+        },
+    }
+
+def get_assisted_stats():
+    """Métricas acumuladas de la generación asistida en este proceso."""
+    with _assisted_lock:
+        stats = dict(_assisted_stats)
+    return {
+        'draft_model': _assisted_config['draft_model'],
+        'num_tokens': _assisted_config['num_tokens'],
+        'draft_error': _registry.get('generator', {}).get('draft_error'),
+        'generations': stats['generations'],
+        'acceptance_rate': round(stats['accepted'] / stats['proposed'], 3) if stats['proposed'] else None,
+        'tokens_per_forward': round(stats['new_tokens'] / stats['main_forwards'], 2) if stats['main_forwards'] else None,
+    }
+
+def get_model_revision(pipe):
+    """
+    Identifica el modelo concreto de un pipeline (nombre + commit del hub, si se conoce).
+    Se usa en las claves de caché para que un cambio de modelo invalide las respuestas guardadas.
+    """
+    if pipe is None:
+        return None
+    if getattr(pipe, 'is_remote', False):
+        return pipe.model_revision
+    config = pipe.model.config
+    name = getattr(config, 'name_or_path', None) or type(pipe.model).__name__
+    commit = getattr(config, '_commit_hash', None) or os.getenv('HF_MODEL_REVISION', 'local')
+    variant = getattr(pipe, 'iacodex_variant', None)
+    # Un modelo cuantizado puede dar salidas distintas: su caché no se comparte con la versión fp32.
+    return f"{name}@{commit}+{variant}" if variant and variant != 'fp32' else f"{name}@{commit}"
 
 # Las funciones de inferencia ahora usan los pipelines globales
 def autocomplete_code(prompt: str) -> str:
@@ -97,4 +767,339 @@ def convert_code(code: str, target_language: str) -> str:
 
     input_text = f"Traduce el siguiente código a {target_language}:\n{code}"
     outputs = pipeline(input_text, max_new_tokens=500, do_sample=False, return_full_text=False)
-    return outputs[0]['generated_text']
\ No newline at end of file
+    return outputs[0]['generated_text']
+
+
+def stream_generation(pipe, prompt, max_new_tokens=256, **generate_kwargs):
+    """
+    Genera texto para un único prompt y va devolviendo los fragmentos a medida que se decodifican.
+    Usa un TextIteratorStreamer enganchado al bucle de generate() del modelo, que corre en otro hilo.
+    Si quien consume el generador lo cierra (p. ej. el cliente se desconecta), la generación se detiene.
+    """
+    if getattr(pipe, 'is_remote', False):
+        yield from pipe.stream(prompt, max_new_tokens=max_new_tokens, **generate_kwargs)
+        return
+    if getattr(pipe, 'is_stub', False):
+        with scheduling.model_pass(scheduling.estimate_cost([prompt], max_new_tokens)):
+            yield from pipe.stream(prompt, max_new_tokens=max_new_tokens, **generate_kwargs)
+        return
+
+    import threading
+    from transformers import TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList
+
+    cancelled = threading.Event()
+
+    class _CancelCriteria(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return cancelled.is_set()
+
+    tokenizer = pipe.tokenizer
+    model = pipe.model
+    draft = getattr(pipe, 'iacodex_draft', None)
+    if draft is not None and not generate_kwargs.get('do_sample'):
+        # Generación asistida también en streaming: el streamer recibe varios tokens por pasada.
+        generate_kwargs = dict(generate_kwargs, assistant_model=draft, do_sample=False)
+    inputs = tokenizer(prompt, return_tensors='pt').to(model.device)
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    errors = []
+    priority = scheduling.current() # El hilo de generación no hereda la solicitud en curso
+    cost = inputs['input_ids'].shape[1] + max_new_tokens
+
+    def _generate():
+        try:
+            with scheduling.model_pass(cost, priority), inference_context():
+                model.generate(
+                    **inputs,
+                    streamer=streamer,
+                    max_new_tokens=max_new_tokens,
+                    stopping_criteria=StoppingCriteriaList([_CancelCriteria()]),
+                    **generate_kwargs
+                )
+        except Exception as e:
+            errors.append(e)
+            streamer.end() # Desbloquea al consumidor
+
+    thread = threading.Thread(target=_generate, daemon=True)
+    thread.start()
+    try:
+        for text in streamer:
+            if text:
+                yield text
+    finally:
+        cancelled.set()
+    thread.join()
+    if errors:
+        raise errors[0]
+
+def generate_with_prefix_cache(pipe, prompt, max_new_tokens=256, session_id=None, stop_rule=None, **generate_kwargs):
+    """
+    Autocompleta un único prompt reutilizando la caché KV del prefijo más largo ya visto
+    (ver app/kv_cache.py): sólo se codifican los tokens nuevos del prompt.
+    Con 'stop_rule' (ver app/stopping.py), la generación termina en cuanto la salida está completa.
+    Devuelve una lista con un diccionario {'generated_text': prompt + generación}, como el pipeline
+    con return_full_text=True.
+    """
+    if getattr(pipe, 'is_remote', False):
+        return pipe.prefix_generate(
+            prompt, max_new_tokens=max_new_tokens, session_id=session_id, stop_rule=stop_rule, **generate_kwargs
+        )
+    if getattr(pipe, 'is_stub', False):
+        with scheduling.model_pass(scheduling.estimate_cost([prompt], max_new_tokens)):
+            return pipe.prefix_generate(
+                prompt, max_new_tokens=max_new_tokens, session_id=session_id,
+                stopping_criteria=stopping.generation_criteria(pipe, [stop_rule]), **generate_kwargs
+            )
+
+    import torch
+    from . import kv_cache
+
+    store = kv_cache.prefix_store
+    tokenizer = pipe.tokenizer
+    model = pipe.model
+    with metrics.stage('tokenize'):
+        input_ids = tokenizer(prompt, return_tensors='pt')['input_ids'].to(model.device)
+    token_ids = input_ids[0].tolist()
+
+    past_key_values, reused = (None, 0)
+    if store is not None:
+        past_key_values, reused = store.lookup(token_ids, session_id)
+
+    criteria = stopping.generation_criteria(pipe, [stop_rule], prompt_length=len(token_ids))
+
+    def _generate(past):
+        kwargs = dict(generate_kwargs)
+        if past is not None:
+            kwargs['past_key_values'] = past
+        if criteria is not None:
+            kwargs['stopping_criteria'] = criteria
+        with inference_context():
+            return model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                max_new_tokens=max_new_tokens,
+                use_cache=True,
+                return_dict_in_generate=True,
+                **kwargs
+            )
+
+    started = time.perf_counter()
+    # Sólo se codifican los tokens no reutilizados: es lo que cuesta la pasada.
+    with scheduling.model_pass(len(token_ids) - reused + max_new_tokens):
+        try:
+            with metrics.generation_stages():
+                output = _generate(past_key_values)
+        except Exception as e:
+            if past_key_values is None:
+                raise
+            # Versiones de transformers sin soporte de prefijo en generate(): se repite sin caché.
+            print(f"No se pudo reutilizar la caché KV ({reused} tokens): {e}", file=sys.stderr)
+            with metrics.generation_stages():
+                output = _generate(None)
+    duration = time.perf_counter() - started
+
+    if store is not None and getattr(output, 'past_key_values', None) is not None:
+        store.store(token_ids, kv_cache.kv_crop(output.past_key_values, len(token_ids)), session_id)
+
+    new_tokens = output.sequences[0][len(token_ids):]
+    with metrics.stage('detokenize'):
+        text = tokenizer.decode(new_tokens, skip_special_tokens=True)
+
+    # Sólo se codificaron los tokens no reutilizados de la caché.
+    model_name = model_label(pipe)
+    metrics.inc('iacodex_model_tokens', len(token_ids) - reused, model=model_name, direction='input')
+    metrics.inc('iacodex_model_tokens', len(new_tokens), model=model_name, direction='output')
+    metrics.inc('iacodex_model_generation_seconds', duration, model=model_name)
+    if duration > 0:
+        metrics.observe('iacodex_model_tokens_per_second', len(new_tokens) / duration, model=model_name)
+    return [{'generated_text': prompt + text}]
+
+def assisted_generation_enabled():
+    """Indica si /complete debe usar la generación asistida (HF_MODEL_DRAFT configurado)."""
+    return bool(_assisted_config['draft_model'])
+
+def record_assisted(model_name, new_tokens, main_forwards, draft_forwards):
+    """
+    Registra una generación asistida. Cada pasada del modelo principal verifica los tokens propuestos
+    por el borrador y aporta uno propio, así que los tokens aceptados son los generados menos las pasadas
+    del modelo principal; cada pasada del borrador propone un token.
+    """
+    accepted = max(0, min(new_tokens - main_forwards, draft_forwards))
+    with _assisted_lock:
+        _assisted_stats['generations'] += 1
+        _assisted_stats['proposed'] += draft_forwards
+        _assisted_stats['accepted'] += accepted
+        _assisted_stats['new_tokens'] += new_tokens
+        _assisted_stats['main_forwards'] += main_forwards
+    metrics.inc('iacodex_assisted_draft_tokens', draft_forwards, model=model_name, outcome='proposed')
+    metrics.inc('iacodex_assisted_draft_tokens', accepted, model=model_name, outcome='accepted')
+    if draft_forwards:
+        metrics.observe('iacodex_assisted_acceptance_ratio', accepted / draft_forwards, model=model_name)
+    if main_forwards:
+        metrics.observe('iacodex_assisted_tokens_per_forward', new_tokens / main_forwards, model=model_name)
+
+def generate_assisted(pipe, prompt, max_new_tokens=256, stop_rule=None, **generate_kwargs):
+    """
+    Autocompleta un único prompt con generación asistida (decodificación especulativa): el modelo borrador
+    propone varios tokens y el modelo principal los verifica en una sola pasada. La decodificación es voraz,
+    así que el resultado es idéntico al de generate() sin borrador; sólo cambia el número de pasadas del
+    modelo principal. Sin borrador cargado, se usa el micro-batching como siempre.
+    Devuelve una lista con un diccionario {'generated_text': prompt + generación}, como el pipeline
+    con return_full_text=True.
+    """
+    if getattr(pipe, 'is_remote', False):
+        return pipe.assisted_generate(prompt, max_new_tokens=max_new_tokens, stop_rule=stop_rule, **generate_kwargs)
+    if getattr(pipe, 'is_stub', False):
+        with scheduling.model_pass(scheduling.estimate_cost([prompt], max_new_tokens)):
+            return pipe.assisted_generate(
+                prompt, max_new_tokens=max_new_tokens, stopping_criteria=stopping.generation_criteria(pipe, [stop_rule]),
+                **generate_kwargs
+            )
+
+    draft = getattr(pipe, 'iacodex_draft', None)
+    if draft is None:
+        from . import batching
+        return batching.submit(
+            'generator', prompt, max_new_tokens=max_new_tokens, num_return_sequences=1, return_full_text=True,
+            stop_rule=stop_rule, **generate_kwargs
+        )
+
+    import torch
+
+    tokenizer = pipe.tokenizer
+    model = pipe.model
+    with metrics.stage('tokenize'):
+        input_ids = tokenizer(prompt, return_tensors='pt')['input_ids'].to(model.device)
+
+    # Con la generación asistida se añaden varios tokens por paso: la longitud del prompt se indica.
+    criteria = stopping.generation_criteria(pipe, [stop_rule], prompt_length=input_ids.shape[1])
+    if criteria is not None:
+        generate_kwargs = dict(generate_kwargs, stopping_criteria=criteria)
+    _forward_counts.counts = {'main': 0, 'draft': 0}
+    started = time.perf_counter()
+    try:
+        cost = input_ids.shape[1] + max_new_tokens
+        with scheduling.model_pass(cost), metrics.generation_stages(), inference_context():
+            output_ids = model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                assistant_model=draft,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                **generate_kwargs
+            )
+        counts = _forward_counts.counts
+    finally:
+        _forward_counts.counts = None
+    duration = time.perf_counter() - started
+
+    new_tokens = output_ids[0][input_ids.shape[1]:]
+    with metrics.stage('detokenize'):
+        text = tokenizer.decode(new_tokens, skip_special_tokens=True)
+
+    model_name = model_label(pipe)
+    record_assisted(model_name, len(new_tokens), counts['main'], counts['draft'])
+    metrics.inc('iacodex_model_tokens', input_ids.shape[1], model=model_name, direction='input')
+    metrics.inc('iacodex_model_tokens', len(new_tokens), model=model_name, direction='output')
+    metrics.inc('iacodex_model_generation_seconds', duration, model=model_name)
+    if duration > 0:
+        metrics.observe('iacodex_model_tokens_per_second', len(new_tokens) / duration, model=model_name)
+    return [{'generated_text': prompt + text}]
+
+def generate_suggestions(pipe, prompt, num_suggestions, max_new_tokens=256, stop_rule=None, **generate_kwargs):
+    """
+    Autocompleta un único prompt con varias sugerencias y el prefill compartido (ver app/suggestions.py):
+    el prompt se codifica una sola vez y su caché KV se replica para cada sugerencia. Las sugerencias que
+    terminan, convergen con otra o agotan el presupuesto de decodificación salen del lote, así que cada
+    paso sólo procesa las que siguen activas.
+    Las sugerencias se muestrean (do_sample=True por defecto) con la temperatura, top_k y top_p de la
+    configuración de generación del modelo.
+    Devuelve una lista con un diccionario {'generated_text': prompt + generación} por sugerencia conservada,
+    como el pipeline con return_full_text=True.
+    """
+    if getattr(pipe, 'is_remote', False):
+        return pipe.suggestions_generate(
+            prompt, num_suggestions, max_new_tokens=max_new_tokens, stop_rule=stop_rule, **generate_kwargs
+        )
+    if getattr(pipe, 'is_stub', False):
+        with scheduling.model_pass(scheduling.estimate_cost([prompt], max_new_tokens)):
+            return pipe.suggestions_generate(
+                prompt, num_suggestions, max_new_tokens=max_new_tokens, stop_rule=stop_rule, **generate_kwargs
+            )
+
+    import torch
+    from transformers import LogitsProcessorList, TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
+    from . import kv_cache
+    from . import suggestions
+
+    tokenizer = pipe.tokenizer
+    model = pipe.model
+    config = model.generation_config
+    do_sample = generate_kwargs.get('do_sample', True)
+    temperature = generate_kwargs.get('temperature', config.temperature)
+    top_k = generate_kwargs.get('top_k', config.top_k)
+    top_p = generate_kwargs.get('top_p', config.top_p)
+    warpers = LogitsProcessorList()
+    if do_sample:
+        if temperature and temperature != 1.0:
+            warpers.append(TemperatureLogitsWarper(temperature))
+        if top_k:
+            warpers.append(TopKLogitsWarper(top_k))
+        if top_p is not None and top_p < 1.0:
+            warpers.append(TopPLogitsWarper(top_p))
+
+    with metrics.stage('tokenize'):
+        input_ids = tokenizer(prompt, return_tensors='pt')['input_ids'].to(model.device)
+    tracker = suggestions.SuggestionTracker(num_suggestions, max_new_tokens, identical=not do_sample)
+    generated = [[] for _ in range(num_suggestions)]
+    # Texto de cada fila para la regla de parada: sólo se decodifican los tokens nuevos en cada paso.
+    decoders = [stopping.IncrementalDecoder(tokenizer) for _ in range(num_suggestions)] if stop_rule is not None else None
+
+    started = time.perf_counter()
+    # Coste de la pasada: el prompt una sola vez y, como mucho, el límite de decodificación.
+    cost = input_ids.shape[1] + tracker.decode_limit
+    with scheduling.model_pass(cost), metrics.generation_stages(), inference_context():
+        active = tracker.active
+        output = model(input_ids=input_ids, use_cache=True) # Prefill compartido
+        past = kv_cache.kv_expand(output.past_key_values, len(active))
+        logits = output.logits[:, -1, :].float().repeat(len(active), 1)
+        for _ in range(max_new_tokens):
+            scores = warpers(input_ids, logits)
+            if do_sample:
+                next_tokens = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).squeeze(1)
+            else:
+                next_tokens = scores.argmax(dim=-1)
+
+            finished = []
+            for position, row in enumerate(active):
+                token = int(next_tokens[position])
+                if token == tokenizer.eos_token_id:
+                    finished.append(row)
+                    continue
+                generated[row].append(token)
+                if decoders is not None and stop_rule.find_end(decoders[row].push([token])) is not None:
+                    finished.append(row)
+            remaining = tracker.step(generated, finished)
+            if not remaining or tracker.steps >= max_new_tokens:
+                break
+            if remaining != active:
+                # Las filas terminadas salen del lote y de la caché KV.
+                keep = torch.tensor([active.index(row) for row in remaining], device=next_tokens.device)
+                past = kv_cache.kv_select(past, keep)
+                next_tokens = next_tokens.index_select(0, keep)
+            active = remaining
+            output = model(input_ids=next_tokens.unsqueeze(1), past_key_values=past, use_cache=True)
+            past, logits = output.past_key_values, output.logits[:, -1, :].float()
+    duration = time.perf_counter() - started
+
+    kept = tracker.kept_rows()
+    with metrics.stage('detokenize'):
+        texts = [tokenizer.decode(generated[row], skip_special_tokens=True) for row in kept]
+
+    model_name = model_label(pipe)
+    suggestions.record_generation(tracker, input_ids.shape[1])
+    metrics.inc('iacodex_model_tokens', input_ids.shape[1], model=model_name, direction='input')
+    metrics.inc('iacodex_model_tokens', tracker.decode_tokens, model=model_name, direction='output')
+    metrics.inc('iacodex_model_generation_seconds', duration, model=model_name)
+    if duration > 0:
+        metrics.observe('iacodex_model_tokens_per_second', tracker.decode_tokens / duration, model=model_name)
+    return [{'generated_text': prompt + text} for text in texts]
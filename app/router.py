@@ -0,0 +1,630 @@
+# ia-codex-api/app/router.py
+
+"""
+Router multinodo: un servicio ASGI pequeño delante de varias instancias de la API (cada una arrancada con
+scripts/run_api.py, con sus propios modelos y cachés) que conserva el estado caliente de cada host.
+
+- Afinidad por hash consistente: cada solicitud se asigna a un backend según (modelo, clave de contenido)
+  en un anillo con ROUTER_VNODES nodos virtuales por backend. /complete usa la sesión del editor
+  (X-Session-Id o 'session_id') o los primeros ROUTER_PREFIX_CHARS caracteres del prompt (caché KV por
+  prefijo); /fix y /convert, el código completo (caché de respuestas y agrupación de solicitudes idénticas).
+- Salud: GET / a cada backend cada ROUTER_HEALTH_INTERVAL_S. Tras ROUTER_UNHEALTHY_AFTER fallos seguidos
+  (o un error de conexión al reenviar) sale del anillo y vuelve al responder. Al salir o entrar un backend
+  sólo cambian de nodo sus claves.
+- Altas y bajas en caliente: POST /router/nodes añade un backend y DELETE /router/nodes lo drena
+  (no recibe solicitudes nuevas y se retira cuando terminan las que tiene en curso).
+- Derrame: si el backend elegido tiene ROUTER_SPILL_IN_FLIGHT solicitudes en curso o más, la solicitud va
+  al backend sano con menos solicitudes en curso.
+
+El router no carga modelos. Las solicitudes se reenvían con http.client desde un executor y las respuestas
+(también Server-Sent Events) se transmiten a medida que llegan.
+
+Arranque (requiere uvicorn; ver scripts/run_router.py):
+    ROUTER_BACKENDS=http://10.0.0.1:5000,http://10.0.0.2:5000 uvicorn --factory app.router:create_router_app --port 8000
+"""
+
+import asyncio
+import hashlib
+import http.client
+import json
+import sys
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from . import load_config
+from . import metrics
+from .asgi import _header, _read_body, _send_json, _wait_disconnect
+
+# Cabeceras que no se reenvían (propias de cada conexión).
+HOP_BY_HOP = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailer', 'trailers',
+    'transfer-encoding', 'upgrade', 'host', 'content-length',
+}
+# Endpoints cuya clave es el contenido: (operación, campos que la forman).
+CONTENT_KEYS = {
+    '/fix': ('fix', ('code', 'language')),
+    '/convert': ('convert', ('code', 'target_language')),
+}
+MAX_JOB_ROUTES = 100000 # Trabajos asíncronos recordados (id -> backend que lo tiene en su cola)
+
+
+def _hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def parse_backends(value):
+    """Lee ROUTER_BACKENDS: URLs separadas por comas. Devuelve la lista de URLs normalizadas."""
+    backends = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if item:
+            backends.append(normalize_url(item))
+    return backends
+
+
+def normalize_url(url):
+    parts = urlsplit(url if '://' in url else f"http://{url}")
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError(f"URL de backend inválida: '{url}' (formato: http://host:puerto).")
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    return f"{parts.scheme}://{parts.hostname}:{port}"
+
+
+class HashRing:
+    """
+    Anillo de hash consistente con nodos virtuales. preference(key) devuelve los nodos en el orden en que
+    se prueban para esa clave: al quitar o añadir un nodo, el resto de claves no cambian de nodo.
+    """
+
+    def __init__(self, nodes=(), vnodes=64):
+        self.vnodes = vnodes
+        self._nodes = set()
+        self._points = []  # Posiciones ordenadas
+        self._owners = []  # Nodo de cada posición
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self):
+        return set(self._nodes)
+
+    def add(self, node):
+        if node not in self._nodes:
+            self._nodes.add(node)
+            self._rebuild()
+
+    def remove(self, node):
+        if node in self._nodes:
+            self._nodes.discard(node)
+            self._rebuild()
+
+    def _rebuild(self):
+        points = sorted((_hash(f"{node}#{index}"), node) for node in self._nodes for index in range(self.vnodes))
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def preference(self, key):
+        if not self._points:
+            return []
+        start = bisect_right(self._points, _hash(key))
+        order = []
+        for offset in range(len(self._points)):
+            node = self._owners[(start + offset) % len(self._points)]
+            if node not in order:
+                order.append(node)
+                if len(order) == len(self._nodes):
+                    break
+        return order
+
+
+class Backend:
+    """Estado de un backend visto desde el router."""
+
+    __slots__ = ('url', 'state', 'healthy', 'failures', 'in_flight', 'requests', 'spilled', 'last_error', 'last_check')
+
+    def __init__(self, url):
+        self.url = url
+        self.state = 'active' # 'active' o 'draining'
+        self.healthy = True   # Hasta que una comprobación diga lo contrario
+        self.failures = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.spilled = 0      # Solicitudes recibidas por derrame desde otro backend
+        self.last_error = None
+        self.last_check = None
+
+    def address(self):
+        parts = urlsplit(self.url)
+        return parts.scheme, parts.hostname, parts.port
+
+    def stats(self):
+        return {
+            'state': self.state, 'healthy': self.healthy, 'in_flight': self.in_flight, 'requests': self.requests,
+            'spilled': self.spilled, 'failures': self.failures, 'last_error': self.last_error,
+            'last_check': self.last_check,
+        }
+
+
+def open_connection(backend, timeout):
+    scheme, host, port = backend.address()
+    connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+    return connection_class(host, port, timeout=timeout)
+
+
+class Router:
+    """
+    Estado compartido del router: backends, anillo (sólo los backends activos y sanos), solicitudes en curso
+    por backend y trabajos asíncronos. Lo usan el bucle de eventos, los hilos del executor y el hilo de salud.
+    """
+
+    def __init__(self, backends=(), vnodes=64, spill_in_flight=8, unhealthy_after=2, health_timeout_s=1.0):
+        self.spill_in_flight = spill_in_flight
+        self.unhealthy_after = max(1, unhealthy_after)
+        self.health_timeout_s = health_timeout_s
+        self.ring = HashRing(vnodes=vnodes)
+        self.backends = {}
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        for url in backends:
+            self.join(url, healthy=True)
+
+    # --- Altas, bajas y salud ---
+
+    def _update_ring(self, backend):
+        if backend.state == 'active' and backend.healthy:
+            self.ring.add(backend.url)
+        else:
+            self.ring.remove(backend.url)
+
+    def join(self, url, healthy=False):
+        """
+        Añade un backend (o reactiva uno que se estaba drenando). Un backend nuevo entra en el anillo
+        cuando pasa su primera comprobación de salud. Devuelve True si no existía.
+        """
+        url = normalize_url(url)
+        with self._lock:
+            backend = self.backends.get(url)
+            created = backend is None
+            if created:
+                backend = self.backends[url] = Backend(url)
+                backend.healthy = healthy
+            backend.state = 'active'
+            self._update_ring(backend)
+        metrics.inc('iacodex_router_node_events', node=url, event='join')
+        return created
+
+    def drain(self, url):
+        """
+        Saca un backend del anillo; se retira cuando terminan sus solicitudes en curso.
+        Devuelve False si no existe.
+        """
+        url = normalize_url(url)
+        with self._lock:
+            backend = self.backends.get(url)
+            if backend is None:
+                return False
+            backend.state = 'draining'
+            self._update_ring(backend)
+            self._remove_if_drained(backend)
+        metrics.inc('iacodex_router_node_events', node=url, event='drain')
+        return True
+
+    def _remove_if_drained(self, backend):
+        if backend.state == 'draining' and backend.in_flight == 0 and self.backends.get(backend.url) is backend:
+            del self.backends[backend.url]
+            for job_id in [job_id for job_id, url in self.jobs.items() if url == backend.url]:
+                del self.jobs[job_id]
+
+    def _set_health(self, backend, healthy, error=None):
+        with self._lock:
+            backend.last_check = time.time()
+            if healthy:
+                changed = not backend.healthy
+                backend.failures = 0
+                backend.healthy = True
+            else:
+                backend.failures += 1
+                backend.last_error = error
+                changed = backend.healthy and backend.failures >= self.unhealthy_after
+                if changed:
+                    backend.healthy = False
+            self._update_ring(backend)
+        if changed:
+            metrics.inc('iacodex_router_node_events', node=backend.url, event='up' if healthy else 'down')
+            print(
+                f"Router: backend {backend.url} {'disponible' if healthy else 'fuera del anillo'}"
+                + (f" ({error})" if error else ''),
+                file=sys.stderr if not healthy else sys.stdout
+            )
+
+    def mark_down(self, backend, error):
+        """Error de conexión al reenviar: el backend sale del anillo hasta la siguiente comprobación correcta."""
+        with self._lock:
+            backend.failures = max(backend.failures, self.unhealthy_after - 1)
+        self._set_health(backend, False, str(error))
+
+    def check(self, backend):
+        """Comprueba un backend con GET /."""
+        connection = open_connection(backend, self.health_timeout_s)
+        try:
+            connection.request('GET', '/')
+            response = connection.getresponse()
+            response.read()
+            healthy = response.status == 200
+            error = None if healthy else f"GET / respondió {response.status}"
+        except OSError as e:
+            healthy, error = False, str(e) or e.__class__.__name__
+        finally:
+            connection.close()
+        self._set_health(backend, healthy, error)
+        return healthy
+
+    def check_all(self):
+        with self._lock:
+            backends = list(self.backends.values())
+        for backend in backends:
+            self.check(backend)
+
+    def start_health_checks(self, interval_s):
+        def loop():
+            while True:
+                time.sleep(interval_s)
+                try:
+                    self.check_all()
+                except Exception as e:
+                    print(f"Error en las comprobaciones de salud del router: {e}", file=sys.stderr)
+
+        threading.Thread(target=loop, name='iacodex-router-health', daemon=True).start()
+
+    # --- Elección del backend ---
+
+    def candidates(self, key):
+        """
+        Backends a los que reenviar una solicitud con clave 'key', en orden (el primero es el elegido y el resto
+        sirven para reintentar), y el motivo de la elección: 'ring' o 'spill'.
+        """
+        with self._lock:
+            order = [self.backends[url] for url in self.ring.preference(key)]
+            if not order:
+                return [], 'ring'
+            target = order[0]
+            if self.spill_in_flight and target.in_flight >= self.spill_in_flight:
+                least = min(order, key=lambda backend: backend.in_flight)
+                if least.in_flight < target.in_flight:
+                    order.remove(least)
+                    return [least] + order, 'spill'
+            return order, 'ring'
+
+    def acquire(self, backend, route):
+        with self._lock:
+            backend.in_flight += 1
+            backend.requests += 1
+            if route == 'spill':
+                backend.spilled += 1
+        metrics.inc('iacodex_router_requests', node=backend.url, route=route)
+
+    def release(self, backend):
+        with self._lock:
+            backend.in_flight -= 1
+            self._remove_if_drained(backend)
+
+    def backend(self, url):
+        with self._lock:
+            return self.backends.get(url)
+
+    # --- Trabajos asíncronos ---
+
+    def remember_job(self, job_id, backend):
+        with self._lock:
+            self.jobs[job_id] = backend.url
+            self.jobs.move_to_end(job_id)
+            while len(self.jobs) > MAX_JOB_ROUTES:
+                self.jobs.popitem(last=False)
+
+    def job_backends(self, job_id):
+        """Backend que tiene el trabajo o, si no se conoce, todos los sanos (se prueban en orden)."""
+        with self._lock:
+            url = self.jobs.get(job_id)
+            if url is not None and url in self.backends:
+                return [self.backends[url]]
+            return [backend for backend in self.backends.values() if backend.healthy]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ring': sorted(self.ring.nodes),
+                'vnodes': self.ring.vnodes,
+                'spill_in_flight': self.spill_in_flight,
+                'backends': {url: backend.stats() for url, backend in self.backends.items()},
+                'jobs_tracked': len(self.jobs),
+            }
+
+
+def routing_key(path, data, session_id, prefix_chars):
+    """
+    Clave de afinidad de una solicitud: el modelo (campo 'model') y su contenido. Las solicitudes con la misma
+    clave van al mismo backend mientras siga en el anillo.
+    """
+    if not isinstance(data, dict):
+        return path
+    if path == '/jobs' and isinstance(data.get('input'), dict):
+        # Un trabajo va donde iría su solicitud síncrona (mismas cachés).
+        return routing_key(f"/{data.get('operation')}", data['input'], None, prefix_chars)
+    if path.endswith('/batch'):
+        items = data.get('items')
+        first = items[0] if isinstance(items, list) and items and isinstance(items[0], dict) else {}
+        defaults = {key: value for key, value in data.items() if key != 'items'}
+        return routing_key(path[:-len('/batch')], dict(defaults, **first), None, prefix_chars)
+
+    model = data.get('model') if isinstance(data.get('model'), str) else ''
+    if path == '/complete':
+        session_id = session_id or data.get('session_id')
+        if session_id:
+            return f"{model}|session|{session_id}"
+        prompt = data.get('prompt') if isinstance(data.get('prompt'), str) else ''
+        return f"{model}|complete|{prompt[:prefix_chars]}"
+    if path in CONTENT_KEYS:
+        operation, fields = CONTENT_KEYS[path]
+        return '|'.join([model, operation] + [str(data.get(field) or '') for field in fields])
+    return path
+
+
+class RouterApp:
+    """Aplicación ASGI del router: rutas propias (/, /router/...) y reenvío del resto a los backends."""
+
+    def __init__(self, router, config):
+        self.router = router
+        self.prefix_chars = int(config.get('ROUTER_PREFIX_CHARS', 256))
+        self.retries = int(config.get('ROUTER_RETRIES', 2))
+        self.timeout_s = float(config.get('ROUTER_TIMEOUT_S', 300))
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(config.get('ROUTER_MAX_CONNECTIONS', 256)), thread_name_prefix='iacodex-router'
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    self.executor.shutdown(wait=False, cancel_futures=True)
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+
+        path, method = scope['path'], scope['method']
+        if path == '/' and method == 'GET':
+            await self.home(send)
+        elif path == '/router/stats' and method == 'GET':
+            await _send_json(send, 200, self.router.stats())
+        elif path == '/router/metrics' and method == 'GET':
+            body = (await self._offload(metrics.render)).encode()
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/plain; version=0.0.4'), (b'content-length', str(len(body)).encode())
+            ]})
+            await send({'type': 'http.response.body', 'body': body})
+        elif path == '/router/nodes' and method in ('POST', 'DELETE'):
+            await self.nodes(method, receive, send)
+        elif path.startswith('/jobs/') and method == 'GET':
+            await self.get_job(scope, receive, send, path[len('/jobs/'):])
+        else:
+            await self.forward(scope, receive, send)
+
+    async def _offload(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def home(self, send):
+        """Salud del propio router: 503 si no hay ningún backend en el anillo."""
+        ring = self.router.ring.nodes
+        status = 200 if ring else 503
+        await _send_json(send, status, {"message": "IA Codex API (router).", "backends_in_ring": len(ring)})
+
+    async def nodes(self, method, receive, send):
+        """POST /router/nodes {"url"}: añade un backend. DELETE /router/nodes {"url"}: lo drena y retira."""
+        body = await _read_body(receive)
+        try:
+            url = json.loads(body or b'{}').get('url')
+        except (ValueError, AttributeError):
+            url = None
+        if not isinstance(url, str) or not url:
+            await _send_json(send, 400, {"error": "El campo 'url' es requerido."})
+            return
+        try:
+            if method == 'POST':
+                created = self.router.join(url)
+                healthy = await self._offload(self.router.check, self.router.backend(normalize_url(url)))
+                await _send_json(send, 201 if created else 200, {"url": normalize_url(url), "healthy": healthy})
+                return
+            if not self.router.drain(url):
+                await _send_json(send, 404, {"error": f"El backend '{url}' no existe."})
+                return
+        except ValueError as e:
+            await _send_json(send, 400, {"error": str(e)})
+            return
+        backend = self.router.backend(normalize_url(url))
+        await _send_json(send, 202, {"url": normalize_url(url), "in_flight": backend.in_flight if backend else 0})
+
+    def _request_headers(self, scope, body):
+        headers = {}
+        for key, value in scope.get('headers', []):
+            name = key.decode('latin-1').lower()
+            if name not in HOP_BY_HOP:
+                headers[name] = value.decode('latin-1')
+        client = scope.get('client')
+        if client:
+            forwarded = headers.get('x-forwarded-for')
+            headers['x-forwarded-for'] = f"{forwarded}, {client[0]}" if forwarded else client[0]
+        headers['content-length'] = str(len(body))
+        return headers
+
+    def _key(self, scope, body):
+        if scope['method'] != 'POST' or not body:
+            return scope['path']
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return scope['path'] # El backend responde el error de validación
+        return routing_key(scope['path'], data, _header(scope, 'x-session-id'), self.prefix_chars)
+
+    def _request(self, backend, method, target, headers, body):
+        """Envía la solicitud a un backend y devuelve (conexión, respuesta) en cuanto llegan las cabeceras."""
+        connection = open_connection(backend, self.timeout_s)
+        try:
+            connection.request(method, target, body=body, headers=headers)
+            return connection, connection.getresponse()
+        except BaseException:
+            connection.close()
+            raise
+
+    async def _open(self, scope, body, candidates, route):
+        """
+        Reenvía la solicitud al primer candidato que responda; los errores de conexión sacan al backend del
+        anillo y se reintenta con el siguiente (hasta ROUTER_RETRIES veces).
+        Devuelve (backend, conexión, respuesta) o None. El backend queda con la solicitud en curso.
+        """
+        query = scope.get('query_string', b'').decode('latin-1')
+        target = scope['path'] + (f"?{query}" if query else '')
+        headers = self._request_headers(scope, body)
+        for backend in candidates[:self.retries + 1]:
+            self.router.acquire(backend, route)
+            try:
+                connection, response = await self._offload(
+                    self._request, backend, scope['method'], target, headers, body
+                )
+            except OSError as e:
+                self.router.release(backend)
+                self.router.mark_down(backend, e)
+                route = 'retry'
+                continue
+            return backend, connection, response
+        return None
+
+    async def _start(self, send, backend, route, response):
+        headers = [
+            (key.lower().encode('latin-1'), value.encode('latin-1'))
+            for key, value in response.getheaders() if key.lower() not in HOP_BY_HOP
+        ]
+        length = response.getheader('content-length')
+        if length is not None:
+            headers.append((b'content-length', length.encode('latin-1')))
+        headers += [(b'x-iacodex-backend', backend.url.encode()), (b'x-iacodex-route', route.encode())]
+        await send({'type': 'http.response.start', 'status': response.status, 'headers': headers})
+
+    async def forward(self, scope, receive, send):
+        body = await _read_body(receive)
+        if body is None:
+            return
+        candidates, route = self.router.candidates(self._key(scope, body))
+        if not candidates:
+            await _send_json(send, 503, {"error": "No hay backends disponibles."}, {'Retry-After': 1})
+            return
+        opened = await self._open(scope, body, candidates, route)
+        if opened is None:
+            await _send_json(send, 502, {"error": "Ningún backend respondió a la solicitud."}, {'Retry-After': 1})
+            return
+        backend, connection, response = opened
+        route = route if backend is candidates[0] else 'retry'
+        try:
+            if scope['path'] == '/jobs' and scope['method'] == 'POST':
+                await self._relay_job(send, backend, route, response)
+            else:
+                await self._relay(receive, send, backend, route, connection, response)
+        finally:
+            connection.close()
+            self.router.release(backend)
+
+    async def _relay(self, receive, send, backend, route, connection, response):
+        """
+        Transmite la respuesta a medida que llega (Server-Sent Events incluidos). Si el cliente se desconecta,
+        se cierra la conexión con el backend, que deja de generar.
+        """
+        await self._start(send, backend, route, response)
+        disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+            while True:
+                reader = asyncio.ensure_future(self._offload(response.read1, 65536))
+                await asyncio.wait({reader, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if not reader.done():
+                    connection.close()
+                    try:
+                        await reader
+                    except Exception:
+                        pass
+                    return
+                try:
+                    chunk = reader.result()
+                except (OSError, http.client.HTTPException) as e:
+                    print(f"Router: respuesta de {backend.url} interrumpida: {e}", file=sys.stderr)
+                    chunk = b''
+                if not chunk:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+
+    async def _relay_job(self, send, backend, route, response):
+        """POST /jobs: la respuesta es pequeña; se recuerda en qué backend quedó el trabajo."""
+        body = await self._offload(response.read)
+        if response.status in (200, 202):
+            try:
+                self.router.remember_job(json.loads(body)['job_id'], backend)
+            except (ValueError, KeyError, TypeError):
+                pass
+        await self._start(send, backend, route, response)
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def get_job(self, scope, receive, send, job_id):
+        """GET /jobs/<id>: al backend que tiene el trabajo o, si no se conoce, al primero que lo encuentre."""
+        body = await _read_body(receive)
+        if body is None:
+            return
+        last = None
+        for backend in self.router.job_backends(job_id):
+            opened = await self._open(scope, body, [backend], 'jobs')
+            if opened is None:
+                continue
+            backend, connection, response = opened
+            try:
+                data = await self._offload(response.read)
+            finally:
+                connection.close()
+                self.router.release(backend)
+            last = (backend, response, data)
+            if response.status != 404:
+                self.router.remember_job(job_id, backend)
+                break
+        if last is None:
+            await _send_json(send, 503, {"error": "No hay backends disponibles."}, {'Retry-After': 1})
+            return
+        backend, response, data = last
+        await self._start(send, backend, 'jobs', response)
+        await send({'type': 'http.response.body', 'body': data})
+
+
+def create_router_app(config=None):
+    """
+    Crea la aplicación ASGI del router con los backends de ROUTER_BACKENDS y arranca sus comprobaciones
+    de salud (ROUTER_HEALTH_INTERVAL_S=0 las desactiva). 'config' permite sobrescribir valores del entorno.
+    """
+    app_config = load_config()
+    app_config.update(config or {})
+    metrics.init_metrics(dict(app_config, METRICS_DIR='')) # Métricas propias, sin sumar las de los backends
+
+    router = Router(
+        parse_backends(app_config.get('ROUTER_BACKENDS')),
+        vnodes=int(app_config.get('ROUTER_VNODES', 64)),
+        spill_in_flight=int(app_config.get('ROUTER_SPILL_IN_FLIGHT', 8)),
+        unhealthy_after=int(app_config.get('ROUTER_UNHEALTHY_AFTER', 2)),
+        health_timeout_s=float(app_config.get('ROUTER_HEALTH_TIMEOUT_S', 1)),
+    )
+    interval_s = float(app_config.get('ROUTER_HEALTH_INTERVAL_S', 2))
+    if interval_s > 0:
+        router.start_health_checks(interval_s)
+    return RouterApp(router, app_config)
@@ -0,0 +1,372 @@
+# ia-codex-api/app/scheduling.py
+
+"""
+Carriles de prioridad y reparto justo de las pasadas del modelo.
+
+Cada solicitud HTTP entra en un carril:
+- 'interactive': por defecto /complete (autocompletado desde el editor).
+- 'bulk': el resto (/fix, /convert, endpoints por lotes, modo archivo).
+La cabecera X-Priority (interactive o bulk) cambia el carril de una solicitud concreta.
+
+Todas las pasadas del modelo de un proceso (lotes del planificador, endpoints por lotes, caché KV por prefijo,
+generación asistida, streaming), de cualquier modelo, piden turno a una puerta común con
+PRIORITY_MAX_CONCURRENT_PASSES plazas: el recurso que se reparte es la CPU, así que una conversión masiva con
+t5 cede igual ante un autocompletado con el modelo generativo que ante otro del mismo modelo.
+- El carril interactivo pasa siempre antes que el masivo, salvo que una pasada masiva lleve esperando más de
+  PRIORITY_BULK_MAX_WAIT_S (así el carril masivo nunca se queda sin servicio).
+- Dentro de cada carril, las pasadas se reparten entre clientes (cabecera X-API-Key o, sin ella, la IP) con
+  colas justas ponderadas (WFQ): cada pasada cuesta sus tokens de entrada y de salida divididos por el peso
+  del cliente (PRIORITY_CLIENT_WEIGHTS), y se atiende primero la de menor tiempo virtual de fin.
+- Con PRIORITY_PREEMPT, una generación masiva cede su plaza entre dos pasos de decodificación cuando hay
+  una pasada interactiva esperando, y continúa (sin perder lo generado) cuando ésta termina.
+"""
+
+import contextlib
+import contextvars
+import hashlib
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from . import metrics
+
+LANES = ('interactive', 'bulk')
+
+Priority = namedtuple('Priority', ['lane', 'client'])
+
+# Prioridad del trabajo sin solicitud HTTP (CLI, scripts, precarga): no cede el turno.
+DEFAULT_PRIORITY = Priority('interactive', 'local')
+
+_config = {
+    'enabled': True,
+    'max_concurrent_passes': 1,
+    'interactive_endpoints': ('/complete',),
+    'lane_header': 'X-Priority',
+    'client_header': 'X-API-Key',
+    'client_weights': {},
+    'preempt': True,
+    'bulk_max_wait_s': 5.0,
+}
+
+_current = contextvars.ContextVar('iacodex_priority', default=None)
+_local = threading.local() # Turno que tiene el hilo (las pasadas anidadas no vuelven a pedirlo)
+
+gate = None
+
+
+def client_id(value):
+    """Identificador del cliente: la clave de API no se guarda tal cual (aparece en /stats)."""
+    return 'key:' + hashlib.sha256(value.encode('utf-8')).hexdigest()[:12]
+
+
+def classify(endpoint, header, remote_addr=None):
+    """
+    Carril y cliente de una solicitud. 'header' es una función que devuelve el valor de una cabecera
+    (o None/'' si no está); 'endpoint' es la ruta ('/complete', '/fix/batch', ...).
+    """
+    lane = (header(_config['lane_header']) or '').strip().lower()
+    if lane not in LANES:
+        lane = 'interactive' if endpoint in _config['interactive_endpoints'] else 'bulk'
+    key = header(_config['client_header'])
+    return Priority(lane, client_id(key) if key else f"ip:{remote_addr or 'desconocida'}")
+
+
+def start_request(endpoint, header, remote_addr=None):
+    """Fija el carril de la solicitud en curso. Devuelve el token para finish_request()."""
+    return _current.set(classify(endpoint, header, remote_addr))
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def current():
+    """Prioridad de la solicitud en curso (DEFAULT_PRIORITY fuera de una solicitud)."""
+    return _current.get() or DEFAULT_PRIORITY
+
+
+@contextlib.contextmanager
+def use_priority(priority):
+    """Ejecuta un bloque con la prioridad indicada (p. ej. la que envía un worker al servidor de modelos)."""
+    token = _current.set(Priority(*priority) if priority else None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+class _Turn:
+    """Turno de una pasada del modelo en la puerta (en espera o concedido)."""
+
+    __slots__ = ('gate', 'lane', 'client', 'start', 'finish', 'enqueued_at', 'queued_at', 'granted', 'preemptible')
+
+    def __init__(self, gate, lane, client):
+        self.gate = gate
+        self.lane = lane
+        self.client = client
+        self.start = 0.0 # Tiempo virtual de inicio y de fin (WFQ)
+        self.finish = 0.0
+        self.enqueued_at = time.monotonic() # Primera vez que pidió turno (para no dejarlo sin servicio)
+        self.queued_at = self.enqueued_at # Última vez que se puso en la cola (para medir la espera)
+        self.granted = False
+        self.preemptible = False
+
+    def checkpoint(self, *args, **kwargs):
+        """
+        Punto de cesión entre dos pasos de decodificación. Tiene la firma de un StoppingCriteria y devuelve
+        siempre False: nunca detiene la generación, sólo la pausa mientras pasa el carril interactivo.
+        """
+        if self.preemptible and self.gate.should_yield(self):
+            self.gate.yield_turn(self)
+        return False
+
+
+class _NoTurn:
+    """Turno de una pasada que no pasa por la puerta (priorización desactivada o pasada anidada)."""
+
+    preemptible = False
+
+    def checkpoint(self, *args, **kwargs):
+        return False
+
+
+class FairGate:
+    """
+    Puerta de las pasadas del modelo con 'slots' plazas, prioridad estricta del carril interactivo
+    (con antigüedad máxima para el masivo) y colas justas ponderadas por cliente dentro de cada carril.
+    """
+
+    def __init__(self, slots=1, bulk_max_wait_s=5.0, client_weights=None, preempt=True):
+        self.slots = max(1, int(slots))
+        self.bulk_max_wait_s = bulk_max_wait_s
+        self.client_weights = dict(client_weights or {})
+        self.preempt = preempt
+        self._cond = threading.Condition()
+        self._free = self.slots
+        self._waiting = []
+        self._waiting_interactive = 0
+        self._vtime = dict.fromkeys(LANES, 0.0)
+        self._last_finish = {} # (carril, cliente) -> tiempo virtual de fin de su última pasada
+        self._active = dict.fromkeys(LANES, 0)
+        self._stats = {
+            lane: {'granted': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'preemptions': 0, 'aged': 0}
+            for lane in LANES
+        }
+
+    def _enqueue(self, turn, cost):
+        """Pone el turno en la cola de su carril con su tiempo virtual de fin. Se llama con el cerrojo."""
+        weight = self.client_weights.get(turn.client, 1.0)
+        turn.start = max(self._vtime[turn.lane], self._last_finish.get((turn.lane, turn.client), 0.0))
+        turn.finish = turn.start + max(0.0, cost) / weight
+        turn.queued_at = time.monotonic()
+        turn.granted = False
+        self._last_finish[(turn.lane, turn.client)] = turn.finish
+        self._waiting.append(turn)
+        if turn.lane == 'interactive':
+            self._waiting_interactive += 1
+        depth = sum(1 for waiting in self._waiting if waiting.lane == turn.lane)
+        metrics.observe('iacodex_priority_queue_depth', depth, lane=turn.lane)
+
+    def _pick(self, now):
+        bulk = [turn for turn in self._waiting if turn.lane == 'bulk']
+        if bulk:
+            oldest = min(bulk, key=lambda turn: turn.enqueued_at)
+            if now - oldest.enqueued_at >= self.bulk_max_wait_s:
+                return oldest, True
+        interactive = [turn for turn in self._waiting if turn.lane == 'interactive']
+        return min(interactive or bulk, key=lambda turn: turn.finish), False
+
+    def _dispatch(self):
+        """Concede las plazas libres a los turnos en espera. Se llama con el cerrojo."""
+        granted = False
+        now = time.monotonic()
+        while self._free > 0 and self._waiting:
+            turn, aged = self._pick(now)
+            self._waiting.remove(turn)
+            if turn.lane == 'interactive':
+                self._waiting_interactive -= 1
+            self._free -= 1
+            self._active[turn.lane] += 1
+            self._vtime[turn.lane] = max(self._vtime[turn.lane], turn.start)
+            self._expire(turn.lane)
+            # Una pasada masiva que entra por antigüedad no vuelve a ceder el turno.
+            turn.preemptible = self.preempt and turn.lane == 'bulk' and not aged
+            turn.granted = True
+            granted = True
+
+            waited = now - turn.queued_at
+            stats = self._stats[turn.lane]
+            stats['granted'] += 1
+            stats['wait_seconds'] += waited
+            stats['max_wait_seconds'] = max(stats['max_wait_seconds'], waited)
+            stats['aged'] += 1 if aged else 0
+            metrics.observe('iacodex_priority_wait_seconds', waited, lane=turn.lane)
+        if granted:
+            self._cond.notify_all()
+
+    def _expire(self, lane):
+        """
+        Olvida a los clientes inactivos del carril. Se llama con el cerrojo. Un cliente cuyo último fin no supera
+        el tiempo virtual del carril empezaría igual sin entrada; con el carril vacío, todos empiezan a la par.
+        """
+        idle = self._active[lane] == 0 and not any(turn.lane == lane for turn in self._waiting)
+        if idle:
+            self._vtime[lane] = max(
+                [self._vtime[lane]] + [finish for (other, _), finish in self._last_finish.items() if other == lane]
+            )
+        vtime = self._vtime[lane]
+        for key in [key for key, finish in self._last_finish.items() if key[0] == lane and (idle or finish <= vtime)]:
+            del self._last_finish[key]
+
+    def _wait_granted(self, turn):
+        while not turn.granted:
+            self._cond.wait()
+
+    def acquire(self, priority, cost):
+        turn = _Turn(self, priority.lane, priority.client)
+        with self._cond:
+            self._enqueue(turn, cost)
+            self._dispatch()
+            self._wait_granted(turn)
+        return turn
+
+    def release(self, turn):
+        with self._cond:
+            self._free += 1
+            self._active[turn.lane] -= 1
+            turn.granted = False
+            self._dispatch()
+            self._expire(turn.lane)
+
+    def should_yield(self, turn):
+        return turn.lane == 'bulk' and self._waiting_interactive > 0
+
+    def yield_turn(self, turn):
+        """Cede la plaza a las pasadas interactivas en espera y espera a recuperarla."""
+        with self._cond:
+            self._stats[turn.lane]['preemptions'] += 1
+            self._free += 1
+            self._active[turn.lane] -= 1
+            self._enqueue(turn, 0) # Conserva su antigüedad: si espera demasiado, entra sin ceder más
+            self._dispatch()
+            self._wait_granted(turn)
+        metrics.inc('iacodex_priority_preemptions', lane=turn.lane)
+
+    def stats(self):
+        with self._cond:
+            lanes = {}
+            for lane in LANES:
+                stats = self._stats[lane]
+                granted = stats['granted']
+                lanes[lane] = {
+                    'waiting': sum(1 for turn in self._waiting if turn.lane == lane),
+                    'active': self._active[lane],
+                    'granted': granted,
+                    'avg_wait_ms': round(stats['wait_seconds'] / granted * 1000, 3) if granted else 0.0,
+                    'max_wait_ms': round(stats['max_wait_seconds'] * 1000, 3),
+                    'preemptions': stats['preemptions'],
+                    'aged': stats['aged'],
+                }
+            return {'slots': self.slots, 'free': self._free, 'clients': len({client for _, client in self._last_finish}), 'lanes': lanes}
+
+
+@contextlib.contextmanager
+def model_pass(cost, priority=None):
+    """
+    Pide turno para una pasada del modelo que procesa unos 'cost' tokens (entrada + salida) con la prioridad
+    indicada (por defecto, la de la solicitud en curso). Devuelve el turno: su método checkpoint() es el punto
+    de cesión entre pasos de decodificación (ver stopping_criteria()).
+    Las pasadas anidadas en el mismo hilo reutilizan el turno que ya tiene.
+    """
+    if gate is None or getattr(_local, 'turn', None) is not None:
+        yield _NoTurn()
+        return
+    turn = gate.acquire(priority or current(), cost)
+    _local.turn = turn
+    try:
+        yield turn
+    finally:
+        _local.turn = None
+        gate.release(turn)
+
+
+def stopping_criteria(turn, pipeline):
+    """
+    Criterios de parada para pasar a generate() con el punto de cesión del turno, o None si la pasada
+    no cede el turno. El pipeline falso acepta una lista de funciones; transformers, un StoppingCriteriaList.
+    """
+    if not turn.preemptible:
+        return None
+    if getattr(pipeline, 'is_stub', False):
+        return [turn.checkpoint]
+    try:
+        from transformers import StoppingCriteria, StoppingCriteriaList
+    except ImportError:
+        return None
+
+    class _YieldCriteria(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return turn.checkpoint()
+
+    return StoppingCriteriaList([_YieldCriteria()])
+
+
+def estimate_cost(prompts, max_new_tokens):
+    """Coste aproximado de una pasada en tokens (~4 caracteres por token de entrada)."""
+    return sum(len(prompt) // 4 + 1 for prompt in prompts) + len(prompts) * int(max_new_tokens or 0)
+
+
+def parse_weights(value):
+    """Convierte 'clave1=4,clave2=0.5' en {cliente: peso}."""
+    weights = {}
+    for item in (value or '').split(','):
+        if not item.strip():
+            continue
+        key, sep, weight = item.rpartition('=')
+        if not sep or not key.strip():
+            raise ValueError(f"Peso de cliente no válido: '{item.strip()}' (formato clave=peso).")
+        weights[client_id(key.strip())] = max(float(weight), 0.01)
+    return weights
+
+
+def init_scheduling(app_config):
+    """Configura los carriles de prioridad a partir de la configuración de la aplicación."""
+    global gate
+    _config['enabled'] = app_config.get('PRIORITY_ENABLED', True)
+    _config['max_concurrent_passes'] = int(app_config.get('PRIORITY_MAX_CONCURRENT_PASSES', 1))
+    _config['interactive_endpoints'] = tuple(
+        endpoint.strip() for endpoint in str(app_config.get('PRIORITY_INTERACTIVE_ENDPOINTS', '/complete')).split(',')
+        if endpoint.strip()
+    )
+    _config['lane_header'] = app_config.get('PRIORITY_HEADER', 'X-Priority')
+    _config['client_header'] = app_config.get('PRIORITY_CLIENT_HEADER', 'X-API-Key')
+    _config['preempt'] = app_config.get('PRIORITY_PREEMPT', True)
+    _config['bulk_max_wait_s'] = float(app_config.get('PRIORITY_BULK_MAX_WAIT_S', 5))
+    try:
+        _config['client_weights'] = parse_weights(app_config.get('PRIORITY_CLIENT_WEIGHTS', ''))
+    except ValueError as e:
+        print(f"Error en PRIORITY_CLIENT_WEIGHTS: {e} Se usa peso 1 para todos los clientes.", file=sys.stderr)
+        _config['client_weights'] = {}
+
+    if not _config['enabled']:
+        gate = None
+        return
+    gate = FairGate(
+        slots=_config['max_concurrent_passes'],
+        bulk_max_wait_s=_config['bulk_max_wait_s'],
+        client_weights=_config['client_weights'],
+        preempt=_config['preempt'],
+    )
+
+
+def get_stats():
+    if gate is None:
+        return {'enabled': False}
+    return dict(
+        gate.stats(),
+        enabled=True,
+        preempt=_config['preempt'],
+        bulk_max_wait_s=_config['bulk_max_wait_s'],
+        interactive_endpoints=list(_config['interactive_endpoints']),
+    )
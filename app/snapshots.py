@@ -0,0 +1,195 @@
+# ia-codex-api/app/snapshots.py
+
+"""
+Instantáneas de modelos para arrancar los workers deprisa (scripts/snapshot_models.py las genera).
+
+Cada modelo registrado se exporta a MODEL_SNAPSHOT_DIR/<nombre>/ con:
+- <variante>/model.safetensors: los pesos ('fp32' y, si se pide, una copia 'bf16'), con config.json
+  y generation_config.json, cargables también con from_pretrained().
+- <variante>/iacodex_buffers.safetensors: los buffers no persistentes (máscaras, frecuencias rotatorias),
+  que no están en el state_dict pero hacen falta para construir el modelo sin inicializarlo.
+- <variante>/tokenizer.json y demás ficheros del tokenizer rápido, ya construido.
+- iacodex_snapshot.json: el modelo de origen, su revisión y las variantes exportadas.
+
+En CPU, los pesos se cargan sin copiarlos: el fichero se mapea en memoria (copia al escribir) y cada
+tensor del modelo apunta a su región del mapa. El arranque no deserializa nada y los workers de una
+misma máquina comparten las mismas páginas de la caché del sistema de ficheros.
+La cuantización int8 no se exporta: se aplica al cargar, sobre los pesos fp32 mapeados.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+MANIFEST = 'iacodex_snapshot.json'
+WEIGHTS = 'model.safetensors'
+BUFFERS = 'iacodex_buffers.safetensors'
+VARIANTS = ('fp32', 'bf16')
+
+# Tipos de safetensors -> nombre del dtype de torch
+_DTYPES = {
+    'F64': 'float64', 'F32': 'float32', 'F16': 'float16', 'BF16': 'bfloat16',
+    'I64': 'int64', 'I32': 'int32', 'I16': 'int16', 'I8': 'int8', 'U8': 'uint8', 'BOOL': 'bool',
+}
+
+
+def read_manifest(snapshot_dir, name):
+    """Manifiesto de la instantánea del modelo 'name', o None si no existe o no se puede leer."""
+    path = os.path.join(snapshot_dir, name, MANIFEST)
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def find_snapshot(snapshot_dir, name, model_name, variant='fp32'):
+    """
+    Directorio de la instantánea de 'name' para la variante pedida (o fp32 si no se exportó),
+    o None si no hay instantánea o es de otro modelo (el .env cambió desde que se generó).
+    """
+    if not snapshot_dir:
+        return None
+    manifest = read_manifest(snapshot_dir, name)
+    if manifest is None:
+        return None
+    if manifest.get('model') != model_name:
+        print(
+            f"Aviso: la instantánea de '{name}' es de '{manifest.get('model')}' y el modelo configurado es "
+            f"'{model_name}'; se ignora (vuelve a ejecutar scripts/snapshot_models.py).",
+            file=sys.stderr
+        )
+        return None
+    variants = manifest.get('variants', [])
+    chosen = variant if variant in variants else 'fp32' if 'fp32' in variants else None
+    if chosen is None:
+        return None
+    return os.path.join(snapshot_dir, name, chosen), manifest, chosen
+
+
+def mmap_safetensors(path):
+    """
+    Lee un fichero safetensors sin copiar los datos: cada tensor es una vista de un mapa en memoria
+    privado (copia al escribir), así que sus páginas se comparten con los demás procesos que lo mapean.
+    """
+    import torch
+
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    header_length = struct.unpack('<Q', mapped[:8])[0]
+    header = json.loads(mapped[8:8 + header_length])
+    base = 8 + header_length
+    tensors = {}
+    for key, info in header.items():
+        if key == '__metadata__':
+            continue
+        dtype = getattr(torch, _DTYPES[info['dtype']])
+        start, end = info['data_offsets']
+        count = (end - start) // torch.empty((), dtype=dtype).element_size()
+        if count == 0:
+            tensors[key] = torch.empty(info['shape'], dtype=dtype)
+            continue
+        tensors[key] = torch.frombuffer(mapped, dtype=dtype, count=count, offset=base + start).reshape(info['shape'])
+    return tensors
+
+
+def _model_class(task):
+    from transformers import AutoModelForCausalLM, AutoModelForSeq2SeqLM
+    return AutoModelForCausalLM if task == 'text-generation' else AutoModelForSeq2SeqLM
+
+
+def _load_model_mmap(path, task):
+    """
+    Construye el modelo sin inicializar sus pesos (dispositivo 'meta') y le asigna los tensores mapeados.
+    Lanza RuntimeError si algún parámetro o buffer queda sin valor.
+    """
+    import torch
+    from transformers import AutoConfig
+
+    config = AutoConfig.from_pretrained(path)
+    with torch.device('meta'):
+        model = _model_class(task).from_config(config)
+    model.load_state_dict(mmap_safetensors(os.path.join(path, WEIGHTS)), strict=False, assign=True)
+    buffers_path = os.path.join(path, BUFFERS)
+    if os.path.exists(buffers_path):
+        for key, tensor in mmap_safetensors(buffers_path).items():
+            module_name, _, buffer_name = key.rpartition('.')
+            model.get_submodule(module_name)._buffers[buffer_name] = tensor
+    model.tie_weights() # Los pesos compartidos (p. ej. lm_head y embeddings) se guardan una sola vez
+    missing = [key for key, tensor in list(model.named_parameters()) + list(model.named_buffers()) if tensor.is_meta]
+    if missing:
+        raise RuntimeError(f"faltan tensores en la instantánea: {', '.join(missing[:5])}")
+    try:
+        from transformers import GenerationConfig
+        model.generation_config = GenerationConfig.from_pretrained(path)
+    except OSError:
+        pass # Sin generation_config.json: se queda la derivada de config.json
+    return model.eval()
+
+
+def load_pipeline(snapshot, task, device):
+    """
+    Carga el pipeline de una instantánea (ver find_snapshot). En CPU los pesos se mapean sin copiarlos;
+    en GPU se cargan con from_pretrained() en fp16. La revisión del modelo es la del modelo de origen,
+    así que las claves de caché no cambian por usar la instantánea.
+    """
+    import torch
+    from transformers import AutoTokenizer, pipeline
+
+    path, manifest, _ = snapshot
+    tokenizer = AutoTokenizer.from_pretrained(path, use_fast=True)
+    if device == -1:
+        model = _load_model_mmap(path, task)
+    else:
+        model = _model_class(task).from_pretrained(path, torch_dtype=torch.float16)
+    model.config.name_or_path = manifest['model']
+    model.config._commit_hash = manifest.get('revision')
+    return pipeline(task, model=model, tokenizer=tokenizer, device=device)
+
+
+def _non_persistent_buffers(model):
+    """Buffers que no forman parte del state_dict (se exportan aparte)."""
+    state_keys = set(model.state_dict())
+    return {key: tensor.detach().clone().contiguous() for key, tensor in model.named_buffers() if key not in state_keys}
+
+
+def export_pipeline(pipe, output_dir, name, kind, task, model_name, variants=('fp32',)):
+    """
+    Exporta un pipeline ya cargado (pesos fp32 sin cuantizar) como instantánea en output_dir/<nombre>/.
+    Devuelve el manifiesto escrito. La variante bf16 se exporta la última: convierte el modelo en su sitio.
+    """
+    import torch
+    from safetensors.torch import save_file
+
+    for variant in variants:
+        if variant not in VARIANTS:
+            raise ValueError(f"Variante desconocida: '{variant}' (debe ser {' o '.join(VARIANTS)}).")
+    model = pipe.model
+    target = os.path.join(output_dir, name)
+    exported = []
+    for variant in sorted(set(variants), key=VARIANTS.index):
+        path = os.path.join(target, variant)
+        if variant == 'bf16':
+            model = model.to(dtype=torch.bfloat16)
+        model.save_pretrained(path, safe_serialization=True)
+        buffers = _non_persistent_buffers(model)
+        if buffers:
+            save_file(buffers, os.path.join(path, BUFFERS))
+        pipe.tokenizer.save_pretrained(path)
+        exported.append(variant)
+
+    manifest = {
+        'name': name,
+        'kind': kind,
+        'task': task,
+        'model': model_name,
+        'revision': getattr(model.config, '_commit_hash', None),
+        'variants': exported,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+    with open(os.path.join(target, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
@@ -0,0 +1,426 @@
+# ia-codex-api/app/stopping.py
+
+"""
+Criterios de parada conscientes del código: la generación termina en cuanto la salida útil está completa,
+en lugar de decodificar siempre hasta max_new_tokens.
+
+Cada solicitud lleva una StopRule con:
+- Secuencias de parada (campo 'stop'): la salida se corta justo antes de la primera que aparezca.
+- En /complete (continuación del prompt), si se pide ('stop_at_block_end' o STOP_AT_BLOCK_END), fin del bloque
+  en el que está el cursor:
+  - Lenguajes por sangría (Python, Ruby): la primera línea con menos sangría que el bloque del cursor
+    (en Ruby se conserva el 'end' que lo cierra), o dos líneas en blanco seguidas.
+  - Lenguajes con llaves (JavaScript, Java, C++, Go...): la llave que cierra el bloque del cursor
+    (o, en el nivel superior, el primer bloque completo), contando las llaves del prompt sin las de
+    cadenas y comentarios; se conserva el resto de esa línea.
+- En /fix y /convert (salida completa), reglas del lenguaje ('language' o 'target_language'): con llaves,
+  una llave de cierre sin abrir indica que el modelo ya terminó y empieza a divagar.
+
+Durante la generación, un StoppingCriteria por fila del lote decodifica los tokens nuevos (el texto de
+cada fila se guarda entre pasos) y marca la fila como terminada; después, la salida se recorta en el punto exacto (truncate). En streaming, filter_stream
+retiene sólo lo que todavía podría recortarse.
+"""
+
+import re
+
+from . import metrics
+
+MAX_STOP_SEQUENCES = 4
+MAX_STOP_LENGTH = 64
+
+# Estilo de bloque de cada lenguaje: 'indent' (por sangría) o 'braces' (por llaves).
+LANGUAGES = {
+    'python': {
+        'style': 'indent',
+        'opener': re.compile(r':\s*(#.*)?$'),
+        'continuers': ('elif', 'else', 'except', 'finally'),
+    },
+    'ruby': {
+        'style': 'indent',
+        'opener': re.compile(r'^\s*(def|class|module|if|unless|while|until|case|begin|for)\b|\bdo(\s*\|[^|]*\|)?\s*$'),
+        'continuers': ('elsif', 'else', 'when', 'in', 'rescue', 'ensure'),
+        'closer': 'end',
+    },
+    'javascript': {'style': 'braces'},
+    'typescript': {'style': 'braces'},
+    'java': {'style': 'braces'},
+    'c': {'style': 'braces'},
+    'c++': {'style': 'braces'},
+    'c#': {'style': 'braces'},
+    'go': {'style': 'braces'},
+    'rust': {'style': 'braces'},
+    'php': {'style': 'braces'},
+    'kotlin': {'style': 'braces'},
+    'swift': {'style': 'braces'},
+}
+
+_BLANK_LINES = re.compile(r'\n[ \t]*\n[ \t]*\n')
+_FIRST_WORD = re.compile(r'[A-Za-z_]+')
+
+_config = {
+    'block_end': False,          # STOP_AT_BLOCK_END: valor por defecto de 'stop_at_block_end' en /complete
+    'complete_language': 'python', # COMPLETE_LANGUAGE: lenguaje de /complete si la solicitud no lo indica
+    'language_rules': True,      # STOP_LANGUAGE_RULES: reglas por lenguaje en /fix y /convert
+    'return_full_text': True,    # COMPLETE_RETURN_FULL_TEXT: /complete devuelve prompt + generación
+}
+
+
+def _indent_width(line):
+    return len(line[:len(line) - len(line.lstrip(' \t'))].expandtabs(4))
+
+
+def _brace_events(text):
+    """Posiciones de las llaves de un texto, sin las de cadenas ni comentarios (// y /* */)."""
+    i, length = 0, len(text)
+    while i < length:
+        ch = text[i]
+        if ch in '"\'`':
+            i += 1
+            while i < length and text[i] != ch:
+                if text[i] == '\\':
+                    i += 1
+                elif text[i] == '\n' and ch != '`':
+                    break # Cadena sin cerrar en la línea: se deja de considerar cadena
+                i += 1
+        elif text.startswith('//', i):
+            newline = text.find('\n', i)
+            i = length if newline == -1 else newline
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = length if end == -1 else end + 1
+        elif ch in '{}':
+            yield i, ch
+        i += 1
+
+
+def _brace_depth(text):
+    depth = 0
+    for _, ch in _brace_events(text):
+        depth = depth + 1 if ch == '{' else max(depth - 1, 0)
+    return depth
+
+
+class StopRule:
+    """
+    Reglas de parada de una solicitud. find_end() devuelve (posición de corte, motivo) en el texto generado
+    o None si la salida todavía no ha terminado; con final=True, el texto ya no va a crecer.
+    """
+
+    __slots__ = ('stop', 'language', 'mode', 'block_end', 'threshold', 'depth')
+
+    def __init__(self, stop=(), language=None, block_end=False, prompt='', mode='continuation'):
+        self.stop = tuple(stop)
+        self.language = language if language in LANGUAGES else None
+        self.mode = mode # 'continuation' (/complete) o 'whole' (/fix y /convert)
+        # En la salida completa sólo hay reglas de bloque para los lenguajes con llaves.
+        self.block_end = bool(block_end) and self.language is not None and (
+            mode == 'continuation' or LANGUAGES[self.language]['style'] == 'braces'
+        )
+        self.threshold = 0 # Sangría mínima de las líneas del bloque del cursor
+        self.depth = 0     # Llaves abiertas en el prompt
+        if self.block_end and mode == 'continuation':
+            spec = LANGUAGES[self.language]
+            if spec['style'] == 'indent':
+                lines = [line for line in prompt.split('\n') if line.strip()]
+                if lines:
+                    opens = spec['opener'].search(lines[-1]) is not None
+                    self.threshold = _indent_width(lines[-1]) + (1 if opens else 0)
+            else:
+                self.depth = _brace_depth(prompt)
+
+    @property
+    def active(self):
+        return bool(self.stop) or self.block_end
+
+    def signature(self):
+        """Identifica las reglas para las claves de caché (cambian la salida)."""
+        return repr((self.stop, self.language if self.block_end else None, self.mode))
+
+    def _stop_sequence_end(self, text):
+        positions = [position for position in (text.find(stop) for stop in self.stop) if position != -1]
+        return (min(positions), 'stop_sequence') if positions else None
+
+    def _indent_end(self, text, final):
+        spec = LANGUAGES[self.language]
+        newline = text.find('\n')
+        while newline != -1:
+            start = newline + 1
+            newline = text.find('\n', start)
+            line = text[start:] if newline == -1 else text[start:newline]
+            stripped = line.strip()
+            indent = _indent_width(line)
+            if not stripped or indent >= self.threshold:
+                continue
+            word = _FIRST_WORD.match(stripped)
+            word = word.group(0) if word else ''
+            if newline == -1 and not final and word == stripped:
+                return None # Palabra a medias: puede ser 'else', 'end'...
+            if word in spec.get('continuers', ()) and indent >= self.threshold - 1:
+                continue # 'else:' / 'except:' al nivel de la cabecera: la sentencia compuesta sigue
+            if word == spec.get('closer'):
+                if newline == -1 and not final:
+                    return None # Se espera al final de la línea que cierra el bloque
+                return len(line.rstrip()) + start, 'block_end'
+            return len(text[:start].rstrip()), 'block_end'
+        return None
+
+    def _braces_end(self, text, final):
+        depth = self.depth
+        for position, ch in _brace_events(text):
+            if ch == '{':
+                depth += 1
+                continue
+            depth -= 1
+            if self.mode == 'whole':
+                if depth < 0:
+                    return len(text[:position].rstrip()), 'unbalanced'
+                continue
+            if depth < self.depth or (self.depth == 0 and depth == 0):
+                newline = text.find('\n', position)
+                rest = text[position + 1:] if newline == -1 else text[position + 1:newline]
+                if '{' in rest:
+                    continue # '} else {': el bloque sigue
+                if newline == -1 and not final:
+                    return None
+                return len(text[:len(text) if newline == -1 else newline].rstrip()), 'block_end'
+        return None
+
+    def _blank_lines_end(self, text):
+        for match in _BLANK_LINES.finditer(text):
+            if text[:match.start()].strip():
+                return len(text[:match.start()].rstrip()), 'block_end'
+        return None
+
+    def find_end(self, text, final=False):
+        ends = []
+        if self.stop:
+            ends.append(self._stop_sequence_end(text))
+        if self.block_end:
+            style = LANGUAGES[self.language]['style']
+            if self.mode == 'continuation':
+                ends.append(self._blank_lines_end(text))
+                if style == 'indent' and self.threshold > 0:
+                    ends.append(self._indent_end(text, final))
+            if style == 'braces':
+                ends.append(self._braces_end(text, final))
+        ends = [end for end in ends if end is not None]
+        return min(ends) if ends else None
+
+    def safe_length(self, text):
+        """Longitud del texto que ya no puede recortarse (se puede emitir en streaming)."""
+        safe = len(text.rstrip()) if self.block_end else len(text)
+        if self.stop:
+            safe = min(safe, len(text) - max(len(stop) for stop in self.stop) + 1)
+        return max(safe, 0)
+
+    def truncate(self, text, operation=None):
+        """Recorta la salida completa en su punto de parada y cuenta el motivo en las métricas."""
+        end = self.find_end(text, final=True)
+        if end is None:
+            return text
+        if operation is not None:
+            metrics.inc('iacodex_early_stops', endpoint=operation, reason=end[1])
+        return text[:end[0]]
+
+
+def parse_stop(value):
+    """Valida el campo 'stop' (cadena o lista de cadenas). Lanza ValueError si no es válido."""
+    if value is None:
+        return ()
+    stops = [value] if isinstance(value, str) else value
+    if not isinstance(stops, list) or not all(isinstance(stop, str) and stop for stop in stops):
+        raise ValueError("El campo 'stop' debe ser una cadena o una lista de cadenas no vacías.")
+    if len(stops) > MAX_STOP_SEQUENCES or any(len(stop) > MAX_STOP_LENGTH for stop in stops):
+        raise ValueError(
+            f"El campo 'stop' admite hasta {MAX_STOP_SEQUENCES} secuencias de {MAX_STOP_LENGTH} caracteres como máximo."
+        )
+    return tuple(stops)
+
+
+def _bool_field(data, name, default):
+    value = data.get(name, default)
+    if not isinstance(value, bool):
+        raise ValueError(f"El campo '{name}' debe ser true o false.")
+    return value
+
+
+def _language_field(data, name, default=None):
+    value = data.get(name, default)
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"El campo '{name}' debe ser una cadena.")
+    return value.strip().lower()
+
+
+def completion_options(data, prompt):
+    """
+    Reglas de parada de /complete y si la respuesta incluye el prompt. Devuelve (StopRule o None,
+    return_full_text). Lanza ValueError si algún campo no es válido.
+    """
+    rule = StopRule(
+        stop=parse_stop(data.get('stop')),
+        language=_language_field(data, 'language', _config['complete_language']),
+        block_end=_bool_field(data, 'stop_at_block_end', _config['block_end']),
+        prompt=prompt,
+    )
+    return (rule if rule.active else None), _bool_field(data, 'return_full_text', _config['return_full_text'])
+
+
+def output_rule(data, language=None):
+    """Reglas de parada de /fix y /convert (salida completa), o None. Lanza ValueError si no son válidas."""
+    language = language.strip().lower() if language else _language_field(data, 'language')
+    rule = StopRule(
+        stop=parse_stop(data.get('stop')), language=language, block_end=_config['language_rules'], mode='whole'
+    )
+    return rule if rule.active else None
+
+
+def _per_row_supported():
+    """transformers >= 4.39 admite un resultado por fila en los StoppingCriteria."""
+    try:
+        from transformers.generation.stopping_criteria import EosTokenCriteria # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class IncrementalDecoder:
+    """
+    Texto generado por una fila, decodificado a medida que llegan los tokens. Cada paso sólo decodifica
+    los tokens desde el último punto estable (normalmente el anterior y el nuevo, para que el tokenizer
+    resuelva los espacios entre ellos), no toda la salida: decodificarla entera en cada paso cuesta
+    O(n²) por solicitud. Si el último token deja un carácter a medias ('\ufffd', UTF-8 partido entre
+    tokens), el texto no avanza hasta que llega el resto.
+    """
+
+    __slots__ = ('tokenizer', 'ids', 'text', 'prefix_offset', 'read_offset')
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.ids = []
+        self.text = ''
+        self.prefix_offset = 0 # Inicio de la ventana que se vuelve a decodificar
+        self.read_offset = 0   # Tokens ya incluidos en 'text'
+
+    def push(self, token_ids):
+        """Añade los tokens nuevos de la fila y devuelve el texto decodificado hasta ahora."""
+        self.ids.extend(token_ids)
+        prefix = self.tokenizer.decode(self.ids[self.prefix_offset:self.read_offset], skip_special_tokens=True)
+        window = self.tokenizer.decode(self.ids[self.prefix_offset:], skip_special_tokens=True)
+        if len(window) > len(prefix) and not window.endswith('\ufffd'):
+            self.text += window[len(prefix):]
+            self.prefix_offset = self.read_offset
+            self.read_offset = len(self.ids)
+        return self.text
+
+
+class TextStopCriteria:
+    """
+    StoppingCriteria que decodifica lo generado en cada fila y la da por terminada cuando su regla
+    encuentra el final. 'rules' tiene una regla (o None) por fila; 'prompt_length' es la longitud de
+    input_ids antes de generar (si no se indica, se deduce en la primera llamada, tras el primer token).
+    Cada fila guarda su texto y sólo decodifica los tokens nuevos (ver IncrementalDecoder).
+    El pipeline falso pasa directamente los textos generados en 'generated_texts'.
+    """
+
+    def __init__(self, rules, tokenizer=None, prompt_length=None):
+        self.rules = rules
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.done = [False] * len(rules)
+        self.per_row = tokenizer is None or _per_row_supported()
+        self.decoders = [IncrementalDecoder(tokenizer) for _ in rules] if tokenizer is not None else None
+
+    def __call__(self, input_ids, scores, generated_texts=None, **kwargs):
+        if generated_texts is None and self.prompt_length is None:
+            self.prompt_length = input_ids.shape[1] - 1
+        for row, rule in enumerate(self.rules):
+            if rule is None or self.done[row]:
+                continue
+            if generated_texts is not None:
+                text = generated_texts[row]
+            else:
+                decoder = self.decoders[row]
+                text = decoder.push(input_ids[row, self.prompt_length + len(decoder.ids):].tolist())
+            self.done[row] = rule.find_end(text) is not None
+        if generated_texts is not None:
+            return list(self.done)
+        if not self.per_row:
+            return all(done or rule is None for done, rule in zip(self.done, self.rules))
+        import torch
+        return torch.tensor(self.done, dtype=torch.bool, device=input_ids.device)
+
+
+def generation_criteria(pipeline, rules, num_return_sequences=1, prompt_length=None):
+    """
+    Criterios de parada para una pasada con una regla (o None) por prompt, en el formato que acepta
+    el pipeline (lista de funciones para el falso, StoppingCriteriaList para transformers), o None.
+    """
+    if not rules or not any(rule is not None for rule in rules):
+        return None
+    rows = [rule for rule in rules for _ in range(num_return_sequences)]
+    if getattr(pipeline, 'is_stub', False):
+        return [TextStopCriteria(rows)]
+    try:
+        from transformers import StoppingCriteria, StoppingCriteriaList
+    except ImportError:
+        return None
+
+    class _TextStop(StoppingCriteria):
+        def __init__(self):
+            self.criteria = TextStopCriteria(rows, pipeline.tokenizer, prompt_length)
+
+        def __call__(self, input_ids, scores, **kwargs):
+            return self.criteria(input_ids, scores)
+
+    return StoppingCriteriaList([_TextStop()])
+
+
+def merge_criteria(*criteria_lists):
+    """Une varias listas de criterios de parada (las que no son None) conservando el tipo de la primera."""
+    lists = [criteria for criteria in criteria_lists if criteria]
+    if not lists:
+        return None
+    return type(lists[0])([criteria for criteria_list in lists for criteria in criteria_list])
+
+
+def filter_stream(chunks, rule, operation=None):
+    """
+    Filtra los fragmentos de una generación en streaming: emite sólo el texto que ya no puede recortarse
+    y, cuando la regla encuentra el final, emite el resto hasta el corte y cierra la generación.
+    """
+    if rule is None:
+        yield from chunks
+        return
+    text = ''
+    emitted = 0
+    try:
+        for chunk in chunks:
+            text += chunk
+            end = rule.find_end(text)
+            if end is not None:
+                if operation is not None:
+                    metrics.inc('iacodex_early_stops', endpoint=operation, reason=end[1])
+                if end[0] > emitted:
+                    yield text[emitted:end[0]]
+                return
+            safe = rule.safe_length(text)
+            if safe > emitted:
+                yield text[emitted:safe]
+                emitted = safe
+        cut = len(rule.truncate(text, operation))
+        if cut > emitted:
+            yield text[emitted:cut]
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close() # Detiene la generación en cuanto la salida está completa
+
+
+def init_stopping(app_config):
+    """Configura los criterios de parada a partir de la configuración de la aplicación."""
+    _config['block_end'] = bool(app_config.get('STOP_AT_BLOCK_END', False))
+    _config['complete_language'] = (app_config.get('COMPLETE_LANGUAGE') or 'python').strip().lower()
+    _config['language_rules'] = bool(app_config.get('STOP_LANGUAGE_RULES', True))
+    _config['return_full_text'] = bool(app_config.get('COMPLETE_RETURN_FULL_TEXT', True))
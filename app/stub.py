@@ -0,0 +1,139 @@
+# ia-codex-api/app/stub.py
+
+"""
+Pipeline falso y determinista para benchmarks y pruebas sin descargar modelos (MODEL_STUB=True).
+
+Imita la interfaz de los pipelines de transformers que usa la API (llamada por lotes, tokenizer,
+streaming y caché por prefijo) y simula el coste de la generación con un retardo fijo por token.
+Como en un modelo real con batching, un lote de N prompts tarda lo mismo que uno solo.
+Cada token generado son exactamente 4 caracteres, así que los benchmarks pueden contar tokens por la longitud.
+"""
+
+import hashlib
+import time
+from types import SimpleNamespace
+
+from . import metrics
+
+
+class StubTokenizer:
+    """Tokenizer aproximado: un token cada 4 caracteres."""
+
+    def __call__(self, text, **kwargs):
+        return {'input_ids': list(range((len(text) + 3) // 4))}
+
+
+class StubPipeline:
+    is_stub = True
+
+    def __init__(self, task, model_name, token_delay_s=0.005):
+        self.task = task
+        self.token_delay_s = token_delay_s
+        self.tokenizer = StubTokenizer()
+        self.model = SimpleNamespace(config=SimpleNamespace(name_or_path=f"stub:{model_name}", _commit_hash='stub'))
+
+    def _tokens(self, prompt, max_new_tokens, sequence=0):
+        """Tokens deterministas (4 caracteres cada uno) que dependen del prompt y del número de secuencia."""
+        seed = hashlib.sha256(f"{sequence}:{prompt}".encode()).hexdigest()
+        return [f" {seed[(i * 3) % 60:(i * 3) % 60 + 3]}" for i in range(max_new_tokens)]
+
+    def _sleep_generation(self, max_new_tokens, stopping_criteria=None, rows=None):
+        """
+        Simula la generación: el primer token (prefill) y el resto (decode), medidos como en un modelo real.
+        Con 'stopping_criteria' (funciones con la firma de un StoppingCriteria), se llaman tras cada token
+        con el texto generado de cada fila ('rows': sus tokens) y cada fila termina cuando alguna devuelve
+        True para ella (o True para todo el lote). Devuelve los tokens generados por fila.
+        """
+        rows = rows or [[]]
+        lengths = [max_new_tokens] * len(rows)
+        with metrics.generation_stages():
+            time.sleep(self.token_delay_s)
+            metrics.mark_forward()
+            if not stopping_criteria:
+                time.sleep(self.token_delay_s * max(0, max_new_tokens - 1))
+                return lengths
+            texts = [''.join(tokens[:1]) for tokens in rows]
+            for step in range(1, max_new_tokens):
+                for criteria in stopping_criteria:
+                    done = criteria(None, None, generated_texts=texts)
+                    for row, row_done in enumerate([done] * len(rows) if isinstance(done, bool) else done):
+                        if row_done and lengths[row] == max_new_tokens:
+                            lengths[row] = step
+                if all(length < max_new_tokens for length in lengths):
+                    return lengths
+                time.sleep(self.token_delay_s)
+                texts = [text + ''.join(tokens[step:step + 1]) for text, tokens in zip(texts, rows)]
+        return lengths
+
+    def _result(self, prompt, tokens, return_full_text):
+        text = ''.join(tokens)
+        return {'generated_text': prompt + text if return_full_text and self.task == 'text-generation' else text}
+
+    def __call__(self, inputs, batch_size=None, max_new_tokens=256, num_return_sequences=1,
+                 return_full_text=True, stopping_criteria=None, **params):
+        prompts = [inputs] if isinstance(inputs, str) else list(inputs)
+        rows = [
+            self._tokens(prompt, max_new_tokens, sequence) for prompt in prompts for sequence in range(num_return_sequences)
+        ]
+        lengths = self._sleep_generation(max_new_tokens, stopping_criteria, rows) # Todo el lote avanza a la vez
+        outputs = [
+            [
+                self._result(prompt, rows[row][:lengths[row]], return_full_text)
+                for row in range(index * num_return_sequences, (index + 1) * num_return_sequences)
+            ]
+            for index, prompt in enumerate(prompts)
+        ]
+        return outputs[0] if isinstance(inputs, str) else outputs
+
+    def stream(self, prompt, max_new_tokens=256, **params):
+        for token in self._tokens(prompt, max_new_tokens):
+            time.sleep(self.token_delay_s)
+            yield token
+
+    def prefix_generate(self, prompt, max_new_tokens=256, session_id=None, stopping_criteria=None, **params):
+        tokens = self._tokens(prompt, max_new_tokens)
+        (length,) = self._sleep_generation(max_new_tokens, stopping_criteria, [tokens])
+        return [self._result(prompt, tokens[:length], True)]
+
+    def assisted_generate(self, prompt, max_new_tokens=256, stopping_criteria=None, **params):
+        """
+        Generación asistida simulada: la misma salida que sin borrador y un borrador que siempre acierta
+        (cada pasada del modelo principal acepta ASSISTED_NUM_TOKENS tokens y aporta uno propio).
+        """
+        from . import models
+
+        tokens = self._tokens(prompt, max_new_tokens)
+        (length,) = self._sleep_generation(max_new_tokens, stopping_criteria, [tokens])
+        per_forward = models._assisted_config['num_tokens'] + 1
+        main_forwards = -(-length // per_forward)
+        models.record_assisted(self.model.config.name_or_path, length, main_forwards, length - main_forwards)
+        return [self._result(prompt, tokens[:length], True)]
+
+    def suggestions_generate(self, prompt, num_suggestions, max_new_tokens=256, stop_rule=None, **params):
+        """
+        Varias sugerencias con el prefill compartido simulado (ver app/suggestions.py): un solo prefill y un
+        paso por token para todas las filas activas; las que terminan, convergen o agotan el presupuesto
+        dejan de decodificarse.
+        """
+        from . import suggestions
+
+        rows = [self._tokens(prompt, max_new_tokens, sequence) for sequence in range(num_suggestions)]
+        tracker = suggestions.SuggestionTracker(num_suggestions, max_new_tokens, identical=params.get('do_sample') is False)
+        generated = [[] for _ in rows]
+        with metrics.generation_stages():
+            time.sleep(self.token_delay_s)
+            metrics.mark_forward()
+            active = tracker.active
+            for step in range(max_new_tokens):
+                if step:
+                    time.sleep(self.token_delay_s)
+                finished = []
+                for row in active:
+                    generated[row].append(rows[row][step])
+                    if stop_rule is not None and stop_rule.find_end(''.join(generated[row])) is not None:
+                        finished.append(row)
+                active = tracker.step(generated, finished)
+                if not active:
+                    break
+        suggestions.record_generation(tracker, len(self.tokenizer(prompt)['input_ids']))
+        return [self._result(prompt, generated[row], True) for row in tracker.kept_rows()]
@@ -0,0 +1,168 @@
+# ia-codex-api/app/suggestions.py
+
+"""
+Varias sugerencias por solicitud de /complete (num_suggestions > 1) con el prefill compartido:
+el prompt se codifica una sola vez y su caché KV se replica para cada sugerencia, que sólo paga
+su decodificación (ver models.generate_suggestions).
+
+Durante la decodificación:
+- Convergencia: si dos sugerencias generan los mismos COMPLETE_CONVERGE_TOKENS primeros tokens, la
+  posterior se da por repetida (con el mismo contexto, casi siempre termina igual), deja de decodificarse
+  y no se devuelve.
+- Presupuesto: COMPLETE_MAX_DECODE_TOKENS limita los tokens decodificados entre todas las sugerencias de
+  la solicitud. Se reserva lo que necesita la primera sugerencia para llegar a max_tokens; las demás se
+  cortan (empezando por la última) cuando lo que sobra no alcanza, y se devuelven hasta donde llegaron.
+- Las filas que terminan (fin de secuencia, regla de parada, convergencia o presupuesto) salen del lote,
+  así que cada paso sólo cuesta las sugerencias que siguen activas.
+
+Al formatear la respuesta, las sugerencias con el mismo texto (tras aplicar las reglas de parada) se
+devuelven una sola vez (COMPLETE_DEDUP_SUGGESTIONS).
+"""
+
+import threading
+
+from . import metrics
+
+OUTCOMES = ('returned', 'converged', 'duplicate', 'budget')
+
+_config = {
+    'shared_prefill': True,   # COMPLETE_SHARED_PREFILL
+    'dedup': True,            # COMPLETE_DEDUP_SUGGESTIONS
+    'converge_tokens': 16,    # COMPLETE_CONVERGE_TOKENS (0 = sin detección de convergencia)
+    'max_decode_tokens': 1024,  # COMPLETE_MAX_DECODE_TOKENS (0 = sin límite)
+}
+_counters = {
+    'requests': 0, 'requested': 0, 'decode_tokens': 0, 'max_decode_tokens': 0, 'prefill_tokens_saved': 0,
+    **{outcome: 0 for outcome in OUTCOMES},
+}
+_counters_lock = threading.Lock()
+
+
+def uses_shared_prefill(num_suggestions):
+    """Indica si una solicitud con 'num_suggestions' sugerencias usa el prefill compartido."""
+    return _config['shared_prefill'] and num_suggestions > 1
+
+
+class SuggestionTracker:
+    """
+    Estado de la decodificación de 'num_rows' sugerencias del mismo prompt: qué filas siguen activas,
+    cuáles convergieron con otra y cuántos tokens se han decodificado. No depende de torch: el pipeline
+    falso y el bucle de models.generate_suggestions le pasan los tokens generados por cada fila.
+    """
+
+    def __init__(self, num_rows, max_new_tokens, identical=False):
+        self.num_rows = num_rows
+        self.max_new_tokens = max_new_tokens
+        self.active = list(range(num_rows))
+        self.converged = {} # Fila repetida -> fila que se conserva
+        self.cut = set()    # Filas cortadas por el presupuesto
+        self.steps = 0
+        self.decode_tokens = 0
+        self.budget = _config['max_decode_tokens'] or None
+        self.converge_tokens = _config['converge_tokens']
+        if identical:
+            # Decodificación voraz: todas las filas darían el mismo texto, sólo se decodifica la primera.
+            self.converged = {row: 0 for row in range(1, num_rows)}
+            self.active = [0]
+
+    @property
+    def decode_limit(self):
+        """Tokens que, como mucho, se decodificarán entre todas las filas."""
+        limit = len(self.active) * self.max_new_tokens
+        return min(limit, self.budget) if self.budget is not None else limit
+
+    def step(self, generated, finished=()):
+        """
+        Registra un paso de decodificación: 'generated' tiene los tokens generados hasta ahora por cada fila
+        y 'finished' las filas activas que terminaron en este paso (fin de secuencia o regla de parada).
+        Devuelve las filas que siguen activas para el siguiente paso.
+        """
+        self.steps += 1
+        self.decode_tokens += len(self.active)
+        finished = set(finished)
+        active = [row for row in self.active if row not in finished]
+
+        # Dos filas con los mismos primeros tokens sólo pueden converger justo en el paso del umbral:
+        # con un prefijo distinto ya no vuelven a coincidir.
+        if self.steps == self.converge_tokens:
+            seen = {}
+            for row in self.active:
+                key = tuple(generated[row])
+                if key in seen:
+                    self.converged[row] = seen[key]
+                else:
+                    seen[key] = row
+            active = [row for row in active if row not in self.converged]
+
+        if self.budget is not None and self.steps < self.max_new_tokens:
+            # Se reserva lo que le falta a la primera fila para llegar a max_new_tokens; el resto avanza
+            # mientras sobre presupuesto y se corta empezando por la última fila.
+            remaining = self.budget - self.decode_tokens
+            reserve = self.max_new_tokens - self.steps
+            while len(active) > 1 and len(active) - 1 + reserve > remaining:
+                self.cut.add(active.pop())
+            if active and remaining < 1:
+                self.cut.add(active.pop())
+        self.active = active
+        return active
+
+    def kept_rows(self):
+        """Filas que se devuelven (las que convergieron con otra se descartan), en su orden."""
+        return [row for row in range(self.num_rows) if row not in self.converged]
+
+
+def record_generation(tracker, prompt_tokens=0):
+    """
+    Anota una generación de varias sugerencias: sugerencias pedidas, convergidas y cortadas, tokens
+    decodificados frente al máximo sin prefill compartido y tokens de prefill ahorrados.
+    """
+    converged, cut = len(tracker.converged), len(tracker.cut)
+    with _counters_lock:
+        _counters['requests'] += 1
+        _counters['requested'] += tracker.num_rows
+        _counters['converged'] += converged
+        _counters['budget'] += cut
+        _counters['decode_tokens'] += tracker.decode_tokens
+        _counters['max_decode_tokens'] += tracker.num_rows * tracker.max_new_tokens
+        _counters['prefill_tokens_saved'] += prompt_tokens * (tracker.num_rows - 1)
+    if converged:
+        metrics.inc('iacodex_suggestions', converged, outcome='converged')
+    if cut:
+        metrics.inc('iacodex_suggestions', cut, outcome='budget')
+    metrics.inc('iacodex_suggestion_decode_tokens', tracker.decode_tokens)
+
+
+def distinct(values):
+    """Sugerencias sin repetir (se conserva la primera aparición de cada texto), si la deduplicación está activa."""
+    if _config['dedup'] and len(values) > 1:
+        unique = list(dict.fromkeys(values))
+    else:
+        unique = list(values)
+    duplicates = len(values) - len(unique)
+    with _counters_lock:
+        _counters['returned'] += len(unique)
+        _counters['duplicate'] += duplicates
+    metrics.inc('iacodex_suggestions', len(unique), outcome='returned')
+    if duplicates:
+        metrics.inc('iacodex_suggestions', duplicates, outcome='duplicate')
+    return unique
+
+
+def init_suggestions(app_config):
+    """Configura la generación de varias sugerencias a partir de la configuración de la aplicación."""
+    _config['shared_prefill'] = bool(app_config.get('COMPLETE_SHARED_PREFILL', True))
+    _config['dedup'] = bool(app_config.get('COMPLETE_DEDUP_SUGGESTIONS', True))
+    _config['converge_tokens'] = max(0, int(app_config.get('COMPLETE_CONVERGE_TOKENS', 16)))
+    _config['max_decode_tokens'] = max(0, int(app_config.get('COMPLETE_MAX_DECODE_TOKENS', 1024)))
+
+
+def get_stats():
+    with _counters_lock:
+        counters = dict(_counters)
+    maximum = counters.pop('max_decode_tokens')
+    return dict(
+        counters,
+        shared_prefill=_config['shared_prefill'],
+        dedup=_config['dedup'],
+        decode_ratio=round(counters['decode_tokens'] / maximum, 4) if maximum else None,
+    )
@@ -1,7 +1,12 @@
 # ia-codex-api/app/utils.py
 
+import json
+import os
+import sqlite3
 from flask import request, jsonify
 
+from . import metrics
+
 def get_json_data(req):
     """
     Intenta obtener datos JSON de una solicitud.
@@ -11,8 +16,41 @@ def get_json_data(req):
     if not req.is_json:
         return None, "Formato JSON inválido. Content-Type debe ser application/json.", 415
     
-    data = req.get_json()
+    with metrics.stage('parse'):
+        data = req.get_json()
     if data is None:
         return None, "No se proporcionaron datos JSON o el JSON está vacío.", 400
     
-    return data, None, None # Datos, Sin error, Sin código de estado de error
\ No newline at end of file
+    return data, None, None # Datos, Sin error, Sin código de estado de error
+
+def wants_stream(req, data):
+    """
+    Indica si el cliente pidió una respuesta en streaming (Server-Sent Events),
+    ya sea con "stream": true en el JSON o con la cabecera Accept: text/event-stream.
+    """
+    return data.get('stream') is True or 'text/event-stream' in req.headers.get('Accept', '')
+
+
+def sse_event(data, event=None):
+    """
+    Formatea un evento Server-Sent Events con los datos serializados en JSON.
+    """
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+def sqlite_connection(local, db_path, timeout=5, row_factory=None, **connect_kwargs):
+    """
+    Conexión sqlite por hilo y por proceso (las conexiones no se comparten tras un fork), guardada en
+    'local' (el threading.local de quien la usa). En modo WAL, varios workers pueden leer a la vez.
+    """
+    conn = getattr(local, 'conn', None)
+    if conn is None or getattr(local, 'pid', None) != os.getpid():
+        conn = sqlite3.connect(db_path, timeout=timeout, **connect_kwargs)
+        if row_factory is not None:
+            conn.row_factory = row_factory
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        local.conn = conn
+        local.pid = os.getpid()
+    return conn
@@ -2,41 +2,293 @@
 """
 CLI universal para interactuar con la IA Codex API desde cualquier editor o terminal.
 Permite autocompletar, corregir y convertir código usando la API local.
+
+Todas las solicitudes comparten una sesión HTTP con keep-alive, y las respuestas de /fix y /convert
+(deterministas) se guardan en una caché local en disco. Con `iacodex_cli.py daemon`, un proceso
+en segundo plano mantiene la sesión abierta y atiende a los editores por un socket Unix: cada
+invocación de la CLI sólo reenvía sus argumentos al daemon, sin importar `requests` ni abrir conexiones.
 """
 import argparse
-import sys
-import requests
+import glob
+import hashlib
+import io
 import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+API_URL = os.getenv("IACODEX_API_URL", "http://127.0.0.1:5000")
+CACHE_DIR = os.getenv("IACODEX_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "iacodex"))
+SOCKET_PATH = os.getenv("IACODEX_SOCKET", os.path.join(CACHE_DIR, "daemon.sock"))
+CACHE_TTL_S = float(os.getenv("IACODEX_CACHE_TTL_S", 7 * 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.getenv("IACODEX_CACHE_MAX_ENTRIES", 2000))
+
+# Comandos deterministas cuyas respuestas se guardan en la caché local
+CACHEABLE_COMMANDS = ("fix", "convert")
+
+_session = None
+_session_lock = threading.Lock()
+_cache = None
+
+
+def get_session(pool_size=32):
+    """
+    Sesión HTTP compartida con keep-alive: las solicitudes reutilizan las conexiones abiertas.
+    `requests` se importa aquí para que reenviar una orden al daemon no pague su importación.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+    return _session
+
+
+def post(path, payload, **kwargs):
+    resp = get_session().post(f"{API_URL}{path}", json=payload, **kwargs)
+    resp.raise_for_status()
+    return resp
+
+
+class ResultCache:
+    """
+    Caché local en disco (sqlite) de las respuestas recientes de /fix y /convert.
+    Las entradas caducan tras CACHE_TTL_S y sólo se conservan las CACHE_MAX_ENTRIES más recientes.
+    """
+
+    def __init__(self, path, ttl_s=CACHE_TTL_S, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl_s:
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time())
+            )
+            self._conn.execute(
+                "DELETE FROM results WHERE key NOT IN (SELECT key FROM results ORDER BY created_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+
+def get_cache():
+    """Caché local compartida por todas las solicitudes del proceso (None si no se puede abrir)."""
+    global _cache
+    with _session_lock:
+        if _cache is None:
+            try:
+                _cache = ResultCache(os.path.join(CACHE_DIR, "results.sqlite3"))
+            except (OSError, sqlite3.Error) as e:
+                print(f"Aviso: caché local desactivada ({e}).", file=sys.stderr)
+                _cache = False
+    return _cache or None
+
+
+def make_key(command, payload):
+    """Clave de la caché local: servidor, comando y cuerpo de la solicitud."""
+    raw = json.dumps([API_URL, command, payload], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
 
-API_URL = "http://127.0.0.1:5000"
+def cached_request(command, payload, result_field, use_cache=True):
+    """POST /<command> que pasa por la caché local si el comando es determinista."""
+    cache = get_cache() if use_cache and command in CACHEABLE_COMMANDS else None
+    key = make_key(command, payload) if cache else None
+    if cache:
+        value = cache.get(key)
+        if value is not None:
+            return value
+    value = post(f"/{command}", payload).json()[result_field]
+    if cache:
+        cache.set(key, value)
+    return value
 
 
-def complete_code(prompt, max_tokens=100, num_suggestions=1):
-    resp = requests.post(f"{API_URL}/complete", json={
+def with_model(payload, model=None):
+    """Añade el modelo elegido con --model (si no se elige, el servidor usa su modelo por defecto)."""
+    return dict(payload, model=model) if model else payload
+
+
+def complete_code(prompt, max_tokens=100, num_suggestions=1, session_id=None, model=None):
+    headers = {"X-Session-Id": session_id} if session_id else {}
+    resp = post("/complete", with_model({
         "prompt": prompt,
         "max_tokens": max_tokens,
         "num_suggestions": num_suggestions
-    })
-    resp.raise_for_status()
+    }, model), headers=headers)
     return resp.json()["suggestions"][0]
 
 
-def fix_code(code):
-    resp = requests.post(f"{API_URL}/fix", json={"code": code})
-    resp.raise_for_status()
-    return resp.json()["fixed_code"]
+def stream_events(path, payload):
+    """
+    Envía una solicitud con streaming activado y devuelve los eventos Server-Sent Events
+    (nombre del evento, datos) a medida que llegan.
+    """
+    payload = dict(payload, stream=True)
+    with get_session().post(f"{API_URL}{path}", json=payload, stream=True,
+                            headers={"Accept": "text/event-stream"}) as resp:
+        resp.raise_for_status()
+        event = "message"
+        for line in resp.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                yield event, json.loads(line[len("data:"):].strip())
+                event = "message"
+
+
+def print_stream(path, payload, prefix=""):
+    """Imprime los tokens en cuanto llegan (útil para ver la respuesta sin esperar al final)."""
+    sys.stdout.write(prefix)
+    sys.stdout.flush()
+    for event, data in stream_events(path, payload):
+        if event == "error":
+            print(file=sys.stdout)
+            print(data.get("error", "Error desconocido"), file=sys.stderr)
+            sys.exit(1)
+        if event == "message":
+            sys.stdout.write(data["token"])
+            sys.stdout.flush()
+    print()
 
 
-def convert_code(code, target_language):
-    resp = requests.post(f"{API_URL}/convert", json={
+def fix_code(code, use_cache=True, model=None):
+    return cached_request("fix", with_model({"code": code}, model), "fixed_code", use_cache)
+
+
+def convert_code(code, target_language, use_cache=True, model=None):
+    return cached_request("convert", with_model({
         "code": code,
         "target_language": target_language
-    })
-    resp.raise_for_status()
-    return resp.json()["converted_code"]
+    }, model), "converted_code", use_cache)
 
 
-def main():
+# Campo de entrada y de resultado de cada comando en los endpoints por lotes
+BATCH_FIELDS = {
+    "complete": ("prompt", "suggestions"),
+    "fix": ("code", "fixed_code"),
+    "convert": ("code", "converted_code"),
+}
+
+
+def expand_files(patterns, cwd=None):
+    """
+    Expande rutas y patrones glob (admite '**') en una lista de ficheros sin duplicados.
+    Las rutas relativas se resuelven desde 'cwd' (el directorio del editor cuando se usa el daemon).
+    """
+    cwd = cwd or os.getcwd()
+    paths = []
+    for pattern in patterns:
+        pattern = os.path.join(cwd, os.path.expanduser(pattern))
+        matches = sorted(glob.glob(pattern, recursive=True)) or [pattern]
+        for path in matches:
+            if os.path.isfile(path) and path not in paths:
+                paths.append(path)
+            elif not os.path.exists(path):
+                print(f"Aviso: '{os.path.relpath(path, cwd)}' no existe, se omite.", file=sys.stderr)
+    return paths
+
+
+def process_files_batch(command, paths, options, chunk_size=16, parallel=1, use_cache=True):
+    """
+    Envía los ficheros a /<command>/batch en trozos de chunk_size elementos, hasta 'parallel' trozos a la vez.
+    Los ficheros cuya respuesta está en la caché local no se envían.
+    Devuelve (ruta, resultado) por fichero, en orden; el resultado es el JSON de cada elemento.
+    """
+    input_field, result_field = BATCH_FIELDS[command]
+    cache = get_cache() if use_cache and command in CACHEABLE_COMMANDS else None
+    contents, keys, results, pending = [], [], [None] * len(paths), []
+    for index, path in enumerate(paths):
+        with open(path, encoding="utf-8") as f:
+            contents.append(f.read())
+        keys.append(make_key(command, dict(options, **{input_field: contents[index]})) if cache else None)
+        cached = cache.get(keys[index]) if cache else None
+        if cached is not None:
+            results[index] = {result_field: cached}
+        else:
+            pending.append(index)
+
+    def send(indices):
+        items = [{input_field: contents[index]} for index in indices]
+        return post(f"/{command}/batch", dict(options, items=items)).json()["results"]
+
+    chunks = [pending[start:start + chunk_size] for start in range(0, len(pending), chunk_size)]
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        futures = {}
+        for chunk in chunks:
+            future = executor.submit(send, chunk)
+            for index in chunk:
+                futures[index] = (future, chunk)
+        for index, path in enumerate(paths):
+            if results[index] is None:
+                # Los resultados se devuelven en orden, a medida que termina el trozo de cada fichero.
+                future, chunk = futures[index]
+                for other, result in zip(chunk, future.result()):
+                    results[other] = result
+                    if cache and "error" not in result:
+                        cache.set(keys[other], result[result_field])
+            yield path, results[index]
+
+
+def run_files(command, patterns, options, chunk_size, write=False, parallel=1, use_cache=True, cwd=None):
+    """Procesa varios ficheros con los endpoints por lotes e imprime (o escribe) cada resultado."""
+    cwd = cwd or os.getcwd()
+    paths = expand_files(patterns, cwd)
+    if not paths:
+        print("No se encontró ningún fichero.", file=sys.stderr)
+        sys.exit(1)
+
+    _, result_field = BATCH_FIELDS[command]
+    failures = 0
+    for path, result in process_files_batch(command, paths, options, chunk_size, parallel, use_cache):
+        name = os.path.relpath(path, cwd)
+        if "error" in result:
+            failures += 1
+            print(f"{name}: {result['error']}", file=sys.stderr)
+            continue
+        output = result[result_field]
+        if command == "complete":
+            output = output[0]
+        if write:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(output)
+            print(f"{name}: actualizado")
+        else:
+            print(f"==> {name} <==")
+            print(output)
+    if failures:
+        sys.exit(1)
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description="CLI para IA Codex API")
     subparsers = parser.add_subparsers(dest="command", required=True)
 
@@ -44,26 +296,292 @@ def main():
     parser_complete.add_argument("-p", "--prompt", required=False, help="Código de entrada (si no se pasa, se lee de stdin)")
     parser_complete.add_argument("-m", "--max_tokens", type=int, default=100, help="Tokens máximos")
     parser_complete.add_argument("-n", "--num_suggestions", type=int, default=1, help="Número de sugerencias")
+    parser_complete.add_argument("-s", "--stream", action="store_true", help="Mostrar los tokens a medida que se generan")
+    parser_complete.add_argument("--session", help="Identificador de sesión del editor (reutiliza la caché KV del prompt anterior)")
+    parser_complete.add_argument("-f", "--files", nargs="+", help="Ficheros o patrones glob a procesar por lotes")
 
     parser_fix = subparsers.add_parser("fix", help="Corregir código")
     parser_fix.add_argument("-c", "--code", required=False, help="Código a corregir (si no se pasa, se lee de stdin)")
+    parser_fix.add_argument("-f", "--files", nargs="+", help="Ficheros o patrones glob a procesar por lotes")
+    parser_fix.add_argument("-w", "--write", action="store_true", help="Con --files, sobrescribir cada fichero con su corrección")
 
     parser_convert = subparsers.add_parser("convert", help="Convertir código entre lenguajes")
     parser_convert.add_argument("-c", "--code", required=False, help="Código a convertir (si no se pasa, se lee de stdin)")
     parser_convert.add_argument("-t", "--target_language", required=True, help="Lenguaje de destino")
+    parser_convert.add_argument("-s", "--stream", action="store_true", help="Mostrar los tokens a medida que se generan")
+    parser_convert.add_argument("-f", "--files", nargs="+", help="Ficheros o patrones glob a procesar por lotes")
+
+    for subparser in (parser_complete, parser_fix, parser_convert):
+        subparser.add_argument("--chunk-size", type=int, default=16, help="Ficheros por solicitud en modo --files")
+        subparser.add_argument("--parallel", type=int, default=1, help="Solicitudes simultáneas en modo --files")
+        subparser.add_argument("--no-cache", action="store_true", help="No usar la caché local de respuestas")
+        subparser.add_argument("--model", help="Modelo del servidor a usar (ver GET /models; por defecto, el de la operación)")
+        subparser.add_argument("--no-daemon", action="store_true", help="No reenviar la orden al daemon aunque esté en marcha")
 
-    args = parser.parse_args()
+    parser_daemon = subparsers.add_parser("daemon", help="Proceso en segundo plano para los editores (socket Unix)")
+    parser_daemon.add_argument("--socket", default=SOCKET_PATH, help="Ruta del socket Unix")
+    parser_daemon.add_argument("--detach", action="store_true", help="Arrancar el daemon en segundo plano y volver")
+    parser_daemon.add_argument("--stop", action="store_true", help="Detener el daemon en marcha")
+    parser_daemon.add_argument("--idle-timeout", type=float, default=0, help="Terminar tras estos segundos sin órdenes (0 = nunca)")
+    return parser
+
+
+def needs_stdin(args):
+    """Indica si la orden lee el código de stdin (no se pasó por argumento ni hay ficheros)."""
+    if args.command == "daemon" or args.files:
+        return False
+    return not (args.prompt if args.command == "complete" else args.code)
+
+
+def execute(args, cwd=None):
+    use_cache = not args.no_cache
+
+    # Modo por lotes: muchos ficheros en pocas solicitudes
+    if args.files:
+        options = {}
+        if args.command == "complete":
+            options = {"max_tokens": args.max_tokens, "num_suggestions": 1}
+        elif args.command == "convert":
+            options = {"target_language": args.target_language}
+        options = with_model(options, args.model)
+        run_files(args.command, args.files, options, args.chunk_size, write=getattr(args, "write", False),
+                  parallel=args.parallel, use_cache=use_cache, cwd=cwd)
+        return
 
     # Leer código de stdin si no se pasa por argumento
     if args.command == "complete":
         prompt = args.prompt if args.prompt else sys.stdin.read()
-        print(complete_code(prompt, args.max_tokens, args.num_suggestions))
+        if args.stream:
+            # El servidor sólo envía los tokens nuevos; se imprime antes el prompt como en el modo normal.
+            payload = with_model({"prompt": prompt, "max_tokens": args.max_tokens}, args.model)
+            print_stream("/complete", payload, prefix=prompt)
+        else:
+            print(complete_code(prompt, args.max_tokens, args.num_suggestions, args.session, args.model))
     elif args.command == "fix":
         code = args.code if args.code else sys.stdin.read()
-        print(fix_code(code))
+        print(fix_code(code, use_cache, args.model))
     elif args.command == "convert":
         code = args.code if args.code else sys.stdin.read()
-        print(convert_code(code, args.target_language))
+        if args.stream:
+            print_stream("/convert", with_model({"code": code, "target_language": args.target_language}, args.model))
+        else:
+            print(convert_code(code, args.target_language, use_cache, args.model))
+
+
+def run_command(argv, cwd=None):
+    """Ejecuta una orden de la CLI y devuelve su código de salida (lo usa también el daemon)."""
+    try:
+        execute(build_parser().parse_args(argv), cwd)
+        return 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception as e:
+        # Errores de conexión o HTTP de la API
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+# --- Daemon (socket Unix) ---
+# Protocolo: el cliente envía una línea JSON {"argv": [...], "stdin": "...", "cwd": "..."} y recibe
+# líneas JSON {"stdout": "..."} / {"stderr": "..."} a medida que se producen y, al final, {"exit": código}.
+
+_thread_streams = threading.local()
+
+
+class _ThreadStream:
+    """En el daemon sustituye a sys.stdin/stdout/stderr: cada hilo usa los flujos de su conexión."""
+
+    def __init__(self, name, default):
+        self._name = name
+        self._default = default
+
+    def _target(self):
+        return getattr(_thread_streams, self._name, None) or self._default
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def read(self, *args):
+        return self._target().read(*args)
+
+    def __getattr__(self, attr):
+        return getattr(self._target(), attr)
+
+
+class _FrameWriter:
+    """Flujo de salida que envía cada escritura al cliente como una línea JSON (conserva el streaming)."""
+
+    def __init__(self, wfile, kind, lock):
+        self._wfile = wfile
+        self._kind = kind
+        self._lock = lock
+
+    def write(self, text):
+        if text:
+            send_frame(self._wfile, {self._kind: text}, self._lock)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def send_frame(wfile, frame, lock):
+    with lock:
+        wfile.write((json.dumps(frame) + "\n").encode("utf-8"))
+        wfile.flush()
+
+
+def daemon_request(socket_path, request):
+    """Envía una petición al daemon y devuelve el socket conectado, o None si no hay daemon escuchando."""
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+    except OSError:
+        sock.close()
+        return None # Socket de un daemon que ya no existe
+    return sock
+
+
+def forward_to_daemon(argv, socket_path=SOCKET_PATH):
+    """
+    Reenvía la orden al daemon si está en marcha y escribe su salida a medida que llega.
+    Devuelve el código de salida, o None si no hay daemon (la orden se ejecuta en este proceso).
+    """
+    if not os.path.exists(socket_path):
+        return None
+    args = build_parser().parse_args(argv)
+    stdin = sys.stdin.read() if needs_stdin(args) else None
+    sock = daemon_request(socket_path, {"argv": argv, "stdin": stdin, "cwd": os.getcwd()})
+    if sock is None:
+        return None
+    with sock, sock.makefile("rb") as rfile:
+        for line in rfile:
+            frame = json.loads(line)
+            if "exit" in frame:
+                return frame["exit"]
+            stream = sys.stdout if "stdout" in frame else sys.stderr
+            stream.write(frame.get("stdout", frame.get("stderr", "")))
+            stream.flush()
+    print("Error: el daemon cerró la conexión.", file=sys.stderr)
+    return 1
+
+
+def serve_daemon(socket_path, idle_timeout_s=0):
+    """
+    Atiende órdenes por el socket Unix, cada conexión en su propio hilo, con una única sesión HTTP
+    (keep-alive) y la caché local compartidas. Termina con `daemon --stop` o tras idle_timeout_s sin órdenes.
+    """
+    import socketserver
+
+    probe = daemon_request(socket_path, {"ping": True})
+    if probe is not None:
+        probe.close()
+        print(f"El daemon ya está en marcha en {socket_path}.", file=sys.stderr)
+        return 1
+    if os.path.exists(socket_path):
+        os.unlink(socket_path) # Socket de un daemon anterior que no se cerró bien
+    os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+
+    sys.stdin = _ThreadStream("stdin", sys.stdin)
+    sys.stdout = _ThreadStream("stdout", sys.stdout)
+    sys.stderr = _ThreadStream("stderr", sys.stderr)
+    get_session() # Importa requests y prepara el pool antes de la primera orden
+    last_activity = [time.monotonic()]
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            last_activity[0] = time.monotonic()
+            request = json.loads(self.rfile.readline() or "{}")
+            lock = threading.Lock()
+            if request.get("command") == "shutdown":
+                send_frame(self.wfile, {"exit": 0}, lock)
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+            if "argv" not in request:
+                return
+            _thread_streams.stdin = io.StringIO(request.get("stdin") or "")
+            _thread_streams.stdout = _FrameWriter(self.wfile, "stdout", lock)
+            _thread_streams.stderr = _FrameWriter(self.wfile, "stderr", lock)
+            try:
+                code = run_command(request["argv"], request.get("cwd"))
+                send_frame(self.wfile, {"exit": code}, lock)
+            except OSError:
+                pass # El editor cerró la conexión
+            finally:
+                _thread_streams.stdin = _thread_streams.stdout = _thread_streams.stderr = None
+                last_activity[0] = time.monotonic()
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    server = Server(socket_path, Handler)
+    os.chmod(socket_path, 0o600) # Sólo el usuario puede pedir órdenes (el daemon escribe ficheros con --write)
+
+    if idle_timeout_s > 0:
+        def _reaper():
+            while time.monotonic() - last_activity[0] < idle_timeout_s:
+                time.sleep(min(idle_timeout_s, 5))
+            server.shutdown()
+        threading.Thread(target=_reaper, daemon=True).start()
+
+    print(f"Daemon de IA Codex escuchando en {socket_path} (API: {API_URL})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+    return 0
+
+
+def daemon_command(args):
+    if not hasattr(socket, "AF_UNIX"):
+        print("El daemon necesita sockets Unix (no disponibles en este sistema).", file=sys.stderr)
+        return 1
+    if args.stop:
+        sock = daemon_request(args.socket, {"command": "shutdown"})
+        if sock is None:
+            print("No hay ningún daemon en marcha.", file=sys.stderr)
+            return 1
+        with sock:
+            sock.recv(64)
+        print("Daemon detenido.")
+        return 0
+    if args.detach:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        log_path = os.path.join(CACHE_DIR, "daemon.log")
+        with open(log_path, "ab") as log:
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "daemon", "--socket", args.socket,
+                 "--idle-timeout", str(args.idle_timeout)],
+                stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True
+            )
+        for _ in range(100): # Espera a que el socket esté listo
+            if os.path.exists(args.socket):
+                print(f"Daemon en marcha en {args.socket} (registro: {log_path}).")
+                return 0
+            time.sleep(0.05)
+        print(f"El daemon no arrancó; revisa {log_path}.", file=sys.stderr)
+        return 1
+    return serve_daemon(args.socket, args.idle_timeout)
+
+
+def main():
+    argv = sys.argv[1:]
+    if argv[:1] == ["daemon"]:
+        sys.exit(daemon_command(build_parser().parse_args(argv)))
+    # Si hay un daemon en marcha, la orden se ejecuta allí (sesión abierta, sin importar requests aquí).
+    if "--no-daemon" not in argv:
+        code = forward_to_daemon(argv)
+        if code is not None:
+            sys.exit(code)
+    sys.exit(run_command(argv))
 
 if __name__ == "__main__":
     main()
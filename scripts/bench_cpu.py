@@ -0,0 +1,160 @@
+# ia-codex-api/scripts/bench_cpu.py
+
+"""
+Compara los perfiles de CPU (fp32, int8, bf16) de un modelo: latencia por generación y memoria residente.
+Cada perfil se mide en un subproceso propio para que la memoria de uno no contamine al siguiente.
+Con --draft se mide también la generación asistida de /complete (latencia, tasa de aceptación del
+borrador y si la salida coincide con la del modelo solo). Con --engines se comparan los motores de
+app/engines.py (eager, compile, onnx) para el endpoint del modelo: latencia y si la salida voraz
+coincide con la de eager.
+
+Uso:
+    python scripts/bench_cpu.py --kind generator --profiles none int8 --runs 10
+    python scripts/bench_cpu.py --kind generator --profiles none --draft sshleifer/tiny-gpt2
+    python scripts/bench_cpu.py --kind text2text --profiles none --engines eager compile onnx --onnx-dir onnx
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+DEFAULT_PROMPTS = {
+    'generator': "def fibonacci(n):\n    ",
+    'text2text': "Corrige los errores de sintaxis y ajusta la sangría de este código:\ndef f(x)\nreturn x+1",
+}
+ENDPOINTS = {'generator': '/complete', 'text2text': '/fix, /convert'}
+
+
+def measure(kind, profile, runs, max_new_tokens, threads, draft='', engine='eager', onnx_dir=''):
+    """Carga el modelo con el perfil y el motor indicados y mide 'runs' generaciones deterministas."""
+    sys.path.insert(0, PROJECT_ROOT)
+    from app import load_config
+    from app import models
+
+    config = load_config()
+    config.update(
+        CPU_QUANTIZE=profile, CPU_THREADS=threads, INFERENCE_BACKEND='local', MODEL_WARMUP=False, HF_MODEL_DRAFT=draft,
+        MODEL_ENGINE=engine, MODEL_ENGINES='', MODEL_ONNX_DIR=onnx_dir or config.get('MODEL_ONNX_DIR', ''),
+    )
+    models.load_models(config)
+
+    started = time.perf_counter()
+    pipe = models.get_generator_pipeline() if kind == 'generator' else models.get_text2text_pipeline()
+    if pipe is None:
+        raise SystemExit(f"No se pudo cargar el modelo de {kind}.")
+    load_seconds = time.perf_counter() - started
+
+    prompt = DEFAULT_PROMPTS[kind]
+    params = dict(max_new_tokens=max_new_tokens, do_sample=False)
+    with models.inference_context():
+        pipe(prompt, **params) # Calentamiento: la primera llamada incluye inicializaciones perezosas
+        latencies = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            output = pipe(prompt, **params)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    status = models.get_model_status()[kind]
+    result = {
+        'endpoint': ENDPOINTS[kind],
+        'profile': profile,
+        'engine': engine,
+        'engine_used': status['engine'], # Distinto de 'engine' si se recurrió a eager
+        'variant': status['variant'],
+        'load_s': round(load_seconds, 2),
+        'latency_ms_mean': round(statistics.mean(latencies), 1),
+        'latency_ms_p50': round(statistics.median(latencies), 1),
+        'latency_ms_max': round(max(latencies), 1),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), # KiB en Linux
+        'sample': output[0]['generated_text'][-80:],
+        'output': output[0]['generated_text'],
+    }
+    if draft and kind == 'generator':
+        result.update(measure_assisted(pipe, prompt, runs, max_new_tokens, output[0]['generated_text']))
+    return result
+
+
+def measure_assisted(pipe, prompt, runs, max_new_tokens, expected):
+    """Mide la generación asistida con el borrador ya cargado junto al modelo."""
+    from app import models
+
+    if getattr(pipe, 'iacodex_draft', None) is None:
+        return {'assisted_error': models.get_model_status()['generator'].get('assisted', {}).get('draft_error')}
+    models.generate_assisted(pipe, prompt, max_new_tokens=max_new_tokens) # Calentamiento
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = models.generate_assisted(pipe, prompt, max_new_tokens=max_new_tokens)
+        latencies.append((time.perf_counter() - started) * 1000)
+    stats = models.get_assisted_stats()
+    return {
+        'assisted_latency_ms_mean': round(statistics.mean(latencies), 1),
+        'assisted_latency_ms_p50': round(statistics.median(latencies), 1),
+        'acceptance_rate': stats['acceptance_rate'],
+        'tokens_per_forward': stats['tokens_per_forward'],
+        'identical_output': output[0]['generated_text'] == expected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara la latencia y la memoria de los perfiles de CPU.")
+    parser.add_argument('--kind', choices=('generator', 'text2text'), default='generator')
+    parser.add_argument('--profiles', nargs='+', default=['none', 'int8', 'bf16'])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-new-tokens', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=0, help="Hilos intra-op (0 = todos los núcleos).")
+    parser.add_argument('--draft', default='', help="Modelo borrador para medir también la generación asistida.")
+    parser.add_argument('--engines', nargs='+', default=['eager'], choices=('eager', 'compile', 'onnx'),
+                        help="Motores a comparar (ver app/engines.py).")
+    parser.add_argument('--onnx-dir', default='', help="Exportaciones ONNX (por defecto, MODEL_ONNX_DIR).")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = measure(
+            args.kind, args.profiles[0], args.runs, args.max_new_tokens, args.threads, args.draft,
+            args.engines[0], args.onnx_dir,
+        )
+        print(json.dumps(result))
+        return
+
+    results = []
+    for profile in args.profiles:
+        for engine in args.engines:
+            cmd = [
+                sys.executable, os.path.abspath(__file__), '--child', '--kind', args.kind, '--profiles', profile,
+                '--runs', str(args.runs), '--max-new-tokens', str(args.max_new_tokens), '--threads', str(args.threads),
+                '--draft', args.draft, '--engines', engine, '--onnx-dir', args.onnx_dir,
+            ]
+            completed = subprocess.run(cmd, cwd=PROJECT_ROOT, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"Error al medir el perfil '{profile}' con '{engine}':\n{completed.stderr}", file=sys.stderr)
+                continue
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    baseline = next((r for r in results if r['profile'] == 'none' and r['engine'] == 'eager'), None)
+    for result in results:
+        eager = next((r for r in results if r['profile'] == result['profile'] and r['engine'] == 'eager'), None)
+        if eager and result is not eager:
+            # Misma salida voraz que eager con el mismo perfil (paridad del motor) y su aceleración.
+            result['identical_to_eager'] = result['output'] == eager['output']
+            result['speedup_vs_eager'] = round(eager['latency_ms_mean'] / result['latency_ms_mean'], 2)
+        if baseline and result is not baseline and result['engine'] == 'eager':
+            result['speedup_vs_fp32'] = round(baseline['latency_ms_mean'] / result['latency_ms_mean'], 2)
+            result['rss_ratio_vs_fp32'] = round(result['max_rss_mb'] / baseline['max_rss_mb'], 2)
+        if 'assisted_latency_ms_mean' in result:
+            result['assisted_speedup'] = round(result['latency_ms_mean'] / result['assisted_latency_ms_mean'], 2)
+    for result in results:
+        del result['output']
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+# ia-codex-api/scripts/benchmark.py
+
+"""
+Benchmark de carga de la API: latencia (p50/p95/p99), solicitudes/s, tokens/s y memoria residente máxima.
+
+Por defecto arranca la aplicación Flask en este mismo proceso con el pipeline falso de app/stub.py
+(MODEL_STUB=True), de modo que mide el camino de servicio (HTTP, validación, micro-batching, cachés)
+sin descargar modelos. Con --real usa los modelos configurados en .env, y con --url mide un servidor ya
+arrancado (gunicorn, uvicorn...).
+
+Ejemplos:
+    python scripts/benchmark.py --concurrency 1 8 32 --requests 200 --output bench.json
+    python scripts/benchmark.py --compare bench.json --threshold 0.10   # sale con código 1 si hay regresiones
+    python scripts/benchmark.py --url http://localhost:5000 --server-pid 12345
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Tamaños de solicitud: líneas de código del prompt y tokens máximos a generar.
+SIZES = {
+    'small': {'lines': 5, 'max_tokens': 16},
+    'medium': {'lines': 40, 'max_tokens': 64},
+    'large': {'lines': 200, 'max_tokens': 128},
+}
+
+ENDPOINTS = ('complete', 'fix', 'convert')
+
+
+def parse_mix(text):
+    """'small=0.6,medium=0.3,large=0.1' -> [('small', 0.6), ...]"""
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SIZES:
+            raise argparse.ArgumentTypeError(f"Tamaño desconocido: {name} (usa {', '.join(SIZES)})")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def make_code(lines, request_id):
+    """Fragmento de código sintético. El comentario inicial hace que cada solicitud sea única (sin aciertos de caché)."""
+    body = [f"# solicitud {request_id}", "def calcula(x0):"]
+    body += [f"    x{i} = x{i - 1} * {i} + {i % 7}" for i in range(1, lines)]
+    body.append(f"    return x{lines - 1}")
+    return "\n".join(body)
+
+
+def make_request(endpoint, size, request_id):
+    spec = SIZES[size]
+    code = make_code(spec['lines'], request_id)
+    if endpoint == 'complete':
+        return {"prompt": code + "\n\ndef siguiente(", "max_tokens": spec['max_tokens']}
+    if endpoint == 'fix':
+        return {"code": code, "max_tokens": spec['max_tokens']}
+    return {"code": code, "target_language": "javascript", "max_tokens": spec['max_tokens']}
+
+
+def generated_chars(endpoint, payload, response):
+    """Caracteres generados por el modelo en una respuesta (para estimar tokens/s a ~4 caracteres por token)."""
+    if endpoint == 'complete':
+        return sum(max(0, len(text) - len(payload['prompt'])) for text in response.get('suggestions', []))
+    value = response.get('fixed_code') if endpoint == 'fix' else response.get('converted_code')
+    return len(value or '')
+
+
+def post(url, payload, timeout):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(), headers={'Content-Type': 'application/json'}, method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+    except (urllib.error.URLError, OSError):
+        return 0, None
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return round(ordered[index], 2)
+
+
+def run_level(base_url, endpoint, concurrency, num_requests, mix, rng, timeout, allow_cache):
+    """Lanza num_requests solicitudes a un endpoint con 'concurrency' clientes simultáneos."""
+    names, weights = zip(*mix)
+    requests_to_send = []
+    for i in range(num_requests):
+        size = rng.choices(names, weights)[0]
+        request_id = 0 if allow_cache else f"{endpoint}-{concurrency}-{i}-{rng.random()}"
+        requests_to_send.append(make_request(endpoint, size, request_id))
+
+    latencies, chars, errors = [], 0, 0
+    lock = threading.Lock()
+
+    def worker(payload):
+        nonlocal chars, errors
+        started = time.perf_counter()
+        status, response = post(f"{base_url}/{endpoint}", payload, timeout)
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            if status == 200:
+                latencies.append(elapsed)
+                chars += generated_chars(endpoint, payload, response)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, requests_to_send))
+    wall = time.perf_counter() - started
+
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': num_requests,
+        'errors': errors,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'mean': round(statistics.mean(latencies), 2) if latencies else None,
+            'max': round(max(latencies), 2) if latencies else None,
+        },
+        'requests_per_s': round(len(latencies) / wall, 2),
+        'tokens_per_s': round(chars / 4 / wall, 1),
+        'wall_s': round(wall, 3),
+    }
+
+
+def start_local_server(args):
+    """Arranca la aplicación Flask en un hilo de este proceso y devuelve su URL."""
+    if not args.real:
+        os.environ['MODEL_STUB'] = 'True'
+        os.environ['MODEL_STUB_TOKEN_DELAY_MS'] = str(args.token_delay_ms)
+    sys.path.insert(0, PROJECT_ROOT)
+    import logging
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR) # Sin una línea de log por solicitud
+    server = make_server('127.0.0.1', 0, create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def peak_rss_mb(server_pid):
+    """Memoria residente máxima del servidor: de este proceso, o de --server-pid (VmHWM en /proc)."""
+    if server_pid is None:
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) # KiB en Linux
+    try:
+        with open(f"/proc/{server_pid}/status") as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError as e:
+        print(f"No se pudo leer la memoria del proceso {server_pid}: {e}", file=sys.stderr)
+    return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Compara cada (endpoint, concurrencia) con la ejecución de referencia.
+    Es una regresión si el p95 sube o las solicitudes/s bajan más de 'threshold' (fracción).
+    """
+    reference = {(r['endpoint'], r['concurrency']): r for r in baseline['results']}
+    comparison = []
+    for result in results:
+        base = reference.get((result['endpoint'], result['concurrency']))
+        if base is None or not base['latency_ms']['p95'] or not result['latency_ms']['p95']:
+            continue
+        p95_ratio = result['latency_ms']['p95'] / base['latency_ms']['p95']
+        rps_ratio = result['requests_per_s'] / base['requests_per_s'] if base['requests_per_s'] else 1.0
+        comparison.append({
+            'endpoint': result['endpoint'],
+            'concurrency': result['concurrency'],
+            'p95_ratio': round(p95_ratio, 3),
+            'rps_ratio': round(rps_ratio, 3),
+            'regression': p95_ratio > 1 + threshold or rps_ratio < 1 - threshold or result['errors'] > base['errors'],
+        })
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga de /complete, /fix y /convert.")
+    parser.add_argument('--url', help="URL de un servidor ya arrancado (por defecto, Flask en este proceso).")
+    parser.add_argument('--server-pid', type=int, help="PID del servidor externo para medir su memoria.")
+    parser.add_argument('--real', action='store_true', help="Usar los modelos reales en lugar del pipeline falso.")
+    parser.add_argument('--token-delay-ms', type=float, default=5.0, help="Retardo por token del pipeline falso.")
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=50, help="Solicitudes por endpoint y nivel de concurrencia.")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('small=0.6,medium=0.3,large=0.1'),
+                        help="Distribución de tamaños de solicitud (p. ej. small=0.6,medium=0.3,large=0.1).")
+    parser.add_argument('--allow-cache', action='store_true', help="Repetir prompts (mide aciertos de caché).")
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', help="Guardar el resultado JSON en este archivo.")
+    parser.add_argument('--compare', help="JSON de una ejecución anterior con el que comparar.")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Tolerancia de la comparación (0.10 = 10%%).")
+    args = parser.parse_args()
+
+    # La salida estándar queda reservada para el JSON final; los mensajes del servidor van a stderr.
+    report_stream, sys.stdout = sys.stdout, sys.stderr
+    base_url = args.url.rstrip('/') if args.url else start_local_server(args)
+    rng = random.Random(args.seed)
+
+    # Calentamiento: la primera solicitud de cada endpoint carga el modelo y no se mide.
+    for endpoint in args.endpoints:
+        post(f"{base_url}/{endpoint}", make_request(endpoint, 'small', 'calentamiento'), args.timeout)
+
+    results = []
+    for endpoint in args.endpoints:
+        for concurrency in args.concurrency:
+            result = run_level(
+                base_url, endpoint, concurrency, args.requests, args.mix, rng, args.timeout, args.allow_cache
+            )
+            results.append(result)
+            print(
+                f"{endpoint:>8} c={concurrency:<3} p50={result['latency_ms']['p50']}ms "
+                f"p95={result['latency_ms']['p95']}ms p99={result['latency_ms']['p99']}ms "
+                f"{result['requests_per_s']} req/s {result['tokens_per_s']} tok/s errores={result['errors']}",
+                file=sys.stderr
+            )
+
+    report = {
+        'config': {
+            'url': args.url,
+            'stub': not args.real and not args.url,
+            'token_delay_ms': args.token_delay_ms,
+            'requests': args.requests,
+            'mix': dict(args.mix),
+            'allow_cache': args.allow_cache,
+            'seed': args.seed,
+        },
+        'results': results,
+        'peak_rss_mb': peak_rss_mb(args.server_pid),
+    }
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        report['comparison'] = compare(results, baseline, args.threshold)
+        regressions = [c for c in report['comparison'] if c['regression']]
+        for c in regressions:
+            print(
+                f"REGRESIÓN en /{c['endpoint']} c={c['concurrency']}: p95 x{c['p95_ratio']}, req/s x{c['rps_ratio']}",
+                file=sys.stderr
+            )
+        exit_code = 1 if regressions else 0
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output, file=report_stream)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# ia-codex-api/scripts/export_onnx.py
+
+"""
+Exporta los modelos configurados (.env: HF_MODEL_AUTOCOMPLETE, HF_MODEL_TEXT2TEXT y MODELS) a ONNX con la
+caché KV, para servirlos con ONNX Runtime (ver app/engines.py). Requiere optimum[onnxruntime].
+Después, define MODEL_ONNX_DIR con el mismo directorio y MODEL_ENGINE=onnx (o MODEL_ENGINES por modelo).
+
+Uso:
+    python scripts/export_onnx.py --output onnx
+    python scripts/export_onnx.py --output onnx --models generator rapido
+"""
+
+import argparse
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_ROOT)
+
+
+def main():
+    from app import load_config
+    from app import engines, models
+
+    config = load_config()
+    parser = argparse.ArgumentParser(description="Exporta los modelos configurados a ONNX con caché KV.")
+    parser.add_argument('--output', default=config.get('MODEL_ONNX_DIR') or os.path.join(PROJECT_ROOT, 'onnx'),
+                        help="Directorio de las exportaciones (por defecto, MODEL_ONNX_DIR o ./onnx)")
+    parser.add_argument('--models', nargs='+', help="Nombres de los modelos a exportar (por defecto, todos)")
+    args = parser.parse_args()
+
+    available = {
+        kind: (kind, config.get(config_key) or default_model)
+        for kind, (_, config_key, default_model, _, _) in models._MODEL_SPECS.items()
+    }
+    available.update(models.parse_model_specs(config.get('MODELS')))
+    names = args.models or list(available)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        print(f"Modelos desconocidos: {', '.join(unknown)}. Disponibles: {', '.join(available)}.", file=sys.stderr)
+        sys.exit(1)
+
+    failures = 0
+    for name in names:
+        kind, model_name = available[name]
+        started = time.monotonic()
+        try:
+            manifest = engines.export_onnx(model_name, kind, models._MODEL_SPECS[kind][0], args.output, name)
+        except Exception as e:
+            print(f"No se pudo exportar '{name}' ({model_name}): {e}", file=sys.stderr)
+            failures += 1
+            continue
+        print(
+            f"'{name}' ({model_name}) exportado en {os.path.join(args.output, name)} "
+            f"[{', '.join(manifest['files'])}] en {time.monotonic() - started:.1f}s."
+        )
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
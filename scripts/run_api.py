@@ -3,7 +3,9 @@
 import subprocess
 import sys
 import os
+import secrets
 import shutil # Para eliminar el venv si es necesario
+import time
 
 def get_project_root():
     """Devuelve la ruta absoluta a la raíz del proyecto (donde esta .env, requirements.txt)."""
@@ -57,6 +59,41 @@ def create_and_activate_venv(project_root):
         print(f"Error al instalar dependencias: {e}", file=sys.stderr)
         sys.exit(1)
 
+def start_model_server(project_root, address, timeout=600):
+    """
+    Arranca el proceso servidor de modelos (app/model_server.py) y espera a que acepte conexiones.
+    Es el único proceso que carga los modelos; los workers HTTP le reenvían las solicitudes.
+    """
+    print(f"Arrancando el servidor de modelos en {address}...")
+    is_unix_socket = not (':' in address and not address.startswith('/'))
+    if is_unix_socket and os.path.exists(address):
+        os.unlink(address) # Socket de una ejecución anterior: evita dar el servidor por listo antes de tiempo
+    server = subprocess.Popen([sys.executable, '-m', 'app.model_server'], cwd=project_root)
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            print("Error: el servidor de modelos terminó durante el arranque.", file=sys.stderr)
+            sys.exit(1)
+        if is_unix_socket and os.path.exists(address):
+            break
+        if not is_unix_socket:
+            import socket
+            host, port = address.rsplit(':', 1)
+            try:
+                with socket.create_connection((host or '127.0.0.1', int(port)), timeout=1):
+                    break
+            except OSError:
+                pass
+        time.sleep(0.5)
+    else:
+        print("Error: el servidor de modelos no respondió a tiempo.", file=sys.stderr)
+        server.terminate()
+        sys.exit(1)
+
+    print("Servidor de modelos listo.")
+    return server
+
 def main():
     project_root = get_project_root()
     os.chdir(project_root) # Cambia el directorio de trabajo a la raíz del proyecto
@@ -91,12 +128,17 @@ def main():
     flask_env = os.getenv('FLASK_ENV', 'development')
     debug_mode = os.getenv('DEBUG', 'False').lower() == 'true'
     api_port = int(os.getenv('API_PORT', 5000))
+    inference_backend = os.getenv('INFERENCE_BACKEND', 'local').lower()
+    model_server_address = os.getenv('MODEL_SERVER_ADDRESS', '/tmp/iacodex-model-server.sock')
+    api_server = os.getenv('API_SERVER', 'wsgi').lower() # 'wsgi' (gunicorn + Flask) o 'asgi' (uvicorn)
 
     print("\n--- Configuración de la API ---")
     print(f"FLASK_APP: {flask_app}")
     print(f"FLASK_ENV: {flask_env}")
     print(f"DEBUG: {debug_mode}")
     print(f"API_PORT: {api_port}")
+    print(f"INFERENCE_BACKEND: {inference_backend}")
+    print(f"API_SERVER: {api_server}")
     print("--------------------------\n")
 
     # Asegurarse de que el entorno virtual esté listo y dependencias instaladas
@@ -106,23 +148,54 @@ def main():
     if flask_env == 'development' and debug_mode:
         print("Ejecutando con el servidor de desarrollo de Flask (NO para producción)...")
         cmd = [sys.executable, '-m', 'flask', 'run', '--host=0.0.0.0', f'--port={api_port}']
+    elif api_server == 'asgi':
+        print("Ejecutando con Uvicorn (ASGI)...")
+        # Cada worker atiende miles de conexiones; la inferencia se ejecuta en un executor acotado (app/asgi.py).
+        workers = int(os.getenv('WEB_CONCURRENCY', 1))
+        cmd = [
+            sys.executable, '-m', 'uvicorn', '--factory', 'app.asgi:create_asgi_app',
+            '--host', '0.0.0.0', '--port', str(api_port), '--workers', str(workers),
+        ]
+        os.environ.setdefault('WEB_CONCURRENCY', str(workers))
     else:
         print("Ejecutando con Gunicorn...")
         # Gunicorn es un paquete de Python, su ejecutable estará en venv/bin o venv/Scripts
         # Lo llamamos vía python -m gunicorn para asegurar que se use el del venv.
-        cmd = [sys.executable, '-m', 'gunicorn', '-w', '4', '-b', f'0.0.0.0:{api_port}', flask_app]
+        workers = int(os.getenv('WEB_CONCURRENCY', 4))
+        cmd = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'0.0.0.0:{api_port}', flask_app]
+        # Cada worker que carga modelos reparte los núcleos entre todos (ver CPU_THREADS en el README).
+        os.environ.setdefault('WEB_CONCURRENCY', str(workers))
+
+    # Métricas de varios procesos: se descartan los volcados de una ejecución anterior (ver app/metrics.py).
+    metrics_dir = os.getenv('METRICS_DIR', '')
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for filename in os.listdir(metrics_dir):
+            if filename.startswith('metrics-') and filename.endswith('.json'):
+                os.unlink(os.path.join(metrics_dir, filename))
+
+    # Con INFERENCE_BACKEND=remote, un único proceso carga los modelos y los workers sólo reenvían solicitudes.
+    model_server = None
+    if inference_backend == 'remote':
+        if not os.getenv('MODEL_SERVER_AUTHKEY'):
+            # Clave aleatoria para esta ejecución: la heredan el servidor de modelos y los workers.
+            os.environ['MODEL_SERVER_AUTHKEY'] = secrets.token_hex(32)
+        model_server = start_model_server(project_root, model_server_address)
 
     try:
         print(f"Ejecutando comando: {' '.join(cmd)}")
         subprocess.run(cmd, check=True)
     except FileNotFoundError:
-        print(f"Error: Asegúrate de que 'flask' o 'gunicorn' estén instalados en tu entorno virtual.", file=sys.stderr)
+        print(f"Error: Asegúrate de que 'flask', 'gunicorn' o 'uvicorn' estén instalados en tu entorno virtual.", file=sys.stderr)
         sys.exit(1)
     except subprocess.CalledProcessError as e:
         print(f"Error al iniciar la aplicación: {e}", file=sys.stderr)
         sys.exit(1)
     except KeyboardInterrupt:
         print("\nServidor detenido por el usuario.")
-    
+    finally:
+        if model_server is not None:
+            model_server.terminate()
+            model_server.wait()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
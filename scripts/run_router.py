@@ -0,0 +1,126 @@
+# ia-codex-api/scripts/run_router.py
+
+"""
+Arranca el router multinodo (app/router.py) con uvicorn delante de los backends de ROUTER_BACKENDS
+(o de --backends).
+
+Con --local N arranca además N backends en este host (puertos --base-port, --base-port + 1, ...), cada uno
+en su propio proceso con el pipeline falso (MODEL_STUB=True) y sus propias cachés y cola de trabajos.
+Así se prueba el enrutado (afinidad, salud, derrame, altas y bajas) sin descargar modelos.
+
+Ejemplos:
+    python scripts/run_router.py --backends http://10.0.0.1:5000,http://10.0.0.2:5000
+    python scripts/run_router.py --local 3 --port 8000
+    curl -s localhost:8000/router/stats
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def wait_until_up(url, process, timeout=60):
+    """Espera a que GET / responda 200 (o a que el proceso termine)."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(f"{url}/", timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            pass
+        time.sleep(0.3)
+    return False
+
+
+def start_local_backends(count, base_port, state_dir):
+    """Arranca 'count' backends con el pipeline falso, cada uno con su puerto, su caché y su cola de trabajos."""
+    processes, urls = [], []
+    for index in range(count):
+        port = base_port + index
+        env = dict(
+            os.environ,
+            MODEL_STUB='True',
+            CACHE_DB_PATH=os.path.join(state_dir, f"cache-{port}.sqlite"),
+            COALESCE_DB_PATH='',
+            JOBS_DB_PATH=os.path.join(state_dir, f"jobs-{port}.sqlite"),
+            METRICS_DIR='',
+        )
+        cmd = [
+            sys.executable, '-m', 'uvicorn', '--factory', 'app.asgi:create_asgi_app',
+            '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning',
+        ]
+        processes.append(subprocess.Popen(cmd, cwd=PROJECT_ROOT, env=env))
+        urls.append(f"http://127.0.0.1:{port}")
+
+    for url, process in zip(urls, processes):
+        if not wait_until_up(url, process):
+            print(f"Error: el backend {url} no arrancó.", file=sys.stderr)
+            stop(processes)
+            sys.exit(1)
+        print(f"Backend local listo: {url}")
+    return processes, urls
+
+
+def stop(processes):
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Router multinodo de IA Codex API.")
+    parser.add_argument('--backends', default=None, help="URLs de los backends separadas por comas (por defecto, ROUTER_BACKENDS)")
+    parser.add_argument('--local', type=int, default=0, metavar='N', help="Arranca N backends locales con MODEL_STUB=True")
+    parser.add_argument('--base-port', type=int, default=5001, help="Puerto del primer backend local")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=None, help="Puerto del router (por defecto, ROUTER_PORT o 8000)")
+    args = parser.parse_args()
+
+    os.chdir(PROJECT_ROOT)
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=os.path.join(PROJECT_ROOT, '.env'))
+
+    backends = [url for url in (args.backends or os.getenv('ROUTER_BACKENDS', '')).split(',') if url.strip()]
+    processes = []
+    if args.local:
+        state_dir = tempfile.mkdtemp(prefix='iacodex-router-')
+        processes, local_urls = start_local_backends(args.local, args.base_port, state_dir)
+        backends += local_urls
+    if not backends:
+        print("Error: no hay backends (usa --backends, ROUTER_BACKENDS o --local N).", file=sys.stderr)
+        sys.exit(1)
+
+    port = args.port or int(os.getenv('ROUTER_PORT', 8000))
+    env = dict(os.environ, ROUTER_BACKENDS=','.join(backends))
+    cmd = [
+        sys.executable, '-m', 'uvicorn', '--factory', 'app.router:create_router_app',
+        '--host', args.host, '--port', str(port),
+    ]
+    print(f"Router en el puerto {port} con {len(backends)} backends: {', '.join(backends)}")
+    try:
+        subprocess.run(cmd, check=True, env=env)
+    except FileNotFoundError:
+        print("Error: uvicorn no está instalado (pip install -r requirements.txt).", file=sys.stderr)
+        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        print(f"Error al iniciar el router: {e}", file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\nRouter detenido por el usuario.")
+    finally:
+        stop(processes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# ia-codex-api/scripts/snapshot_models.py
+
+"""
+Exporta los modelos configurados (.env: HF_MODEL_AUTOCOMPLETE, HF_MODEL_TEXT2TEXT y MODELS) como instantáneas
+para que los workers arranquen sin deserializar pesos ni construir el tokenizer (ver app/snapshots.py).
+Después, define MODEL_SNAPSHOT_DIR con el mismo directorio al arrancar la API.
+
+Uso:
+    python scripts/snapshot_models.py --output snapshots
+    python scripts/snapshot_models.py --output snapshots --models generator rapido --variants fp32 bf16
+"""
+
+import argparse
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_ROOT)
+
+
+def main():
+    from app import load_config
+    from app import models, snapshots
+
+    config = load_config()
+    parser = argparse.ArgumentParser(description="Exporta los modelos configurados como instantáneas safetensors.")
+    parser.add_argument('--output', default=config.get('MODEL_SNAPSHOT_DIR') or os.path.join(PROJECT_ROOT, 'snapshots'),
+                        help="Directorio de las instantáneas (por defecto, MODEL_SNAPSHOT_DIR o ./snapshots)")
+    parser.add_argument('--models', nargs='+', help="Nombres de los modelos a exportar (por defecto, todos)")
+    parser.add_argument('--variants', nargs='+', choices=snapshots.VARIANTS,
+                        help="Variantes de los pesos (por defecto fp32, y bf16 si CPU_QUANTIZE=bf16)")
+    args = parser.parse_args()
+
+    variants = args.variants or ['fp32'] + (['bf16'] if config.get('CPU_QUANTIZE') == 'bf16' else [])
+    # Se exportan los pesos originales: sin instantánea previa, sin cuantizar, sin borrador y sin modelo falso.
+    config.update(
+        INFERENCE_BACKEND='local', MODEL_SNAPSHOT_DIR='', CPU_QUANTIZE='none', HF_MODEL_DRAFT='', MODEL_ENGINE='eager',
+        MODEL_ENGINES='',
+        MODEL_STUB=False, MODEL_WARMUP=False, MODEL_MEMORY_BUDGET_MB=0,
+    )
+    models.load_models(config)
+    status = models.get_model_status()
+    names = args.models or list(status)
+    unknown = [name for name in names if name not in status]
+    if unknown:
+        print(f"Modelos desconocidos: {', '.join(unknown)}. Disponibles: {', '.join(status)}.", file=sys.stderr)
+        sys.exit(1)
+
+    failures = 0
+    for name in names:
+        started = time.monotonic()
+        pipe = models.get_pipeline(name)
+        if pipe is None:
+            print(f"No se pudo cargar '{name}'; no se exporta.", file=sys.stderr)
+            failures += 1
+            continue
+        entry = status[name]
+        manifest = snapshots.export_pipeline(
+            pipe, args.output, name, entry['kind'], pipe.task, entry['model'], variants
+        )
+        models.unload_model(name, reason='manual') # Sólo un modelo en memoria a la vez
+        print(
+            f"'{name}' ({manifest['model']}) exportado en {os.path.join(args.output, name)} "
+            f"[{', '.join(manifest['variants'])}] en {time.monotonic() - started:.1f}s."
+        )
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# ia-codex-api/tests/conftest.py
+
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, jobs, models
+
+
+@pytest.fixture
+def make_stub_client(monkeypatch):
+    """
+    Crea clientes de la aplicación completa con MODEL_STUB=True (sin descargar modelos), sin caché de
+    respuestas y sin cola de trabajos. Las variables de entorno que se le pasen (make_stub_client(FIX_FAST_PATH='False'))
+    sustituyen a éstas.
+    """
+    monkeypatch.setenv('MODEL_STUB', 'True')
+    monkeypatch.setenv('MODEL_STUB_TOKEN_DELAY_MS', '0')
+    monkeypatch.setenv('CACHE_ENABLED', 'False')
+    monkeypatch.setenv('JOBS_ENABLED', 'False')
+    monkeypatch.setattr(models, 'generator_pipeline', None)
+    monkeypatch.setattr(models, 'text2text_pipeline', None)
+    # El registro de modelos queda en modo falso sólo durante la prueba.
+    monkeypatch.setattr(models, '_registry', {})
+    monkeypatch.setattr(models, '_registry_config', dict(models._registry_config))
+
+    def _make(**env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, str(value))
+        return create_app().test_client()
+
+    yield _make
+    jobs.init_jobs({'JOBS_ENABLED': False}) # Detiene los hilos de la cola si la prueba la activó
+
+
+@pytest.fixture
+def client(make_stub_client):
+    """Aplicación completa con la configuración de make_stub_client, sin más cambios."""
+    return make_stub_client()
@@ -0,0 +1,130 @@
+# ia-codex-api/tests/test_admission.py
+
+import threading
+import time
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import admission
+from app.admission import AdmissionError, TokenBudget
+
+
+class WordTokenizer:
+    """Tokenizer falso: un token por palabra, con ventana de contexto de 16 tokens."""
+
+    model_max_length = 16
+
+    def __call__(self, text, **kwargs):
+        return {'input_ids': text.split(' ')}
+
+    def decode(self, ids):
+        return ' '.join(ids)
+
+
+class WordPipeline:
+    tokenizer = WordTokenizer()
+
+
+@pytest.fixture
+def client(make_stub_client):
+    """Aplicación con el pipeline falso y límites de admisión pequeños."""
+    yield make_stub_client(
+        ADMISSION_MAX_NEW_TOKENS='32',
+        ADMISSION_MAX_SUGGESTIONS='3',
+        ADMISSION_MAX_INPUT_TOKENS_COMPLETE='10',
+        ADMISSION_MAX_INPUT_TOKENS_FIX='20',
+    )
+    admission.init_admission({})
+
+
+def test_rejects_oversized_requests(client):
+    """
+    max_tokens y num_suggestions fuera de rango devuelven 422; una entrada demasiado larga en /fix, 413.
+    """
+    response = client.post('/complete', json={"prompt": "x", "max_tokens": 1000})
+    assert response.status_code == 422 and 'max_tokens' in response.json['error']
+    response = client.post('/complete', json={"prompt": "x", "num_suggestions": 50})
+    assert response.status_code == 422 and 'num_suggestions' in response.json['error']
+    response = client.post('/fix', json={"code": "x", "max_tokens": "mucho"})
+    assert response.status_code == 422
+
+    response = client.post('/fix', json={"code": "x = 1\n" * 50, "max_tokens": 4})
+    assert response.status_code == 413
+    assert client.post('/fix', json={"code": "x = 1", "max_tokens": 4}).status_code == 200
+    assert client.get('/stats').json['admission']['rejected_413'] == 1
+
+
+def test_complete_keeps_the_tail(client):
+    """
+    En /complete, una entrada demasiado larga se trunca conservando el final (desde una línea completa).
+    """
+    prompt = "".join(f"linea{i}\n" for i in range(20)) + "def f("
+    response = client.post('/complete', json={"prompt": prompt, "max_tokens": 4})
+    assert response.status_code == 200
+    assert int(response.headers['X-Input-Truncated']) > 0
+    suggestion = response.json['suggestions'][0]
+    assert suggestion.startswith("linea") and "def f(" in suggestion and "linea0\n" not in suggestion
+
+
+def test_context_window_and_truncation_modes():
+    """
+    El límite respeta la ventana de contexto (compartida con la generación en /complete)
+    y la truncación conserva el principio o el final del texto según el modo.
+    """
+    admission.init_admission({'ADMISSION_TRUNCATE_FIX': 'keep_head'})
+    try:
+        pipe = WordPipeline()
+        text = ' '.join(f"w{i}" for i in range(30))
+
+        head = admission.admit('fix', pipe, text, prefix='arregla: ', max_new_tokens=8)
+        assert head.input_tokens == 16 and head.text.startswith('w0 ') and head.truncated_tokens == 16
+
+        tail = admission.admit('complete', pipe, text, max_new_tokens=6)
+        assert tail.input_tokens == 10 and tail.text.endswith('w29') and tail.truncated_tokens == 20
+
+        with pytest.raises(AdmissionError) as error:
+            admission.admit('convert', pipe, text, max_new_tokens=8)
+        assert error.value.status_code == 413
+        with pytest.raises(AdmissionError) as error:
+            admission.admit('complete', pipe, 'w0', max_new_tokens=16)
+        assert error.value.status_code == 422
+    finally:
+        admission.init_admission({})
+
+
+def test_token_budget_is_fifo_and_times_out():
+    """
+    El presupuesto de tokens atiende por orden de llegada: una solicitud pequeña no adelanta
+    a una grande que espera. Sin turno antes del tiempo máximo, 503.
+    """
+    budget = TokenBudget(10, timeout_s=2)
+    order = []
+    first = budget.reserve(6)
+    first.__enter__()
+
+    def take(name, tokens):
+        with budget.reserve(tokens):
+            order.append(name)
+
+    big = threading.Thread(target=take, args=('grande', 50)) # Más que todo el presupuesto: se ejecuta sola
+    big.start()
+    time.sleep(0.05)
+    small = threading.Thread(target=take, args=('pequeña', 2))
+    small.start()
+    time.sleep(0.05)
+    assert order == [] and budget.stats()['waiting'] == 2
+    first.__exit__(None, None, None)
+    big.join()
+    small.join()
+    assert order == ['grande', 'pequeña']
+
+    budget.timeout_s = 0.05
+    with budget.reserve(10):
+        with pytest.raises(AdmissionError) as error:
+            with budget.reserve(1):
+                pass
+    assert error.value.status_code == 503
+    assert budget.stats()['timeouts'] == 1 and budget.stats()['in_use'] == 0
@@ -0,0 +1,160 @@
+# ia-codex-api/tests/test_asgi.py
+
+import asyncio
+import json
+import sys
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import asgi, models
+
+
+class SlowPipeline:
+    """Pipeline falso que devuelve la última línea del prompt en mayúsculas; puede bloquearse hasta 'release'."""
+    tokenizer = None
+    model = SimpleNamespace(config=SimpleNamespace(name_or_path="fake-t5"))
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.release.set()
+        self.calls = 0
+
+    def __call__(self, prompts, batch_size=None, **params):
+        self.calls += 1
+        self.release.wait(5)
+        return [{"generated_text": prompt.splitlines()[-1].upper()} for prompt in prompts]
+
+
+async def call(app, method, path, payload=None, headers=None):
+    """Envía una solicitud HTTP a la aplicación ASGI y devuelve (estado, cabeceras, cuerpo)."""
+    body = json.dumps(payload).encode() if payload is not None else b''
+    scope = {
+        'type': 'http', 'method': method, 'path': path,
+        'headers': [(b'content-type', b'application/json')] + [
+            (key.lower().encode(), value.encode()) for key, value in (headers or {}).items()
+        ],
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait() # El cliente sigue conectado
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start = sent[0]
+    return (
+        start['status'],
+        {key.decode(): value.decode() for key, value in start['headers']},
+        b''.join(message.get('body', b'') for message in sent[1:]).decode(),
+    )
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    pipeline = SlowPipeline()
+    monkeypatch.setattr(asgi, 'load_models', lambda config: None)
+    monkeypatch.setattr(models, 'text2text_pipeline', pipeline)
+    monkeypatch.setattr(models, 'generator_pipeline', pipeline)
+    return pipeline
+
+
+def make_app(**config):
+    return asgi.create_asgi_app(dict({'CACHE_ENABLED': True, 'CACHE_DB_PATH': '', 'BATCH_MAX_WAIT_MS': 0}, **config))
+
+
+def test_asgi_same_contract_as_flask(pipeline):
+    """
+    /, /fix y los errores de validación responden igual que la aplicación Flask.
+    """
+    app = make_app()
+
+    async def scenario():
+        status, _, body = await call(app, 'GET', '/')
+        assert status == 200 and "Bienvenido" in json.loads(body)["message"]
+
+        status, headers, body = await call(app, 'POST', '/fix', {"code": "print('hola')"})
+        assert status == 200
+        assert json.loads(body) == {"fixed_code": "PRINT('HOLA')", "fix_path": "model"}
+        assert headers['x-cache'] == 'MISS'
+
+        status, headers, _ = await call(app, 'POST', '/fix', {"code": "print('hola')"})
+        assert headers['x-cache'] == 'HIT'
+
+        status, _, body = await call(app, 'POST', '/convert', {"code": "x = 1"})
+        assert status == 400
+        assert json.loads(body) == {"error": "El campo 'target_language' es requerido."}
+
+        status, _, _ = await call(app, 'GET', '/fix')
+        assert status == 405
+
+    asyncio.run(scenario())
+
+
+def test_asgi_backpressure(pipeline):
+    """
+    Con todos los huecos de inferencia ocupados y la cola llena se responde 429;
+    si una solicitud espera su turno más de ASGI_QUEUE_TIMEOUT_S, 503.
+    """
+    app = make_app(CACHE_ENABLED=False, ASGI_MAX_IN_FLIGHT=1, ASGI_MAX_QUEUE=1, ASGI_QUEUE_TIMEOUT_S=0.2)
+    pipeline.release.clear()
+
+    async def scenario():
+        first = asyncio.ensure_future(call(app, 'POST', '/fix', {"code": "a"}))
+        await asyncio.sleep(0.05)
+        queued = asyncio.ensure_future(call(app, 'POST', '/fix', {"code": "b"}))
+        await asyncio.sleep(0.05)
+
+        status, headers, _ = await call(app, 'POST', '/fix', {"code": "c"})
+        assert status == 429 and headers['retry-after'] == '1'
+
+        status, _, _ = await queued
+        assert status == 503
+
+        pipeline.release.set()
+        status, _, _ = await first
+        assert status == 200
+        assert app.gate.stats()['in_flight'] == 0
+
+    asyncio.run(scenario())
+
+
+def test_asgi_stream(pipeline, monkeypatch):
+    """
+    El streaming emite los mismos eventos que la aplicación Flask.
+    """
+    def fake_stream_generation(pipeline, prompt, max_new_tokens=256, **kwargs):
+        yield from ["    return", " a", " + b"]
+
+    monkeypatch.setattr(asgi, 'stream_generation', fake_stream_generation)
+    app = make_app()
+
+    status, headers, body = asyncio.run(
+        call(app, 'POST', '/complete', {"prompt": "def suma(a, b):\n", "stream": True})
+    )
+    assert status == 200
+    assert headers['content-type'].startswith('text/event-stream')
+    blocks = body.strip().split("\n\n")
+    assert [json.loads(block[len("data: "):])["token"] for block in blocks[:-1]] == ["    return", " a", " + b"]
+    assert blocks[-1] == 'event: done\ndata: ' + json.dumps({"suggestions": ["def suma(a, b):\n    return a + b"]})
+
+
+def test_asgi_file_mode(pipeline):
+    """
+    En modo archivo, cada fragmento pasa por el pipeline y los resultados se unen en el orden original.
+    """
+    app = make_app(FILE_CHUNK_MAX_TOKENS=8)
+    code = "def a():\n    return 1\n\ndef b():\n    return 2\n"
+
+    status, _, body = asyncio.run(call(app, 'POST', '/fix', {"code": code, "mode": "file"}))
+    assert status == 200
+    assert json.loads(body) == {"fixed_code": "    RETURN 1\n\n    RETURN 2\n", "chunks": 2, "fix_path": "model"}
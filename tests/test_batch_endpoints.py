@@ -0,0 +1,87 @@
+# ia-codex-api/tests/test_batch_endpoints.py
+
+import pytest
+import sys
+import os
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import app as app_module
+from app import create_app, models
+
+
+class RecordingPipeline:
+    """Pipeline falso que devuelve la última línea del prompt en mayúsculas y registra cada pasada."""
+    tokenizer = None
+    model = SimpleNamespace(config=SimpleNamespace(name_or_path="fake-t5"))
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, prompts, batch_size=None, **params):
+        self.batches.append(list(prompts))
+        return [{"generated_text": prompt.splitlines()[-1].upper()} for prompt in prompts]
+
+
+@pytest.fixture
+def pipeline():
+    return RecordingPipeline()
+
+
+@pytest.fixture
+def client(monkeypatch, pipeline):
+    monkeypatch.setattr(app_module, 'load_models', lambda config: None)
+    monkeypatch.setattr(models, 'text2text_pipeline', pipeline)
+    monkeypatch.setenv('CACHE_ENABLED', 'False')
+    monkeypatch.setenv('BATCH_MAX_SIZE', '8')
+
+    app = create_app()
+    with app.test_client() as client:
+        yield client
+
+
+def test_fix_batch_returns_results_in_order(client, pipeline):
+    """
+    Los resultados vuelven en el orden de la solicitud aunque el pipeline los procese ordenados por longitud.
+    """
+    items = [{"code": "codigo largo"}, {"code": "a"}, {"code": "medio"}]
+    response = client.post('/fix/batch', json={"items": items})
+
+    assert response.status_code == 200
+    assert response.json['results'] == [
+        {"fixed_code": "CODIGO LARGO", "fix_path": "model"},
+        {"fixed_code": "A", "fix_path": "model"},
+        {"fixed_code": "MEDIO", "fix_path": "model"},
+    ]
+    # Una sola pasada por el modelo para los tres elementos.
+    assert len(pipeline.batches) == 1
+
+
+def test_convert_batch_reports_per_item_errors(client, pipeline):
+    """
+    Un elemento inválido produce un error en su posición sin abortar el resto del lote.
+    """
+    items = [
+        {"code": "print(1)"},
+        {"code": "print(2)", "target_language": "klingon"},
+        {"target_language": "go"},
+    ]
+    response = client.post('/convert/batch', json={"items": items, "target_language": "javascript"})
+
+    results = response.json['results']
+    assert response.status_code == 200
+    assert results[0] == {"converted_code": "PRINT(1)"}
+    assert results[1]['status'] == 400
+    assert "no es soportado" in results[1]['error']
+    assert results[2] == {"error": "El campo 'code' es requerido.", "status": 400}
+
+
+def test_batch_requires_items(client):
+    """
+    Sin una lista 'items' no vacía la solicitud completa se rechaza.
+    """
+    response = client.post('/fix/batch', json={"items": []})
+
+    assert response.status_code == 400
+    assert "'items'" in response.json['error']
@@ -0,0 +1,78 @@
+# ia-codex-api/tests/test_batching.py
+
+import sys
+import os
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.batching import BatchScheduler, run_batch
+
+
+class FakePipeline:
+    """
+    Pipeline falso que registra cada llamada y devuelve el prompt en mayúsculas.
+    """
+    tokenizer = None
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, prompts, batch_size=None, **params):
+        self.calls.append((list(prompts), params))
+        return [[{"generated_text": prompt.upper()}] for prompt in prompts]
+
+
+def test_run_batch_keeps_request_order():
+    """
+    Los prompts se ordenan por longitud para el pipeline pero los resultados vuelven en el orden original.
+    """
+    pipeline = FakePipeline()
+    results = run_batch(pipeline, ["ccc", "a", "bb"], max_new_tokens=5)
+
+    assert pipeline.calls[0][0] == ["a", "bb", "ccc"]
+    assert [r[0]["generated_text"] for r in results] == ["CCC", "A", "BB"]
+
+
+def test_scheduler_groups_concurrent_requests():
+    """
+    Solicitudes concurrentes con los mismos parámetros se ejecutan en un único lote.
+    """
+    pipeline = FakePipeline()
+    scheduler = BatchScheduler('test', lambda: pipeline, max_wait_ms=200, max_batch_size=4)
+    results = {}
+
+    def worker(prompt):
+        results[prompt] = scheduler.submit(prompt, max_new_tokens=5, do_sample=False)
+
+    threads = [threading.Thread(target=worker, args=(p,)) for p in ["x", "y", "z", "w"]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(pipeline.calls) == 1
+    assert results["y"][0]["generated_text"] == "Y"
+    stats = scheduler.stats()
+    assert stats['batches'] == 1
+    assert stats['requests'] == 4
+
+
+def test_scheduler_separates_incompatible_params():
+    """
+    Solicitudes con distintos parámetros de generación no comparten pasada.
+    """
+    pipeline = FakePipeline()
+    scheduler = BatchScheduler('test', lambda: pipeline, max_wait_ms=200, max_batch_size=2)
+
+    threads = [
+        threading.Thread(target=scheduler.submit, args=("a",), kwargs={"max_new_tokens": 5}),
+        threading.Thread(target=scheduler.submit, args=("b",), kwargs={"max_new_tokens": 10}),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(pipeline.calls) == 2
+    assert {call[1]['max_new_tokens'] for call in pipeline.calls} == {5, 10}
@@ -0,0 +1,89 @@
+# ia-codex-api/tests/test_cache.py
+
+import pytest
+import sys
+import os
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import app as app_module
+from app import create_app, models
+from app.cache import ResponseCache, make_key
+
+
+class CountingPipeline:
+    """Pipeline text2text falso que cuenta cuántas veces se ejecuta."""
+    tokenizer = None
+    model = SimpleNamespace(config=SimpleNamespace(name_or_path="fake-t5", _commit_hash="abc123"))
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, prompts, batch_size=None, **params):
+        self.calls += 1
+        return [{"generated_text": f"salida {len(prompt)}"} for prompt in prompts]
+
+
+def test_make_key_depends_on_every_input():
+    """
+    Cualquier cambio en las entradas (modelo, prompt, parámetros) produce otra clave.
+    """
+    base = make_key('fix', 'fake-t5@abc', 'prompt', 256)
+    assert base == make_key('fix', 'fake-t5@abc', 'prompt', 256)
+    assert base != make_key('fix', 'fake-t5@def', 'prompt', 256)
+    assert base != make_key('fix', 'fake-t5@abc', 'prompt', 128)
+    assert base != make_key('convert', 'fake-t5@abc', 'prompt', 256)
+
+
+def test_memory_lru_is_bounded_by_bytes():
+    """
+    Al superar el límite de bytes se expulsan primero las entradas menos usadas.
+    """
+    response_cache = ResponseCache(max_bytes=30)
+    response_cache.set("a", "x" * 10)
+    response_cache.set("b", "x" * 10)
+    assert response_cache.get("a") is not None # 'a' pasa a ser la más reciente
+    response_cache.set("c", "x" * 10)
+
+    assert response_cache.get("b") is None
+    assert response_cache.get("a") is not None
+    assert response_cache.stats()['evictions'] == 1
+
+
+def test_disk_tier_survives_restarts(tmp_path):
+    """
+    Con CACHE_DB_PATH, otra instancia (otro worker o un reinicio) ve las respuestas guardadas.
+    """
+    db_path = str(tmp_path / "cache.sqlite")
+    ResponseCache(db_path=db_path).set("clave", "valor")
+
+    response_cache = ResponseCache(db_path=db_path)
+    assert response_cache.get("clave") == "valor"
+    assert response_cache.get("clave") == "valor"
+    stats = response_cache.stats()
+    assert stats['disk_hits'] == 1
+    assert stats['memory_hits'] == 1
+
+
+def test_fix_second_call_skips_pipeline(monkeypatch):
+    """
+    Una segunda llamada idéntica a /fix se sirve desde la caché sin ejecutar el pipeline.
+    """
+    pipeline = CountingPipeline()
+    monkeypatch.setattr(app_module, 'load_models', lambda config: None)
+    monkeypatch.setattr(models, 'text2text_pipeline', pipeline)
+    monkeypatch.setenv('CACHE_DB_PATH', '')
+
+    app = create_app()
+    with app.test_client() as client:
+        first = client.post('/fix', json={"code": "pront('hola')"})
+        second = client.post('/fix', json={"code": "pront('hola')"})
+        stats = client.get('/stats').json['cache']
+
+    assert first.headers['X-Cache'] == 'MISS'
+    assert second.headers['X-Cache'] == 'HIT'
+    assert second.json == first.json
+    assert pipeline.calls == 1
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
@@ -0,0 +1,97 @@
+# ia-codex-api/tests/test_chunking.py
+
+import json
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import inference, scheduling
+from app.chunking import split_units, pack_chunks
+
+
+@pytest.fixture
+def client(make_stub_client):
+    """Aplicación con el pipeline falso y fragmentos pequeños."""
+    return make_stub_client(FILE_CHUNK_MAX_TOKENS='12')
+
+
+PYTHON_FILE = '''import os
+
+# Suma dos números
+@cache
+def suma(a, b):
+    return {
+"total": a + b}
+
+class Punto:
+    x = 1
+'''
+
+
+def test_split_on_syntactic_boundaries():
+    """
+    El código se divide en sentencias de primer nivel sin perder nada: con ast en Python,
+    con llaves y sangría en otros lenguajes o en Python con errores. Los comentarios van con su definición.
+    """
+    units = split_units(PYTHON_FILE)
+    assert ''.join(units) == PYTHON_FILE
+    assert units[1].startswith('# Suma') and units[2].startswith('class Punto')
+
+    js = 'const a = 1;\n// doc\nfunction f(x) {\n  if (x) {\n    return "}";\n  }\n}\nclass C {\n}\n'
+    units = split_units(js)
+    assert ''.join(units) == js
+    assert [unit.split('\n')[0] for unit in units] == ['const a = 1;', '// doc', 'class C {']
+
+    broken = 'def f(:\n  pass\ndef g():\n    return 1\n'
+    assert split_units(broken) == ['def f(:\n  pass\n', 'def g():\n    return 1\n']
+
+    chunks = pack_chunks(split_units(PYTHON_FILE), 8, lambda text: (len(text) + 3) // 4)
+    assert ''.join(chunks) == PYTHON_FILE and len(chunks) > 3
+
+
+def test_file_mode_batch_and_stream(client):
+    """
+    En modo archivo, /fix devuelve el archivo completo unido en orden, y con streaming
+    un evento 'chunk' por fragmento seguido de 'done' con el mismo resultado.
+    """
+    response = client.post('/fix', json={"code": PYTHON_FILE, "mode": "file", "max_tokens": 2})
+    assert response.status_code == 200
+    chunks = response.json['chunks']
+    assert chunks > 1
+    # Cada fragmento produce 2 tokens de 4 caracteres, separados por el salto de línea original.
+    assert len(response.json['fixed_code'].split('\n')) >= chunks
+
+    response = client.post(
+        '/convert',
+        json={"code": PYTHON_FILE, "mode": "file", "target_language": "go", "max_tokens": 2, "stream": True}
+    )
+    events = [block.split('\n') for block in response.get_data(as_text=True).strip().split('\n\n')]
+    names = [lines[0][len('event: '):] for lines in events]
+    assert names == ['chunk'] * chunks + ['done']
+    indices = sorted(json.loads(lines[1][len('data: '):])['index'] for lines in events[:-1])
+    assert indices == list(range(chunks))
+    assert json.loads(events[-1][1][len('data: '):])['chunks'] == chunks
+
+    response = client.post('/fix', json={"mode": "file"})
+    assert response.status_code == 400
+
+
+def test_file_mode_stream_keeps_request_priority(client, monkeypatch):
+    """
+    Los fragmentos de un /convert en modo archivo con streaming se ejecutan en el carril de la solicitud
+    (masivo, por IP), aunque el cuerpo se genere después de after_request.
+    """
+    seen = []
+    run = inference.run
+
+    def recording_run(task):
+        seen.append(scheduling.current())
+        return run(task)
+
+    monkeypatch.setattr(inference, 'run', recording_run)
+    body = {"code": "x = 1\n", "target_language": "javascript", "mode": "file", "max_tokens": 4}
+    response = client.post('/convert', json=dict(body, stream=True))
+    assert 'event: done' in response.get_data(as_text=True)
+    assert seen == [scheduling.Priority('bulk', 'ip:127.0.0.1')]
@@ -0,0 +1,100 @@
+# ia-codex-api/tests/test_cli.py
+
+import sys
+import os
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import iacodex_cli as cli
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+class FakeSession:
+    """Sesión HTTP falsa: /fix devuelve el código en mayúsculas y registra cada llamada."""
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def post(self, url, json=None, **kwargs):
+        with self.lock:
+            self.calls.append(url)
+        if url.endswith('/fix/batch'):
+            return FakeResponse({"results": [{"fixed_code": item["code"].upper()} for item in json["items"]]})
+        return FakeResponse({"fixed_code": json["code"].upper()})
+
+
+@pytest.fixture
+def session(monkeypatch, tmp_path):
+    """CLI con la sesión falsa y la caché local en un directorio temporal."""
+    fake = FakeSession()
+    monkeypatch.setattr(cli, '_session', fake)
+    monkeypatch.setattr(cli, '_cache', None)
+    monkeypatch.setattr(cli, 'CACHE_DIR', str(tmp_path / 'cache'))
+    return fake
+
+
+def test_parallel_files_and_local_cache(session, tmp_path, capsys):
+    """
+    --parallel reparte los trozos entre varias solicitudes simultáneas y la salida mantiene el orden.
+    La segunda vez, las respuestas salen de la caché local sin llamar a la API.
+    """
+    for i in range(5):
+        (tmp_path / f"f{i}.py").write_text(f"print({i})")
+
+    argv = ["fix", "-f", "f*.py", "--chunk-size", "2", "--parallel", "3"]
+    assert cli.run_command(argv, cwd=str(tmp_path)) == 0
+    first = capsys.readouterr().out
+    assert first.split("\n")[:4] == ["==> f0.py <==", "PRINT(0)", "==> f1.py <==", "PRINT(1)"]
+    assert len(session.calls) == 3
+
+    assert cli.run_command(argv, cwd=str(tmp_path)) == 0
+    assert capsys.readouterr().out == first
+    assert len(session.calls) == 3
+
+    assert cli.run_command(["fix", "-c", "print(0)"]) == 0 # Misma clave que el elemento del lote
+    assert capsys.readouterr().out == "PRINT(0)\n" and len(session.calls) == 3
+
+
+def test_daemon_round_trip(session, tmp_path, monkeypatch, capsys):
+    """
+    El daemon ejecuta las órdenes que le reenvía el cliente por el socket Unix (con su stdin)
+    y devuelve su salida y su código de salida; --stop lo detiene.
+    """
+    if not hasattr(cli.socket, 'AF_UNIX'):
+        pytest.skip("Sockets Unix no disponibles")
+    for name in ('stdin', 'stdout', 'stderr'):
+        monkeypatch.setattr(sys, name, getattr(sys, name)) # El daemon los sustituye
+    socket_path = str(tmp_path / 'd.sock')
+    server = threading.Thread(target=cli.serve_daemon, args=(socket_path,), daemon=True)
+    server.start()
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.01)
+
+    monkeypatch.setattr(sys.stdin, 'read', lambda: "pront('hola')", raising=False)
+    assert cli.forward_to_daemon(["fix"], socket_path) == 0
+    assert cli.forward_to_daemon(["fix", "-f", "no-existe.py"], socket_path) == 1
+    output = capsys.readouterr()
+    assert output.out == "PRONT('HOLA')\n"
+    assert "No se encontró ningún fichero." in output.err
+
+    args = cli.build_parser().parse_args(["daemon", "--socket", socket_path, "--stop"])
+    assert cli.daemon_command(args) == 0
+    server.join(5)
+    assert not server.is_alive() and not os.path.exists(socket_path)
@@ -0,0 +1,96 @@
+# ia-codex-api/tests/test_coalesce.py
+
+import sys
+import os
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.coalesce import SingleFlight
+
+
+def _run_concurrently(flights, key, func, count):
+    results = [None] * count
+    def worker(index):
+        results[index] = flights[index % len(flights)].run(key, func)
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_identical_requests_share_one_execution():
+    """
+    Las solicitudes con la misma clave que llegan mientras la primera está en curso reciben su resultado
+    sin volver a ejecutar la función; una clave distinta se ejecuta por separado.
+    """
+    flight = SingleFlight()
+    calls = []
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return "def f():\n    return 1"
+
+    results = _run_concurrently([flight], 'fix:abc', slow, 8)
+
+    assert len(calls) == 1
+    assert {value for value, _ in results} == {"def f():\n    return 1"}
+    assert sorted(origin or '' for _, origin in results) == [''] + ['worker'] * 7
+    assert flight.run('fix:otra', lambda: "x") == ("x", None)
+    assert flight.stats()['coalesced_local'] == 7 and flight.stats()['in_flight'] == 0
+
+
+def test_failed_leader_lets_waiters_retry():
+    """Si la primera ejecución falla, las que esperaban la repiten en lugar de recibir su error."""
+    flight = SingleFlight()
+    attempts = []
+    def flaky():
+        attempts.append(1)
+        time.sleep(0.1)
+        if len(attempts) == 1:
+            raise RuntimeError("fallo")
+        return "ok"
+
+    results = [None] * 2
+    def worker(index):
+        try:
+            results[index] = flight.run('k', flaky)
+        except RuntimeError as e:
+            results[index] = e
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(2)]
+    threads[0].start()
+    time.sleep(0.03)
+    threads[1].start()
+    for thread in threads:
+        thread.join()
+
+    assert isinstance(results[0], RuntimeError) and results[1] == ("ok", None)
+
+
+def test_workers_share_results_through_sqlite(tmp_path):
+    """
+    Dos workers (dos instancias con la misma base sqlite) ejecutan una sola vez la misma clave.
+    Si el proceso que la tenía registrada ya no existe, el siguiente la ejecuta él mismo.
+    """
+    db_path = str(tmp_path / 'coalesce.db')
+    workers = [SingleFlight(db_path=db_path, poll_interval_s=0.005), SingleFlight(db_path=db_path, poll_interval_s=0.005)]
+    calls = []
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"fixed_code": "x = 1"}
+
+    results = _run_concurrently(workers, 'convert:abc', slow, 6)
+
+    assert len(calls) == 1
+    assert all(value == {"fixed_code": "x = 1"} for value, _ in results)
+    assert sum(worker.stats()['coalesced_remote'] for worker in workers) == 1
+
+    # Registro huérfano de un worker que murió sin terminar (un pid que no existe).
+    conn = workers[0]._db()
+    conn.execute("INSERT INTO inflight (key, pid, started_at) VALUES ('huerfana', 2147483646, 0)")
+    assert workers[1].run('huerfana', lambda: "nuevo") == ("nuevo", None)
+    assert workers[1].stats()['takeovers'] == 1
@@ -0,0 +1,120 @@
+# ia-codex-api/tests/test_engines.py
+
+import json
+import pytest
+import sys
+import os
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import engines, metrics, models
+from app.stub import StubPipeline
+
+# Modelos diminutos para comprobar la paridad de los motores (se descargan del hub la primera vez).
+PARITY_MODELS = {'generator': 'sshleifer/tiny-gpt2', 'text2text': 'hf-internal-testing/tiny-random-t5'}
+
+
+@pytest.fixture(autouse=True)
+def _reset_engines():
+    yield
+    engines.init_engines({})
+
+
+def _entry(kind='generator', model_name='distilgpt2'):
+    return models._new_entry(kind, model_name)
+
+
+def _fallbacks():
+    return sum(value for (name, _), value in metrics._counters.items() if name == 'iacodex_engine_fallbacks')
+
+
+class _FakePipeline:
+    """Pipeline mínimo cuya llamada ejecuta el forward del modelo."""
+
+    def __init__(self, forward):
+        self.model = SimpleNamespace(forward=forward)
+
+    def __call__(self, prompt, **params):
+        return self.model.forward(prompt, **params)
+
+
+def test_engine_config_and_onnx_export_lookup(tmp_path):
+    """
+    MODEL_ENGINES elige el motor por modelo; sólo se usa la exportación ONNX del modelo configurado.
+    """
+    engines.init_engines({'MODEL_ENGINE': 'compile', 'MODEL_ENGINES': 'generator=onnx, rapido=eager'})
+    assert [engines.engine_for(name) for name in ('generator', 'rapido', 'text2text')] == ['onnx', 'eager', 'compile']
+    with pytest.raises(ValueError):
+        engines.parse_engines('generator=tensorrt')
+
+    root = str(tmp_path)
+    os.makedirs(os.path.join(root, 'generator'))
+    with open(os.path.join(root, 'generator', engines.ONNX_MANIFEST), 'w') as f:
+        json.dump({'model': 'distilgpt2', 'kind': 'generator', 'use_cache': True}, f)
+    assert engines.find_onnx_export(root, 'generator', 'distilgpt2') == os.path.join(root, 'generator')
+    for name, model_name in (('generator', 'gpt2'), ('text2text', 't5-small')): # El .env cambió / sin exportar
+        with pytest.raises(FileNotFoundError):
+            engines.find_onnx_export(root, name, model_name)
+
+
+def test_unavailable_engine_falls_back_to_eager(tmp_path, monkeypatch):
+    """
+    Sin exportación ONNX, o si la generación de prueba del modelo compilado falla, el modelo se carga
+    en eager (con el forward original) y se anota el motor usado y el motivo.
+    """
+    engines.init_engines({'MODEL_ENGINES': 'generator=onnx,text2text=compile', 'MODEL_ONNX_DIR': str(tmp_path)})
+    before = _fallbacks()
+    entry = _entry()
+    pipe = engines.build_pipeline('generator', entry, -1, lambda: StubPipeline('text-generation', 'distilgpt2'))
+    assert isinstance(pipe, StubPipeline) and entry['engine'] == 'eager' and pipe.iacodex_engine == 'eager'
+    assert 'no hay exportación' in entry['engine_error']
+
+    def original_forward(prompt, **params):
+        return [{'generated_text': prompt}]
+    def broken_compile(pipe):
+        def compiled(*args, **kwargs):
+            raise RuntimeError("operación no soportada")
+        pipe.model.forward = compiled
+        return original_forward
+    monkeypatch.setattr(engines, 'compile_pipeline', broken_compile)
+    fake = _FakePipeline(original_forward)
+    entry = _entry('text2text', 't5-small')
+    pipe = engines.build_pipeline('text2text', entry, -1, lambda: fake)
+    assert pipe.model.forward is original_forward and entry['engine'] == 'eager'
+    assert 'operación no soportada' in entry['engine_error']
+    assert _fallbacks() - before == 2
+
+
+@pytest.mark.parametrize('kind', ['generator', 'text2text'])
+def test_onnx_and_compile_match_eager_greedy_output(kind, tmp_path):
+    """
+    Paridad: con decodificación voraz, ONNX Runtime (exportado con caché KV) y torch.compile generan
+    exactamente el mismo texto que PyTorch eager, para el modelo solo-decodificador y el codificador-decodificador.
+    """
+    pytest.importorskip('torch')
+    pytest.importorskip('optimum.onnxruntime')
+    from transformers import pipeline
+
+    task = models._MODEL_SPECS[kind][0]
+    model_name = PARITY_MODELS[kind]
+    try:
+        eager = pipeline(task, model=model_name, device=-1)
+        engines.export_onnx(model_name, kind, task, str(tmp_path), kind)
+    except OSError as e:
+        pytest.skip(f"Modelo no disponible sin red: {e}")
+    engines.init_engines({'MODEL_ENGINES': f'{kind}=onnx', 'MODEL_ONNX_DIR': str(tmp_path)})
+
+    prompts = ["def fibonacci(n):\n    ", "x = [1, 2, 3]\nfor"]
+    params = dict(max_new_tokens=16, do_sample=False)
+    expected = [output[0]['generated_text'] for output in eager(prompts, **params)]
+
+    onnx_pipe = engines.load_onnx(kind, _entry(kind, model_name), -1)
+    assert [output[0]['generated_text'] for output in onnx_pipe(prompts, **params)] == expected
+
+    entry = _entry(kind, model_name)
+    engines.init_engines({'MODEL_ENGINE': 'compile'})
+    compiled = engines.build_pipeline(kind, entry, -1, lambda: pipeline(task, model=model_name, device=-1))
+    if entry['engine'] != 'compile':
+        pytest.skip(f"torch.compile no disponible: {entry['engine_error']}")
+    assert [output[0]['generated_text'] for output in compiled(prompts, **params)] == expected
@@ -0,0 +1,79 @@
+# ia-codex-api/tests/test_fastfix.py
+
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import fastfix, models
+from app.fastfix import reindent_python
+
+
+@pytest.fixture
+def client(make_stub_client, monkeypatch):
+    """Aplicación completa con MODEL_STUB=True y contadores de la vía rápida vacíos."""
+    monkeypatch.setattr(fastfix, '_counters', {path: 0 for path in fastfix.PATHS})
+    monkeypatch.setattr(fastfix, '_checkers', dict(fastfix._checkers))
+    return make_stub_client()
+
+
+def test_reindent_python():
+    """
+    La sangría se reconstruye a partir de la estructura: niveles que no coinciden, fragmentos copiados
+    con sangría y tabuladores. Las cadenas y continuaciones no se tocan; no se adivinan ni un bloque sin
+    sangría ni el bloque de una línea que queda entre dos niveles abiertos.
+    """
+    code = "def f(x):\n    if x:\n        a = 1\n            b = 2\n    return b\n"
+    assert reindent_python(code) == "def f(x):\n    if x:\n        a = 1\n        b = 2\n    return b\n"
+    assert reindent_python("    def f():\n\treturn 1\n") == "def f():\n    return 1\n"
+    code = "s = '''\n   dentro\n'''\n  t = (1,\n        2)\n"
+    assert reindent_python(code) == "s = '''\n   dentro\n'''\nt = (1,\n        2)\n"
+
+    assert reindent_python("def f():\nreturn 1\n") is None
+    assert reindent_python("x = (1,\n") is None
+    assert reindent_python("class A:\n    def f(self):\n        pass\n   def g(self):\n        pass\n") is None
+    assert reindent_python("def f(x):\n    if x:\n        a = 1\n      b = 2\n    return a") is None
+
+
+def test_fix_paths_and_bypass_ratio(client):
+    """
+    El código válido y el que sólo tiene errores de sangría se resuelven sin cargar el modelo;
+    el resto pasa por el modelo. La vía se indica en la respuesta y se cuenta en /stats y /metrics.
+    """
+    response = client.post('/fix', json={"code": "def f():\n    return 1\n", "language": "python"})
+    assert response.json == {"fixed_code": "def f():\n    return 1\n", "fix_path": "valid"}
+    response = client.post('/fix', json={"code": "def f():\n    x = 1\n      return x\n", "language": "python"})
+    assert response.json == {"fixed_code": "def f():\n    x = 1\n    return x\n", "fix_path": "reindent"}
+    assert models.get_model_status()['text2text']['loaded'] is False
+
+    response = client.post('/fix', json={"code": "pront 'hola'", "language": "python", "max_tokens": 4})
+    assert response.status_code == 200 and response.json["fix_path"] == "model" and len(response.json["fixed_code"]) == 16
+    # Sin 'language' (FIX_DEFAULT_LANGUAGE vacío) no se comprueba nada, aunque el código parezca Python.
+    response = client.post('/fix', json={"code": "console.log(x)", "max_tokens": 4})
+    assert response.json["fix_path"] == "model"
+    # Sin comprobador para el lenguaje: siempre el modelo.
+    response = client.post('/fix', json={"code": "let x = 1;", "language": "cobol", "max_tokens": 4})
+    assert response.json["fix_path"] == "model"
+
+    stats = client.get('/stats').json['fix_fast_path']
+    assert (stats['valid'], stats['reindent'], stats['model']) == (1, 1, 3) and stats['bypass_ratio'] == 0.4
+    assert 'iacodex_fix_requests_total{path="reindent"} 1' in client.get('/metrics').get_data(as_text=True)
+
+    # Los elementos repetidos de un lote no vuelven a ejecutar el modelo, así que no cuentan en su vía.
+    items = [{"code": "pront 'adios'", "max_tokens": 4}] * 2
+    assert client.post('/fix/batch', json={"items": items}).status_code == 200
+    assert client.get('/stats').json['fix_fast_path']['model'] == 4
+
+
+def test_file_mode_and_pluggable_checkers(client):
+    """
+    Un archivo válido no se divide (un solo fragmento, sin modelo), y register_checker() añade lenguajes.
+    """
+    code = "def a():\n    return 1\n\n\ndef b():\n    return 2\n"
+    response = client.post('/fix', json={"code": code, "language": "python", "mode": "file"})
+    assert response.json == {"fixed_code": code, "chunks": 1, "fix_path": "valid"}
+
+    fastfix.register_checker('json', lambda text: text.count('{') == text.count('}'))
+    response = client.post('/fix/batch', json={"language": "json", "items": [{"code": "{}"}, {"code": "{", "max_tokens": 4}]})
+    assert [item["fix_path"] for item in response.json["results"]] == ["valid", "model"]
@@ -0,0 +1,145 @@
+# ia-codex-api/tests/test_jobs.py
+
+import pytest
+import sys
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import jobs
+
+
+@pytest.fixture
+def client(make_stub_client, tmp_path):
+    """Aplicación con modelos falsos y la cola de trabajos en un directorio temporal."""
+    return make_stub_client(JOBS_ENABLED='True', JOBS_DB_PATH=tmp_path / 'jobs.sqlite', JOBS_POLL_MS='20')
+
+
+def test_job_runs_in_background_and_keeps_its_result(client):
+    """
+    POST /jobs responde 202 con el id en seguida; GET /jobs/<id>?wait= devuelve el mismo resultado
+    que el endpoint síncrono, y volver a pedirlo no repite la inferencia.
+    """
+    body = {"operation": "convert", "input": {"code": "x = 1", "target_language": "go", "max_tokens": 4}}
+    created = client.post('/jobs', json=body)
+    assert created.status_code == 202 and created.headers['Location'] == f"/jobs/{created.json['job_id']}"
+
+    job = client.get(f"{created.json['status_url']}?wait=5").json
+    assert job['status'] == 'done' and job['attempts'] == 1
+    assert job['result'] == client.post('/convert', json=body['input']).json
+
+    assert client.get(created.json['status_url']).json == job
+    assert client.get('/jobs/no-existe').status_code == 404
+    assert client.post('/jobs', json={"operation": "borrar", "input": {}}).status_code == 400
+
+
+def test_failed_jobs_and_idempotency_key(client):
+    """
+    Un trabajo con una entrada no válida termina 'failed' con el error del endpoint.
+    Repetir POST /jobs con la misma Idempotency-Key devuelve el trabajo ya creado (200); si su resultado
+    ya caducó (aunque la fila siga en la cola), se crea uno nuevo.
+    """
+    headers = {'Idempotency-Key': 'migracion-42'}
+    first = client.post('/jobs', json={"operation": "fix", "input": {}}, headers=headers)
+    again = client.post('/jobs', json={"operation": "fix", "input": {}}, headers=headers)
+    assert first.status_code == 202 and again.status_code == 200
+    assert again.json['job_id'] == first.json['job_id']
+
+    job = client.get(f"/jobs/{first.json['job_id']}?wait=5").json
+    assert job['status'] == 'failed' and job['status_code'] == 400
+    assert job['error'] == "El campo 'code' es requerido."
+    assert client.get('/stats').json['jobs']['deduplicated'] == 1
+
+    jobs.store._db().execute("UPDATE jobs SET expires_at = ? WHERE id = ?", (time.time() - 1, first.json['job_id']))
+    renewed = client.post('/jobs', json={"operation": "fix", "input": {}}, headers=headers)
+    assert renewed.status_code == 202 and renewed.json['job_id'] != first.json['job_id']
+
+
+def test_callback_and_recovery_of_interrupted_jobs(client, monkeypatch):
+    """
+    Al terminar, el resultado se envía por POST al callback_url (aquí, un host de JOBS_CALLBACK_ALLOWED_HOSTS).
+    Un trabajo que estaba en marcha en un proceso que ya no existe se vuelve a encolar y termina.
+    """
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append(self.rfile.read(int(self.headers['Content-Length'])))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    monkeypatch.setitem(jobs._config, 'callback_allowed_hosts', {'127.0.0.1'})
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/hecho"
+        created = client.post('/jobs', json={"operation": "fix", "input": {"code": "x"}, "callback_url": url}).json
+        client.get(f"/jobs/{created['job_id']}?wait=5")
+        deadline = time.monotonic() + 5
+        while not received and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert received and created['job_id'].encode() in received[0]
+    finally:
+        server.shutdown()
+
+    # Trabajo huérfano: 'running' en un pid que no existe.
+    job_id, _ = jobs.store.insert('fix', {"code": "y"}, 'ip:127.0.0.1')
+    jobs.store._db().execute("UPDATE jobs SET status = 'running', worker_pid = 2147483646, attempts = 1 WHERE id = ?", (job_id,))
+    assert jobs.store.recover(max_attempts=3, ttl_s=60) == 1
+    jobs._wakeup.set()
+    job = client.get(f"/jobs/{job_id}?wait=5").json
+    assert job['status'] == 'done' and job['attempts'] == 2
+
+
+def test_callback_url_cannot_reach_internal_addresses(client, monkeypatch):
+    """
+    Sin JOBS_CALLBACK_ALLOWED_HOSTS, un callback_url a localhost, a la red privada o a la dirección de
+    metadatos de la nube responde 400 sin encolar nada; el envío va a la dirección comprobada; con la
+    lista, sólo se admiten sus hosts.
+    """
+    submitted = client.get('/stats').json['jobs']['submitted']
+    for url in ("http://127.0.0.1:8080/hecho", "http://localhost/hecho", "http://10.0.0.5/hecho",
+                "http://169.254.169.254/latest/meta-data/", "http://[::1]/hecho", "ftp://example.com/"):
+        response = client.post('/jobs', json={"operation": "fix", "input": {"code": "x"}, "callback_url": url})
+        assert response.status_code == 400, url
+    assert client.get('/stats').json['jobs']['submitted'] == submitted
+
+    # El envío se conecta a la dirección comprobada, sin volver a resolver el host (DNS rebinding):
+    # 'hooks.invalid' no existe y el servidor local recibe el POST con su cabecera Host.
+    public = [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('93.184.216.34', 80))]
+    with monkeypatch.context() as patch:
+        patch.setattr(jobs.socket, 'getaddrinfo', lambda *args, **kwargs: public)
+        assert jobs.check_callback_url("http://hooks.invalid/hecho") == ['93.184.216.34']
+
+    hosts = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            hosts.append(self.headers['Host'])
+            self.rfile.read(int(self.headers['Content-Length']))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        port = server.server_address[1]
+        jobs._post_callback(f"http://hooks.invalid:{port}/hecho", b"{}", ['127.0.0.1'])
+        assert hosts == [f"hooks.invalid:{port}"]
+    finally:
+        server.shutdown()
+
+    monkeypatch.setitem(jobs._config, 'callback_allowed_hosts', {'hooks.interno'})
+    with pytest.raises(jobs.JobError):
+        jobs.check_callback_url("http://127.0.0.1/hecho")
+    assert jobs.check_callback_url("https://HOOKS.interno:8443/hecho") is None
@@ -0,0 +1,95 @@
+# ia-codex-api/tests/test_kv_cache.py
+
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import kv_cache
+from app.kv_cache import PrefixKVStore
+
+
+class FakeTensor:
+    """Tensor mínimo (n tokens) para probar el almacén sin torch."""
+
+    def __init__(self, length):
+        self.length = length
+
+    def numel(self):
+        return self.length
+
+    def element_size(self):
+        return 4
+
+
+class FakeCache:
+    """Caché KV falsa de una capa, con la interfaz de DynamicCache que usa el almacén."""
+
+    def __init__(self, length):
+        self.key_cache = [FakeTensor(length)]
+        self.value_cache = [FakeTensor(length)]
+
+    def crop(self, length):
+        self.key_cache = [FakeTensor(length)]
+        self.value_cache = [FakeTensor(length)]
+
+
+def test_lookup_reuses_longest_cached_prefix():
+    """
+    Un prompt que extiende uno ya visto reutiliza la caché de ese prefijo.
+    """
+    store = PrefixKVStore(min_tokens=2)
+    store.store([1, 2, 3], FakeCache(3))
+    store.store([1, 2, 3, 4, 5], FakeCache(5))
+
+    past, reused = store.lookup([1, 2, 3, 4, 5, 6, 7])
+
+    assert reused == 5
+    assert past.key_cache[0].length == 5
+
+
+def test_lookup_leaves_at_least_one_token_to_encode():
+    """
+    Si el prompt coincide exactamente con una entrada, se reutiliza todo menos el último token.
+    """
+    store = PrefixKVStore(min_tokens=2)
+    store.store([1, 2, 3, 4], FakeCache(4))
+
+    past, reused = store.lookup([1, 2, 3, 4])
+
+    assert reused == 3
+    assert past.key_cache[0].length == 3
+
+
+def test_session_affinity_allows_partial_reuse():
+    """
+    Dentro de una sesión se reutiliza el prefijo común aunque el último token haya cambiado
+    (p. ej. el tokenizer fusionó el carácter recién escrito con el token anterior).
+    """
+    store = PrefixKVStore(min_tokens=2)
+    store.store([1, 2, 3, 9], FakeCache(4), session_id="editor-1")
+
+    _, reused_other = store.lookup([1, 2, 3, 10, 11], session_id="editor-2")
+    _, reused_same = store.lookup([1, 2, 3, 10, 11], session_id="editor-1")
+
+    assert reused_other == 0
+    assert reused_same == 3
+
+
+def test_eviction_by_memory_budget_and_per_session_limit():
+    """
+    Se expulsan entradas al superar el presupuesto de memoria o el máximo por sesión.
+    """
+    store = PrefixKVStore(max_bytes=100, max_entries_per_session=2, min_tokens=1)
+    for length in (2, 3, 4):
+        store.store(list(range(length)), FakeCache(length), session_id="s")
+    assert store.stats()['entries'] == 2
+
+    store.store(list(range(100, 110)), FakeCache(10)) # 80 bytes: obliga a expulsar por memoria
+    stats = store.stats()
+    assert stats['bytes'] <= 100
+    assert stats['evictions'] >= 2
+
+
+def test_kv_nbytes_counts_keys_and_values():
+    assert kv_cache.kv_nbytes(FakeCache(3)) == 2 * 3 * 4
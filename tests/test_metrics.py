@@ -0,0 +1,70 @@
+# ia-codex-api/tests/test_metrics.py
+
+import json
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import metrics
+
+
+@pytest.fixture
+def client(make_stub_client, monkeypatch):
+    """Aplicación con el pipeline falso y métricas vacías."""
+    monkeypatch.setattr(metrics, '_counters', {})
+    monkeypatch.setattr(metrics, '_histograms', {})
+    return make_stub_client(MODEL_STUB_TOKEN_DELAY_MS='1', METRICS_DIR='')
+
+
+def _samples(text):
+    """Convierte el texto de /metrics en {nombre{etiquetas}: valor}."""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_request_stages_and_model_metrics(client):
+    """
+    Cada solicitud registra sus etapas (también en Server-Timing), los tokens y tokens/s del modelo.
+    """
+    response = client.post('/fix', json={"code": "x = 1", "max_tokens": 8})
+    assert response.status_code == 200
+    stages = [part.split(';')[0] for part in response.headers['Server-Timing'].split(', ')]
+    assert {'parse', 'queue', 'prefill', 'decode', 'serialize'} <= set(stages)
+
+    samples = _samples(client.get('/metrics').get_data(as_text=True))
+    assert samples['iacodex_requests_total{endpoint="/fix",status="200"}'] == 1
+    assert samples['iacodex_stage_duration_seconds_count{endpoint="/fix",stage="decode"}'] == 1
+    assert samples['iacodex_model_tokens_total{direction="output",model="stub:t5-small"}'] == 8
+    assert samples['iacodex_model_tokens_per_second_count{model="stub:t5-small"}'] == 1
+    assert samples['iacodex_request_duration_seconds_bucket{endpoint="/fix",le="+Inf"}'] == 1
+
+
+def test_metrics_are_summed_across_processes(client, tmp_path):
+    """
+    Con METRICS_DIR, /metrics suma los valores volcados por todos los procesos.
+    """
+    metrics.init_metrics({'METRICS_DIR': str(tmp_path)})
+    try:
+        metrics.inc('iacodex_model_load_failures', model='m')
+        metrics.observe('iacodex_model_load_duration_seconds', 2.0, model='m')
+        other = {
+            'counters': [['iacodex_model_load_failures', [['model', 'm']], 2.0]],
+            'histograms': [['iacodex_model_load_duration_seconds', [['model', 'm']], [0, 0, 0, 0, 1, 0, 0, 0, 0, 0], 7.0, 1]],
+        }
+        (tmp_path / 'metrics-999999.json').write_text(json.dumps(other))
+
+        samples = _samples(metrics.render())
+        assert samples['iacodex_model_load_failures_total{model="m"}'] == 3
+        assert samples['iacodex_model_load_duration_seconds_count{model="m"}'] == 2
+        assert samples['iacodex_model_load_duration_seconds_sum{model="m"}'] == 9
+        assert samples['iacodex_model_load_duration_seconds_bucket{model="m",le="2.5"}'] == 1
+        assert samples['iacodex_model_load_duration_seconds_bucket{model="m",le="10"}'] == 2
+        assert (tmp_path / f'metrics-{os.getpid()}.json').exists()
+    finally:
+        metrics.init_metrics({})
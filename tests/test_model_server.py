@@ -0,0 +1,77 @@
+# ia-codex-api/tests/test_model_server.py
+
+import pytest
+import sys
+import os
+import threading
+from multiprocessing.connection import Listener
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import models
+from app.model_server import ModelServerClient, RemotePipeline, RemoteError, _serve_connection, check_listen_address, parse_address
+
+
+class EchoPipeline:
+    """Pipeline falso que devuelve el prompt tal cual."""
+    tokenizer = None
+
+    def __call__(self, inputs, **params):
+        return [[{"generated_text": prompt}] for prompt in inputs]
+
+
+def _start_server(address, authkey):
+    listener = Listener(address, family='AF_UNIX', authkey=authkey.encode())
+
+    def accept_loop():
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                break
+            threading.Thread(target=_serve_connection, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener
+
+
+def test_remote_pipeline_forwards_calls(tmp_path, monkeypatch):
+    """
+    El proxy remoto reenvía la llamada al proceso que tiene los modelos y devuelve su salida.
+    """
+    monkeypatch.setattr(models, 'text2text_pipeline', EchoPipeline())
+    monkeypatch.setattr(models, 'generator_pipeline', None)
+    address = str(tmp_path / "model.sock")
+    listener = _start_server(address, 'secreto')
+
+    try:
+        client = ModelServerClient(address, 'secreto')
+        assert client.request('ping') == {'generator': False, 'text2text': True}
+
+        outputs = RemotePipeline('text2text', client)(["hola"], max_new_tokens=5)
+        assert outputs == [[{"generated_text": "hola"}]]
+
+        # Un pipeline no cargado en el servidor produce un error remoto, no un cuelgue.
+        try:
+            RemotePipeline('generator', client)(["hola"])
+            assert False, "Se esperaba RemoteError"
+        except RemoteError as e:
+            assert "no disponible" in str(e)
+    finally:
+        listener.close()
+
+
+def test_tcp_listener_requires_own_key_and_loopback():
+    """
+    Por TCP el servidor exige una clave distinta de la de por defecto y una dirección de loopback
+    (salvo con MODEL_SERVER_ALLOW_REMOTE); el socket Unix admite la clave por defecto.
+    """
+    check_listen_address(*parse_address('/tmp/modelos.sock'), 'iacodex')
+    check_listen_address(*parse_address('127.0.0.1:7000'), 'secreto')
+    check_listen_address(*parse_address(':7000'), 'secreto')
+    check_listen_address(*parse_address('0.0.0.0:7000'), 'secreto', allow_remote=True)
+
+    for address, authkey in (('127.0.0.1:7000', 'iacodex'), ('127.0.0.1:7000', ''), ('/tmp/modelos.sock', ''),
+                             ('0.0.0.0:7000', 'secreto'), ('10.0.0.5:7000', 'secreto')):
+        with pytest.raises(ValueError):
+            check_listen_address(*parse_address(address), authkey)
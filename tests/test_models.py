@@ -0,0 +1,146 @@
+# ia-codex-api/tests/test_models.py
+
+import subprocess
+import sys
+import os
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import models
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def _register(monkeypatch, **config):
+    """Registra los modelos con una función de carga falsa que tarda un poco y cuenta las cargas."""
+    loads = []
+
+    def fake_load(kind):
+        loads.append(kind)
+        time.sleep(0.05)
+        return object()
+
+    monkeypatch.setattr(models, '_load_pipeline', fake_load)
+    models.load_models(dict({'HF_MODEL_AUTOCOMPLETE': 'distilgpt2', 'HF_MODEL_TEXT2TEXT': 't5-small'}, **config))
+    return loads
+
+
+def test_import_app_does_not_import_torch():
+    """
+    Importar el paquete (y por tanto los health checks y la CLI de flask) no carga torch ni transformers.
+    """
+    code = "import sys, app; print('torch' in sys.modules or 'transformers' in sys.modules)"
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=PROJECT_ROOT, text=True)
+    assert output.strip().splitlines()[-1] == 'False'
+
+
+def test_models_load_once_on_first_use(monkeypatch):
+    """
+    Los modelos no se cargan al registrarlos; las solicitudes concurrentes esperan a una única carga.
+    """
+    loads = _register(monkeypatch)
+    assert loads == []
+    assert models.get_model_status()['text2text']['loaded'] is False
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(models.get_text2text_pipeline())) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loads == ['text2text']
+    assert len({id(result) for result in results}) == 1
+    assert models.get_model_status()['generator']['loaded'] is False
+
+
+def test_warmup_loads_everything(monkeypatch):
+    loads = _register(monkeypatch, MODEL_WARMUP=True)
+    assert sorted(loads) == ['generator', 'text2text']
+
+
+def test_unloaded_model_reloads_on_next_use(monkeypatch):
+    """
+    Un modelo descargado (por inactividad) se vuelve a cargar con la siguiente solicitud.
+    """
+    loads = _register(monkeypatch)
+    models.get_generator_pipeline()
+    assert models.unload_model('generator') is True
+    assert models.get_model_status()['generator']['loaded'] is False
+
+    models.get_generator_pipeline()
+    assert loads == ['generator', 'generator']
+
+
+def test_cpu_threads_split_between_workers(monkeypatch):
+    """
+    Sin CPU_THREADS, cada proceso de inferencia usa núcleos / INFERENCE_WORKERS hilos intra-op, fijados una sola vez.
+    """
+    calls = []
+    fake_torch = type('FakeTorch', (), {
+        'set_num_threads': staticmethod(lambda n: calls.append(('intra', n))),
+        'set_num_interop_threads': staticmethod(lambda n: calls.append(('inter', n))),
+    })
+    monkeypatch.setattr(models.os, 'cpu_count', lambda: 8)
+    _register(monkeypatch, INFERENCE_WORKERS=4)
+    monkeypatch.setitem(models._cpu_profile, 'applied_threads', None)
+
+    models._configure_cpu_threads(fake_torch)
+    models._configure_cpu_threads(fake_torch)
+    assert calls == [('intra', 2), ('inter', 1)]
+    assert models.get_cpu_profile()['intra_op_threads'] == 2
+
+
+def test_quantized_model_has_its_own_revision():
+    """
+    Las respuestas de un modelo cuantizado no comparten caché con las del modelo fp32.
+    """
+    from types import SimpleNamespace
+    config = SimpleNamespace(name_or_path='t5-small', _commit_hash='abc')
+    fp32 = SimpleNamespace(model=SimpleNamespace(config=config))
+    int8 = SimpleNamespace(model=SimpleNamespace(config=config), iacodex_variant='int8-dynamic')
+    assert models.get_model_revision(fp32) == 't5-small@abc'
+    assert models.get_model_revision(int8) == 't5-small@abc+int8-dynamic'
+
+
+def test_memory_budget_evicts_least_recently_used(monkeypatch):
+    """
+    Con MODEL_MEMORY_BUDGET_MB, cargar un modelo descarga los menos usados recientemente,
+    salvo los que tienen solicitudes en curso. GET /models muestra residencia, memoria y aciertos.
+    """
+    from types import SimpleNamespace
+    loads = []
+
+    def fake_load(name):
+        loads.append(name)
+        return SimpleNamespace(iacodex_footprint_bytes=40 * 2**20)
+
+    monkeypatch.setattr(models, '_load_pipeline', fake_load)
+    models.load_models({
+        'MODELS': 'rapido=generator:tiny-gpt2, grande=text2text:t5-base',
+        'MODEL_MEMORY_BUDGET_MB': 100,
+    })
+    assert models.resolve_model('generator', 'rapido') == 'rapido'
+    assert models.resolve_model('text2text') == 'text2text'
+    with pytest.raises(ValueError):
+        models.resolve_model('generator', 'grande') # Existe, pero no es de autocompletado
+
+    with models.model_in_use('generator'):
+        models.get_pipeline('generator')
+        models.get_pipeline('text2text')
+        models.get_pipeline('rapido') # 120 MB: se descarga text2text, el menos reciente que no está en uso
+        assert [entry['name'] for entry in models.list_models()['models'] if entry['resident']] == ['generator', 'rapido']
+
+        models.get_pipeline('grande') # generator sigue en uso: se descarga rapido
+        listing = models.list_models()
+        resident = {entry['name']: entry for entry in listing['models'] if entry['resident']}
+        assert sorted(resident) == ['generator', 'grande']
+        assert resident['generator']['in_use'] == 1 and resident['generator']['hits'] == 1
+        assert listing['memory'] == {'budget_mb': 100.0, 'resident_mb': 80.0}
+
+    assert loads == ['generator', 'text2text', 'rapido', 'grande']
+    assert models.get_model_status()['generator']['in_use'] == 0
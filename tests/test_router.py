@@ -0,0 +1,226 @@
+# ia-codex-api/tests/test_router.py
+
+import asyncio
+import json
+import sys
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.router import HashRing, create_router_app, routing_key
+
+
+class FakeBackend:
+    """
+    Backend HTTP mínimo en un puerto local: responde con su nombre, puede fallar las comprobaciones
+    de salud ('healthy') y retener las solicitudes hasta 'release'.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.healthy = True
+        self.release = threading.Event()
+        self.release.set()
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/':
+                    self._reply(200 if backend.healthy else 503, {"message": backend.name})
+                elif self.path.startswith('/jobs/'):
+                    found = self.path[len('/jobs/'):].startswith(backend.name)
+                    self._reply(200 if found else 404, {"backend": backend.name})
+
+            def do_POST(self):
+                data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                backend.release.wait(5)
+                if self.path == '/jobs':
+                    self._reply(202, {"job_id": f"{backend.name}-1"})
+                elif data.get('stream'):
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/event-stream')
+                    self.end_headers()
+                    for token in ("a", "b"):
+                        self.wfile.write(f"data: {json.dumps({'token': token})}\n\n".encode())
+                        self.wfile.flush()
+                else:
+                    self._reply(200, {"backend": backend.name})
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+async def call(app, method, path, payload=None, headers=None):
+    """Envía una solicitud HTTP a la aplicación ASGI y devuelve (estado, cabeceras, cuerpo)."""
+    body = json.dumps(payload).encode() if payload is not None else b''
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'client': ('10.0.0.9', 1234),
+        'headers': [(b'content-type', b'application/json')] + [
+            (key.lower().encode(), value.encode()) for key, value in (headers or {}).items()
+        ],
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait() # El cliente sigue conectado
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start = sent[0]
+    return (
+        start['status'],
+        {key.decode(): value.decode() for key, value in start['headers']},
+        b''.join(message.get('body', b'') for message in sent[1:]).decode(),
+    )
+
+
+@pytest.fixture
+def backends():
+    nodes = [FakeBackend(name) for name in ('a', 'b', 'c')]
+    yield nodes
+    for node in nodes:
+        node.release.set()
+        node.close()
+
+
+def make_router(backends, **config):
+    return create_router_app(dict({
+        'ROUTER_BACKENDS': ','.join(node.url for node in backends), 'ROUTER_HEALTH_INTERVAL_S': 0,
+    }, **config))
+
+
+def test_hash_ring_balance_and_minimal_movement():
+    """
+    Las claves se reparten entre los nodos, y al añadir uno sólo se mueven a él las claves que le tocan
+    (alrededor de 1/N); al quitarlo vuelven a su nodo anterior.
+    """
+    ring = HashRing(['a', 'b', 'c'], vnodes=64)
+    keys = [f"clave-{i}" for i in range(3000)]
+    before = {key: ring.preference(key)[0] for key in keys}
+    assert all(600 < list(before.values()).count(node) < 1400 for node in 'abc')
+    assert sorted(ring.preference('x')) == ['a', 'b', 'c']
+
+    ring.add('d')
+    moved = [key for key in keys if ring.preference(key)[0] != before[key]]
+    assert all(ring.preference(key)[0] == 'd' for key in moved) and 450 < len(moved) < 1100
+    ring.remove('d')
+    assert {key: ring.preference(key)[0] for key in keys} == before
+
+    # Clave de afinidad: sesión del editor, código completo y primer elemento de los lotes.
+    assert routing_key('/complete', {"prompt": "def f", "model": "m"}, 's1', 256) == \
+        routing_key('/complete', {"prompt": "def g(x):", "model": "m"}, 's1', 256)
+    assert routing_key('/fix/batch', {"items": [{"code": "x"}], "language": "python"}, None, 256) == \
+        routing_key('/fix', {"code": "x", "language": "python"}, None, 256)
+    assert routing_key('/jobs', {"operation": "fix", "input": {"code": "x"}}, None, 256) == \
+        routing_key('/fix', {"code": "x"}, None, 256)
+
+
+def test_affinity_health_and_rebalance(backends):
+    """
+    Las solicitudes con la misma clave van al mismo backend. Uno que falla las comprobaciones de salud
+    sale del anillo (sólo sus claves cambian de nodo) y al recuperarse vuelve a recibir las suyas.
+    Un backend caído se detecta al reenviar y la solicitud se reintenta en el siguiente.
+    """
+    app = make_router(backends)
+    router = app.router
+    codes = [f"x = {i}" for i in range(30)]
+
+    def owners():
+        return {code: asyncio.run(call(app, 'POST', '/fix', {"code": code}))[1]['x-iacodex-backend'] for code in codes}
+
+    first = owners()
+    assert first == owners() and len(set(first.values())) == 3
+
+    backends[0].healthy = False
+    router.check_all()
+    router.check_all() # ROUTER_UNHEALTHY_AFTER=2
+    assert backends[0].url not in router.ring.nodes
+    second = owners()
+    assert all(second[code] == first[code] for code in codes if first[code] != backends[0].url)
+    assert backends[0].url not in second.values()
+
+    backends[0].healthy = True
+    router.check_all()
+    assert owners() == first
+
+    # Caída sin comprobación de salud: error de conexión, reintento en el siguiente y fuera del anillo.
+    code = next(code for code in codes if first[code] == backends[1].url)
+    backends[1].close()
+    status, headers, body = asyncio.run(call(app, 'POST', '/fix', {"code": code}))
+    assert status == 200 and headers['x-iacodex-route'] == 'retry' and headers['x-iacodex-backend'] != backends[1].url
+    assert backends[1].url not in router.ring.nodes
+
+
+def test_spill_drain_join_streaming_and_jobs(backends):
+    """
+    Con el backend elegido ocupado, la solicitud se derrama al menos cargado. Un backend drenado no recibe
+    solicitudes nuevas y se retira al terminar las suyas; POST /router/nodes lo vuelve a añadir.
+    El streaming se transmite tal cual y los trabajos se consultan en el backend que los tiene.
+    """
+    app = make_router(backends, ROUTER_SPILL_IN_FLIGHT=1)
+    router = app.router
+    target = backends[0]
+    code = next(
+        f"y = {i}" for i in range(100)
+        if router.ring.preference(routing_key('/fix', {"code": f"y = {i}"}, None, 256))[0] == target.url
+    )
+
+    async def scenario():
+        target.release.clear()
+        held = asyncio.ensure_future(call(app, 'POST', '/fix', {"code": code}))
+        while router.backend(target.url).in_flight == 0:
+            await asyncio.sleep(0.01)
+        status, headers, _ = await call(app, 'POST', '/fix', {"code": code})
+        assert status == 200 and headers['x-iacodex-route'] == 'spill' and headers['x-iacodex-backend'] != target.url
+
+        # Drenaje con una solicitud en curso: fuera del anillo, pero no se retira hasta que termina.
+        status, _, body = await call(app, 'DELETE', '/router/nodes', {"url": target.url})
+        assert status == 202 and json.loads(body)['in_flight'] == 1
+        assert target.url not in router.ring.nodes and target.url in router.stats()['backends']
+        target.release.set()
+        status, headers, _ = await held
+        assert status == 200 and headers['x-iacodex-backend'] == target.url
+        assert target.url not in router.stats()['backends']
+
+        status, _, body = await call(app, 'POST', '/router/nodes', {"url": target.url})
+        assert status == 201 and json.loads(body)['healthy'] is True and target.url in router.ring.nodes
+
+        status, headers, body = await call(app, 'POST', '/complete', {"prompt": "def f", "stream": True})
+        assert status == 200 and headers['content-type'] == 'text/event-stream'
+        assert [json.loads(line[6:])['token'] for line in body.split('\n') if line] == ["a", "b"]
+
+        status, headers, body = await call(app, 'POST', '/jobs', {"operation": "fix", "input": {"code": code}})
+        job_id = json.loads(body)['job_id']
+        router.jobs.clear() # Sin la ruta recordada, se busca en todos los backends
+        status, headers, _ = await call(app, 'GET', f'/jobs/{job_id}')
+        assert status == 200 and headers['x-iacodex-backend'] == target.url and router.jobs[job_id] == target.url
+
+    asyncio.run(scenario())
+    status, _, body = asyncio.run(call(app, 'GET', '/router/stats'))
+    assert json.loads(body)['backends'][target.url]['requests'] >= 1
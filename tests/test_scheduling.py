@@ -0,0 +1,141 @@
+# ia-codex-api/tests/test_scheduling.py
+
+import sys
+import os
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import batching, scheduling
+from app.scheduling import FairGate, Priority
+from app.stub import StubPipeline
+
+
+def _queue_turns(gate, requests, hold_s=0.0):
+    """
+    Encola (prioridad, coste) mientras la única plaza está ocupada (al menos 'hold_s' segundos)
+    y devuelve el orden en que se conceden.
+    """
+    order = []
+    holder = gate.acquire(Priority('bulk', 'ocupa'), 1)
+
+    def worker(label, priority, cost):
+        turn = gate.acquire(priority, cost)
+        order.append(label)
+        gate.release(turn)
+
+    threads = []
+    for label, priority, cost in requests:
+        threads.append(threading.Thread(target=worker, args=(label, priority, cost)))
+        threads[-1].start()
+        # Cada turno se encola antes que el siguiente (el orden de llegada importa para el reparto justo).
+        while sum(lane['waiting'] for lane in gate.stats()['lanes'].values()) < len(threads):
+            time.sleep(0.001)
+    time.sleep(hold_s)
+    gate.release(holder)
+    for thread in threads:
+        thread.join()
+    return order
+
+
+def test_interactive_lane_first_and_fair_share_between_clients():
+    """
+    El carril interactivo pasa antes que el masivo; dentro del masivo, un cliente con muchas pasadas
+    encoladas no retrasa al que sólo tiene una (colas justas por cliente).
+    """
+    gate = FairGate(slots=1, bulk_max_wait_s=60)
+    order = _queue_turns(gate, [
+        ('a1', Priority('bulk', 'a'), 100),
+        ('a2', Priority('bulk', 'a'), 100),
+        ('a3', Priority('bulk', 'a'), 100),
+        ('b1', Priority('bulk', 'b'), 100),
+        ('editor', Priority('interactive', 'c'), 10),
+    ])
+
+    assert order[0] == 'editor'
+    assert order.index('b1') < order.index('a2')
+    assert gate.stats()['lanes']['bulk']['granted'] == 5 # 4 + la que ocupaba la plaza
+
+
+def test_old_bulk_passes_are_not_starved():
+    """Una pasada masiva que supera PRIORITY_BULK_MAX_WAIT_S entra antes que las interactivas."""
+    gate = FairGate(slots=1, bulk_max_wait_s=0.05)
+    order = _queue_turns(gate, [
+        ('masiva', Priority('bulk', 'a'), 100),
+        ('editor', Priority('interactive', 'b'), 10),
+    ], hold_s=0.1)
+
+    assert gate.stats()['lanes']['bulk']['aged'] >= 1 and order == ['masiva', 'editor']
+
+
+def test_bulk_generation_yields_between_decode_steps(monkeypatch):
+    """
+    Una generación masiva larga cede el turno entre pasos de decodificación: la pasada interactiva
+    no espera a que termine, y la masiva continúa después con su salida completa.
+    """
+    gate = FairGate(slots=1, bulk_max_wait_s=60)
+    pipe = StubPipeline('text2text-generation', 't5-small', token_delay_s=0.005)
+    monkeypatch.setattr(scheduling, 'gate', gate)
+    results = {}
+
+    def bulk():
+        with scheduling.use_priority(Priority('bulk', 'migracion')):
+            results['bulk'] = batching.run_batch(pipe, ["x = 1"], max_new_tokens=80)
+
+    thread = threading.Thread(target=bulk)
+    thread.start()
+    time.sleep(0.05) # La generación masiva (~0,4 s) ya tiene la plaza
+    started = time.monotonic()
+    with scheduling.use_priority(Priority('interactive', 'editor')):
+        with scheduling.model_pass(10):
+            waited = time.monotonic() - started
+    thread.join()
+
+    assert waited < 0.1
+    assert gate.stats()['lanes']['bulk']['preemptions'] == 1
+    assert len(results['bulk'][0][0]['generated_text']) == 80 * 4
+
+
+def test_bulk_convert_yields_to_interactive_complete(make_stub_client):
+    """
+    La puerta es común a todos los modelos: una conversión masiva (t5) en curso cede el turno entre pasos
+    de decodificación a un /complete (modelo generativo) que pasa por el micro-batching.
+    """
+    client = make_stub_client(MODEL_STUB_TOKEN_DELAY_MS=5)
+    responses = {}
+
+    def convert():
+        responses['convert'] = client.post(
+            '/convert', json={"code": "x = 1", "target_language": "go", "max_tokens": 80}
+        )
+
+    thread = threading.Thread(target=convert)
+    thread.start()
+    while scheduling.gate.stats()['lanes']['bulk']['active'] == 0:
+        time.sleep(0.001)
+    started = time.monotonic()
+    complete = client.post('/complete', json={"prompt": "def suma(a, b):", "max_tokens": 4})
+    elapsed = time.monotonic() - started
+    thread.join()
+
+    stats = client.get('/stats').json['priority']
+    assert complete.status_code == 200 and responses['convert'].status_code == 200
+    assert elapsed < 0.3 # La conversión completa tarda ~0,4 s
+    assert stats['slots'] == 1 and stats['lanes']['bulk']['preemptions'] == 1
+    assert stats['lanes']['interactive']['granted'] == 1
+
+
+def test_idle_clients_are_forgotten():
+    """Los clientes sin pasadas pendientes no dejan entradas en la puerta (no crece con cada IP o clave)."""
+    gate = FairGate(slots=1, bulk_max_wait_s=60)
+    for index in range(50):
+        gate.release(gate.acquire(Priority('bulk', f'ip:10.0.0.{index}'), 100))
+    assert gate.stats()['clients'] == 0
+
+    order = _queue_turns(gate, [
+        ('a1', Priority('bulk', 'a'), 100),
+        ('a2', Priority('bulk', 'a'), 100),
+        ('b1', Priority('bulk', 'b'), 100),
+    ])
+    assert order.index('b1') < order.index('a2') and gate.stats()['clients'] == 0
@@ -0,0 +1,48 @@
+# ia-codex-api/tests/test_snapshots.py
+
+import json
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import snapshots
+
+
+def _write_manifest(root, name, **manifest):
+    os.makedirs(os.path.join(root, name), exist_ok=True)
+    with open(os.path.join(root, name, snapshots.MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+
+
+def test_find_snapshot_checks_model_and_variant(tmp_path):
+    """
+    Sólo se usa la instantánea del modelo configurado; sin la variante pedida se usa fp32.
+    """
+    root = str(tmp_path)
+    _write_manifest(root, 'generator', model='distilgpt2', variants=['fp32'])
+    _write_manifest(root, 'text2text', model='t5-small', variants=['fp32', 'bf16'])
+
+    path, manifest, variant = snapshots.find_snapshot(root, 'generator', 'distilgpt2', 'bf16')
+    assert variant == 'fp32' and path == os.path.join(root, 'generator', 'fp32')
+    assert snapshots.find_snapshot(root, 'text2text', 't5-small', 'bf16')[2] == 'bf16'
+    assert snapshots.find_snapshot(root, 'generator', 'gpt2') is None # El .env cambió
+    assert snapshots.find_snapshot(root, 'rapido', 'tiny-gpt2') is None
+    assert snapshots.find_snapshot('', 'generator', 'distilgpt2') is None
+
+
+def test_mmap_safetensors_is_zero_copy(tmp_path):
+    """
+    Los tensores leídos son vistas del fichero mapeado: mismos valores, sin copiar los datos.
+    """
+    torch = pytest.importorskip('torch')
+    save_file = pytest.importorskip('safetensors.torch').save_file
+    path = str(tmp_path / 'model.safetensors')
+    weights = {'a': torch.arange(12, dtype=torch.float32).reshape(3, 4), 'b': torch.ones(5, dtype=torch.bfloat16)}
+    save_file(weights, path)
+
+    loaded = snapshots.mmap_safetensors(path)
+    assert torch.equal(loaded['a'], weights['a']) and torch.equal(loaded['b'], weights['b'])
+    # Ambos tensores apuntan a la misma región mapeada del fichero.
+    assert abs(loaded['b'].data_ptr() - loaded['a'].data_ptr()) < os.path.getsize(path)
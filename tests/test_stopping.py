@@ -0,0 +1,144 @@
+# ia-codex-api/tests/test_stopping.py
+
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import batching
+from app.stopping import StopRule, TextStopCriteria, completion_options, filter_stream
+from app.stub import StubPipeline
+
+
+def test_block_end_rules_per_language():
+    """
+    La salida termina donde acaba el bloque del cursor: por sangría en Python (las ramas 'else' siguen)
+    y en Ruby (conservando su 'end'), por llaves en JavaScript (sin contar las de las cadenas),
+    y con una llave sin abrir en la salida completa de /convert.
+    """
+    rule = StopRule(language='python', block_end=True, prompt="def fibonacci(n):\n    ")
+    generated = "if n < 2:\n        return n\n    else:\n        return fibonacci(n - 1)\n\ndef main():\n    pass"
+    assert rule.truncate(generated) == "if n < 2:\n        return n\n    else:\n        return fibonacci(n - 1)"
+    assert rule.find_end("if n < 2:\n        return n\n") is None # Todavía no se sabe si el bloque sigue
+
+    rule = StopRule(language='python', block_end=True, prompt="import os\n")
+    assert rule.truncate("def f():\n    return 1\n\n\ndef g():") == "def f():\n    return 1"
+
+    rule = StopRule(language='ruby', block_end=True, prompt="def saludo(nombre)\n")
+    assert rule.truncate("  puts nombre\nend\n\ndef otro\nend") == "  puts nombre\nend"
+
+    rule = StopRule(language='javascript', block_end=True, prompt="function f(a) {\n  if (a) {\n    ")
+    generated = "return '}';\n  } else {\n    return 0;\n  }\n}\n\nfunction g() {"
+    assert rule.truncate(generated) == "return '}';\n  } else {\n    return 0;\n  }"
+
+    rule = StopRule(language='go', block_end=True, mode='whole')
+    assert rule.truncate("func f() int {\n\treturn 1\n}\n}\nfunc") == "func f() int {\n\treturn 1\n}"
+
+    rule = StopRule(stop=("\n#",), language='python', block_end=False)
+    assert rule.truncate("x = 1\n# fin") == "x = 1" and StopRule(language='cobol', block_end=True).active is False
+
+
+def test_rows_stop_independently_in_a_batch():
+    """
+    En una misma pasada, la fila con regla deja de generar en cuanto encuentra su secuencia de parada
+    y la otra llega hasta max_new_tokens.
+    """
+    pipe = StubPipeline('text-generation', 'gpt2', token_delay_s=0)
+    tokens = pipe._tokens("a = ", 20)
+    rule = StopRule(stop=(tokens[5],))
+
+    results = batching.run_batch(pipe, ["a = ", "bb = "], stop_rules=[rule, None], max_new_tokens=20, return_full_text=False)
+
+    assert results[0][0]['generated_text'] == ''.join(tokens[:6]) # Se detiene tras el token de la secuencia
+    assert rule.truncate(results[0][0]['generated_text']) == ''.join(tokens[:5])
+    assert len(results[1][0]['generated_text']) == 20 * 4
+
+
+class ByteTokenizer:
+    """Tokenizer falso de un byte por token que cuenta los tokens que decodifica."""
+
+    def __init__(self):
+        self.decoded = 0
+
+    def decode(self, ids, skip_special_tokens=False):
+        self.decoded += len(ids)
+        return bytes(ids).decode('utf-8', errors='replace')
+
+
+class _Row(list):
+    def tolist(self):
+        return list(self)
+
+
+class _InputIds:
+    """input_ids mínimos (una fila) con la indexación que usa TextStopCriteria."""
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.shape = (1, len(ids))
+
+    def __getitem__(self, key):
+        return _Row(self.ids[key[1]])
+
+
+def test_stop_criteria_decode_only_new_tokens():
+    """
+    Con un tokenizer real, el criterio de parada decodifica sólo los tokens nuevos de cada fila (no toda la
+    salida en cada paso), espera a completar los caracteres partidos entre tokens y para en el mismo punto.
+    """
+    tokenizer = ByteTokenizer()
+    prompt = list("x = ".encode())
+    criteria = TextStopCriteria([StopRule(stop=("\n\n",))], tokenizer, prompt_length=len(prompt))
+    criteria.per_row = False # Resultado único para todo el lote (sin torch)
+
+    generated = list("ñandú = 1\n\nfin = 2".encode())
+    for step in range(1, len(generated) + 1):
+        if criteria(_InputIds(prompt + generated[:step]), None):
+            break
+    assert criteria.decoders[0].text == "ñandú = 1\n\n" and step == len("ñandú = 1\n\n".encode())
+    assert tokenizer.decoded <= 4 * step # Decodificar todo en cada paso serían step * (step + 1) / 2 tokens
+
+
+def test_stream_filter_holds_back_and_stops_generation():
+    """
+    En streaming, lo que aún podría recortarse no se emite; al encontrar el final se emite hasta el corte
+    y se cierra la generación.
+    """
+    closed = []
+    def chunks():
+        try:
+            yield from ["return a", " + b;\n", "}\n", "\nfunction", " g() {}"]
+        finally:
+            closed.append(True)
+
+    rule = StopRule(language='javascript', block_end=True, prompt="function add(a, b) {\n  ")
+    emitted = list(filter_stream(chunks(), rule))
+
+    assert ''.join(emitted) == "return a + b;\n}" and closed == [True]
+
+
+def test_complete_stop_and_suffix_only(client):
+    """
+    /complete con 'stop' y 'return_full_text': false devuelve sólo la generación hasta la secuencia de
+    parada, también en streaming; un 'stop' inválido es un 400.
+    """
+    prompt = "def suma(a, b):"
+    tokens = StubPipeline('text-generation', 'distilgpt2')._tokens(prompt, 16)
+    body = {"prompt": prompt, "max_tokens": 16, "stop": [tokens[3]], "return_full_text": False}
+
+    response = client.post('/complete', json=body)
+    assert response.status_code == 200 and response.json["suggestions"] == [''.join(tokens[:3])]
+
+    response = client.post('/complete', json=dict(body, stream=True))
+    events = [json.loads(line[6:]) for line in response.get_data(as_text=True).splitlines() if line.startswith('data: ')]
+    assert ''.join(event.get('token', '') for event in events[:-1]) == ''.join(tokens[:3])
+    assert events[-1] == {"suggestions": [''.join(tokens[:3])]}
+
+    response = client.post('/complete', json={"prompt": prompt, "stop": ["x" * 100]})
+    assert response.status_code == 400
+
+    # El fin de bloque sólo se aplica si se pide: sin el campo, la salida de /complete no cambia.
+    assert completion_options({}, prompt) == (None, True)
+    rule, _ = completion_options({"stop_at_block_end": True}, prompt)
+    assert rule.block_end and rule.truncate("    return a\nprint(1)") == "    return a"
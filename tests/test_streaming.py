@@ -0,0 +1,84 @@
+# ia-codex-api/tests/test_streaming.py
+
+import pytest
+import json
+import sys
+import os
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import app as app_module
+from app import create_app, models, api
+
+
+def fake_stream_generation(pipeline, prompt, max_new_tokens=256, **kwargs):
+    """Simula la generación token a token."""
+    for token in ["    return", " a", " + b"]:
+        yield token
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """
+    Cliente de prueba con pipelines falsos: estas pruebas sólo verifican el formato del streaming.
+    """
+    monkeypatch.setattr(app_module, 'load_models', lambda config: None)
+    fake_pipeline = SimpleNamespace(model=SimpleNamespace(config=SimpleNamespace(name_or_path="fake")))
+    monkeypatch.setattr(models, 'generator_pipeline', fake_pipeline)
+    monkeypatch.setattr(models, 'text2text_pipeline', fake_pipeline)
+    monkeypatch.setattr(api, 'stream_generation', fake_stream_generation)
+
+    app = create_app()
+    with app.test_client() as client:
+        yield client
+
+
+def _parse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event = "message"
+        for line in block.split("\n"):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                events.append((event, json.loads(line[len("data:"):])))
+    return events
+
+
+def test_complete_stream(client):
+    """
+    Con "stream": true, /complete emite un evento por token y un evento 'done' con la sugerencia completa.
+    """
+    response = client.post('/complete', json={"prompt": "def suma(a, b):\n", "stream": True})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = _parse_events(response.get_data(as_text=True))
+    assert [data["token"] for event, data in events if event == "message"] == ["    return", " a", " + b"]
+    assert events[-1] == ("done", {"suggestions": ["def suma(a, b):\n    return a + b"]})
+
+
+def test_convert_stream_with_accept_header(client):
+    """
+    La cabecera Accept: text/event-stream también activa el streaming en /convert.
+    """
+    response = client.post(
+        '/convert',
+        json={"code": "print('Hola')", "target_language": "javascript"},
+        headers={"Accept": "text/event-stream"}
+    )
+
+    assert response.mimetype == 'text/event-stream'
+    events = _parse_events(response.get_data(as_text=True))
+    assert events[-1] == ("done", {"converted_code": "    return a + b"})
+
+
+def test_complete_stream_rejects_multiple_suggestions(client):
+    """
+    El streaming no admite varias sugerencias a la vez.
+    """
+    response = client.post('/complete', json={"prompt": "x", "stream": True, "num_suggestions": 2})
+
+    assert response.status_code == 400
+    assert "num_suggestions=1" in response.json['error']
@@ -0,0 +1,89 @@
+# ia-codex-api/tests/test_stub.py
+
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, models
+from app.stub import StubPipeline
+
+
+@pytest.fixture
+def client(make_stub_client):
+    """Aplicación completa con MODEL_STUB=True: sin descargar modelos."""
+    return make_stub_client()
+
+
+def test_stub_models_serve_every_endpoint(client):
+    """
+    Con el pipeline falso, /complete, /fix y /convert responden de forma determinista.
+    """
+    first = client.post('/complete', json={"prompt": "def suma(a, b):", "max_tokens": 8, "num_suggestions": 2})
+    second = client.post('/complete', json={"prompt": "def suma(a, b):", "max_tokens": 8, "num_suggestions": 2})
+    assert first.status_code == 200
+    assert first.json == second.json
+    suggestions = first.json["suggestions"]
+    assert len(suggestions) == 2 and suggestions[0] != suggestions[1]
+    assert all(s.startswith("def suma(a, b):") and len(s) == len("def suma(a, b):") + 8 * 4 for s in suggestions)
+
+    response = client.post('/fix', json={"code": "x = 1", "max_tokens": 4})
+    assert response.status_code == 200 and len(response.json["fixed_code"]) == 16
+
+    response = client.post('/convert', json={"code": "x = 1", "target_language": "go", "max_tokens": 4})
+    assert response.status_code == 200
+    assert models.get_model_status()['text2text']['loaded'] is True
+
+
+def test_stub_batch_outputs():
+    """
+    Un lote devuelve una salida por prompt, distinta para cada uno, y el streaming emite tokens.
+    """
+    pipe = StubPipeline('text2text-generation', 't5-small', token_delay_s=0)
+    outputs = pipe(["a", "b", "c"], batch_size=3, max_new_tokens=3)
+    assert [len(output) for output in outputs] == [1, 1, 1]
+    assert len({output[0]['generated_text'] for output in outputs}) == 3
+    assert list(pipe.stream("a", max_new_tokens=3)) != []
+
+
+def test_assisted_generation_matches_plain_output(client, monkeypatch):
+    """
+    Con HF_MODEL_DRAFT, /complete de una sugerencia pasa por la generación asistida: la salida es la misma
+    que sin borrador y la tasa de aceptación aparece en /stats.
+    """
+    plain = client.post('/complete', json={"prompt": "def resta(a, b):", "max_tokens": 12})
+
+    monkeypatch.setenv('HF_MODEL_DRAFT', 'tiny-draft')
+    monkeypatch.setenv('ASSISTED_NUM_TOKENS', '3')
+    monkeypatch.setattr(models, '_assisted_config', dict(models._assisted_config))
+    monkeypatch.setattr(models, '_assisted_stats', dict.fromkeys(models._assisted_stats, 0))
+    app = create_app()
+    with app.test_client() as assisted_client:
+        assisted = assisted_client.post('/complete', json={"prompt": "def resta(a, b):", "max_tokens": 12})
+        status = assisted_client.get('/stats').json['models']['generator']['assisted']
+
+    assert assisted.status_code == 200 and assisted.json == plain.json
+    # 12 tokens en pasadas de 3 propuestos + 1 propio: 3 pasadas del modelo principal, 9 tokens aceptados.
+    assert status['draft_model'] == 'tiny-draft' and status['generations'] == 1
+    assert status['acceptance_rate'] == 1.0 and status['tokens_per_forward'] == 4.0
+
+
+def test_requests_pick_a_model_by_name(client, monkeypatch):
+    """
+    El campo 'model' elige uno de los modelos de MODELS; GET /models lista los modelos y sus aciertos.
+    """
+    monkeypatch.setenv('MODELS', 'rapido=generator:tiny-gpt2')
+    app = create_app()
+    with app.test_client() as named_client:
+        default = named_client.post('/complete', json={"prompt": "def f():", "max_tokens": 4})
+        fast = named_client.post('/complete', json={"prompt": "def f():", "max_tokens": 4, "model": "rapido"})
+        assert default.status_code == 200 and fast.status_code == 200
+        assert named_client.post('/fix', json={"code": "x", "model": "rapido"}).status_code == 400
+        assert named_client.post('/complete', json={"prompt": "x", "model": "nada"}).status_code == 400
+        listing = named_client.get('/models').json
+
+    by_name = {entry['name']: entry for entry in listing['models']}
+    assert by_name['rapido']['model'] == 'tiny-gpt2' and by_name['rapido']['kind'] == 'generator'
+    assert by_name['rapido']['hits'] == 1 and by_name['rapido']['resident'] is True
+    assert by_name['generator']['default'] is True and by_name['rapido']['default'] is False
@@ -0,0 +1,109 @@
+# ia-codex-api/tests/test_suggestions.py
+
+import hashlib
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import suggestions
+from app.stub import StubPipeline
+from app.suggestions import SuggestionTracker
+
+
+def _converging_tokens(self, prompt, max_new_tokens, sequence=0):
+    """Como StubPipeline._tokens, pero las secuencias pares e impares coinciden (dos sugerencias distintas)."""
+    seed = hashlib.sha256(f"{sequence % 2}:{prompt}".encode()).hexdigest()
+    return [f" {seed[(i * 3) % 60:(i * 3) % 60 + 3]}" for i in range(max_new_tokens)]
+
+
+@pytest.fixture
+def make_client(make_stub_client, monkeypatch):
+    """Aplicación completa con MODEL_STUB=True y la configuración de sugerencias indicada."""
+    monkeypatch.setattr(suggestions, '_counters', {key: 0 for key in suggestions._counters})
+    return make_stub_client
+
+
+def test_tracker_convergence_budget_and_greedy(monkeypatch):
+    """
+    Las filas con los mismos primeros tokens convergen en el paso del umbral; el presupuesto corta
+    primero las últimas filas; con decodificación voraz sólo se decodifica la primera.
+    """
+    monkeypatch.setitem(suggestions._config, 'converge_tokens', 2)
+    monkeypatch.setitem(suggestions._config, 'max_decode_tokens', 0)
+    tracker = SuggestionTracker(3, max_new_tokens=4)
+    generated = [[1], [1], [2]]
+    assert tracker.step(generated) == [0, 1, 2]
+    generated = [[1, 5], [1, 5], [2, 5]]
+    assert tracker.step(generated) == [0, 2]
+    assert tracker.converged == {1: 0} and tracker.kept_rows() == [0, 2]
+    assert tracker.step(generated, finished=[2]) == [0]
+    assert tracker.decode_tokens == 3 + 3 + 2
+
+    monkeypatch.setitem(suggestions._config, 'max_decode_tokens', 7)
+    tracker = SuggestionTracker(3, max_new_tokens=4)
+    assert tracker.decode_limit == 7
+    assert tracker.step([[1], [2], [3]]) == [0, 1] # La primera fila necesita 3 tokens más
+    assert tracker.step([[1, 1], [2, 2]]) == [0]
+    assert tracker.step([[1, 1, 1]]) == [0] and tracker.step([[1, 1, 1, 1]]) == [0]
+    assert tracker.cut == {1, 2} and tracker.kept_rows() == [0, 1, 2] and tracker.decode_tokens == 7
+
+    tracker = SuggestionTracker(3, max_new_tokens=4, identical=True)
+    assert tracker.active == [0] and tracker.kept_rows() == [0]
+
+    assert suggestions.distinct(["a", "b", "a"]) == ["a", "b"]
+
+
+def test_converged_suggestions_stop_early_and_are_not_returned(make_client, monkeypatch):
+    """
+    Con 4 sugerencias de las que sólo 2 son distintas, las repetidas dejan de decodificarse al converger:
+    se devuelven 2 sugerencias completas, el prompt se codifica una sola vez y se decodifica mucho menos
+    que 4 generaciones independientes.
+    """
+    monkeypatch.setattr(StubPipeline, '_tokens', _converging_tokens)
+    client = make_client(COMPLETE_CONVERGE_TOKENS='2', COMPLETE_MAX_DECODE_TOKENS='0')
+
+    prompt = "def suma(a, b):"
+    response = client.post('/complete', json={"prompt": prompt, "max_tokens": 10, "num_suggestions": 4})
+    assert response.status_code == 200
+    values = response.json["suggestions"]
+    assert len(values) == 2 and values[0] != values[1]
+    assert all(value.startswith(prompt) and len(value) == len(prompt) + 10 * 4 for value in values)
+
+    stats = client.get('/stats').json["suggestions"]
+    assert stats["requested"] == 4 and stats["converged"] == 2 and stats["returned"] == 2
+    assert stats["decode_tokens"] == 2 * 4 + 8 * 2 # 2 pasos con 4 filas y 8 con 2
+    assert stats["decode_ratio"] == 0.6
+    assert stats["prefill_tokens_saved"] == 3 * 4 # 3 prefills de 4 tokens que no se repiten
+
+    # El lote por endpoint también usa el prefill compartido.
+    items = [{"prompt": prompt, "max_tokens": 10, "num_suggestions": 4}]
+    response = client.post('/complete/batch', json={"items": items})
+    assert response.status_code == 200
+    assert response.json["results"][0]["suggestions"] == values
+
+
+def test_decode_budget_and_dedup_after_stop_rules(make_client, monkeypatch):
+    """
+    COMPLETE_MAX_DECODE_TOKENS corta las últimas sugerencias y la primera llega a max_tokens; las que quedan
+    iguales tras aplicar la secuencia de parada se devuelven una sola vez.
+    """
+    client = make_client(COMPLETE_MAX_DECODE_TOKENS='12', COMPLETE_CONVERGE_TOKENS='0')
+    response = client.post('/complete', json={
+        "prompt": "x = ", "max_tokens": 6, "num_suggestions": 3, "return_full_text": False
+    })
+    assert response.status_code == 200
+    values = response.json["suggestions"]
+    assert [len(value) for value in values] == [6 * 4, 3 * 4, 3 * 4]
+    stats = client.get('/stats').json["suggestions"]
+    assert stats["budget"] == 2 and stats["decode_tokens"] == 12
+
+    monkeypatch.setattr(StubPipeline, '_tokens', lambda self, prompt, max_new_tokens, sequence=0: (
+        [" a", f"{sequence}", "\n"] * max_new_tokens
+    )[:max_new_tokens])
+    response = client.post('/complete', json={
+        "prompt": "x = ", "max_tokens": 6, "num_suggestions": 3, "stop": [" a"], "return_full_text": False
+    })
+    assert response.json["suggestions"] == [""]
+    assert client.get('/stats').json["suggestions"]["duplicate"] == 2